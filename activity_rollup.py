@@ -0,0 +1,534 @@
+"""
+Hourly Activity Rollups
+scan_hourly_rollup (scans per hour, user and dispatch area) and audit_hourly_rollup
+(audit events per hour, user and action) back the dashboard, activity API, user
+activity page and reports, so those views no longer aggregate raw scan/audit_log
+rows and their cost stops growing with history.
+
+An aggregator thread consumes new rows by id watermark (rollup_watermark). Ids are
+drawn before commit, so a transaction can commit a lower id after a higher one is
+visible. Each source therefore advances in two steps: a tick records the current
+max id together with the transaction horizon (txid_snapshot_xmax), and a later tick
+only consumes up to that id once every transaction that was running at the time
+has finished (txid_snapshot_xmin >= horizon). No committed row is ever skipped.
+
+Rows leave the raw tables too (bag and user-data deletes, user_id SET NULL,
+archived scan partitions, dropped audit partitions). Statement triggers on
+DELETE and on UPDATE of a counted column record the affected hours in
+rollup_stale_hour; partition detach/drop and direct deletes from a partition
+(which bypass the parent's triggers) record them explicitly (mark_stale_hours).
+The aggregator rebuilds stale hours from the raw rows it has consumed, so the
+rollup only ever holds what the raw tables still contain.
+
+Readers add the not-yet-aggregated tail (id > watermark, inside the requested time
+range) to the rollup in the same statement, and count stale hours from the raw
+rows instead of the rollup, so counts are exact, not lagging.
+Windows are whole hours (UTC, like the stored timestamps).
+"""
+
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from threading import Thread, Event
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock serializing aggregation across workers
+ROLLUP_LOCK_ID = 600000
+
+# Upserts of raw rows ({rows}, filtered by {where}) into each rollup, keyed by watermark source
+_ROLLUP_UPSERT = {
+    'scan': """
+        INSERT INTO scan_hourly_rollup AS r
+            (hour, user_id, dispatch_area, scan_count, parent_scans, child_scans, updated_at)
+        SELECT date_trunc('hour', s.timestamp), COALESCE(s.user_id, 0), COALESCE(b.dispatch_area, ''),
+               COUNT(*), COUNT(*) FILTER (WHERE s.child_bag_id IS NULL),
+               COUNT(*) FILTER (WHERE s.child_bag_id IS NOT NULL), NOW()
+        FROM {rows} s
+        LEFT JOIN bag b ON b.id = COALESCE(s.parent_bag_id, s.child_bag_id)
+        WHERE {where}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (hour, user_id, dispatch_area) DO UPDATE SET
+            scan_count = r.scan_count + EXCLUDED.scan_count,
+            parent_scans = r.parent_scans + EXCLUDED.parent_scans,
+            child_scans = r.child_scans + EXCLUDED.child_scans,
+            updated_at = EXCLUDED.updated_at
+    """,
+    'audit_log': """
+        INSERT INTO audit_hourly_rollup AS r (hour, user_id, action, event_count, updated_at)
+        SELECT date_trunc('hour', s.timestamp), COALESCE(s.user_id, 0), s.action, COUNT(*), NOW()
+        FROM {rows} s
+        WHERE {where}
+        GROUP BY 1, 2, 3
+        ORDER BY 1, 2, 3
+        ON CONFLICT (hour, user_id, action) DO UPDATE SET
+            event_count = r.event_count + EXCLUDED.event_count,
+            updated_at = EXCLUDED.updated_at
+    """,
+}
+
+# New rows: the (lo, hi] id range
+_AGGREGATE_SQL = {
+    source: sql.format(rows=source, where='s.id > :lo AND s.id <= :hi')
+    for source, sql in _ROLLUP_UPSERT.items()
+}
+
+# Stale hours: every consumed row (id <= hi) in the :hours being rebuilt
+_REBUILD_SQL = {
+    source: sql.format(
+        rows=f"unnest(CAST(:hours AS timestamp[])) AS h(hour) CROSS JOIN {source}",
+        where="s.timestamp >= h.hour AND s.timestamp < h.hour + INTERVAL '1 hour' AND s.id <= :hi"
+    )
+    for source, sql in _ROLLUP_UPSERT.items()
+}
+
+ROLLUP_SOURCES = tuple(_AGGREGATE_SQL)
+
+_ROLLUP_TABLES = {'scan': 'scan_hourly_rollup', 'audit_log': 'audit_hourly_rollup'}
+
+# Raw columns whose change moves a row to another rollup group
+_GROUP_CHANGED = {
+    'scan': ("o.timestamp <> n.timestamp OR o.user_id IS DISTINCT FROM n.user_id"
+             " OR o.parent_bag_id IS DISTINCT FROM n.parent_bag_id"
+             " OR o.child_bag_id IS DISTINCT FROM n.child_bag_id"),
+    'audit_log': "o.timestamp <> n.timestamp OR o.user_id IS DISTINCT FROM n.user_id OR o.action <> n.action",
+}
+
+
+def _stale_function_sql(source: str) -> str:
+    """Trigger function recording the hours a DELETE/UPDATE statement on source touched"""
+    return f"""
+        CREATE OR REPLACE FUNCTION {source}_rollup_mark_stale() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO rollup_stale_hour (source, hour)
+                SELECT DISTINCT '{source}', date_trunc('hour', timestamp) FROM old_rows
+                ON CONFLICT DO NOTHING;
+            ELSE
+                INSERT INTO rollup_stale_hour (source, hour)
+                SELECT DISTINCT '{source}', date_trunc('hour', moved.timestamp)
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (VALUES (o.timestamp), (n.timestamp)) AS moved(timestamp)
+                WHERE {_GROUP_CHANGED[source]}
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """
+
+
+# (trigger name suffix, event, transition tables)
+STALE_TRIGGERS = [
+    ('delete', 'DELETE', 'OLD TABLE AS old_rows'),
+    ('update', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+]
+
+
+def install_activity_rollup_triggers(conn, sources: Sequence[str] = ROLLUP_SOURCES):
+    """Create (or replace) the stale-hour functions and statement triggers on scan and audit_log"""
+    for source in sources:
+        conn.execute(text(_stale_function_sql(source)))
+        for suffix, event, referencing in STALE_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{source}_rollup_{suffix} ON {source}"))
+            conn.execute(text(f"""
+                CREATE TRIGGER trg_{source}_rollup_{suffix}
+                AFTER {event} ON {source}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {source}_rollup_mark_stale()
+            """))
+
+
+def drop_activity_rollup_triggers(conn):
+    """Remove the stale-hour triggers and their functions"""
+    for source in ROLLUP_SOURCES:
+        for suffix, _, _ in STALE_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{source}_rollup_{suffix} ON {source}"))
+        conn.execute(text(f"DROP FUNCTION IF EXISTS {source}_rollup_mark_stale()"))
+
+
+def mark_stale_hours(conn, source: str, start: datetime, end: datetime) -> int:
+    """
+    Mark every rolled-up hour of source in [start, end) stale, for removals the
+    triggers do not see (detached or dropped partitions, deletes that go to a
+    partition directly). Call it after the rows are gone, in the same transaction.
+    Returns the number of hours marked.
+    """
+    return conn.execute(text(f"""
+        INSERT INTO rollup_stale_hour (source, hour)
+        SELECT DISTINCT :source, hour FROM {_ROLLUP_TABLES[source]}
+        WHERE hour >= :start AND hour < :end
+        ON CONFLICT DO NOTHING
+    """), {'source': source, 'start': start, 'end': end}).rowcount
+
+
+def rebuild_stale_hours(conn, source: str, last_id: int, limit: int) -> Dict:
+    """
+    Recompute up to limit stale hours of source from the raw rows with id <= last_id
+    (caller holds ROLLUP_LOCK_ID). A marker committed after this transaction's
+    DELETE stays behind, so a concurrent removal is rebuilt again on a later tick.
+
+    Returns:
+        dict with 'rebuilt' (hours recomputed now) and 'stale' (hours still marked)
+    """
+    hours = [row[0] for row in conn.execute(text("""
+        DELETE FROM rollup_stale_hour
+        WHERE source = :source AND hour IN (
+            SELECT hour FROM rollup_stale_hour WHERE source = :source ORDER BY hour LIMIT :limit
+        )
+        RETURNING hour
+    """), {'source': source, 'limit': limit})]
+    if hours:
+        conn.execute(text(f"DELETE FROM {_ROLLUP_TABLES[source]} WHERE hour = ANY(:hours)"), {'hours': hours})
+        conn.execute(text(_REBUILD_SQL[source]), {'hours': hours, 'hi': last_id})
+
+    stale = conn.execute(text("SELECT COUNT(*) FROM rollup_stale_hour WHERE source = :source"),
+                         {'source': source}).scalar()
+    return {'rebuilt': len(hours), 'stale': stale}
+
+# Group-by expressions for readers: (rollup row, raw tail row)
+_SCAN_GROUPS = {
+    'hour': ('hour', "date_trunc('hour', s.timestamp)"),
+    'day': ('hour::date', 's.timestamp::date'),
+    'user_id': ('user_id', 'COALESCE(s.user_id, 0)'),
+    'dispatch_area': ('dispatch_area', "COALESCE(b.dispatch_area, '')"),
+}
+_AUDIT_GROUPS = {
+    'hour': ('hour', "date_trunc('hour', a.timestamp)"),
+    'day': ('hour::date', 'a.timestamp::date'),
+    'user_id': ('user_id', 'COALESCE(a.user_id, 0)'),
+    'action': ('action', 'a.action'),
+}
+
+
+# Raw columns readers need from each source
+_RAW_COLUMNS = {
+    'scan': 'id, timestamp, user_id, parent_bag_id, child_bag_id',
+    'audit_log': 'id, timestamp, user_id, action',
+}
+
+
+def _rolled_up_filter(source: str) -> str:
+    """Rollup rows of source that are current (their hour is not stale)"""
+    table = _ROLLUP_TABLES[source]
+    return f"""NOT EXISTS (SELECT 1 FROM rollup_stale_hour x
+                             WHERE x.source = '{source}' AND x.hour = {table}.hour)"""
+
+
+def _unrolled_rows(source: str) -> str:
+    """Raw rows of source in [:start, :end) not covered by the rollup: the tail past the watermark and stale hours"""
+    watermark = f"COALESCE((SELECT last_id FROM rollup_watermark WHERE source = '{source}'), 0)"
+    return f"""(SELECT {_RAW_COLUMNS[source]} FROM {source}
+               WHERE id > {watermark} AND timestamp >= :start AND timestamp < :end
+               UNION ALL
+               SELECT {', '.join(f'r.{c}' for c in _RAW_COLUMNS[source].split(', '))}
+               FROM rollup_stale_hour x
+               JOIN {source} r ON r.timestamp >= x.hour AND r.timestamp < x.hour + INTERVAL '1 hour'
+               WHERE x.source = '{source}' AND x.hour >= :start AND x.hour < :end AND r.id <= {watermark})"""
+
+
+def floor_hour(value: datetime) -> datetime:
+    """Start of the hour containing value - rollup windows are whole hours"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _window(start, end):
+    """Hour-aligned [start, end) from dates or datetimes"""
+    if not isinstance(start, datetime):
+        start = datetime.combine(start, datetime.min.time())
+    if not isinstance(end, datetime):
+        end = datetime.combine(end, datetime.min.time())
+    return floor_hour(start), floor_hour(end)
+
+
+def aggregate_source(conn, source: str, batch_size: int) -> Optional[Dict]:
+    """
+    Advance one source's watermark (caller holds ROLLUP_LOCK_ID in conn's transaction).
+
+    Returns:
+        dict with 'consumed' (ids aggregated now), 'behind' (settled ids still to
+        consume), 'last_id' (new watermark) and 'lag' (ids not yet in the rollup)
+    """
+    conn.execute(text("""
+        INSERT INTO rollup_watermark (source, last_id, updated_at)
+        VALUES (:source, 0, NOW())
+        ON CONFLICT (source) DO NOTHING
+    """), {'source': source})
+    last_id, pending_id, pending_xmax = conn.execute(text("""
+        SELECT last_id, pending_id, pending_xmax FROM rollup_watermark WHERE source = :source
+    """), {'source': source}).fetchone()
+
+    consumed = 0
+    xmin = conn.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+    if pending_id is not None and pending_id > last_id and xmin >= pending_xmax:
+        # Every transaction that could still commit an id <= pending_id has finished
+        hi = min(pending_id, last_id + batch_size)
+        conn.execute(text(_AGGREGATE_SQL[source]), {'lo': last_id, 'hi': hi})
+        consumed = hi - last_id
+        last_id = hi
+
+    if pending_id is None or last_id >= pending_id:
+        # Record the next target and the horizon it has to wait for
+        max_id, pending_xmax = conn.execute(text(
+            f"SELECT MAX(id), txid_snapshot_xmax(txid_current_snapshot()) FROM {source}"
+        )).fetchone()
+        pending_id = max_id if max_id and max_id > last_id else None
+    else:
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {source}")).scalar()
+
+    conn.execute(text("""
+        UPDATE rollup_watermark
+        SET last_id = :last_id, pending_id = :pending_id, pending_xmax = :pending_xmax, updated_at = NOW()
+        WHERE source = :source
+    """), {'source': source, 'last_id': last_id, 'pending_id': pending_id,
+           'pending_xmax': pending_xmax if pending_id is not None else None})
+
+    settled_behind = pending_id - last_id if pending_id is not None and xmin >= (pending_xmax or 0) else 0
+    return {'consumed': consumed, 'behind': settled_behind, 'last_id': last_id,
+            'lag': max(0, (max_id or 0) - last_id)}
+
+
+def reset_activity_rollups(conn, sources: Sequence[str] = ROLLUP_SOURCES):
+    """Empty the rollups and rewind their watermarks - the aggregator rebuilds them from the raw tables"""
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': ROLLUP_LOCK_ID})
+    for source in sources:
+        conn.execute(text(f"DELETE FROM {_ROLLUP_TABLES[source]}"))
+        conn.execute(text("DELETE FROM rollup_stale_hour WHERE source = :source"), {'source': source})
+        conn.execute(text("DELETE FROM rollup_watermark WHERE source = :source"), {'source': source})
+
+
+def _counts_sql(rollup_select: str, tail_select: str, groups: Dict, group_by: Sequence[str],
+                value_columns: Sequence[str]) -> str:
+    """Rollup rows UNION ALL the raw tail, summed per requested group"""
+    unknown = set(group_by) - set(groups)
+    if unknown:
+        raise ValueError(f"Unsupported rollup grouping: {', '.join(sorted(unknown))}")
+    names = [f"g{index}" for index in range(len(group_by))]
+    rollup_cols = ''.join(f"{groups[g][0]} AS {n}, " for g, n in zip(group_by, names))
+    tail_cols = ''.join(f"{groups[g][1]} AS {n}, " for g, n in zip(group_by, names))
+    sums = ', '.join(f"SUM({column})" for column in value_columns)
+    grouping = f"GROUP BY {', '.join(names)} ORDER BY {', '.join(names)}" if names else ''
+    select_names = ''.join(f"{n}, " for n in names)
+    return f"""
+        SELECT {select_names}{sums}
+        FROM ({rollup_select.format(cols=rollup_cols)}
+              UNION ALL
+              {tail_select.format(cols=tail_cols)}) counts
+        {grouping}
+    """
+
+
+def get_scan_counts(start, end, group_by: Sequence[str] = (), user_id: Optional[int] = None) -> List:
+    """
+    Scan counts for the hour-aligned window [start, end), grouped by any of
+    'hour', 'day', 'user_id' (0 = unknown) and 'dispatch_area' ('' = none).
+
+    Returns:
+        rows of (*group values, scans, parent_scans, child_scans)
+    """
+    from app import db
+
+    start, end = _window(start, end)
+    user_filter = 'AND user_id = :user_id' if user_id is not None else ''
+    tail_user_filter = 'AND s.user_id = :user_id' if user_id is not None else ''
+    area_join = ("LEFT JOIN bag b ON b.id = COALESCE(s.parent_bag_id, s.child_bag_id)"
+                 if 'dispatch_area' in group_by else '')
+    sql = _counts_sql(
+        f"""SELECT {{cols}}scan_count AS scans, parent_scans, child_scans
+            FROM scan_hourly_rollup
+            WHERE hour >= :start AND hour < :end {user_filter} AND {_rolled_up_filter('scan')}""",
+        f"""SELECT {{cols}}1 AS scans, (s.child_bag_id IS NULL)::int, (s.child_bag_id IS NOT NULL)::int
+            FROM {_unrolled_rows('scan')} s {area_join}
+            WHERE TRUE {tail_user_filter}""",
+        _SCAN_GROUPS, group_by, ('scans', 'parent_scans', 'child_scans')
+    )
+    rows = db.session.execute(text(sql), {'start': start, 'end': end, 'user_id': user_id}).fetchall()
+    if not group_by:
+        return [tuple(value or 0 for value in rows[0])]
+    return rows
+
+
+def get_audit_counts(start, end, group_by: Sequence[str] = (), actions: Optional[Sequence[str]] = None) -> List:
+    """
+    Audit event counts for the hour-aligned window [start, end), optionally limited
+    to actions, grouped by any of 'hour', 'day', 'user_id' (0 = unknown) and 'action'.
+
+    Returns:
+        rows of (*group values, events)
+    """
+    from app import db
+
+    start, end = _window(start, end)
+    params = {'start': start, 'end': end}
+    action_filter = tail_action_filter = ''
+    if actions is not None:
+        params['actions'] = list(actions)
+        action_filter = 'AND action = ANY(:actions)'
+        tail_action_filter = 'AND a.action = ANY(:actions)'
+    sql = _counts_sql(
+        f"""SELECT {{cols}}event_count AS events
+            FROM audit_hourly_rollup
+            WHERE hour >= :start AND hour < :end {action_filter} AND {_rolled_up_filter('audit_log')}""",
+        f"""SELECT {{cols}}1 AS events
+            FROM {_unrolled_rows('audit_log')} a
+            WHERE TRUE {tail_action_filter}""",
+        _AUDIT_GROUPS, group_by, ('events',)
+    )
+    rows = db.session.execute(text(sql), params).fetchall()
+    if not group_by:
+        return [tuple(value or 0 for value in rows[0])]
+    return rows
+
+
+def get_daily_scans(start: date, end: date) -> Dict[date, int]:
+    """Scans per day for start..end inclusive (days without scans omitted)"""
+    rows = get_scan_counts(start, end + timedelta(days=1), group_by=('day',))
+    return {day: scans for day, scans, _, _ in rows}
+
+
+def get_scans_by_user(start=None, end=None) -> Dict[int, int]:
+    """Scans per user id in [start, end) - default all time up to the next hour"""
+    end = end or floor_hour(datetime.utcnow()) + timedelta(hours=1)
+    rows = get_scan_counts(start or datetime(2000, 1, 1), end, group_by=('user_id',))
+    return {user_id: scans for user_id, scans, _, _ in rows if user_id}
+
+
+class ActivityRollupAggregator:
+    """Background thread that folds new scan and audit_log rows into the hourly rollups and rebuilds stale hours"""
+
+    # How often new rows are aggregated (seconds) - also the watermark settle delay
+    INTERVAL = int(os.environ.get('ACTIVITY_ROLLUP_INTERVAL', '30'))
+
+    # Ids consumed per transaction (keeps catch-up after a rebuild in small steps)
+    BATCH_SIZE = int(os.environ.get('ACTIVITY_ROLLUP_BATCH_SIZE', '50000'))
+
+    # Stale hours recomputed per source and transaction
+    REBUILD_HOURS = int(os.environ.get('ACTIVITY_ROLLUP_REBUILD_HOURS', '500'))
+
+    def __init__(self, app, db, enabled=True):
+        """
+        Initialize activity rollup aggregator
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            enabled: Whether aggregation is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.stop_event = Event()
+        self.aggregator_thread = None
+        self.stats = {
+            'runs': 0,
+            'skipped_busy': 0,
+            'ids_consumed': {source: 0 for source in ROLLUP_SOURCES},
+            'hours_rebuilt': {source: 0 for source in ROLLUP_SOURCES},
+            'lag': {},
+            'last_run_ms': None,
+            'errors': 0
+        }
+
+    def start(self):
+        """Start aggregating in background thread"""
+        if not self.enabled:
+            logger.info("Activity rollup aggregator is disabled")
+            return
+
+        if self.aggregator_thread and self.aggregator_thread.is_alive():
+            logger.warning("Activity rollup aggregator already running")
+            return
+
+        self.stop_event.clear()
+        self.aggregator_thread = Thread(target=self._aggregate_loop, daemon=True, name='activity-rollup')
+        self.aggregator_thread.start()
+        logger.info(f"Activity rollup aggregator started - every {self.INTERVAL}s, "
+                    f"batches of {self.BATCH_SIZE} ids")
+
+    def stop(self):
+        """Stop aggregating"""
+        if not self.aggregator_thread:
+            return
+
+        self.stop_event.set()
+        self.aggregator_thread.join(timeout=5)
+        logger.info("Activity rollup aggregator stopped")
+
+    def _aggregate_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.is_set():
+            try:
+                # Keep going without waiting while settled rows or full batches of stale hours are queued
+                result = self.aggregate_once()
+                while (result and any(r['behind'] or (r['stale'] and r['rebuilt'] == self.REBUILD_HOURS)
+                                      for r in result.values())
+                       and not self.stop_event.is_set()):
+                    result = self.aggregate_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Activity rollup error: {e}")
+
+            # Wait for next tick or stop event
+            self.stop_event.wait(self.INTERVAL)
+
+    def aggregate_once(self) -> Optional[Dict[str, Dict]]:
+        """Advance every source once. Returns per-source results, or None if another worker holds the lock."""
+        start = time.time()
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"),
+                                    {"id": ROLLUP_LOCK_ID}).scalar():
+                    self.stats['skipped_busy'] += 1
+                    return None
+                results = {}
+                for source in ROLLUP_SOURCES:
+                    result = aggregate_source(conn, source, self.BATCH_SIZE)
+                    result.update(rebuild_stale_hours(conn, source, result['last_id'], self.REBUILD_HOURS))
+                    results[source] = result
+
+        self.stats['runs'] += 1
+        for source, result in results.items():
+            self.stats['ids_consumed'][source] += result['consumed']
+            self.stats['hours_rebuilt'][source] += result['rebuilt']
+            self.stats['lag'][source] = result['lag']
+        self.stats['last_run_ms'] = round((time.time() - start) * 1000, 2)
+        return results
+
+    def get_stats(self) -> Dict:
+        """Get aggregator statistics for monitoring"""
+        return dict(self.stats, running=bool(self.aggregator_thread and self.aggregator_thread.is_alive()))
+
+
+# Global aggregator instance (initialized in app.py)
+activity_rollup_aggregator: Optional[ActivityRollupAggregator] = None
+
+
+def get_activity_rollup_aggregator() -> Optional[ActivityRollupAggregator]:
+    """Get the global activity rollup aggregator instance"""
+    return activity_rollup_aggregator
+
+
+def init_activity_rollup_aggregator(app, db, enabled=True):
+    """
+    Initialize and start the global activity rollup aggregator
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable aggregation (default: True)
+    """
+    global activity_rollup_aggregator
+
+    activity_rollup_aggregator = ActivityRollupAggregator(app, db, enabled=enabled)
+    activity_rollup_aggregator.start()
+
+    from shutdown_handler import register_cleanup_callback
+    register_cleanup_callback(activity_rollup_aggregator.stop, "activity_rollup_aggregator_stop")
+
+    return activity_rollup_aggregator
@@ -8,10 +8,13 @@ from datetime import datetime, timedelta
 from flask import jsonify, request, make_response
 from sqlalchemy import func, or_, desc, text
 from app import app, db, limiter
-from models import User, Bag, BagType, Link, Scan, Bill, BillBag
+from models import User, Bag, BagType, Link, Scan, Bill, BillBag, StatisticsCache, qr_match_sql
 from auth_utils import require_auth, current_user
 from validation_utils import InputValidator
-from dashboard_cache import get_dashboard_cache
+from dashboard_cache import get_dashboard_cache, STATS_CACHE_TTL, HOURLY_CACHE_TTL
+from dashboard_refresher import register_section as register_dashboard_section
+from activity_rollup import get_scan_counts
+from search_utils import search, match_condition
 
 logger = logging.getLogger(__name__)
 
@@ -19,88 +22,185 @@ logger = logging.getLogger(__name__)
 # DASHBOARD ANALYTICS ENDPOINT
 # =============================================================================
 
+def _compute_core_stats():
+    """Core bag/scan/bill/user counts for the dashboard (cached across workers)"""
+    # OPTIMIZED: Exact counts from trigger-maintained counters (O(1) at any scale)
+    # Linked children == link rows (one-child-one-parent constraint on link.child_bag_id)
+    try:
+        counts = StatisticsCache.get_exact_counts()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Statistics counters unavailable, using live counts: {e}")
+        counts = None
+    
+    if counts:
+        return {
+            'parent_bags': counts['parent_bags'],
+            'child_bags': counts['child_bags'],
+            'total_bags': counts['total_bags'],
+            'total_scans': counts['total_scans'],
+            'total_bills': counts['total_bills'],
+            'total_users': counts['total_users'],
+            'unlinked_children': max(0, counts['child_bags'] - counts['total_links'])
+        }
+    
+    # Fallback: single aggregated query (full scans - only before counters are seeded)
+    stats_result = db.session.execute(text("""
+        WITH stats AS (
+            SELECT 
+                COUNT(*) FILTER (WHERE type = 'parent') as parent_bags,
+                COUNT(*) FILTER (WHERE type = 'child') as child_bags,
+                COUNT(*) as total_bags
+            FROM bag
+        ), scan_stats AS (
+            SELECT COUNT(*) as total_scans FROM scan
+        ), bill_stats AS (
+            SELECT COUNT(*) as total_bills FROM bill
+        ), user_stats AS (
+            SELECT COUNT(*) as total_users FROM "user"
+        ), unlinked AS (
+            SELECT COUNT(*) as unlinked_children FROM bag 
+            WHERE type = 'child' 
+            AND NOT EXISTS (SELECT 1 FROM link WHERE link.child_bag_id = bag.id)
+        )
+        SELECT * FROM stats, scan_stats, bill_stats, user_stats, unlinked
+    """)).fetchone()
+    
+    if stats_result is None:
+        return {
+            'parent_bags': 0, 'child_bags': 0, 'total_bags': 0, 'total_scans': 0,
+            'total_bills': 0, 'total_users': 0, 'unlinked_children': 0
+        }
+    
+    return {
+        'parent_bags': stats_result[0] or 0,
+        'child_bags': stats_result[1] or 0,
+        'total_bags': stats_result[2] or 0,
+        'total_scans': stats_result[3] or 0,
+        'total_bills': stats_result[4] or 0,
+        'total_users': stats_result[5] or 0,
+        'unlinked_children': stats_result[6] or 0
+    }
+
+
+def _compute_scan_activity():
+    """Today's scan volume and active users (cached across workers)"""
+    now = datetime.now()
+    today_start = datetime.combine(now.date(), datetime.min.time())
+    
+    # Today's totals from the hourly rollup (+ the not yet aggregated tail)
+    by_user = get_scan_counts(today_start, today_start + timedelta(days=1), group_by=('user_id',))
+    
+    # The last hour is not hour-aligned - a small range query on the current partition
+    scans_last_hour = db.session.execute(text("""
+        SELECT COUNT(*) FROM scan WHERE timestamp >= :hour_ago
+    """), {'hour_ago': now - timedelta(hours=1)}).scalar()
+    
+    return {
+        'scans_today': sum(row[1] for row in by_user),
+        'scans_last_hour': scans_last_hour or 0,
+        'active_users_today': sum(1 for row in by_user if row[0])
+    }
+
+
+def _compute_hourly_scans():
+    """Today's scans per hour plus the peak hour (cached across workers)"""
+    today_start = datetime.combine(datetime.now().date(), datetime.min.time())
+    
+    # OPTIMIZED: 24 rollup buckets instead of grouping today's raw scans
+    hourly_data = get_scan_counts(today_start, today_start + timedelta(days=1), group_by=('hour',))
+    
+    # Convert to dict for O(1) lookup and fill in missing hours with 0
+    hourly_dict = {row[0].hour: row[1] for row in hourly_data}
+    hourly_scans = [hourly_dict.get(hour, 0) for hour in range(24)]
+    
+    # Find peak hour from the already-queried data
+    if hourly_dict:
+        peak_hour = f"{max(hourly_dict, key=hourly_dict.get)}:00"
+    else:
+        peak_hour = "--"
+    
+    return {'hourly_scans': hourly_scans, 'peak_hour': peak_hour}
+
+
+def _compute_billing_stats():
+    """Bill status breakdown for admin/biller dashboards (cached across workers)"""
+    month_ago = datetime.now().date() - timedelta(days=30)
+    
+    bill_counts_result = db.session.execute(text("""
+        SELECT 
+            COUNT(*) FILTER (WHERE status = 'completed') as completed,
+            COUNT(*) FILTER (WHERE status = 'in_progress') as in_progress,
+            COUNT(*) FILTER (WHERE status = 'new') as pending,
+            COUNT(*) FILTER (WHERE created_at >= :month_ago) as monthly,
+            AVG(parent_bag_count) as avg_bags,
+            COUNT(*) as total
+        FROM bill
+    """), {'month_ago': month_ago}).fetchone()
+    
+    if not bill_counts_result:
+        return {
+            'total_bills': 0,
+            'completed_bills': 0,
+            'in_progress_bills': 0,
+            'pending_bills': 0,
+            'monthly_bills': 0,
+            'overdue_bills': 0,
+            'avg_bags_per_bill': 0
+        }
+    
+    return {
+        'total_bills': bill_counts_result[5] or 0,
+        'completed_bills': bill_counts_result[0] or 0,
+        'in_progress_bills': bill_counts_result[1] or 0,
+        'pending_bills': bill_counts_result[2] or 0,
+        'monthly_bills': bill_counts_result[3] or 0,
+        'overdue_bills': 0,
+        'avg_bags_per_bill': round(float(bill_counts_result[4]), 1) if bill_counts_result[4] else 0
+    }
+
+
+register_dashboard_section('core_stats', STATS_CACHE_TTL, _compute_core_stats)
+register_dashboard_section('scan_activity', STATS_CACHE_TTL, _compute_scan_activity)
+register_dashboard_section('hourly_scans', HOURLY_CACHE_TTL, _compute_hourly_scans)
+register_dashboard_section('billing_stats', STATS_CACHE_TTL, _compute_billing_stats)
+
+
 @app.route('/api/dashboard/analytics')
 @require_auth
 @limiter.limit("10000 per minute")  # Increased for 100+ concurrent users
 def get_dashboard_analytics():
     """Comprehensive dashboard analytics endpoint with role-based data.
     
-    OPTIMIZATION: Uses short-lived in-memory cache (5s TTL) to reduce DB load
-    while maintaining near real-time accuracy.
+    OPTIMIZATION: Aggregates come from the cross-worker dashboard cache, kept warm by
+    the background refresher (dashboard_refresher.py), so requests serve cached
+    values immediately instead of recomputing them inline.
     """
     try:
         cache = get_dashboard_cache()
         now = datetime.now()
         today = now.date()
         week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
         
         # Get current user role
         user_role = current_user.role if hasattr(current_user, 'role') else 'dispatcher'
         
-        # Try to get core stats from cache first
-        cached_core = cache.get_core_stats()
-        if cached_core:
-            parent_bags = cached_core['parent_bags']
-            child_bags = cached_core['child_bags']
-            total_bags = cached_core['total_bags']
-            total_scans = cached_core['total_scans']
-            total_bills = cached_core['total_bills']
-            total_users = cached_core['total_users']
-            unlinked_children = cached_core['unlinked_children']
-        else:
-            # OPTIMIZED: Single aggregated query for all core stats
-            stats_result = db.session.execute(text("""
-                WITH stats AS (
-                    SELECT 
-                        COUNT(*) FILTER (WHERE type = 'parent') as parent_bags,
-                        COUNT(*) FILTER (WHERE type = 'child') as child_bags,
-                        COUNT(*) as total_bags
-                    FROM bag
-                ), scan_stats AS (
-                    SELECT COUNT(*) as total_scans FROM scan
-                ), bill_stats AS (
-                    SELECT COUNT(*) as total_bills FROM bill
-                ), user_stats AS (
-                    SELECT COUNT(*) as total_users FROM "user"
-                ), unlinked AS (
-                    SELECT COUNT(*) as unlinked_children FROM bag 
-                    WHERE type = 'child' 
-                    AND NOT EXISTS (SELECT 1 FROM link WHERE link.child_bag_id = bag.id)
-                )
-                SELECT * FROM stats, scan_stats, bill_stats, user_stats, unlinked
-            """)).fetchone()
-            
-            if stats_result is None:
-                parent_bags, child_bags, total_bags, total_scans, total_bills, total_users, unlinked_children = 0, 0, 0, 0, 0, 0, 0
-            else:
-                parent_bags = stats_result[0] or 0
-                child_bags = stats_result[1] or 0
-                total_bags = stats_result[2] or 0
-                total_scans = stats_result[3] or 0
-                total_bills = stats_result[4] or 0
-                total_users = stats_result[5] or 0
-                unlinked_children = stats_result[6] or 0
-            
-            # Cache the result
-            cache.set_core_stats({
-                'parent_bags': parent_bags,
-                'child_bags': child_bags,
-                'total_bags': total_bags,
-                'total_scans': total_scans,
-                'total_bills': total_bills,
-                'total_users': total_users,
-                'unlinked_children': unlinked_children
-            })
+        core, _, _ = cache.get_or_compute('core_stats', STATS_CACHE_TTL, _compute_core_stats)
+        activity, _, _ = cache.get_or_compute('scan_activity', STATS_CACHE_TTL, _compute_scan_activity)
+        parent_bags = core['parent_bags']
+        child_bags = core['child_bags']
+        total_bags = core['total_bags']
+        total_scans = core['total_scans']
+        total_bills = core['total_bills']
+        total_users = core['total_users']
+        unlinked_children = core['unlinked_children']
         
         # System metrics (admin only)
         system_metrics = {}
         if user_role == 'admin':
             system_metrics = {
                 'total_users': total_users,
-                'active_users_today': db.session.query(func.count(func.distinct(Scan.user_id))).filter(
-                    func.date(Scan.timestamp) == today
-                ).scalar() or 0,
+                'active_users_today': activity['active_users_today'],
                 'users_growth': User.query.filter(User.created_at >= week_ago).count(),
                 'database_size_mb': 15.0,  # Simplified for now
                 'uptime_hours': int((now - datetime(2025, 8, 19)).total_seconds() / 3600),
@@ -108,76 +208,18 @@ def get_dashboard_analytics():
             }
         
         # Performance metrics
-        scans_today = Scan.query.filter(func.date(Scan.timestamp) == today).count()
-        
-        # Calculate hourly rate
-        hour_ago = now - timedelta(hours=1)
-        scans_last_hour = Scan.query.filter(Scan.timestamp >= hour_ago).count()
+        scans_today = activity['scans_today']
+        scans_last_hour = activity['scans_last_hour']
         
-        # Try to get hourly data from cache (longer TTL since it changes slowly)
-        cached_hourly = cache.get_hourly_scans()
-        if cached_hourly:
-            hourly_scans, peak_hour = cached_hourly
-        else:
-            # OPTIMIZED: Get hourly distribution using single grouped query
-            hourly_data_raw = db.session.query(
-                func.extract('hour', Scan.timestamp).label('hour'),
-                func.count().label('count')
-            ).filter(
-                func.date(Scan.timestamp) == today
-            ).group_by('hour').all()
-            
-            # Convert to dict for O(1) lookup and fill in missing hours with 0
-            hourly_dict = {int(row.hour): row.count for row in hourly_data_raw}
-            hourly_scans = [hourly_dict.get(hour, 0) for hour in range(24)]
-            
-            # Find peak hour from the already-queried data
-            if hourly_data_raw:
-                peak_hour_row = max(hourly_data_raw, key=lambda x: x[1])
-                peak_hour = f"{int(peak_hour_row[0])}:00"
-            else:
-                peak_hour = "--"
-            
-            cache.set_hourly_scans(hourly_scans, peak_hour)
+        # Hourly distribution (longer TTL since it changes slowly)
+        hourly, _, _ = cache.get_or_compute('hourly_scans', HOURLY_CACHE_TTL, _compute_hourly_scans)
+        hourly_scans = hourly['hourly_scans']
+        peak_hour = hourly['peak_hour']
         
         # Billing metrics (admin and biller) - with caching
         billing_metrics = {}
         if user_role in ['admin', 'biller']:
-            cached_billing = cache.get_billing_stats()
-            if cached_billing:
-                billing_metrics = cached_billing
-            else:
-                bill_counts_result = db.session.execute(text("""
-                    SELECT 
-                        COUNT(*) FILTER (WHERE status = 'completed') as completed,
-                        COUNT(*) FILTER (WHERE status = 'in_progress') as in_progress,
-                        COUNT(*) FILTER (WHERE status = 'new') as pending,
-                        COUNT(*) FILTER (WHERE created_at >= :month_ago) as monthly,
-                        AVG(parent_bag_count) as avg_bags
-                    FROM bill
-                """), {'month_ago': month_ago}).fetchone()
-                
-                if bill_counts_result:
-                    billing_metrics = {
-                        'total_bills': total_bills,
-                        'completed_bills': bill_counts_result[0] or 0,
-                        'in_progress_bills': bill_counts_result[1] or 0,
-                        'pending_bills': bill_counts_result[2] or 0,
-                        'monthly_bills': bill_counts_result[3] or 0,
-                        'overdue_bills': 0,
-                        'avg_bags_per_bill': round(bill_counts_result[4], 1) if bill_counts_result[4] else 0
-                    }
-                else:
-                    billing_metrics = {
-                        'total_bills': 0,
-                        'completed_bills': 0,
-                        'in_progress_bills': 0,
-                        'pending_bills': 0,
-                        'monthly_bills': 0,
-                        'overdue_bills': 0,
-                        'avg_bags_per_bill': 0
-                    }
-                cache.set_billing_stats(billing_metrics)
+            billing_metrics, _, _ = cache.get_or_compute('billing_stats', STATS_CACHE_TTL, _compute_billing_stats)
         
         # Dispatch metrics (admin and dispatcher) - lightweight queries
         dispatch_metrics = {}
@@ -191,11 +233,16 @@ def get_dashboard_analytics():
                 Bag.dispatch_area != None
             ).count()
             
+            # Today's scans per dispatch area (hourly rollup - a few dozen rows)
+            today_start = datetime.combine(today, datetime.min.time())
+            scans_by_area = get_scan_counts(today_start, today_start + timedelta(days=1), group_by=('dispatch_area',))
+            
             dispatch_metrics = {
                 'dispatch_areas': dispatch_areas,
                 'dispatched_today': dispatched_today,
                 'pending_dispatch': Bag.query.filter_by(dispatch_area=None).count(),
-                'avg_dispatch_time_hours': 2.5
+                'avg_dispatch_time_hours': 2.5,
+                'scans_today_by_area': {area or 'unassigned': scans for area, scans, _, _ in scans_by_area}
             }
         
         # Recent activity - always fresh (small query, important for user experience)
@@ -294,20 +341,22 @@ def get_all_parent_bags():
         # Build query
         if search:
             search = InputValidator.sanitize_search_query(search)
+            # Prefix range scan for short terms, trigram index otherwise
+            condition, params = match_condition('bag', search)
             # Count total for pagination
-            total = db.session.execute(text("""
+            total = db.session.execute(text(f"""
                 SELECT COUNT(*) FROM bag 
-                WHERE type = 'parent' AND (qr_id ILIKE :pattern OR name ILIKE :pattern)
-            """), {'pattern': f'%{search}%'}).scalar() or 0
+                WHERE type = 'parent' AND {condition}
+            """), params).scalar() or 0
             
             # Get page data
-            bags_result = db.session.execute(text("""
+            bags_result = db.session.execute(text(f"""
                 SELECT id, qr_id, name, type, dispatch_area, created_at, updated_at
                 FROM bag
-                WHERE type = 'parent' AND (qr_id ILIKE :pattern OR name ILIKE :pattern)
+                WHERE type = 'parent' AND {condition}
                 ORDER BY created_at DESC
                 LIMIT :limit OFFSET :offset
-            """), {'pattern': f'%{search}%', 'limit': per_page, 'offset': offset}).fetchall()
+            """), dict(params, limit=per_page, offset=offset)).fetchall()
         else:
             # Count total
             total = db.session.execute(text("""
@@ -393,14 +442,14 @@ def get_bag_children(bag_id):
 def get_bag_by_qr(qr_id):
     """Get bag details by QR code - useful for testing and integrations"""
     try:
-        # Query bag by QR code (case-insensitive)
-        bag_result = db.session.execute(text("""
+        # Query bag by canonical QR code (plain equality on the unique qr_id index)
+        bag_result = db.session.execute(text(f"""
             SELECT id, qr_id, name, type, status, child_count, weight_kg, dispatch_area, 
                    created_at, updated_at
             FROM bag
-            WHERE UPPER(qr_id) = UPPER(:qr_id)
+            WHERE {qr_match_sql('qr_id', ':qr_id')}
             LIMIT 1
-        """), {'qr_id': qr_id}).fetchone()
+        """), {'qr_id': InputValidator.normalize_qr(qr_id)}).fetchone()
         
         if not bag_result:
             return jsonify({'success': False, 'error': 'Bag not found'}), 404
@@ -434,12 +483,12 @@ def get_bag_children_by_qr(qr_id):
     """Get children of parent bag by QR code"""
     try:
         # First get parent bag ID
-        parent_result = db.session.execute(text("""
+        parent_result = db.session.execute(text(f"""
             SELECT id, type
             FROM bag
-            WHERE UPPER(qr_id) = UPPER(:qr_id)
+            WHERE {qr_match_sql('qr_id', ':qr_id')}
             LIMIT 1
-        """), {'qr_id': qr_id}).fetchone()
+        """), {'qr_id': InputValidator.normalize_qr(qr_id)}).fetchone()
         
         if not parent_result:
             return jsonify({'success': False, 'error': 'Parent bag not found'}), 404
@@ -634,7 +683,7 @@ def get_recent_scans():
 @require_auth
 @limiter.limit("10000 per minute")  # Increased for 100+ concurrent users
 def search_bags_api():
-    """Ultra-optimized bag search using raw SQL - Target: <5ms"""
+    """Bag search by QR code or name, backed by the search indexes (search_utils)"""
     try:
         from validation_utils import InputValidator
         
@@ -651,13 +700,9 @@ def search_bags_api():
         # Validate limit
         limit = max(1, min(request.args.get('limit', 50, type=int), 100))
         
-        # Raw SQL for maximum speed - uses existing indexes on qr_id and name
-        bags_result = db.session.execute(text("""
-            SELECT id, qr_id, name, type, dispatch_area, status
-            FROM bag
-            WHERE qr_id ILIKE :pattern OR name ILIKE :pattern
-            LIMIT :limit
-        """), {'pattern': f'%{query_text}%', 'limit': limit}).fetchall()
+        # Exact / prefix / trigram strategy picked from the term, ranked by relevance
+        found = search('bag', query_text, 'id, qr_id, name, type, dispatch_area, status', limit=limit)
+        bags_result = found['rows']
         
         # Response with all required fields
         bags_data = [
@@ -675,7 +720,9 @@ def search_bags_api():
         return jsonify({
             'success': True,
             'bags': bags_data,
-            'count': len(bags_data)
+            'count': len(bags_data),
+            'strategy': found['strategy'],
+            'truncated': found['truncated']
         })
         
     except Exception as e:
@@ -686,10 +733,10 @@ def search_bags_api():
 @require_auth
 @limiter.limit("5000 per minute")  # Reduced from 10000 - search is heavier
 def search_unified():
-    """Unified search endpoint with optimized UNION query for better performance.
+    """Unified search across bags, bills and users (users for admins only).
     
-    OPTIMIZATION: Uses a single SQL UNION query instead of 3 sequential ORM queries.
-    This reduces database round trips from 3 to 1, improving response time by ~60%.
+    Each entity is searched with the strategy its term allows (exact match, prefix
+    range scan or trigram index) and ranked by relevance - see search_utils.
     """
     try:
         query_text = request.args.get('q', '').strip()
@@ -712,77 +759,46 @@ def search_unified():
         results = {'bags': [], 'bills': [], 'users': []}
         is_admin = current_user.is_admin()
         
-        search_pattern = f'%{query_text}%'
-        
         search_bags = entity_type in ['all', 'bags', 'bag']
         search_bills = entity_type in ['all', 'bills', 'bill']
         search_users = is_admin and entity_type in ['all', 'users', 'user']
         
-        union_parts = []
-        params = {'pattern': search_pattern, 'limit': limit}
+        # One ranked, index-backed search per entity (exact / prefix / trigram),
+        # each within its own latency budget - see search_utils
+        strategies = {}
+        truncated = False
         
         if search_bags:
-            union_parts.append("""
-                SELECT 'bag' as entity_type, id, qr_id as identifier, name as secondary, 
-                       type as extra1, dispatch_area as extra2, NULL as extra3
-                FROM bag 
-                WHERE qr_id ILIKE :pattern OR name ILIKE :pattern
-                LIMIT :limit
-            """)
+            found = search('bag', query_text, 'id, qr_id, name, type, dispatch_area', limit=limit)
+            strategies['bags'], truncated = found['strategy'], truncated or found['truncated']
+            results['bags'] = [
+                {'id': row[0], 'qr_id': row[1], 'name': row[2], 'type': row[3], 'dispatch_area': row[4]}
+                for row in found['rows']
+            ]
         
         if search_bills:
-            union_parts.append("""
-                SELECT 'bill' as entity_type, id, bill_id as identifier, description as secondary,
-                       status as extra1, NULL as extra2, NULL as extra3
-                FROM bill
-                WHERE bill_id ILIKE :pattern OR description ILIKE :pattern
-                LIMIT :limit
-            """)
+            found = search('bill', query_text, 'id, bill_id, description, status', limit=limit)
+            strategies['bills'], truncated = found['strategy'], truncated or found['truncated']
+            results['bills'] = [
+                {'id': row[0], 'bill_id': row[1], 'description': row[2], 'status': row[3]}
+                for row in found['rows']
+            ]
         
         if search_users:
-            union_parts.append("""
-                SELECT 'user' as entity_type, id, username as identifier, email as secondary,
-                       role as extra1, NULL as extra2, NULL as extra3
-                FROM "user"
-                WHERE username ILIKE :pattern OR email ILIKE :pattern
-                LIMIT :limit
-            """)
-        
-        if union_parts:
-            combined_query = " UNION ALL ".join(union_parts)
-            rows = db.session.execute(text(combined_query), params).fetchall()
-            
-            for row in rows:
-                entity_type_val, id_val, identifier, secondary, extra1, extra2, extra3 = row
-                
-                if entity_type_val == 'bag':
-                    results['bags'].append({
-                        'id': id_val,
-                        'qr_id': identifier,
-                        'name': secondary,
-                        'type': extra1,
-                        'dispatch_area': extra2
-                    })
-                elif entity_type_val == 'bill':
-                    results['bills'].append({
-                        'id': id_val,
-                        'bill_id': identifier,
-                        'description': secondary,
-                        'status': extra1
-                    })
-                elif entity_type_val == 'user':
-                    results['users'].append({
-                        'id': id_val,
-                        'username': identifier,
-                        'email': secondary,
-                        'role': extra1
-                    })
+            found = search('user', query_text, 'id, username, email, role', limit=limit)
+            strategies['users'], truncated = found['strategy'], truncated or found['truncated']
+            results['users'] = [
+                {'id': row[0], 'username': row[1], 'email': row[2], 'role': row[3]}
+                for row in found['rows']
+            ]
         
         return jsonify({
             'success': True,
             'query': query_text,
             'results': results,
             'total_found': sum(len(v) for v in results.values()),
+            'strategies': strategies,
+            'truncated': truncated,
             'timestamp': time.time()
         })
         
@@ -3,6 +3,7 @@ Optimized API Endpoints - Mobile-First Performance
 Replaces slow routes with ultra-fast raw SQL and smart caching
 Target: <50ms response time, <5KB payload size for mobile
 """
+import json
 import logging
 from datetime import datetime
 from flask import jsonify, request
@@ -12,6 +13,7 @@ from auth_utils import require_auth, current_user
 from validation_utils import InputValidator
 # Cache disabled - using live data only
 from api_middleware import add_cache_headers, filter_fields, get_optimal_page_size, is_health_check_request
+from search_utils import match_condition
 
 logger = logging.getLogger(__name__)
 
@@ -66,8 +68,10 @@ def api_bags_optimized():
             params['bag_type'] = bag_type
         
         if search:
-            where_clauses.append("qr_id ILIKE :search")
-            params['search'] = f'%{search}%'
+            # Prefix range scan for short terms, trigram index otherwise
+            condition, search_params = match_condition('bag', search, include_secondary=False)
+            where_clauses.append(condition)
+            params.update(search_params)
         
         # KEYSET PAGINATION: Efficient for 1M+ records
         if cursor:
@@ -379,7 +383,7 @@ def api_batch_unlink():
         
         # Find parent bag
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         
@@ -394,7 +398,7 @@ def api_batch_unlink():
         for child_qr in child_qrs:
             try:
                 child_bag = Bag.query.filter(
-                    func.upper(Bag.qr_id) == func.upper(child_qr)
+                    Bag.qr_match(child_qr)
                 ).first()
                 
                 if not child_bag:
@@ -440,4 +444,224 @@ def api_batch_unlink():
         logger.error(f"Batch unlink error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
+# =============================================================================
+# BATCH LINK OPERATION
+# =============================================================================
+
+@app.route('/api/v2/batch/link', methods=['POST'])
+@require_auth
+@limiter.limit("100 per minute")
+def api_batch_link():
+    """
+    Batch link operation - counterpart of /api/v2/batch/unlink
+    Link multiple children to one parent in a single statement
+    
+    Request body:
+        {
+            "parent_qr": "SB12345",
+            "child_qrs": ["CH001", "CH002", "CH003"]
+        }
+    
+    Returns per-child outcomes in request order. Valid children are linked in
+    order until the parent reaches 30; the rest are reported, not failed as a batch.
+    
+    Performance: One round trip - set-wise validation, multi-row INSERTs
+    """
+    try:
+        from api_middleware import validate_batch_size
+        from query_optimizer import query_optimizer
+        
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        
+        parent_qr = str(data.get('parent_qr') or '').strip()
+        child_qrs = data.get('child_qrs', [])
+        
+        if not parent_qr:
+            return jsonify({'success': False, 'error': 'parent_qr required'}), 400
+        
+        # Validate batch size
+        is_valid, error_msg = validate_batch_size(child_qrs, max_size=30)
+        if not is_valid:
+            return jsonify({'success': False, 'error': error_msg}), 400
+        
+        # Format errors are answered here; only well-formed codes reach the database
+        results = [None] * len(child_qrs)
+        valid = []
+        for index, child_qr in enumerate(child_qrs):
+            is_valid, cleaned_qr, error_msg = InputValidator.validate_qr_code(str(child_qr or '').strip(), bag_type='child')
+            if is_valid:
+                valid.append((index, cleaned_qr))
+            else:
+                results[index] = {'qr_code': child_qr, 'status': 'invalid_format', 'success': False,
+                                  'created': False, 'message': error_msg}
+        
+        linked_count = 0
+        child_count = None
+        if valid:
+            outcome = query_optimizer.batch_link_children(parent_qr, [qr for _, qr in valid], current_user.id)
+            if not outcome['success']:
+                return jsonify({'success': False, 'error': outcome['message']}), 500
+            for (index, _), result in zip(valid, outcome['results']):
+                results[index] = result
+            linked_count = outcome['linked_count']
+            child_count = outcome['child_count']
+        
+        return jsonify({
+            'success': True,
+            'parent_qr': InputValidator.normalize_qr(parent_qr),
+            'linked_count': linked_count,
+            'child_count': child_count,
+            'results': results
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Batch link error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
+# =============================================================================
+# OFFLINE SCAN SYNC
+# =============================================================================
+
+SCAN_SYNC_MAX_BATCH = 500
+
+def _parse_sync_scan(item, can_bill):
+    """
+    Validate one queued scan from a sync batch.
+    
+    Returns:
+        (client_scan_id, group_key, qr_code, error) where group_key is
+        ('child', parent_qr) or ('bill_parent', bill_pk) and error is a result dict
+    """
+    import uuid
+    
+    if not isinstance(item, dict):
+        return None, None, None, {'success': False, 'error_type': 'invalid_request', 'message': 'Scan must be an object'}
+    
+    try:
+        client_scan_id = str(uuid.UUID(str(item.get('id', ''))))
+    except ValueError:
+        return None, None, None, {'success': False, 'error_type': 'invalid_request', 'message': 'Scan id must be a UUID'}
+    
+    kind = item.get('type')
+    qr_code = str(item.get('qr_code') or '').strip()
+    if kind == 'child':
+        parent_qr = InputValidator.normalize_qr(str(item.get('parent_qr') or '').strip())
+        if not parent_qr:
+            return client_scan_id, None, None, {'success': False, 'error_type': 'missing_data', 'message': 'No parent bag selected'}
+        is_valid, qr_code, error_msg = InputValidator.validate_qr_code(qr_code, bag_type='child')
+        if is_valid and qr_code == parent_qr:
+            is_valid, error_msg = False, 'Cannot link to itself'
+        group_key = (kind, parent_qr)
+    elif kind == 'bill_parent':
+        if not can_bill:
+            return client_scan_id, None, None, {'success': False, 'error_type': 'access_denied',
+                                                'message': 'Access restricted to admin and biller users.'}
+        try:
+            bill_pk = int(item.get('bill_id'))
+        except (TypeError, ValueError):
+            return client_scan_id, None, None, {'success': False, 'error_type': 'missing_data', 'message': 'Missing bill ID'}
+        is_valid, qr_code, error_msg = InputValidator.validate_qr_code(qr_code, bag_type='parent')
+        group_key = (kind, bill_pk)
+    else:
+        return client_scan_id, None, None, {'success': False, 'error_type': 'invalid_request',
+                                            'message': "Scan type must be 'child' or 'bill_parent'"}
+    
+    if not is_valid:
+        return client_scan_id, None, None, {'success': False, 'error_type': 'invalid_format', 'message': error_msg}
+    return client_scan_id, group_key, qr_code, None
+
+@app.route('/api/v2/scans/sync', methods=['POST'])
+@require_auth
+@limiter.limit("600 per minute")
+def api_sync_scans():
+    """
+    Replay a device's offline scan queue in one request
+    
+    Request body (scans in the order they were made on the device):
+        {
+            "scans": [
+                {"id": "<uuid>", "type": "child", "parent_qr": "SB12345", "qr_code": "CH001"},
+                {"id": "<uuid>", "type": "bill_parent", "bill_id": 42, "qr_code": "SB12345"}
+            ]
+        }
+    
+    Scans are grouped per parent bag / bill and each group is applied in one
+    transaction (QueryOptimizer.sync_scan_group). The id is recorded in
+    scan_sync_receipt with the outcome, so re-sending a batch after a dropped
+    response is safe: already-applied ids return their stored result with
+    "replayed": true. Only server_error results should be retried by the device.
+    
+    Performance: one round trip per device, one transaction per parent/bill
+    """
+    try:
+        from api_middleware import validate_batch_size
+        from models import ScanSyncReceipt
+        from query_optimizer import query_optimizer
+        
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        
+        scans = data.get('scans')
+        is_valid, error_msg = validate_batch_size(scans, max_size=SCAN_SYNC_MAX_BATCH)
+        if not is_valid:
+            return jsonify({'success': False, 'error': error_msg}), 400
+        
+        can_bill = current_user.can_edit_bills()
+        results = [None] * len(scans)
+        ids = [None] * len(scans)
+        groups = {}  # group_key -> [(index, client_scan_id, qr_code)], in first-seen order
+        first_index = {}  # client_scan_id -> index of its first occurrence in this batch
+        
+        for index, item in enumerate(scans):
+            client_scan_id, group_key, qr_code, error = _parse_sync_scan(item, can_bill)
+            ids[index] = client_scan_id
+            if error:
+                results[index] = dict(error, replayed=False)
+            elif client_scan_id in first_index:
+                continue  # Same id queued twice - answered with the first occurrence's result
+            else:
+                first_index[client_scan_id] = index
+                groups.setdefault(group_key, []).append((index, client_scan_id, qr_code))
+        
+        # Ids already synced by an earlier (possibly timed-out) request
+        if first_index:
+            receipts = db.session.query(ScanSyncReceipt.client_scan_id, ScanSyncReceipt.result).filter(
+                ScanSyncReceipt.client_scan_id.in_(list(first_index))
+            ).all()
+            for client_scan_id, stored in receipts:
+                results[first_index[client_scan_id]] = dict(json.loads(stored) if stored else {'success': True}, replayed=True)
+        
+        for (kind, target), members in groups.items():
+            pending = [(index, client_scan_id, qr_code) for index, client_scan_id, qr_code in members
+                       if results[index] is None]
+            if not pending:
+                continue
+            outcomes = query_optimizer.sync_scan_group(
+                kind, target, [(client_scan_id, qr_code) for _, client_scan_id, qr_code in pending], current_user.id
+            )
+            for (index, _, _), (_, result, replayed) in zip(pending, outcomes):
+                results[index] = dict(result, replayed=replayed)
+        
+        for index, client_scan_id in enumerate(ids):
+            if results[index] is None:
+                results[index] = dict(results[first_index[client_scan_id]], replayed=True)
+            results[index] = dict(results[index], id=client_scan_id)
+        
+        return jsonify({
+            'success': True,
+            'applied': sum(1 for r in results if r.get('success') and not r.get('replayed')),
+            'replayed': sum(1 for r in results if r.get('replayed')),
+            'failed': sum(1 for r in results if not r.get('success')),
+            'results': results
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Scan sync error: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
 logger.info("✅ Optimized API endpoints registered (v2)")
@@ -506,7 +506,87 @@ def _run_lazy_initialization():
                 logger.info(f"Slow query logging initialized (lazy) - {threshold}ms")
         except Exception as e:
             logger.debug(f"Slow query logging skipped: {e}")
-            
+
+        # Statistics counter folding (deferred)
+        try:
+            from statistics_folder import init_statistics_folder
+            folding_enabled = os.environ.get('STATS_FOLDING_ENABLED', 'true').lower() == 'true'
+            init_statistics_folder(app, db, enabled=folding_enabled)
+            if folding_enabled:
+                logger.info("Statistics counter folding initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Statistics counter folding skipped: {e}")
+
+        # Monthly scan partition creation/archiving (deferred)
+        try:
+            from scan_partitions import init_scan_partition_maintainer
+            partitions_enabled = os.environ.get('SCAN_PARTITION_MAINTENANCE_ENABLED', 'true').lower() == 'true'
+            init_scan_partition_maintainer(app, db, enabled=partitions_enabled)
+            if partitions_enabled:
+                logger.info("Scan partition maintainer initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Scan partition maintainer skipped: {e}")
+
+        # Buffered audit log writer (deferred)
+        try:
+            from audit_writer import init_audit_writer
+            audit_writer_enabled = os.environ.get('AUDIT_WRITER_ENABLED', 'true').lower() == 'true'
+            init_audit_writer(app, db, enabled=audit_writer_enabled)
+            if audit_writer_enabled:
+                logger.info("Buffered audit writer initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Buffered audit writer skipped: {e}")
+
+        # Hourly scan/audit activity rollups (deferred)
+        try:
+            from activity_rollup import init_activity_rollup_aggregator
+            rollup_enabled = os.environ.get('ACTIVITY_ROLLUP_ENABLED', 'true').lower() == 'true'
+            init_activity_rollup_aggregator(app, db, enabled=rollup_enabled)
+            if rollup_enabled:
+                logger.info("Activity rollup aggregator initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Activity rollup aggregator skipped: {e}")
+
+        # Incremental data integrity checks (deferred)
+        try:
+            from integrity_checker import init_integrity_checker
+            integrity_enabled = os.environ.get('INTEGRITY_CHECK_ENABLED', 'true').lower() == 'true'
+            init_integrity_checker(app, db, enabled=integrity_enabled)
+            if integrity_enabled:
+                logger.info("Integrity checker initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Integrity checker skipped: {e}")
+
+        # Maintenance jobs whose runner died are claimed from their lease (deferred)
+        try:
+            from maintenance_jobs import init_maintenance_job_runner
+            reclaim_enabled = os.environ.get('MAINTENANCE_JOB_RECLAIM_ENABLED', 'true').lower() == 'true'
+            init_maintenance_job_runner(app, db, enabled=reclaim_enabled)
+            if reclaim_enabled:
+                logger.info("Maintenance job reclaim initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Maintenance job reclaim skipped: {e}")
+
+        # Import jobs orphaned by a dead worker (deferred)
+        try:
+            from import_jobs import get_import_job_queue
+            if os.environ.get('IMPORT_JOB_RECOVERY_ENABLED', 'true').lower() == 'true':
+                recovered = get_import_job_queue().recover_orphaned_jobs()
+                if any(recovered.values()):
+                    logger.info(f"Orphaned import jobs recovered: {recovered}")
+        except Exception as e:
+            logger.debug(f"Import job recovery skipped: {e}")
+
+        # Dashboard cache background refresh (deferred)
+        try:
+            from dashboard_refresher import init_dashboard_refresher
+            refresh_enabled = os.environ.get('DASHBOARD_REFRESH_ENABLED', 'true').lower() == 'true'
+            init_dashboard_refresher(app, db, enabled=refresh_enabled)
+            if refresh_enabled:
+                logger.info("Dashboard cache refresher initialized (lazy)")
+        except Exception as e:
+            logger.debug(f"Dashboard cache refresher skipped: {e}")
+
         logger.info("Lazy initialization completed")
         
     except Exception as e:
@@ -787,9 +867,13 @@ except Exception as e:
 # migration status before reporting full readiness.
 # ==================================================================================
 try:
+    import multiprocessing
     from background_migrations import start_background_migrations
-    # Start migrations 3 seconds after server starts (gives time for port to open)
-    start_background_migrations(app, delay_seconds=3)
+    # Pool processes (import jobs, Excel parsing) import the app too - only the
+    # server process runs migrations
+    if multiprocessing.parent_process() is None:
+        # Start migrations 3 seconds after server starts (gives time for port to open)
+        start_background_migrations(app, delay_seconds=3)
 except Exception as e:
     logger.warning(f"⚠️  Background migrations not started: {e}")
 
@@ -3,10 +3,14 @@ Audit Log Retention Policy and Cleanup Utilities
 Manages storage growth for audit logs with before/after snapshots
 """
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, time, timedelta
+from typing import Callable, List, Optional
 from sqlalchemy import text
 from app import db
+from activity_rollup import mark_stale_hours
+from scan_partitions import (
+    PARTITION_LOCK_ID, add_months, is_partitioned, list_partitions, partition_month
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +19,17 @@ AUDIT_RETENTION_DAYS = 90  # Keep audit logs for 90 days
 AUDIT_SNAPSHOT_RETENTION_DAYS = 30  # Keep before/after snapshots for 30 days
 AUDIT_CLEANUP_BATCH_SIZE = 1000  # Process deletions in batches
 
+# Actions copied to the permanent audit_log_critical table before their logs are removed
+AUDIT_CRITICAL_ACTIONS = ('delete_user', 'delete_bag', 'delete_bill', 'role_change', 'promote_to_admin')
+CRITICAL_ACTIONS_SQL = ", ".join(f"'{action}'" for action in AUDIT_CRITICAL_ACTIONS)
+CRITICAL_COLUMNS = 'id, timestamp, user_id, action, entity_type, entity_id, details, ip_address, request_id'
+
+
+def _report_progress(callback: Optional[Callable[[dict], None]], step: str, **progress) -> None:
+    """Pass cleanup progress to an optional callback (CLI output, job status)"""
+    if callback:
+        callback(dict(progress, step=step))
+
 
 class AuditRetentionPolicy:
     """Manages audit log retention and cleanup"""
@@ -27,33 +42,37 @@ class AuditRetentionPolicy:
     @staticmethod
     def cleanup_old_snapshots(
         retention_days: int = AUDIT_SNAPSHOT_RETENTION_DAYS,
-        dry_run: bool = True
+        dry_run: bool = True,
+        progress_callback: Optional[Callable[[dict], None]] = None
     ) -> dict:
         """
         Remove before/after snapshots from old audit logs to save space.
         Keeps the audit log record but removes the large JSON snapshots.
+        Runs in batches of AUDIT_CLEANUP_BATCH_SIZE, committing after each.
         
         Args:
             retention_days: Number of days to keep snapshots
             dry_run: If True, only count records without deleting
+            progress_callback: Called with a progress dict after every batch
             
         Returns:
             Dict with operation stats
         """
         cutoff_date = AuditRetentionPolicy.get_retention_cutoff_date(retention_days)
         
-        # Count records that will be affected
-        count_query = text("""
-            SELECT COUNT(*) as count
-            FROM audit_log
-            WHERE timestamp < :cutoff_date
-            AND (before_state IS NOT NULL OR after_state IS NOT NULL)
-        """)
-        
-        result = db.session.execute(count_query, {'cutoff_date': cutoff_date}).fetchone()
-        affected_count = result[0] if result else 0
-        
         if dry_run:
+            # Count records that will be affected
+            count_query = text("""
+                SELECT COUNT(*) as count
+                FROM audit_log
+                WHERE timestamp < :cutoff_date
+                AND (before_state IS NOT NULL OR after_state IS NOT NULL
+                     OR state_diff IS NOT NULL OR state_diff_zstd IS NOT NULL)
+            """)
+            
+            result = db.session.execute(count_query, {'cutoff_date': cutoff_date}).fetchone()
+            affected_count = result[0] if result else 0
+            
             logger.info(
                 f"[DRY RUN] Would clear snapshots from {affected_count} audit logs "
                 f"older than {retention_days} days"
@@ -64,122 +83,293 @@ class AuditRetentionPolicy:
                 'cutoff_date': cutoff_date.isoformat()
             }
         
-        # Clear snapshots but keep audit records
-        update_query = text("""
-            UPDATE audit_log
+        # Clear snapshots but keep audit records - keyset batches so each one is
+        # a short transaction and never rescans rows already cleared
+        batch_query = text("""
+            WITH batch AS (
+                SELECT id, timestamp FROM audit_log
+                WHERE timestamp < :cutoff_date
+                AND id > :last_id
+                AND (before_state IS NOT NULL OR after_state IS NOT NULL
+                     OR state_diff IS NOT NULL OR state_diff_zstd IS NOT NULL)
+                ORDER BY id
+                LIMIT :batch_size
+            )
+            UPDATE audit_log a
             SET before_state = NULL,
-                after_state = NULL
-            WHERE timestamp < :cutoff_date
-            AND (before_state IS NOT NULL OR after_state IS NOT NULL)
+                after_state = NULL,
+                state_diff = NULL,
+                state_diff_zstd = NULL,
+                changed_keys = NULL
+            FROM batch b
+            WHERE a.id = b.id AND a.timestamp = b.timestamp
+            RETURNING a.id
         """)
         
-        result = db.session.execute(update_query, {'cutoff_date': cutoff_date})
-        db.session.commit()
+        total_cleared = 0
+        last_id = 0
+        while True:
+            ids = [row[0] for row in db.session.execute(batch_query, {
+                'cutoff_date': cutoff_date,
+                'last_id': last_id,
+                'batch_size': AUDIT_CLEANUP_BATCH_SIZE
+            })]
+            db.session.commit()
+            
+            if not ids:
+                break
+            last_id = max(ids)
+            total_cleared += len(ids)
+            _report_progress(progress_callback, 'clear_snapshots', cleared=total_cleared)
         
         logger.info(
-            f"Cleared snapshots from {result.rowcount} audit logs "
+            f"Cleared snapshots from {total_cleared} audit logs "
             f"older than {retention_days} days"
         )
         
         return {
             'dry_run': False,
-            'cleared_snapshots': result.rowcount,
+            'cleared_snapshots': total_cleared,
             'cutoff_date': cutoff_date.isoformat()
         }
     
+    @staticmethod
+    def get_expired_partitions(cutoff_date: datetime) -> List[dict]:
+        """
+        Monthly audit_log partitions whose whole range is older than cutoff_date.
+        Empty when audit_log is not partitioned.
+        """
+        conn = db.session.connection()
+        if not is_partitioned(conn, 'audit_log'):
+            return []
+        
+        expired = []
+        for partition in list_partitions(conn, 'audit_log'):
+            month = partition_month(partition['name'], 'audit_log')
+            if month is not None and datetime.combine(add_months(month, 1), time.min) <= cutoff_date:
+                expired.append(dict(partition, month=month.isoformat()))
+        return expired
+    
+    @staticmethod
+    def archive_critical_actions(
+        source: str = 'audit_log',
+        cutoff_date: Optional[datetime] = None,
+        progress_callback: Optional[Callable[[dict], None]] = None
+    ) -> int:
+        """
+        Copy critical actions from source (audit_log or one of its partitions) into
+        audit_log_critical in keyset batches. Already-copied rows are skipped, so
+        an interrupted run can simply be repeated.
+        
+        Returns:
+            Number of critical rows read from source
+        """
+        cutoff_filter = "AND timestamp < :cutoff_date" if cutoff_date else ""
+        batch_query = text(f"""
+            WITH batch AS (
+                SELECT {CRITICAL_COLUMNS} FROM {source}
+                WHERE id > :last_id
+                AND action IN ({CRITICAL_ACTIONS_SQL})
+                {cutoff_filter}
+                ORDER BY id
+                LIMIT :batch_size
+            ), copied AS (
+                INSERT INTO audit_log_critical ({CRITICAL_COLUMNS})
+                SELECT {CRITICAL_COLUMNS} FROM batch
+                ON CONFLICT (id) DO NOTHING
+            )
+            SELECT COUNT(*), MAX(id) FROM batch
+        """)
+        
+        total = 0
+        last_id = 0
+        while True:
+            count, max_id = db.session.execute(batch_query, {
+                'cutoff_date': cutoff_date,
+                'last_id': last_id,
+                'batch_size': AUDIT_CLEANUP_BATCH_SIZE
+            }).fetchone()
+            db.session.commit()
+            
+            if not count:
+                break
+            last_id = max_id
+            total += count
+            _report_progress(progress_callback, 'archive_critical', source=source, archived=total)
+        
+        return total
+    
+    @staticmethod
+    def delete_old_rows_chunked(
+        source: str,
+        cutoff_date: datetime,
+        preserve_critical_actions: bool = True,
+        progress_callback: Optional[Callable[[dict], None]] = None
+    ) -> int:
+        """
+        Delete rows older than cutoff_date from source in keyset batches, copying
+        critical actions to audit_log_critical in the same statement.
+        
+        Used where a whole partition cannot be dropped: an unpartitioned audit_log
+        and the audit_log_default partition. Deletes from the partition bypass the
+        statement triggers on audit_log, so the batch marks its rollup hours stale.
+        
+        Returns:
+            Number of rows deleted
+        """
+        copy_critical = f"""
+            copied AS (
+                INSERT INTO audit_log_critical ({CRITICAL_COLUMNS})
+                SELECT {CRITICAL_COLUMNS} FROM batch
+                WHERE action IN ({CRITICAL_ACTIONS_SQL})
+                ON CONFLICT (id) DO NOTHING
+            ),""" if preserve_critical_actions else ""
+        batch_query = text(f"""
+            WITH batch AS (
+                SELECT {CRITICAL_COLUMNS} FROM {source}
+                WHERE timestamp < :cutoff_date
+                AND id > :last_id
+                ORDER BY id
+                LIMIT :batch_size
+            ),{copy_critical}
+            stale AS (
+                INSERT INTO rollup_stale_hour (source, hour)
+                SELECT DISTINCT 'audit_log', date_trunc('hour', timestamp) FROM batch
+                ON CONFLICT DO NOTHING
+            ),
+            deleted AS (
+                DELETE FROM {source} a
+                USING batch b
+                WHERE a.id = b.id AND a.timestamp = b.timestamp
+                RETURNING a.id
+            )
+            SELECT COUNT(*), MAX(id) FROM deleted
+        """)
+        
+        total_deleted = 0
+        last_id = 0
+        while True:
+            deleted, max_id = db.session.execute(batch_query, {
+                'cutoff_date': cutoff_date,
+                'last_id': last_id,
+                'batch_size': AUDIT_CLEANUP_BATCH_SIZE
+            }).fetchone()
+            db.session.commit()
+            
+            if not deleted:
+                break
+            last_id = max_id
+            total_deleted += deleted
+            _report_progress(progress_callback, 'delete_rows', source=source, deleted=total_deleted)
+            logger.info(f"Deleted batch of {deleted} audit logs from {source} (total: {total_deleted})")
+        
+        return total_deleted
+    
+    @staticmethod
+    def drop_partition(name: str) -> None:
+        """
+        Detach and drop one audit_log partition. Detaching a whole month is a
+        catalog change - no per-row WAL, no dead tuples left in audit_log.
+        The month's hours are marked stale in the activity rollup.
+        """
+        # Serialize with the partition maintainer creating future months
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': PARTITION_LOCK_ID})
+        db.session.execute(text(f"ALTER TABLE audit_log DETACH PARTITION {name}"))
+        db.session.execute(text(f"DROP TABLE {name}"))
+        month = partition_month(name, 'audit_log')
+        if month is not None:
+            mark_stale_hours(db.session.connection(), 'audit_log', datetime.combine(month, time.min),
+                             datetime.combine(add_months(month, 1), time.min))
+        db.session.commit()
+    
     @staticmethod
     def cleanup_old_audit_logs(
         retention_days: int = AUDIT_RETENTION_DAYS,
         preserve_critical_actions: bool = True,
-        dry_run: bool = True
+        dry_run: bool = True,
+        progress_callback: Optional[Callable[[dict], None]] = None
     ) -> dict:
         """
         Delete old audit logs completely.
         
+        When audit_log is partitioned, every monthly partition lying entirely
+        before the cutoff is dropped whole (so logs are kept for up to one month
+        past retention_days); only stray rows in audit_log_default are deleted
+        row by row. Critical actions are first copied to audit_log_critical,
+        which is never cleaned up.
+        
         Args:
             retention_days: Number of days to keep audit logs
-            preserve_critical_actions: Keep critical actions (deletes, role changes) indefinitely
+            preserve_critical_actions: Copy critical actions (deletes, role changes)
+                to audit_log_critical before removing them
             dry_run: If True, only count records without deleting
+            progress_callback: Called with a progress dict after every batch and partition
             
         Returns:
             Dict with operation stats
         """
         cutoff_date = AuditRetentionPolicy.get_retention_cutoff_date(retention_days)
-        
-        # Build query with optional preservation of critical actions
-        if preserve_critical_actions:
-            count_query = text("""
-                SELECT COUNT(*) as count
-                FROM audit_log
-                WHERE timestamp < :cutoff_date
-                AND action NOT IN ('delete_user', 'delete_bag', 'delete_bill', 'role_change', 'promote_to_admin')
-            """)
-            delete_query = text("""
-                DELETE FROM audit_log
-                WHERE timestamp < :cutoff_date
-                AND action NOT IN ('delete_user', 'delete_bag', 'delete_bill', 'role_change', 'promote_to_admin')
-            """)
-        else:
-            count_query = text("""
-                SELECT COUNT(*) as count
-                FROM audit_log
-                WHERE timestamp < :cutoff_date
-            """)
-            delete_query = text("""
-                DELETE FROM audit_log
-                WHERE timestamp < :cutoff_date
-            """)
-        
-        # Count records
-        result = db.session.execute(count_query, {'cutoff_date': cutoff_date}).fetchone()
-        affected_count = result[0] if result else 0
+        partitioned = is_partitioned(db.session.connection(), 'audit_log')
+        expired = AuditRetentionPolicy.get_expired_partitions(cutoff_date)
+        # Rows that cannot go with a whole partition are deleted in batches
+        row_source = 'audit_log_default' if partitioned else 'audit_log'
         
         if dry_run:
+            # Estimates for partitions (planner stats), exact count for the rest
+            affected_count = sum(p['estimated_rows'] for p in expired)
+            affected_count += db.session.execute(
+                text(f"SELECT COUNT(*) FROM {row_source} WHERE timestamp < :cutoff_date"),
+                {'cutoff_date': cutoff_date}
+            ).scalar() or 0
             logger.info(
-                f"[DRY RUN] Would delete {affected_count} audit logs "
-                f"older than {retention_days} days"
+                f"[DRY RUN] Would delete ~{affected_count} audit logs older than {retention_days} days "
+                f"({len(expired)} partitions)"
             )
             return {
                 'dry_run': True,
                 'would_delete': affected_count,
+                'would_drop_partitions': [p['name'] for p in expired],
                 'cutoff_date': cutoff_date.isoformat(),
                 'critical_preserved': preserve_critical_actions
             }
         
-        # Delete in batches to avoid lock timeouts
         total_deleted = 0
-        batch_size = AUDIT_CLEANUP_BATCH_SIZE
-        
-        while True:
-            batch_query = text(f"""
-                DELETE FROM audit_log
-                WHERE id IN (
-                    SELECT id FROM audit_log
-                    WHERE timestamp < :cutoff_date
-                    {"AND action NOT IN ('delete_user', 'delete_bag', 'delete_bill', 'role_change', 'promote_to_admin')" if preserve_critical_actions else ""}
-                    LIMIT {batch_size}
+        total_preserved = 0
+        dropped = []
+        
+        for index, partition in enumerate(expired, start=1):
+            name = partition['name']
+            if preserve_critical_actions:
+                total_preserved += AuditRetentionPolicy.archive_critical_actions(
+                    name, progress_callback=progress_callback
                 )
-            """)
-            
-            result = db.session.execute(batch_query, {'cutoff_date': cutoff_date})
-            db.session.commit()
-            
-            deleted = result.rowcount
-            total_deleted += deleted
-            
-            if deleted < batch_size:
-                break
-            
-            logger.info(f"Deleted batch of {deleted} audit logs (total: {total_deleted})")
+            rows = db.session.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar() or 0
+            AuditRetentionPolicy.drop_partition(name)
+            total_deleted += rows
+            dropped.append(name)
+            logger.info(f"Dropped audit partition {name} ({rows} rows) [{index}/{len(expired)}]")
+            _report_progress(progress_callback, 'drop_partition', partition=name, rows=rows,
+                             partitions_done=index, partitions_total=len(expired))
+        
+        if preserve_critical_actions:
+            total_preserved += db.session.execute(text(f"""
+                SELECT COUNT(*) FROM {row_source}
+                WHERE timestamp < :cutoff_date AND action IN ({CRITICAL_ACTIONS_SQL})
+            """), {'cutoff_date': cutoff_date}).scalar() or 0
+        total_deleted += AuditRetentionPolicy.delete_old_rows_chunked(
+            row_source, cutoff_date, preserve_critical_actions, progress_callback
+        )
         
         logger.info(
             f"Deleted {total_deleted} audit logs older than {retention_days} days "
-            f"(critical actions preserved: {preserve_critical_actions})"
+            f"({len(dropped)} partitions dropped, {total_preserved} critical actions archived)"
         )
         
         return {
             'dry_run': False,
             'deleted_records': total_deleted,
+            'dropped_partitions': dropped,
+            'critical_archived': total_preserved,
             'cutoff_date': cutoff_date.isoformat(),
             'critical_preserved': preserve_critical_actions
         }
@@ -197,10 +387,21 @@ class AuditRetentionPolicy:
                 COUNT(*) as total_logs,
                 COUNT(before_state) as logs_with_before,
                 COUNT(after_state) as logs_with_after,
-                pg_size_pretty(pg_total_relation_size('audit_log')) as table_size,
+                COUNT(state_diff) + COUNT(state_diff_zstd) as logs_with_diff,
+                COUNT(state_diff_zstd) as logs_with_compressed_diff,
+                pg_size_pretty(COALESCE(SUM(
+                    COALESCE(pg_column_size(before_state), 0) + COALESCE(pg_column_size(after_state), 0)
+                    + COALESCE(pg_column_size(state_diff), 0) + COALESCE(pg_column_size(state_diff_zstd), 0)
+                ), 0)) as snapshot_size,
+                pg_size_pretty(
+                    pg_total_relation_size('audit_log')
+                    + (SELECT COALESCE(SUM(pg_total_relation_size(inhrelid)), 0)
+                       FROM pg_inherits WHERE inhparent = 'audit_log'::regclass)
+                ) as table_size,
                 MIN(timestamp) as oldest_log,
                 MAX(timestamp) as newest_log,
-                COUNT(CASE WHEN timestamp < NOW() - INTERVAL ':retention_days days' THEN 1 END) as logs_past_retention
+                COUNT(CASE WHEN timestamp < NOW() - INTERVAL ':retention_days days' THEN 1 END) as logs_past_retention,
+                (SELECT COUNT(*) FROM audit_log_critical) as critical_archived
             FROM audit_log
         """.replace(':retention_days', str(AUDIT_RETENTION_DAYS)))
         
@@ -211,10 +412,14 @@ class AuditRetentionPolicy:
                 'total_logs': result[0],
                 'logs_with_before_state': result[1],
                 'logs_with_after_state': result[2],
-                'table_size': result[3],
-                'oldest_log': result[4].isoformat() if result[4] else None,
-                'newest_log': result[5].isoformat() if result[5] else None,
-                'logs_past_retention': result[6],
+                'logs_with_diff': result[3],
+                'logs_with_compressed_diff': result[4],
+                'snapshot_size': result[5],
+                'table_size': result[6],
+                'oldest_log': result[7].isoformat() if result[7] else None,
+                'newest_log': result[8].isoformat() if result[8] else None,
+                'logs_past_retention': result[9],
+                'critical_archived': result[10],
                 'retention_policy_days': AUDIT_RETENTION_DAYS,
                 'snapshot_retention_days': AUDIT_SNAPSHOT_RETENTION_DAYS
             }
@@ -222,7 +427,10 @@ class AuditRetentionPolicy:
         return {}
     
     @staticmethod
-    def run_maintenance(dry_run: bool = True) -> dict:
+    def run_maintenance(
+        dry_run: bool = True,
+        progress_callback: Optional[Callable[[dict], None]] = None
+    ) -> dict:
         """
         Run complete audit maintenance:
         1. Clear old snapshots
@@ -230,6 +438,7 @@ class AuditRetentionPolicy:
         
         Args:
             dry_run: If True, only report what would be done
+            progress_callback: Called with a progress dict as batches complete
             
         Returns:
             Dict with all operation results
@@ -242,14 +451,16 @@ class AuditRetentionPolicy:
         # Clear old snapshots
         snapshot_result = AuditRetentionPolicy.cleanup_old_snapshots(
             retention_days=AUDIT_SNAPSHOT_RETENTION_DAYS,
-            dry_run=dry_run
+            dry_run=dry_run,
+            progress_callback=progress_callback
         )
         
         # Delete old audit logs (preserve critical)
         delete_result = AuditRetentionPolicy.cleanup_old_audit_logs(
             retention_days=AUDIT_RETENTION_DAYS,
             preserve_critical_actions=True,
-            dry_run=dry_run
+            dry_run=dry_run,
+            progress_callback=progress_callback
         )
         
         # Get stats after (if not dry run)
@@ -280,8 +491,12 @@ def run_audit_cleanup(dry_run: bool = True):
     """
     from app import app
     
+    def print_progress(progress):
+        details = ", ".join(f"{key}={value}" for key, value in progress.items() if key != 'step')
+        print(f"   ... {progress['step']}: {details}")
+    
     with app.app_context():
-        result = AuditRetentionPolicy.run_maintenance(dry_run=dry_run)
+        result = AuditRetentionPolicy.run_maintenance(dry_run=dry_run, progress_callback=print_progress)
         
         print("\n" + "="*60)
         print("AUDIT LOG MAINTENANCE REPORT")
@@ -296,7 +511,8 @@ def run_audit_cleanup(dry_run: bool = True):
         stats = result['stats_before']
         print(f"   Total audit logs: {stats.get('total_logs', 0):,}")
         print(f"   Table size: {stats.get('table_size', 'unknown')}")
-        print(f"   Logs with snapshots: {stats.get('logs_with_before_state', 0):,}")
+        print(f"   Logs with snapshots: {stats.get('logs_with_before_state', 0) + stats.get('logs_with_diff', 0):,}")
+        print(f"   Snapshot storage: {stats.get('snapshot_size', 'unknown')}")
         print(f"   Logs past retention: {stats.get('logs_past_retention', 0):,}")
         
         print(f"\n🗑️  Snapshot Cleanup:")
@@ -310,8 +526,11 @@ def run_audit_cleanup(dry_run: bool = True):
         delete = result['log_cleanup']
         if delete.get('dry_run'):
             print(f"   Would delete: {delete.get('would_delete', 0):,} logs")
+            print(f"   Partitions to drop: {len(delete.get('would_drop_partitions', []))}")
         else:
             print(f"   Deleted: {delete.get('deleted_records', 0):,} logs")
+            print(f"   Partitions dropped: {len(delete.get('dropped_partitions', []))}")
+            print(f"   Critical actions archived: {delete.get('critical_archived', 0):,}")
         print(f"   Critical actions preserved: {delete.get('critical_preserved', False)}")
         
         if not result['dry_run'] and result['stats_after']:
@@ -0,0 +1,116 @@
+"""
+Diff-only Audit Snapshots
+Audit rows store the difference between the before and after snapshots as a
+JSON patch (RFC 6902 ops on top-level keys) instead of two full JSON documents.
+Every op also carries the old value ("old"), so a patch can be applied in either
+direction and before/after states can be rebuilt on read:
+
+    [{"op": "replace", "path": "/role", "old": "biller", "value": "dispatcher"},
+     {"op": "add", "path": "/dispatch_area", "value": "indore"},
+     {"op": "remove", "path": "/verified", "old": true}]
+
+A create (after only) becomes all "add" ops and a delete (before only) all
+"remove" ops - those rows are the full-state bases that get_entity_history()
+replays later diffs on top of.
+
+Patches of AUDIT_DIFF_COMPRESS_MIN_BYTES or more are zstd-compressed into a bytea
+column when the optional zstandard package is installed.
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import ujson as json
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Patches smaller than this are stored as plain JSON text (compression would not pay off)
+AUDIT_DIFF_COMPRESS_MIN_BYTES = int(os.environ.get('AUDIT_DIFF_COMPRESS_MIN_BYTES', '256'))
+AUDIT_DIFF_COMPRESS_LEVEL = 3
+
+
+def _pointer(key: str) -> str:
+    """JSON pointer for a top-level key (RFC 6901 escaping)"""
+    return '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+
+def _key(pointer: str) -> str:
+    """Top-level key from a JSON pointer"""
+    return pointer[1:].replace('~1', '/').replace('~0', '~')
+
+
+def make_state_patch(before: Optional[Dict], after: Optional[Dict]) -> List[Dict[str, Any]]:
+    """
+    Reversible patch turning before into after (None counts as an empty state).
+    Keys keep the order of the snapshots.
+    """
+    before = before or {}
+    after = after or {}
+    patch = []
+    for key, old in before.items():
+        if key not in after:
+            patch.append({'op': 'remove', 'path': _pointer(key), 'old': old})
+        elif after[key] != old:
+            patch.append({'op': 'replace', 'path': _pointer(key), 'old': old, 'value': after[key]})
+    for key, new in after.items():
+        if key not in before:
+            patch.append({'op': 'add', 'path': _pointer(key), 'value': new})
+    return patch
+
+
+def apply_state_patch(state: Dict, patch: List[Dict[str, Any]], reverse: bool = False) -> Dict:
+    """Apply a patch to a copy of state; reverse=True undoes it (after -> before)"""
+    result = dict(state)
+    for op in patch:
+        key = _key(op['path'])
+        kind = op['op']
+        if reverse:
+            kind = {'add': 'remove', 'remove': 'add', 'replace': 'replace'}[kind]
+            value = op.get('old')
+        else:
+            value = op.get('value')
+        if kind == 'remove':
+            result.pop(key, None)
+        else:
+            result[key] = value
+    return result
+
+
+def patch_changes(patch: List[Dict[str, Any]]) -> Dict[str, Tuple[Any, Any]]:
+    """{key: (old_value, new_value)} for every key a patch touches"""
+    return {_key(op['path']): (op.get('old'), op.get('value')) for op in patch}
+
+
+def encode_state_patch(patch: List[Dict[str, Any]]) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    Encode a patch for storage.
+
+    Returns:
+        (json_text, None) or (None, zstd_bytes) for large patches when zstandard
+        is installed
+    """
+    encoded = json.dumps(patch)
+    if ZSTD_AVAILABLE and len(encoded) >= AUDIT_DIFF_COMPRESS_MIN_BYTES:
+        # Compressor objects are not thread-safe - one per call
+        compressor = zstandard.ZstdCompressor(level=AUDIT_DIFF_COMPRESS_LEVEL)
+        return None, compressor.compress(encoded.encode('utf-8'))
+    return encoded, None
+
+
+def decode_state_patch(text: Optional[str], compressed: Optional[bytes]) -> Optional[List[Dict[str, Any]]]:
+    """Decode a stored patch (either column); None when the row has no snapshots"""
+    if compressed is not None:
+        if not ZSTD_AVAILABLE:
+            logger.warning("Audit row has a zstd-compressed diff but zstandard is not installed")
+            return None
+        return json.loads(zstandard.ZstdDecompressor().decompress(bytes(compressed)).decode('utf-8'))
+    if text is not None:
+        return json.loads(text)
+    return None
@@ -10,12 +10,6 @@ from typing import Optional, Dict, Any, Union, List
 from flask import request, g
 from flask_login import current_user
 from app import db
-from anonymization_utils import (
-    anonymize_ip_address,
-    anonymize_pii_in_dict,
-    get_anonymization_config,
-    ANONYMIZE_AUDIT_LOGS
-)
 
 logger = logging.getLogger(__name__)
 
@@ -161,54 +155,45 @@ def log_audit_with_snapshot(
     try:
         from models import AuditLog
         from request_tracking import get_request_id
+        from audit_writer import prepare_audit_row, stage_audit_row
         
-        # Serialize if needed
+        # Serialize if needed - model instances must be captured now, before they change
         if auto_serialize:
             if before_state and not isinstance(before_state, dict):
                 before_state = serialize_entity(before_state)
             if after_state and not isinstance(after_state, dict):
                 after_state = serialize_entity(after_state)
         
-        # GDPR Compliance: Anonymize PII in snapshots if enabled
-        if ANONYMIZE_AUDIT_LOGS:
-            anonymization_config = get_anonymization_config()
-            if before_state and isinstance(before_state, dict):
-                before_state = anonymize_pii_in_dict(before_state, anonymization_config)
-            if after_state and isinstance(after_state, dict):
-                after_state = anonymize_pii_in_dict(after_state, anonymization_config)
-            if details and isinstance(details, dict):
-                details = anonymize_pii_in_dict(details, anonymization_config)
-        
-        audit = AuditLog()
         # Handle current_user safely (may be None outside request context)
         try:
-            audit.user_id = current_user.id if current_user and current_user.is_authenticated else None
+            user_id = current_user.id if current_user and current_user.is_authenticated else None
         except (AttributeError, RuntimeError):
-            audit.user_id = None
-        audit.action = action
-        audit.entity_type = entity_type
-        audit.entity_id = entity_id
-        audit.details = json.dumps(details) if details else None
-        audit.before_state = json.dumps(before_state) if before_state else None
-        audit.after_state = json.dumps(after_state) if after_state else None
+            user_id = None
         
-        # GDPR Compliance: Anonymize IP address if enabled
-        if request and request.remote_addr:
-            if ANONYMIZE_AUDIT_LOGS:
-                audit.ip_address = anonymize_ip_address(request.remote_addr)
-            else:
-                audit.ip_address = request.remote_addr
-        else:
-            audit.ip_address = None
-        audit.request_id = get_request_id() if hasattr(g, 'request_id') else None
+        # Raw row - anonymization and JSON encoding happen in prepare_audit_row,
+        # off the request path when the buffered writer is running
+        row = {
+            'timestamp': datetime.utcnow(),
+            'user_id': user_id,
+            'action': action,
+            'entity_type': entity_type,
+            'entity_id': entity_id,
+            'details': details,
+            'before_state': before_state,
+            'after_state': after_state,
+            'ip_address': request.remote_addr if request and request.remote_addr else None,
+            'request_id': get_request_id() if hasattr(g, 'request_id') else None
+        }
         
-        db.session.add(audit)
-        # Note: commit should be done by the calling function
+        # Note: commit should be done by the calling function - the row is written
+        # once it commits, either by the audit writer or with the session itself
+        if not stage_audit_row(db.session, row):
+            db.session.add(AuditLog(**prepare_audit_row(row)))
         
-        logger.info(
-            f"Audit logged: {action} on {entity_type} {entity_id} by user {audit.user_id}",
+        logger.debug(
+            f"Audit logged: {action} on {entity_type} {entity_id} by user {user_id}",
             extra={
-                'request_id': audit.request_id,
+                'request_id': row['request_id'],
                 'action': action,
                 'entity_type': entity_type,
                 'entity_id': entity_id,
@@ -376,12 +361,18 @@ def get_entity_history(entity_type: str, entity_id: int) -> list:
     Get complete change history for a specific entity.
     Returns a chronological list of all changes with before/after diffs.
     
+    Snapshots are stored as diffs, so full before/after states are rebuilt by
+    replaying the entity's rows oldest-first: create/delete rows carry every key,
+    update rows only the changed ones. Keys never captured since the entity's
+    first snapshot (e.g. its creation was not audited) are missing from the
+    rebuilt states.
+    
     Args:
         entity_type: Type of entity (e.g., 'user', 'bag')
         entity_id: ID of the entity
         
     Returns:
-        List of dicts with timestamp, action, user, and changes
+        List of dicts with timestamp, action, user, changes and full states
         
     Example:
         history = get_entity_history('user', 5)
@@ -392,14 +383,28 @@ def get_entity_history(entity_type: str, entity_id: int) -> list:
                     print(f"  {field}: {old} -> {new}")
     """
     from models import AuditLog, User
+    from audit_snapshots import apply_state_patch
     
     audit_logs = AuditLog.query.filter_by(
         entity_type=entity_type,
         entity_id=entity_id
-    ).order_by(AuditLog.timestamp.asc()).all()
+    ).order_by(AuditLog.timestamp.asc(), AuditLog.id.asc()).all()
     
     history = []
+    state = {}  # Latest known state of the entity while replaying
     for log in audit_logs:
+        before_state = after_state = None
+        patch = log.get_state_patch()
+        if patch is not None:
+            before_state = apply_state_patch(state, patch, reverse=True)
+            after_state = apply_state_patch(before_state, patch)
+            state = after_state
+        elif log.before_state or log.after_state:
+            # Legacy row with full snapshots
+            before_state = json.loads(log.before_state) if log.before_state else None
+            after_state = json.loads(log.after_state) if log.after_state else None
+            state = after_state if after_state is not None else {}
+        
         entry = {
             'id': log.id,
             'timestamp': log.timestamp,
@@ -409,6 +414,8 @@ def get_entity_history(entity_type: str, entity_id: int) -> list:
             'ip_address': log.ip_address,
             'request_id': log.request_id,
             'changes': log.get_changes(),
+            'before_state': before_state or None,
+            'after_state': after_state or None,
             'details': json.loads(log.details) if log.details else None
         }
         history.append(entry)
@@ -0,0 +1,296 @@
+"""
+Buffered Audit Log Writer
+Takes audit_log inserts off the request path. log_audit_with_snapshot() stages a
+raw row on the caller's session; when that session commits, the row is handed to
+a bounded in-process queue and a background thread writes queued rows in batches
+(one multi-row INSERT every AUDIT_FLUSH_INTERVAL_MS or AUDIT_BATCH_SIZE rows).
+JSON encoding, snapshot diffing and PII anonymization happen in the writer
+thread as well.
+
+Rows staged in a session that rolls back are discarded, exactly like the AuditLog
+objects the session used to hold. When the queue is full, the committing request
+waits up to AUDIT_ENQUEUE_TIMEOUT seconds and then writes its rows itself
+(backpressure - rows are never dropped because the writer fell behind).
+shutdown_handler's flush_audit_logs drains the queue on SIGTERM.
+"""
+
+import logging
+import os
+import queue
+import time
+from threading import Thread, Event
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# session.info key holding rows staged until the session commits
+STAGED_ROWS_KEY = 'pending_audit_rows'
+
+
+def prepare_audit_row(row: Dict) -> Dict:
+    """
+    Turn a raw staged row into audit_log column values: anonymize PII (when
+    enabled), JSON-encode details and store the snapshots as a diff-only patch
+    (audit_snapshots.py) instead of two full documents.
+    """
+    import ujson as json
+    from anonymization_utils import (
+        anonymize_ip_address,
+        anonymize_pii_in_dict,
+        get_anonymization_config,
+        ANONYMIZE_AUDIT_LOGS
+    )
+    from audit_snapshots import make_state_patch, encode_state_patch, patch_changes
+
+    prepared = dict(row)
+    dict_fields = ('details', 'before_state', 'after_state')
+
+    # GDPR Compliance: Anonymize PII in snapshots and the IP address if enabled
+    if ANONYMIZE_AUDIT_LOGS:
+        anonymization_config = get_anonymization_config()
+        for field in dict_fields:
+            if prepared.get(field) and isinstance(prepared[field], dict):
+                prepared[field] = anonymize_pii_in_dict(prepared[field], anonymization_config)
+        if prepared.get('ip_address'):
+            prepared['ip_address'] = anonymize_ip_address(prepared['ip_address'])
+
+    prepared['details'] = json.dumps(prepared['details']) if prepared.get('details') else None
+
+    before = prepared.pop('before_state', None) or None
+    after = prepared.pop('after_state', None) or None
+    prepared.update(before_state=None, after_state=None, state_diff=None,
+                    state_diff_zstd=None, changed_keys=None)
+    if isinstance(before or {}, dict) and isinstance(after or {}, dict):
+        if before is not None or after is not None:
+            patch = make_state_patch(before, after)
+            prepared['state_diff'], prepared['state_diff_zstd'] = encode_state_patch(patch)
+            prepared['changed_keys'] = ','.join(sorted(patch_changes(patch)))
+    else:
+        # Not a key/value snapshot - keep it whole, as before
+        prepared['before_state'] = json.dumps(before) if before else None
+        prepared['after_state'] = json.dumps(after) if after else None
+    return prepared
+
+
+class AuditLogWriter:
+    """Background thread that batches queued audit rows into multi-row INSERTs"""
+
+    # Maximum rows waiting in memory before committing requests feel backpressure
+    QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', '10000'))
+
+    # Rows per INSERT and the longest a row waits before its batch is written
+    BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '500'))
+    FLUSH_INTERVAL_MS = int(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', '200'))
+
+    # How long a committing request waits for queue space before writing itself
+    ENQUEUE_TIMEOUT = float(os.environ.get('AUDIT_ENQUEUE_TIMEOUT', '0.5'))
+
+    def __init__(self, app, db, enabled=True):
+        """
+        Initialize audit log writer
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            enabled: Whether buffered writing is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.stop_event = Event()
+        self.writer_thread = None
+        self.stats = {
+            'rows_written': 0,
+            'batches': 0,
+            'backpressure_writes': 0,
+            'rows_failed': 0,
+            'last_batch_ms': None,
+            'errors': 0
+        }
+
+    def start(self):
+        """Start writing in background thread"""
+        if not self.enabled:
+            logger.info("Buffered audit writer is disabled - audit rows are written in the request")
+            return
+
+        if self.is_running():
+            logger.warning("Audit writer already running")
+            return
+
+        self.stop_event.clear()
+        self.writer_thread = Thread(target=self._write_loop, daemon=True, name='audit-writer')
+        self.writer_thread.start()
+        logger.info(f"Audit writer started - batches of {self.BATCH_SIZE} every "
+                    f"{self.FLUSH_INTERVAL_MS}ms, queue size {self.QUEUE_SIZE}")
+
+    def stop(self, timeout: float = 10):
+        """Stop the writer thread and write everything still queued"""
+        if self.writer_thread:
+            self.stop_event.set()
+            self.writer_thread.join(timeout=timeout)
+
+        # Whatever the thread did not get to (or everything, if it never ran)
+        remaining = self._drain()
+        while remaining:
+            self.write_batch(remaining[:self.BATCH_SIZE])
+            remaining = remaining[self.BATCH_SIZE:]
+        logger.info("Audit writer stopped")
+
+    def is_running(self) -> bool:
+        """True while the background thread accepts rows"""
+        return bool(self.writer_thread and self.writer_thread.is_alive() and not self.stop_event.is_set())
+
+    def submit(self, rows: List[Dict]):
+        """
+        Queue committed rows for writing. Called from the committing thread; if the
+        queue stays full for ENQUEUE_TIMEOUT the rest are written right here.
+        """
+        for index, row in enumerate(rows):
+            try:
+                self.queue.put(row, timeout=self.ENQUEUE_TIMEOUT)
+            except queue.Full:
+                overflow = rows[index:]
+                self.stats['backpressure_writes'] += len(overflow)
+                logger.warning(f"Audit queue full - writing {len(overflow)} audit rows in the request")
+                self.write_batch(overflow)
+                return
+
+    def _write_loop(self):
+        """Main loop - runs in background thread"""
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self.write_batch(batch)
+
+    def _next_batch(self) -> List[Dict]:
+        """Wait for the first row, then collect rows until the batch is full or the interval ends"""
+        interval = self.FLUSH_INTERVAL_MS / 1000
+        try:
+            batch = [self.queue.get(timeout=interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + interval
+        while len(batch) < self.BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[Dict]:
+        """Take every queued row without waiting"""
+        rows = []
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                return rows
+
+    def write_batch(self, rows: List[Dict]):
+        """Write rows with one multi-row INSERT; falls back to row-by-row if the batch fails"""
+        from models import AuditLog
+
+        start = time.time()
+        prepared = [prepare_audit_row(row) for row in rows]
+        try:
+            with self.app.app_context():
+                with self.db.engine.begin() as conn:
+                    conn.execute(AuditLog.__table__.insert(), prepared)
+            self.stats['rows_written'] += len(prepared)
+            self.stats['batches'] += 1
+            self.stats['last_batch_ms'] = round((time.time() - start) * 1000, 2)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Audit batch insert of {len(prepared)} rows failed: {e} - retrying row by row")
+            self._write_rows_individually(prepared)
+
+    def _write_rows_individually(self, prepared: List[Dict]):
+        """Isolate the row(s) that broke a batch so the rest still get written"""
+        from models import AuditLog
+
+        with self.app.app_context():
+            for row in prepared:
+                try:
+                    try:
+                        with self.db.engine.begin() as conn:
+                            conn.execute(AuditLog.__table__.insert(), row)
+                    except IntegrityError:
+                        # The acting user was deleted before the row was written -
+                        # keep the row, as ON DELETE SET NULL would have
+                        with self.db.engine.begin() as conn:
+                            conn.execute(AuditLog.__table__.insert(), dict(row, user_id=None))
+                    self.stats['rows_written'] += 1
+                except Exception as e:
+                    self.stats['rows_failed'] += 1
+                    logger.error(f"Audit row lost: {row.get('action')} on {row.get('entity_type')} "
+                                 f"{row.get('entity_id')}: {e}")
+
+    def get_stats(self) -> Dict:
+        """Get writer statistics for monitoring"""
+        return dict(self.stats, queued=self.queue.qsize(), running=self.is_running())
+
+
+# Global writer instance (initialized in app.py)
+audit_writer: Optional[AuditLogWriter] = None
+
+
+def get_audit_writer() -> Optional[AuditLogWriter]:
+    """Get the global audit writer instance"""
+    return audit_writer
+
+
+def init_audit_writer(app, db, enabled=True):
+    """
+    Initialize and start the global audit writer. It is drained by
+    shutdown_handler's flush_audit_logs callback.
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable buffered writing (default: True)
+    """
+    global audit_writer
+
+    audit_writer = AuditLogWriter(app, db, enabled=enabled)
+    audit_writer.start()
+    return audit_writer
+
+
+def stage_audit_row(session, row: Dict) -> bool:
+    """
+    Stage a raw audit row on session until it commits. Returns False when the
+    writer is not running - the caller then writes the row through the session.
+    """
+    if not (audit_writer and audit_writer.is_running()):
+        return False
+    session.info.setdefault(STAGED_ROWS_KEY, []).append(row)
+    return True
+
+
+@event.listens_for(Session, 'after_commit')
+def _submit_staged_audit_rows(session):
+    """Hand rows staged on a session to the writer once its transaction commits"""
+    rows = session.info.pop(STAGED_ROWS_KEY, None)
+    if not rows:
+        return
+    if audit_writer and audit_writer.is_running():
+        audit_writer.submit(rows)
+    elif audit_writer:
+        # Writer stopped (shutdown) between staging and commit - write directly
+        audit_writer.write_batch(rows)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_staged_audit_rows(session):
+    """Rolled-back work leaves no audit trail, as with rows added to the session"""
+    session.info.pop(STAGED_ROWS_KEY, None)
@@ -0,0 +1,276 @@
+"""
+Daily Bill Rollup
+daily_bill_rollup holds per-day bill aggregates, grouped by the bill's creation
+day (UTC), creator and current status.
+
+Statement-level triggers on bill never touch the rollup rows themselves: every
+INSERT/UPDATE/DELETE statement appends its net deltas per (day, creator, status)
+group to daily_bill_rollup_delta, read from the transition tables. Concurrent
+writers therefore never wait on a shared rollup row. Updates that do not touch
+a counted column (e.g. description) append nothing. The statistics folder
+thread merges pending deltas into daily_bill_rollup (fold_bill_rollup_deltas),
+and readers add any still-pending deltas, so results are exact between folds.
+
+EOD summaries for any day therefore cost two queries - the day's rollup rows and
+the day's bill list - instead of 2N+1.
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock serializing folds across workers (next to the statistics fold lock 300000)
+BILL_ROLLUP_FOLD_LOCK_ID = 300001
+
+ROLLUP_COLUMNS = "day, created_by_id, status, bill_count, parent_bags, expected_bags, child_bags, weight_kg"
+
+# One changed bill as a signed contribution to its rollup group
+_BILL_CONTRIBUTION = """
+    SELECT created_at::date AS day,
+           COALESCE(created_by_id, 0) AS created_by_id,
+           COALESCE(status, 'new') AS status,
+           {sign} AS bill_count,
+           {sign} * COALESCE(linked_parent_count, 0) AS parent_bags,
+           {sign} * COALESCE(parent_bag_count, 0) AS expected_bags,
+           {sign} * COALESCE(total_child_bags, 0) AS child_bags,
+           {sign} * COALESCE(total_weight_kg, 0) AS weight_kg
+    FROM {rows}
+    WHERE created_at IS NOT NULL
+"""
+
+
+def _delta_insert_sql(*sources: str) -> str:
+    """Append the net deltas of the given contribution selects to daily_bill_rollup_delta"""
+    changes = "\n    UNION ALL\n".join(sources)
+    return f"""
+        INSERT INTO daily_bill_rollup_delta ({ROLLUP_COLUMNS})
+        SELECT day, created_by_id, status, SUM(bill_count), SUM(parent_bags), SUM(expected_bags),
+               SUM(child_bags), SUM(weight_kg)
+        FROM ({changes}) changes
+        GROUP BY day, created_by_id, status
+        HAVING SUM(bill_count) <> 0 OR SUM(parent_bags) <> 0 OR SUM(expected_bags) <> 0
+            OR SUM(child_bags) <> 0 OR SUM(weight_kg) <> 0
+    """
+
+
+ADDED = _BILL_CONTRIBUTION.format(sign=1, rows='new_rows')
+REMOVED = _BILL_CONTRIBUTION.format(sign=-1, rows='old_rows')
+
+ROLLUP_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION daily_bill_rollup_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {_delta_insert_sql(ADDED)};
+        ELSIF TG_OP = 'DELETE' THEN
+            {_delta_insert_sql(REMOVED)};
+        ELSE
+            {_delta_insert_sql(ADDED, REMOVED)};
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+# (trigger name, event, transition tables)
+ROLLUP_TRIGGERS = [
+    ('trg_bill_rollup_insert', 'INSERT', 'NEW TABLE AS new_rows'),
+    ('trg_bill_rollup_update', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    ('trg_bill_rollup_delete', 'DELETE', 'OLD TABLE AS old_rows'),
+]
+
+# Rollup rows plus pending deltas matching {where} - what readers aggregate
+_CURRENT_ROLLUP = f"""
+    (SELECT {ROLLUP_COLUMNS} FROM daily_bill_rollup WHERE {{where}}
+     UNION ALL
+     SELECT {ROLLUP_COLUMNS} FROM daily_bill_rollup_delta WHERE {{where}})
+"""
+
+
+def install_bill_rollup_triggers(conn):
+    """Create (or replace) the rollup function and the statement triggers on bill"""
+    conn.execute(text(ROLLUP_FUNCTION_SQL))
+    for name, event, referencing in ROLLUP_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON bill"))
+        conn.execute(text(f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON bill
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION daily_bill_rollup_apply()
+        """))
+
+
+def drop_bill_rollup_triggers(conn):
+    """Remove the statement triggers and their function"""
+    for name, _, _ in ROLLUP_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON bill"))
+    conn.execute(text("DROP FUNCTION IF EXISTS daily_bill_rollup_apply()"))
+
+
+def fold_bill_rollup_deltas(conn) -> Optional[int]:
+    """
+    Merge pending daily_bill_rollup_delta rows into daily_bill_rollup inside
+    conn's transaction. The DELETE ... RETURNING and the upsert are one
+    statement, so a delta is either still pending or folded - never both.
+    Only the folder writes rollup rows, so the upsert never waits on bill writers.
+
+    Returns:
+        Number of delta rows folded, or None if another worker is folding
+    """
+    if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {'id': BILL_ROLLUP_FOLD_LOCK_ID}).scalar():
+        return None
+
+    return int(conn.execute(text(f"""
+        WITH folded AS (
+            DELETE FROM daily_bill_rollup_delta
+            RETURNING {ROLLUP_COLUMNS}
+        ), sums AS (
+            SELECT day, created_by_id, status, SUM(bill_count) AS bill_count, SUM(parent_bags) AS parent_bags,
+                   SUM(expected_bags) AS expected_bags, SUM(child_bags) AS child_bags,
+                   SUM(weight_kg) AS weight_kg, COUNT(*) AS row_count
+            FROM folded
+            GROUP BY day, created_by_id, status
+        ), applied AS (
+            INSERT INTO daily_bill_rollup AS r ({ROLLUP_COLUMNS}, updated_at)
+            SELECT {ROLLUP_COLUMNS}, NOW() FROM sums
+            ON CONFLICT (day, created_by_id, status) DO UPDATE SET
+                bill_count = r.bill_count + EXCLUDED.bill_count,
+                parent_bags = r.parent_bags + EXCLUDED.parent_bags,
+                expected_bags = r.expected_bags + EXCLUDED.expected_bags,
+                child_bags = r.child_bags + EXCLUDED.child_bags,
+                weight_kg = r.weight_kg + EXCLUDED.weight_kg,
+                updated_at = EXCLUDED.updated_at
+        )
+        SELECT COALESCE(SUM(row_count), 0) FROM sums
+    """)).scalar() or 0)
+
+
+def rebuild_daily_bill_rollup(conn) -> int:
+    """
+    Recompute daily_bill_rollup from bill (backfill / repair) and discard pending
+    deltas. Blocks bill writes for the duration so no trigger delta is lost.
+    Returns the rollup row count.
+    """
+    conn.execute(text("LOCK TABLE bill IN SHARE MODE"))
+    conn.execute(text("DELETE FROM daily_bill_rollup_delta"))
+    conn.execute(text("DELETE FROM daily_bill_rollup"))
+    return conn.execute(text(f"""
+        INSERT INTO daily_bill_rollup ({ROLLUP_COLUMNS}, updated_at)
+        SELECT day, created_by_id, status, SUM(bill_count), SUM(parent_bags), SUM(expected_bags),
+               SUM(child_bags), SUM(weight_kg), NOW()
+        FROM ({_BILL_CONTRIBUTION.format(sign=1, rows='bill')}) bills
+        GROUP BY day, created_by_id, status
+    """)).rowcount
+
+
+def _day_bounds(day: date):
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def get_eod_summary(day: Optional[date] = None, include_details: bool = True) -> Dict:
+    """
+    EOD bill summary for one day (UTC creation date, default today) - the shape
+    served by the EOD JSON API, email and preview.
+
+    Two queries regardless of how many bills the day has: the day's rollup rows
+    and pending deltas (totals, by status, by user) and, with include_details,
+    the bill list.
+    """
+    from app import db
+
+    day = day or datetime.utcnow().date()
+    start, end = _day_bounds(day)
+
+    eod_data = {
+        'report_date': format_report_date(day),
+        'date': day.isoformat(),
+        'generated_at': datetime.now().isoformat(),
+        'total_bills': 0,
+        'bills_by_status': {},
+        'bills_by_user': {},
+        'total_parent_bags': 0,
+        'total_child_bags': 0,
+        'total_weight_kg': 0,
+        'detailed_bills': []
+    }
+
+    groups = db.session.execute(text(f"""
+        SELECT r.status, COALESCE(u.username, 'Unknown'), SUM(r.bill_count),
+               SUM(r.parent_bags), SUM(r.child_bags), SUM(r.weight_kg)
+        FROM {_CURRENT_ROLLUP.format(where='day = :day')} r
+        LEFT JOIN "user" u ON u.id = r.created_by_id
+        GROUP BY r.status, r.created_by_id, u.username
+        HAVING SUM(r.bill_count) > 0
+    """), {'day': day}).fetchall()
+
+    for status, creator_name, bill_count, parent_bags, child_bags, weight_kg in groups:
+        eod_data['total_bills'] += bill_count
+        eod_data['total_parent_bags'] += parent_bags
+        eod_data['total_child_bags'] += child_bags
+        eod_data['total_weight_kg'] += weight_kg
+        eod_data['bills_by_status'][status] = eod_data['bills_by_status'].get(status, 0) + bill_count
+        eod_data['bills_by_user'][creator_name] = eod_data['bills_by_user'].get(creator_name, 0) + bill_count
+
+    if include_details and eod_data['total_bills']:
+        bills = db.session.execute(text("""
+            SELECT b.bill_id, COALESCE(u.username, 'Unknown'), b.created_at, COALESCE(b.status, 'new'),
+                   COALESCE(b.linked_parent_count, 0), b.parent_bag_count,
+                   COALESCE(b.total_child_bags, 0), COALESCE(b.total_weight_kg, 0)
+            FROM bill b
+            LEFT JOIN "user" u ON u.id = b.created_by_id
+            WHERE b.created_at >= :start AND b.created_at < :end
+            ORDER BY b.created_at, b.id
+        """), {'start': start, 'end': end}).fetchall()
+
+        eod_data['detailed_bills'] = [
+            {
+                'bill_id': bill_id,
+                'created_by': creator_name,
+                'created_at': created_at.isoformat(),
+                'status': status,
+                'parent_bags': parent_bags,
+                'expected_bags': expected_bags,
+                'child_bags': child_bags,
+                'weight_kg': weight_kg
+            }
+            for bill_id, creator_name, created_at, status, parent_bags, expected_bags, child_bags, weight_kg in bills
+        ]
+
+    return eod_data
+
+
+def get_daily_bill_totals(start: date, end: date) -> List[Dict]:
+    """Per-day bill totals for start..end inclusive (days without bills omitted) - one query"""
+    from app import db
+
+    rows = db.session.execute(text(f"""
+        SELECT day, SUM(bill_count), SUM(parent_bags), SUM(expected_bags), SUM(child_bags), SUM(weight_kg),
+               SUM(bill_count) FILTER (WHERE status = 'completed')
+        FROM {_CURRENT_ROLLUP.format(where='day BETWEEN :start AND :end')} r
+        GROUP BY day
+        HAVING SUM(bill_count) > 0
+        ORDER BY day
+    """), {'start': start, 'end': end}).fetchall()
+
+    return [
+        {
+            'date': day.isoformat(),
+            'report_date': format_report_date(day),
+            'total_bills': bills,
+            'completed_bills': completed or 0,
+            'total_parent_bags': parent_bags,
+            'expected_parent_bags': expected_bags,
+            'total_child_bags': child_bags,
+            'total_weight_kg': weight_kg
+        }
+        for day, bills, parent_bags, expected_bags, child_bags, weight_kg, completed in rows
+    ]
+
+
+def format_report_date(day: date) -> str:
+    """Report date label used by the EOD views (DD/MM/YY)"""
+    return day.strftime('%d/%m/%y')
@@ -1,26 +1,49 @@
 """
-Dashboard Statistics Cache - In-Memory Time-Based Caching
+Dashboard Statistics Cache - Shared Time-Based Caching
 
 Provides short-lived caching for dashboard statistics to reduce database load
 while maintaining near real-time accuracy.
 
 DESIGN DECISIONS:
-- 5-second cache TTL for dashboard stats (balance between freshness and performance)
-- Thread-safe using threading.Lock()
+- Pluggable backend so all gunicorn workers share one copy of each aggregate:
+  - 'shared' (default): JSON files in /dev/shm, visible to every worker on the host
+  - 'redis': used when DASHBOARD_CACHE_BACKEND=redis and REDIS_URL is set
+  - 'memory': per-process dict (previous behaviour, used as the fallback)
+- Single-flight recomputation: when a key expires exactly one worker recomputes it,
+  the others serve the stale value (or wait briefly if there is none)
+- Stale-while-revalidate: with the background refresher running (dashboard_refresher.py)
+  sections are recomputed before they expire and requests never compute inline
 - Falls back to live queries if cache is stale or empty
-- Zero external dependencies (no Redis needed)
+- Zero required external dependencies (Redis is optional)
 - Minimal memory footprint (stores only computed aggregates)
 
 COST SAVINGS:
 - Reduces dashboard API database queries by ~90% under typical usage
 - Each dashboard load saves 4-6 SQL queries
-- At 100 concurrent users, can reduce DB load by 500+ queries/second
+- With 4 workers, each expired aggregate is recomputed once instead of 4 times
 """
+import os
+import copy
+import json
+import datetime
 import time
+import uuid
 import logging
+import tempfile
 import threading
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, Callable
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
@@ -29,109 +52,360 @@ logger = logging.getLogger(__name__)
 STATS_CACHE_TTL = 10.0  # Core stats TTL (was 5s) - still near real-time for dashboards
 HOURLY_CACHE_TTL = 60.0  # Hourly distribution changes slowly (was 30s)
 USER_COUNT_CACHE_TTL = 120.0  # User counts rarely change (new field)
+API_STATS_CACHE_TTL = 30.0  # /api/stats summary (was the routes.py stats_cache dict)
+
+# Single-flight settings
+MAX_STALE_SECONDS = float(os.environ.get('DASHBOARD_CACHE_MAX_STALE', '300'))  # Serve stale data at most this long past TTL
+FLIGHT_LEASE_SECONDS = 30  # Redis lease - a crashed recomputer cannot block a key longer than this
+FLIGHT_WAIT_TIMEOUT = 5.0  # How long followers wait for the recomputing worker when nothing is cached
+FLIGHT_POLL_INTERVAL = 0.05
+
+
+def _encode_value(value: Any) -> Any:
+    """json default for the shared backends: tag datetimes so they are restored on read"""
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    return str(value)
+
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    """json object_hook undoing _encode_value"""
+    if len(obj) == 1:
+        if '__datetime__' in obj:
+            return datetime.datetime.fromisoformat(obj['__datetime__'])
+        if '__date__' in obj:
+            return datetime.date.fromisoformat(obj['__date__'])
+    return obj
+
+
+class LocalMemoryBackend:
+    """Per-process dict backend (only shared between threads of one worker)"""
+
+    name = 'memory'
 
-class DashboardStatsCache:
-    """Thread-safe in-memory cache for dashboard statistics.
-    
-    COST OPTIMIZATION: Extended TTLs for stable data and added user count caching.
-    """
-    
     def __init__(self):
         self._lock = threading.Lock()
-        self._core_stats: Optional[Dict[str, Any]] = None
-        self._core_stats_time: float = 0
-        self._hourly_scans: Optional[list] = None
-        self._hourly_scans_time: float = 0
-        self._billing_stats: Optional[Dict[str, Any]] = None
-        self._billing_stats_time: float = 0
-        self._user_count: Optional[int] = None
-        self._user_count_time: float = 0
-    
-    def get_core_stats(self) -> Optional[Dict[str, Any]]:
-        """Get cached core statistics if still valid."""
-        with self._lock:
-            if self._core_stats and (time.time() - self._core_stats_time) < STATS_CACHE_TTL:
-                return self._core_stats.copy()
-        return None
-    
-    def set_core_stats(self, stats: Dict[str, Any]) -> None:
-        """Cache core statistics."""
-        with self._lock:
-            self._core_stats = stats.copy()
-            self._core_stats_time = time.time()
-    
-    def get_hourly_scans(self) -> Optional[Tuple[list, str]]:
-        """Get cached hourly scan distribution if still valid."""
+        self._entries: Dict[str, Tuple[Any, float]] = {}
+        self._flights: Dict[str, str] = {}
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, stored_at) or None"""
         with self._lock:
-            if self._hourly_scans and (time.time() - self._hourly_scans_time) < HOURLY_CACHE_TTL:
-                return self._hourly_scans.copy(), getattr(self, '_peak_hour', '--')
-        return None
-    
-    def set_hourly_scans(self, hourly_data: list, peak_hour: str) -> None:
-        """Cache hourly scan distribution."""
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return copy.deepcopy(entry[0]), entry[1]
+
+    def set(self, key: str, value: Any) -> None:
         with self._lock:
-            self._hourly_scans = hourly_data.copy()
-            self._peak_hour = peak_hour
-            self._hourly_scans_time = time.time()
-    
-    def get_billing_stats(self) -> Optional[Dict[str, Any]]:
-        """Get cached billing statistics if still valid."""
+            self._entries[key] = (copy.deepcopy(value), time.time())
+
+    def clear(self) -> None:
         with self._lock:
-            if self._billing_stats and (time.time() - self._billing_stats_time) < STATS_CACHE_TTL:
-                return self._billing_stats.copy()
-        return None
-    
-    def set_billing_stats(self, stats: Dict[str, Any]) -> None:
-        """Cache billing statistics."""
+            self._entries.clear()
+
+    def acquire(self, key: str) -> Optional[str]:
+        """Try to become the recomputing thread for key. Returns a token or None."""
         with self._lock:
-            self._billing_stats = stats.copy()
-            self._billing_stats_time = time.time()
-    
-    def get_user_count(self) -> Optional[int]:
-        """Get cached user count if still valid (longer TTL for stable data)."""
+            if key in self._flights:
+                return None
+            token = uuid.uuid4().hex
+            self._flights[key] = token
+            return token
+
+    def release(self, key: str, token: str) -> None:
         with self._lock:
-            if self._user_count is not None and (time.time() - self._user_count_time) < USER_COUNT_CACHE_TTL:
-                return self._user_count
+            if self._flights.get(key) == token:
+                del self._flights[key]
+
+
+class SharedMemoryBackend:
+    """
+    Host-wide backend using files in /dev/shm (tmpfs, so reads/writes never touch disk).
+
+    Values are written to a temp file and os.replace()d into place, so readers never
+    see partial writes. Single-flight uses a non-blocking flock() on a per-key lock
+    file; the kernel drops the lock if the recomputing worker dies.
+    """
+
+    name = 'shared'
+
+    def __init__(self, directory: Optional[str] = None):
+        if directory is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            directory = os.path.join(base, 'traitortrack-dashboard-cache')
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, stored_at) or None"""
+        try:
+            with open(self._path(key, 'json'), 'r') as f:
+                entry = json.load(f, object_hook=_decode_value)
+            return entry['value'], entry['stored_at']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        final_path = self._path(key, 'json')
+        tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'value': value, 'stored_at': time.time()}, f, default=_encode_value)
+        os.replace(tmp_path, final_path)
+
+    def clear(self) -> None:
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def acquire(self, key: str) -> Optional[int]:
+        """Try to become the recomputing worker for key. Returns a lock fd or None."""
+        fd = os.open(self._path(key, 'lock'), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    def release(self, key: str, token: int) -> None:
+        try:
+            fcntl.flock(token, fcntl.LOCK_UN)
+        finally:
+            os.close(token)
+
+
+class RedisBackend:
+    """Backend for multi-host deployments (requires the redis package and REDIS_URL)"""
+
+    name = 'redis'
+    KEY_PREFIX = 'traitortrack:dashboard:'
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        raw = self.client.get(self.KEY_PREFIX + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw, object_hook=_decode_value)
+        return entry['value'], entry['stored_at']
+
+    def set(self, key: str, value: Any) -> None:
+        payload = json.dumps({'value': value, 'stored_at': time.time()}, default=_encode_value)
+        self.client.set(self.KEY_PREFIX + key, payload)
+
+    def clear(self) -> None:
+        for cache_key in self.client.scan_iter(match=self.KEY_PREFIX + '*'):
+            if not cache_key.endswith(b':flight'):
+                self.client.delete(cache_key)
+
+    def acquire(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        if self.client.set(self.KEY_PREFIX + key + ':flight', token, nx=True, ex=FLIGHT_LEASE_SECONDS):
+            return token
         return None
-    
-    def set_user_count(self, count: int) -> None:
-        """Cache user count."""
-        with self._lock:
-            self._user_count = count
-            self._user_count_time = time.time()
-    
+
+    def release(self, key: str, token: str) -> None:
+        flight_key = self.KEY_PREFIX + key + ':flight'
+        if self.client.get(flight_key) == token.encode():
+            self.client.delete(flight_key)
+
+
+def create_backend(backend_name: Optional[str] = None):
+    """
+    Create the configured cache backend (DASHBOARD_CACHE_BACKEND: shared|redis|memory).
+    Falls back to the per-process memory backend if the requested one is unavailable.
+    """
+    backend_name = (backend_name or os.environ.get('DASHBOARD_CACHE_BACKEND', 'shared')).lower()
+
+    try:
+        if backend_name == 'redis':
+            redis_url = os.environ.get('REDIS_URL')
+            if REDIS_AVAILABLE and redis_url:
+                return RedisBackend(redis_url)
+            logger.warning("Redis dashboard cache requested but redis/REDIS_URL unavailable - using memory backend")
+        elif backend_name == 'shared':
+            if FCNTL_AVAILABLE:
+                return SharedMemoryBackend(os.environ.get('DASHBOARD_CACHE_DIR'))
+            logger.warning("Shared dashboard cache requires fcntl - using memory backend")
+    except Exception as e:
+        logger.warning(f"Dashboard cache backend '{backend_name}' failed to initialize ({e}) - using memory backend")
+
+    return LocalMemoryBackend()
+
+
+class DashboardStatsCache:
+    """Cross-worker cache for dashboard statistics with single-flight recomputation.
+
+    COST OPTIMIZATION: Extended TTLs for stable data and one recompute per expired key
+    across all workers.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.background_refresh = False  # Set while the dashboard refresher thread is running
+        self._last_access: Dict[str, float] = {}
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'hits': 0,
+            'misses': 0,
+            'recomputes': 0,
+            'stale_served': 0,
+            'waits': 0,
+            'wait_timeouts': 0,
+            'backend_errors': 0
+        }
+
+    def _count(self, metric: str) -> None:
+        with self._metrics_lock:
+            self._metrics[metric] += 1
+
+    def _read(self, key: str) -> Optional[Tuple[Any, float]]:
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            self._count('backend_errors')
+            logger.debug(f"Dashboard cache read failed for {key}: {e}")
+            return None
+
+    def _write(self, key: str, value: Any) -> None:
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            self._count('backend_errors')
+            logger.debug(f"Dashboard cache write failed for {key}: {e}")
+
+    def get_or_compute(self, key: str, ttl: float, compute_fn: Callable[[], Any]) -> Tuple[Any, bool, float]:
+        """Return a cached value, recomputing it in at most one worker when expired.
+
+        Returns:
+            (value, cached, age_seconds) - cached is False when this call computed the value
+        """
+        self._last_access[key] = time.time()
+        entry = self._read(key)
+        if entry and (time.time() - entry[1]) < ttl:
+            self._count('hits')
+            return entry[0], True, time.time() - entry[1]
+
+        # Background refresher owns recomputation - serve the stale copy immediately
+        if self.background_refresh and entry and (time.time() - entry[1]) < ttl + MAX_STALE_SECONDS:
+            self._count('stale_served')
+            return entry[0], True, time.time() - entry[1]
+
+        self._count('misses')
+        try:
+            token = self.backend.acquire(key)
+        except Exception as e:
+            self._count('backend_errors')
+            logger.debug(f"Dashboard cache flight lock failed for {key}: {e}")
+            token = None
+            entry = None  # Backend is unhealthy - compute directly below
+
+        if token is not None:
+            try:
+                # Another worker may have finished recomputing just before we got the lock
+                latest = self._read(key)
+                if latest and (time.time() - latest[1]) < ttl:
+                    return latest[0], True, time.time() - latest[1]
+
+                value = compute_fn()
+                self._write(key, value)
+                self._count('recomputes')
+                return value, False, 0.0
+            finally:
+                try:
+                    self.backend.release(key, token)
+                except Exception as e:
+                    logger.debug(f"Dashboard cache flight release failed for {key}: {e}")
+
+        # Another worker is recomputing - serve stale data if it is not too old
+        if entry and (time.time() - entry[1]) < ttl + MAX_STALE_SECONDS:
+            self._count('stale_served')
+            return entry[0], True, time.time() - entry[1]
+
+        # Nothing usable cached: wait for the recomputing worker
+        self._count('waits')
+        deadline = time.time() + FLIGHT_WAIT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(FLIGHT_POLL_INTERVAL)
+            latest = self._read(key)
+            if latest and (time.time() - latest[1]) < ttl:
+                return latest[0], True, time.time() - latest[1]
+
+        # Recomputing worker is too slow or gone - compute ourselves
+        self._count('wait_timeouts')
+        value = compute_fn()
+        self._write(key, value)
+        return value, False, 0.0
+
+    def refresh(self, key: str, compute_fn: Callable[[], Any]) -> bool:
+        """Recompute key unconditionally (used by the background refresher).
+
+        Returns:
+            False if another worker is already recomputing this key, True otherwise
+        """
+        token = self.backend.acquire(key)
+        if token is None:
+            return False
+        try:
+            self._write(key, compute_fn())
+            self._count('recomputes')
+            return True
+        finally:
+            self.backend.release(key, token)
+
+    def last_access(self, key: str) -> float:
+        """Time this worker last served key (0 if never)."""
+        return self._last_access.get(key, 0.0)
+
+    def peek(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Return (value, age_seconds) regardless of TTL (for serving stale data on errors)."""
+        entry = self._read(key)
+        if entry is None:
+            return None
+        return entry[0], time.time() - entry[1]
+
     def invalidate_all(self) -> None:
-        """Invalidate all cached data."""
-        with self._lock:
-            self._core_stats = None
-            self._core_stats_time = 0
-            self._hourly_scans = None
-            self._hourly_scans_time = 0
-            self._billing_stats = None
-            self._billing_stats_time = 0
-            self._user_count = None
-            self._user_count_time = 0
+        """Invalidate all cached data (in every worker sharing the backend)."""
+        try:
+            self.backend.clear()
+        except Exception as e:
+            self._count('backend_errors')
+            logger.warning(f"Dashboard cache invalidation failed: {e}")
         logger.debug("Dashboard cache invalidated")
-    
+
     def get_stats(self) -> Dict[str, Any]:
-        """Get cache statistics for monitoring."""
-        with self._lock:
-            now = time.time()
-            return {
-                'core_stats_age_seconds': round(now - self._core_stats_time, 1) if self._core_stats else None,
-                'hourly_scans_age_seconds': round(now - self._hourly_scans_time, 1) if self._hourly_scans else None,
-                'billing_stats_age_seconds': round(now - self._billing_stats_time, 1) if self._billing_stats else None,
-                'user_count_age_seconds': round(now - self._user_count_time, 1) if self._user_count is not None else None,
-                'core_stats_cached': self._core_stats is not None,
-                'hourly_scans_cached': self._hourly_scans is not None,
-                'billing_stats_cached': self._billing_stats is not None,
-                'user_count_cached': self._user_count is not None,
-                'ttl_settings': {
-                    'core_stats_ttl': STATS_CACHE_TTL,
-                    'hourly_scans_ttl': HOURLY_CACHE_TTL,
-                    'user_count_ttl': USER_COUNT_CACHE_TTL
-                }
+        """Get cache statistics for monitoring (metrics are per worker)."""
+        ages = {}
+        for key in ('core_stats', 'scan_activity', 'hourly_scans', 'billing_stats', 'api_stats'):
+            entry = self.peek(key)
+            ages[f'{key}_age_seconds'] = round(entry[1], 1) if entry else None
+
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        return {
+            'backend': self.backend.name,
+            'background_refresh': self.background_refresh,
+            **ages,
+            **metrics,
+            'ttl_settings': {
+                'core_stats_ttl': STATS_CACHE_TTL,
+                'hourly_scans_ttl': HOURLY_CACHE_TTL,
+                'user_count_ttl': USER_COUNT_CACHE_TTL,
+                'api_stats_ttl': API_STATS_CACHE_TTL,
+                'max_stale_seconds': MAX_STALE_SECONDS
             }
+        }
 
 
 # Global cache instance
@@ -145,7 +419,7 @@ def get_dashboard_cache() -> DashboardStatsCache:
 
 def invalidate_dashboard_cache() -> None:
     """Invalidate all dashboard cached data.
-    
+
     Call this after significant data changes like:
     - Bill creation/deletion
     - Bulk bag imports
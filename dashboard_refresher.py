@@ -0,0 +1,199 @@
+"""
+Dashboard Cache Refresher (stale-while-revalidate)
+Recomputes registered dashboard cache sections in the background shortly before
+their TTL expires, so request threads always get a cached value immediately.
+
+Every worker runs a refresher thread, but DashboardStatsCache.refresh() only lets
+one worker recompute a section at a time (others skip that tick). Sections that no
+request in this worker has asked for within IDLE_TIMEOUT are not refreshed, so an
+idle dashboard costs nothing.
+"""
+
+import logging
+import os
+import time
+from threading import Thread, Event
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Registered sections: key -> (ttl, compute_fn). Populated by api.py / routes.py at import.
+_sections: Dict[str, Tuple[float, Callable]] = {}
+
+
+def register_section(key: str, ttl: float, compute_fn: Callable) -> None:
+    """
+    Register a dashboard cache section for background refresh
+
+    Args:
+        key: Cache key used with DashboardStatsCache.get_or_compute()
+        ttl: Section TTL in seconds
+        compute_fn: Zero-argument function returning a JSON-serializable value
+    """
+    _sections[key] = (ttl, compute_fn)
+
+
+class DashboardRefresher:
+    """Background thread that keeps dashboard cache sections warm"""
+
+    # How often sections are checked for refresh (seconds)
+    REFRESH_INTERVAL = float(os.environ.get('DASHBOARD_REFRESH_INTERVAL', '1'))  # Default: 1s
+
+    # Refresh once a section reaches this fraction of its TTL
+    REFRESH_AHEAD = float(os.environ.get('DASHBOARD_REFRESH_AHEAD', '0.8'))  # Default: 80% of TTL
+
+    # Stop refreshing sections nobody has requested for this long (seconds)
+    IDLE_TIMEOUT = int(os.environ.get('DASHBOARD_REFRESH_IDLE_TIMEOUT', '300'))  # Default: 5 minutes
+
+    def __init__(self, app, db, cache, enabled=True):
+        """
+        Initialize dashboard refresher
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            cache: DashboardStatsCache instance to keep warm
+            enabled: Whether refreshing is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.cache = cache
+        self.enabled = enabled
+        self.stop_event = Event()
+        self.refresher_thread = None
+        self.stats = {
+            'refreshes': 0,
+            'skipped_busy': 0,
+            'errors': 0,
+            'sections': {}
+        }
+
+    def start(self):
+        """Start refreshing in background thread"""
+        if not self.enabled:
+            logger.info("Dashboard refresher is disabled")
+            return
+
+        if self.refresher_thread and self.refresher_thread.is_alive():
+            logger.warning("Dashboard refresher already running")
+            return
+
+        self.stop_event.clear()
+        self.cache.background_refresh = True
+        self.refresher_thread = Thread(target=self._refresh_loop, daemon=True, name='dashboard-refresher')
+        self.refresher_thread.start()
+        logger.info(f"Dashboard refresher started - checking every {self.REFRESH_INTERVAL}s, "
+                    f"refreshing at {int(self.REFRESH_AHEAD * 100)}% of TTL")
+
+    def stop(self):
+        """Stop refreshing (requests go back to inline single-flight recomputation)"""
+        self.cache.background_refresh = False
+        if not self.refresher_thread:
+            return
+
+        self.stop_event.set()
+        self.refresher_thread.join(timeout=5)
+        logger.info("Dashboard refresher stopped")
+
+    def _refresh_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_due_sections()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Dashboard refresher error: {e}")
+
+            # Wait for next tick or stop event
+            self.stop_event.wait(self.REFRESH_INTERVAL)
+
+    def refresh_due_sections(self) -> int:
+        """Refresh every active section that is close to expiry. Returns sections refreshed."""
+        refreshed = 0
+        now = time.time()
+
+        for key, (ttl, compute_fn) in list(_sections.items()):
+            if now - self.cache.last_access(key) > self.IDLE_TIMEOUT:
+                continue
+
+            entry = self.cache.peek(key)
+            if entry and entry[1] < ttl * self.REFRESH_AHEAD:
+                continue
+
+            if self.refresh_section(key, compute_fn):
+                refreshed += 1
+
+        return refreshed
+
+    def refresh_section(self, key: str, compute_fn: Callable) -> bool:
+        """Recompute one section and record its duration. Returns False if skipped or failed."""
+        section_stats = self.stats['sections'].setdefault(key, {
+            'refreshes': 0,
+            'errors': 0,
+            'last_duration_ms': None,
+            'max_duration_ms': None,
+            'avg_duration_ms': None,
+            'last_refreshed_at': None
+        })
+
+        with self.app.app_context():
+            start = time.time()
+            try:
+                if not self.cache.refresh(key, compute_fn):
+                    self.stats['skipped_busy'] += 1
+                    return False
+            except Exception as e:
+                self.db.session.rollback()
+                section_stats['errors'] += 1
+                self.stats['errors'] += 1
+                logger.warning(f"Dashboard section '{key}' refresh failed: {e}")
+                return False
+            finally:
+                self.db.session.remove()
+
+        duration_ms = round((time.time() - start) * 1000, 2)
+        count = section_stats['refreshes']
+        section_stats['refreshes'] = count + 1
+        section_stats['last_duration_ms'] = duration_ms
+        section_stats['max_duration_ms'] = max(section_stats['max_duration_ms'] or 0, duration_ms)
+        section_stats['avg_duration_ms'] = round(
+            ((section_stats['avg_duration_ms'] or 0) * count + duration_ms) / (count + 1), 2)
+        section_stats['last_refreshed_at'] = time.time()
+        self.stats['refreshes'] += 1
+        return True
+
+    def get_stats(self) -> Dict:
+        """Get refresher statistics (including per-section refresh durations) for monitoring"""
+        return dict(self.stats, running=bool(self.refresher_thread and self.refresher_thread.is_alive()),
+                    registered_sections=sorted(_sections))
+
+
+# Global refresher instance (initialized in app.py)
+dashboard_refresher: Optional[DashboardRefresher] = None
+
+
+def get_dashboard_refresher() -> Optional[DashboardRefresher]:
+    """Get the global dashboard refresher instance"""
+    return dashboard_refresher
+
+
+def init_dashboard_refresher(app, db, enabled=True):
+    """
+    Initialize and start the global dashboard refresher
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable background refresh (default: True)
+    """
+    global dashboard_refresher
+
+    from dashboard_cache import get_dashboard_cache
+
+    dashboard_refresher = DashboardRefresher(app, db, get_dashboard_cache(), enabled=enabled)
+    dashboard_refresher.start()
+
+    from shutdown_handler import register_cleanup_callback
+    register_cleanup_callback(dashboard_refresher.stop, "dashboard_refresher_stop")
+
+    return dashboard_refresher
@@ -16,6 +16,7 @@ Exit codes:
 import os
 import sys
 from sqlalchemy import create_engine, text
+from search_utils import SEARCH_INDEXES
 
 
 # Critical indexes to verify (NOT create - migrations handle creation)
@@ -51,6 +52,42 @@ def check_column_has_index(conn, table, column):
     return row[0] if row else None
 
 
+def check_named_index(conn, index_name):
+    """Check if an index exists by name and is valid (a failed CONCURRENTLY build leaves it invalid)"""
+    result = conn.execute(text("""
+        SELECT ix.indisvalid
+        FROM pg_class i
+        JOIN pg_index ix ON i.oid = ix.indexrelid
+        WHERE i.relname = :name
+    """), {'name': index_name})
+    row = result.fetchone()
+    return row[0] if row else None
+
+
+def verify_search_indexes(conn):
+    """Verify the exact/prefix/trigram search indexes (search_utils). Returns (found, missing)."""
+    found = 0
+    missing = 0
+    has_trigram = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+    if has_trigram:
+        print("  ✅ pg_trgm extension installed")
+    else:
+        print("  ⚠️  pg_trgm extension NOT installed - substring search falls back to sequential scans")
+    
+    for index_name, table, definition in SEARCH_INDEXES:
+        valid = check_named_index(conn, index_name)
+        if valid:
+            print(f"  ✅ {table} search index {index_name}")
+            found += 1
+        elif valid is None:
+            print(f"  ⚠️  {table} search index {index_name} MISSING")
+            missing += 1
+        else:
+            print(f"  ⚠️  {table} search index {index_name} INVALID (rerun the migration to rebuild it)")
+            missing += 1
+    return found, missing
+
+
 def verify_indexes():
     """Verify critical indexes exist (read-only check)"""
     db_url = os.environ.get('DATABASE_URL')
@@ -71,6 +108,10 @@ def verify_indexes():
             else:
                 print(f"  ⚠️  {table}.{column} NO INDEX")
                 missing += 1
+        
+        search_found, search_missing = verify_search_indexes(conn)
+        found += search_found
+        missing += search_missing
     
     print(f"\nSummary: {found} indexed, {missing} missing")
     
@@ -5,20 +5,24 @@ Provides CSV and Excel export functionality for bags, bills, and reports
 PERFORMANCE DESIGN:
 - All queries use set-based operations (CTEs, JOINs) to avoid N+1 patterns
 - Single optimized query per export - no per-row database lookups
-- Default limit: 10,000 records to prevent memory exhaustion
-- Ready for enterprise scale (1.8M+ bags)
+- Bag and bill exports stream: a server-side cursor feeds a generator that
+  writes CSV chunks / an openpyxl write-only workbook, so a full 1.8M-bag
+  export uses constant memory per worker (no row cap)
 
 SAFETY:
 - Admin-only access enforced in routes
-- Default limits prevent memory issues on large datasets
+- Streaming keeps memory flat regardless of export size
 - All queries use parameterized SQL to prevent injection
 """
 import csv
 import io
+import itertools
 import logging
+import os
+import tempfile
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from flask import Response, make_response
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from flask import Response, make_response, stream_with_context
 from sqlalchemy import text
 
 logger = logging.getLogger(__name__)
@@ -26,6 +30,7 @@ logger = logging.getLogger(__name__)
 # Try to import openpyxl for Excel support (optional)
 try:
     from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
     from openpyxl.styles import Font, PatternFill, Alignment
     from openpyxl.utils import get_column_letter
     EXCEL_AVAILABLE = True
@@ -34,6 +39,29 @@ except ImportError:
     logger.warning("openpyxl not available - Excel exports disabled")
 
 
+def _format_timestamp(value: Any) -> str:
+    """Format a raw-SQL timestamp (a datetime on PostgreSQL, ISO text on SQLite)"""
+    if not value:
+        return 'Unknown'
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+
+# CSV rows buffered before a chunk is sent to the client
+CSV_CHUNK_ROWS = 1000
+
+# Excel file bytes sent per chunk
+EXCEL_CHUNK_BYTES = 64 * 1024
+
+# Rows sampled for Excel column widths (same as the in-memory export)
+EXCEL_WIDTH_SAMPLE_ROWS = 100
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
 class DataExporter:
     """Handles data export to CSV and Excel formats"""
     
@@ -131,34 +159,160 @@ class DataExporter:
         
         # Create response
         response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        response.headers['Content-Type'] = XLSX_CONTENT_TYPE
         response.headers['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+    
+    @staticmethod
+    def stream_query(db, query, params: Dict[str, Any]) -> Iterator[Any]:
+        """
+        Yield result rows from a server-side (named) cursor.
+        
+        Rows are fetched EXPORT_FETCH_SIZE at a time, so memory stays constant
+        no matter how many rows the query returns.
+        """
+        result = db.session.execute(
+            query, params,
+            execution_options={'stream_results': True, 'yield_per': EXPORT_FETCH_SIZE}
+        )
+        try:
+            for row in result:
+                yield row
+        finally:
+            result.close()
+    
+    @staticmethod
+    def _streaming_response(chunks: Iterator, content_type: str, filename: str) -> Response:
+        """Wrap a chunk generator in a chunked download response"""
+        response = Response(stream_with_context(chunks), content_type=content_type)
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        # Stop reverse proxies from buffering the whole download
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @staticmethod
+    def stream_csv(rows: Iterable[Dict[str, Any]], fieldnames: List[str], filename: str) -> Response:
+        """
+        Stream dictionaries as a chunked CSV download.
+        
+        Args:
+            rows: Iterable of dictionaries (typically a generator over a server-side cursor)
+            fieldnames: CSV header, in column order
+            filename: Name for the downloaded file
+            
+        Returns:
+            Flask Response streaming the CSV file
+        """
+        def generate():
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=fieldnames)
+            writer.writeheader()
+            exported = 0
+            try:
+                for exported, row in enumerate(rows, 1):
+                    writer.writerow(row)
+                    if exported % CSV_CHUNK_ROWS == 0:
+                        yield output.getvalue()
+                        output.seek(0)
+                        output.truncate(0)
+                yield output.getvalue()
+            except Exception as e:
+                logger.error(f"CSV export {filename} failed after {exported} rows: {e}")
+                raise
+            logger.info(f"CSV export {filename} streamed {exported} rows")
+        
+        return DataExporter._streaming_response(generate(), 'text/csv; charset=utf-8', filename)
+    
+    @staticmethod
+    def stream_excel(rows: Iterable[Dict[str, Any]], headers: List[str], filename: str,
+                     sheet_name: str = "Data") -> Response:
+        """
+        Stream dictionaries as an Excel download built with openpyxl write-only mode.
+        
+        Write-only worksheets spill rows to a temp file instead of keeping cells in
+        memory. An .xlsx is a zip archive, so the workbook is finished in a temp file
+        and then sent in EXCEL_CHUNK_BYTES chunks.
+        
+        Args:
+            rows: Iterable of dictionaries (typically a generator over a server-side cursor)
+            headers: Column headers, in column order
+            filename: Name for the downloaded file
+            sheet_name: Name of the Excel sheet
+            
+        Returns:
+            Flask Response streaming the Excel file
+        """
+        if not EXCEL_AVAILABLE:
+            raise ImportError("openpyxl not installed - Excel export not available")
+        
+        def generate():
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(title=sheet_name)
+            
+            # Column widths must be set before the first row is written - size them
+            # from a small sample, then chain the sample back in front of the rest
+            rows_iter = iter(rows)
+            sample = list(itertools.islice(rows_iter, EXCEL_WIDTH_SAMPLE_ROWS))
+            for col_idx, header in enumerate(headers, 1):
+                max_length = max([len(str(header))] +
+                                 [len(str(row.get(header))) for row in sample if row.get(header)])
+                ws.column_dimensions[get_column_letter(col_idx)].width = min(max_length + 2, 50)
+            
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(ws, value=header)
+                cell.font = Font(bold=True, color="FFFFFF")
+                cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+                cell.alignment = Alignment(horizontal='center')
+                header_cells.append(cell)
+            ws.append(header_cells)
+            
+            exported = 0
+            for exported, row_data in enumerate(itertools.chain(sample, rows_iter), 1):
+                values = []
+                for header in headers:
+                    value = row_data.get(header, '')
+                    if isinstance(value, datetime):
+                        value = value.strftime('%Y-%m-%d %H:%M:%S')
+                    values.append(value)
+                ws.append(values)
+            
+            with tempfile.NamedTemporaryFile(suffix='.xlsx') as tmp:
+                wb.save(tmp.name)
+                logger.info(f"Excel export {filename} wrote {exported} rows "
+                            f"({os.path.getsize(tmp.name)} bytes)")
+                with open(tmp.name, 'rb') as f:
+                    while True:
+                        chunk = f.read(EXCEL_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        yield chunk
+        
+        return DataExporter._streaming_response(generate(), XLSX_CONTENT_TYPE, filename)
 
 
 class BagExporter:
     """Export functionality for bags"""
     
+    COLUMNS = ['QR ID', 'Type', 'Children Count', 'Linked to Bill', 'Created At']
+    
     @staticmethod
-    def get_bags_data(db, bag_type: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+    def get_bags_data(db, bag_type: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Dict]:
         """
-        Get bag data for export using optimized set-based query.
+        Stream bag data for export using optimized set-based query.
         
         Args:
             db: Database session
             bag_type: Filter by type ('parent' or 'child'), None for all
-            limit: Maximum number of records (None uses default 10000)
+            limit: Maximum number of records (None exports every bag)
             
         Returns:
-            List of dictionaries with bag data
+            Generator of dictionaries with bag data, read from a server-side cursor
         """
-        # Enforce hard limit to prevent memory exhaustion
-        if limit is None or limit <= 0 or limit > 10000:
-            limit = 10000
-        
         # Validate bag_type to prevent SQL injection
         type_filter = ""
-        params = {'limit': limit}
+        limit_clause = ""
+        params = {}
         
         if bag_type:
             # Only allow valid bag types
@@ -167,6 +321,10 @@ class BagExporter:
             type_filter = "AND b.type = :bag_type"
             params['bag_type'] = bag_type
         
+        if limit is not None and limit > 0:
+            limit_clause = "LIMIT :limit"
+            params['limit'] = limit
+        
         query = text(f"""
             SELECT 
                 b.qr_id,
@@ -185,67 +343,64 @@ class BagExporter:
             LEFT JOIN bill ON bb.bill_id = bill.id
             WHERE 1=1 {type_filter}
             ORDER BY b.created_at DESC
-            LIMIT :limit
+            {limit_clause}
         """)
         
-        rows = db.session.execute(query, params).fetchall()
-        
-        result = []
-        for row in rows:
-            bill_info = f"{row.bill_id} ({row.bill_status})" if row.bill_id else 'Not linked'
-            
-            result.append({
-                'QR ID': row.qr_id,
-                'Type': row.type.upper(),
-                'Children Count': row.child_count if row.type == 'parent' else 'N/A',
-                'Linked to Bill': bill_info,
-                'Created At': row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else 'Unknown'
-            })
-        
-        return result
+        return (BagExporter._row_to_dict(row) for row in DataExporter.stream_query(db, query, params))
+    
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        bill_info = f"{row.bill_id} ({row.bill_status})" if row.bill_id else 'Not linked'
+        return {
+            'QR ID': row.qr_id,
+            'Type': row.type.upper(),
+            'Children Count': row.child_count if row.type == 'parent' else 'N/A',
+            'Linked to Bill': bill_info,
+            'Created At': _format_timestamp(row.created_at)
+        }
     
     @staticmethod
     def export_bags_csv(db, bag_type: Optional[str] = None, limit: Optional[int] = None) -> Response:
-        """Export bags to CSV"""
+        """Export bags to CSV (streamed)"""
         data = BagExporter.get_bags_data(db, bag_type, limit)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         type_suffix = f"_{bag_type}" if bag_type else "_all"
         filename = f"bags{type_suffix}_{timestamp}.csv"
-        return DataExporter.dict_to_csv(data, filename)
+        return DataExporter.stream_csv(data, BagExporter.COLUMNS, filename)
     
     @staticmethod
     def export_bags_excel(db, bag_type: Optional[str] = None, limit: Optional[int] = None) -> Response:
-        """Export bags to Excel"""
+        """Export bags to Excel (streamed)"""
         data = BagExporter.get_bags_data(db, bag_type, limit)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         type_suffix = f"_{bag_type}" if bag_type else "_all"
         filename = f"bags{type_suffix}_{timestamp}.xlsx"
-        return DataExporter.dict_to_excel(data, filename, "Bags")
+        return DataExporter.stream_excel(data, BagExporter.COLUMNS, filename, "Bags")
 
 
 class BillExporter:
     """Export functionality for bills"""
     
+    COLUMNS = ['Bill ID', 'Description', 'Status', 'Parent Bags Count', 'Total Child Bags',
+               'Actual Weight (kg)', 'Expected Weight (kg)', 'Created By', 'Created At', 'Updated At']
+    
     @staticmethod
-    def get_bills_data(db, status: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+    def get_bills_data(db, status: Optional[str] = None, limit: Optional[int] = None) -> Iterator[Dict]:
         """
-        Get bill data for export using optimized set-based query.
+        Stream bill data for export using optimized set-based query.
         
         Args:
             db: Database session
             status: Filter by status ('new', 'processing', 'completed')
-            limit: Maximum number of records (None uses default 10000)
+            limit: Maximum number of records (None exports every bill)
             
         Returns:
-            List of dictionaries with bill data
+            Generator of dictionaries with bill data, read from a server-side cursor
         """
-        # Enforce hard limit to prevent memory exhaustion
-        if limit is None or limit <= 0 or limit > 10000:
-            limit = 10000
-        
         # Validate status to prevent SQL injection
         status_filter = ""
-        params = {'limit': limit}
+        limit_clause = ""
+        params = {}
         
         if status:
             # Only allow valid statuses
@@ -254,6 +409,10 @@ class BillExporter:
             status_filter = "AND bill.status = :status"
             params['status'] = status
         
+        if limit is not None and limit > 0:
+            limit_clause = "LIMIT :limit"
+            params['limit'] = limit
+        
         # Optimized query with all data in single query using CTEs
         query = text(f"""
             WITH bill_weights AS (
@@ -287,45 +446,43 @@ class BillExporter:
             LEFT JOIN "user" u ON bill.created_by_id = u.id
             WHERE 1=1 {status_filter}
             ORDER BY bill.created_at DESC
-            LIMIT :limit
+            {limit_clause}
         """)
         
-        rows = db.session.execute(query, params).fetchall()
-        
-        result = []
-        for row in rows:
-            result.append({
-                'Bill ID': row.bill_id,
-                'Description': row.description or 'N/A',
-                'Status': row.status.upper() if row.status else 'NEW',
-                'Parent Bags Count': row.parent_bag_count or 0,
-                'Total Child Bags': row.total_child_bags or 0,
-                'Actual Weight (kg)': row.actual_weight or 0,
-                'Expected Weight (kg)': row.expected_weight_kg or 0,
-                'Created By': row.created_by or 'Unknown',
-                'Created At': row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else 'Unknown',
-                'Updated At': row.updated_at.strftime('%Y-%m-%d %H:%M:%S') if row.updated_at else 'Unknown'
-            })
-        
-        return result
+        return (BillExporter._row_to_dict(row) for row in DataExporter.stream_query(db, query, params))
+    
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        return {
+            'Bill ID': row.bill_id,
+            'Description': row.description or 'N/A',
+            'Status': row.status.upper() if row.status else 'NEW',
+            'Parent Bags Count': row.parent_bag_count or 0,
+            'Total Child Bags': row.total_child_bags or 0,
+            'Actual Weight (kg)': row.actual_weight or 0,
+            'Expected Weight (kg)': row.expected_weight_kg or 0,
+            'Created By': row.created_by or 'Unknown',
+            'Created At': _format_timestamp(row.created_at),
+            'Updated At': _format_timestamp(row.updated_at)
+        }
     
     @staticmethod
     def export_bills_csv(db, status: Optional[str] = None, limit: Optional[int] = None) -> Response:
-        """Export bills to CSV"""
+        """Export bills to CSV (streamed)"""
         data = BillExporter.get_bills_data(db, status, limit)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         status_suffix = f"_{status}" if status else "_all"
         filename = f"bills{status_suffix}_{timestamp}.csv"
-        return DataExporter.dict_to_csv(data, filename)
+        return DataExporter.stream_csv(data, BillExporter.COLUMNS, filename)
     
     @staticmethod
     def export_bills_excel(db, status: Optional[str] = None, limit: Optional[int] = None) -> Response:
-        """Export bills to Excel"""
+        """Export bills to Excel (streamed)"""
         data = BillExporter.get_bills_data(db, status, limit)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         status_suffix = f"_{status}" if status else "_all"
         filename = f"bills{status_suffix}_{timestamp}.xlsx"
-        return DataExporter.dict_to_excel(data, filename, "Bills")
+        return DataExporter.stream_excel(data, BillExporter.COLUMNS, filename, "Bills")
 
 
 class ReportExporter:
@@ -333,29 +490,26 @@ class ReportExporter:
     
     @staticmethod
     def get_user_activity_report(db, days: int = 30) -> List[Dict]:
-        """Get user activity report using optimized set-based query"""
+        """Get user activity report (scan counts from the hourly scan rollup)"""
         from datetime import timedelta
+        from activity_rollup import get_scans_by_user
         
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
-        # Optimized query with aggregations in single query
-        query = text("""
-            SELECT 
-                u.username,
-                u.email,
-                u.role,
-                u.dispatch_area,
-                COUNT(CASE WHEN s.timestamp >= :cutoff_date THEN 1 END) as recent_scans,
-                COUNT(s.id) as total_scans,
-                u.locked_until,
-                u.created_at
-            FROM "user" u
-            LEFT JOIN scan s ON u.id = s.user_id
-            GROUP BY u.id, u.username, u.email, u.role, u.dispatch_area, u.locked_until, u.created_at
-            ORDER BY recent_scans DESC, total_scans DESC
-        """)
+        # Per-user scan counts come from the hourly scan rollup (window rounded to
+        # whole hours), so the report no longer scans raw scan history
+        recent = get_scans_by_user(start=cutoff_date)
+        lifetime = get_scans_by_user()
         
-        rows = db.session.execute(query, {'cutoff_date': cutoff_date}).fetchall()
+        users = db.session.execute(text("""
+            SELECT id, username, email, role, dispatch_area, locked_until, created_at
+            FROM "user"
+        """)).fetchall()
+        rows = sorted(
+            users,
+            key=lambda user: (recent.get(user.id, 0), lifetime.get(user.id, 0)),
+            reverse=True
+        )
         
         result = []
         for row in rows:
@@ -366,8 +520,8 @@ class ReportExporter:
                 'Email': row.email,
                 'Role': row.role.upper(),
                 'Dispatch Area': row.dispatch_area or 'N/A',
-                f'Scans (Last {days} Days)': row.recent_scans,
-                'Total Scans': row.total_scans,
+                f'Scans (Last {days} Days)': recent.get(row.id, 0),
+                'Total Scans': lifetime.get(row.id, 0),
                 'Account Status': 'Locked' if is_locked else 'Active',
                 'Joined': row.created_at.strftime('%Y-%m-%d') if row.created_at else 'Unknown'
             })
@@ -0,0 +1,561 @@
+"""
+Background Import Jobs for TraitorTrack
+Runs multi-file Excel imports (/import/batch_multi) in a process pool instead of
+inside the request, so a lakh-row upload no longer holds a gunicorn worker past
+the 60s timeout.
+
+Flow:
+1. submit() saves the uploads under JOB_ROOT/<job_id>/, inserts an import_job row
+   and hands the job id to a ProcessPoolExecutor (created lazily, forkserver or
+   spawn context - forking a threaded gthread worker can copy a held lock)
+2. run_import_job() runs in the pool process: MultiFileBatchProcessor parses the
+   files in parallel (see ParallelExcelParser) and imports them one at a time,
+   and progress is written to import_job from a separate short transaction
+   (the import transaction stays open until commit)
+3. The status endpoint reads import_job and reports progress, rows/sec and ETA;
+   result and error report workbooks are written next to the uploads and served
+   by the download endpoint once the job finishes
+
+Job directories older than JOB_RETENTION_HOURS are removed on the next submit.
+
+Each job records the gunicorn worker that owns it (import_job.worker_id). When a
+worker dies its pool dies with it, so recover_orphaned_jobs() runs at worker
+start-up: queued jobs whose uploads are still on disk are re-queued in the new
+worker's pool, and running (half-imported) jobs are marked failed.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Dict, List, Optional
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Where uploads and result files live while a job is kept
+JOB_ROOT = os.environ.get('IMPORT_JOB_DIR') or os.path.join(tempfile.gettempdir(), 'traitortrack_import_jobs')
+
+# Pool processes per gunicorn worker
+MAX_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', '1'))
+
+# Minimum seconds between progress writes to import_job
+PROGRESS_INTERVAL = float(os.environ.get('IMPORT_JOB_PROGRESS_INTERVAL', '1'))
+
+# Job directories (uploads, results) are deleted after this many hours
+JOB_RETENTION_HOURS = int(os.environ.get('IMPORT_JOB_RETENTION_HOURS', '24'))
+
+# A running job whose progress has not changed for this long is reported as stalled
+STALLED_AFTER_SECONDS = int(os.environ.get('IMPORT_JOB_STALLED_AFTER', '600'))
+
+# Unfinished jobs owned by a worker on another host are recovered once they have
+# not been updated for this long (workers on this host are checked by pid)
+ORPHANED_AFTER_SECONDS = int(os.environ.get('IMPORT_JOB_ORPHANED_AFTER', '3600'))
+
+# Pool start method - never fork: gthread workers are multi-threaded
+START_METHOD = os.environ.get('IMPORT_JOB_START_METHOD') or (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+RESULT_FILE_NAME = 'import_results.xlsx'
+ERROR_REPORT_FILE_NAME = 'import_errors.xlsx'
+
+
+def job_dir(job_id: str) -> str:
+    """Directory holding a job's uploads and result files"""
+    return os.path.join(JOB_ROOT, job_id)
+
+
+def worker_identity() -> str:
+    """'host:pid' of this gunicorn worker (stored in import_job.worker_id)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _worker_alive(worker_id: Optional[str]) -> Optional[bool]:
+    """Whether a job's owning worker is still running; None if it is on another host"""
+    host, _, pid = (worker_id or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by another user
+    return True
+
+
+def _update_job(db, job_id: str, **values):
+    """Write import_job columns in their own transaction (visible immediately)"""
+    from models import ImportJob
+
+    values['updated_at'] = datetime.datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(ImportJob.__table__.update().where(ImportJob.__table__.c.id == job_id).values(**values))
+
+
+class _ProgressTracker:
+    """Turns per-file importer callbacks into job-wide progress, rows and throttled writes"""
+
+    def __init__(self, db, job_id: str, files_total: int):
+        self.db = db
+        self.job_id = job_id
+        self.files_total = max(files_total, 1)
+        self.file_index = 0
+        self.file_pct = 0.0
+        self.file_rows = 0
+        self.rows_done = 0  # Rows in finished files
+        self.rows_total = 0
+        self.last_write = 0.0
+
+    def start_file(self, index: int, filename: str):
+        self.file_index = index
+        self.file_pct = 0.0
+        self.file_rows = 0
+        self.write(force=True, current_file=filename)
+
+    def total_rows(self, rows: int):
+        """total_rows_callback for the importer"""
+        self.file_rows = rows
+        self.rows_total += rows
+        self.write(force=True)
+
+    def progress(self, current: int, total: int):
+        """progress_callback for the importer (current/total of this file)"""
+        self.file_pct = (current / total) * 100 if total else 0.0
+        self.write()
+
+    def finish_file(self):
+        self.rows_done += self.file_rows
+        self.file_rows = 0
+        self.file_pct = 0.0
+        self.file_index += 1
+        self.write(force=True, files_done=self.file_index)
+
+    def write(self, force: bool = False, **extra):
+        now = time.time()
+        if not force and now - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.last_write = now
+        progress_pct = (self.file_index + self.file_pct / 100) / self.files_total * 100
+        rows_processed = self.rows_done + int(self.file_rows * self.file_pct / 100)
+        try:
+            _update_job(self.db, self.job_id,
+                        progress_pct=round(min(progress_pct, 100.0), 1),
+                        rows_total=self.rows_total,
+                        rows_processed=rows_processed,
+                        **extra)
+        except Exception as e:
+            # Progress is informational - never fail the import over it
+            logger.warning(f"Import job {self.job_id}: progress update failed: {e}")
+
+
+def _init_worker_process():
+    """Pool process initializer - never share the parent's database connections"""
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def run_import_job(job_id: str) -> str:
+    """
+    Run one import job (executes in a pool process).
+
+    Returns:
+        Final job status
+    """
+    from app import app, db
+    from models import ImportJob, ImportJobStatus
+    from werkzeug.datastructures import FileStorage
+    from import_utils import MultiFileBatchProcessor
+
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if not job:
+            logger.error(f"Import job {job_id} not found")
+            return ImportJobStatus.FAILED.value
+
+        user_id = job.user_id
+        import_type = job.import_type
+        dispatch_area = job.dispatch_area
+        filenames = json.loads(job.filenames or '[]')
+        db.session.remove()
+
+        directory = job_dir(job_id)
+        tracker = _ProgressTracker(db, job_id, len(filenames))
+        _update_job(db, job_id, status=ImportJobStatus.RUNNING.value,
+                    started_at=datetime.datetime.utcnow())
+        start_time = time.time()
+
+        file_results: List[Dict] = []
+        row_results = []
+        has_errors = False
+
+        try:
+            upload_paths = [os.path.join(directory, _upload_name(index, name))
+                            for index, name in enumerate(filenames)]
+
+            def file_started(index: int, filename: str):
+                # Files are imported in order; starting one finishes the one before
+                if index > 0:
+                    tracker.finish_file()
+                tracker.start_file(index, filename)
+
+            # All files go to the importer at once so it can parse them in parallel
+            with contextlib.ExitStack() as stack:
+                uploads = [FileStorage(stream=stack.enter_context(open(path, 'rb')), filename=name)
+                           for path, name in zip(upload_paths, filenames)]
+                if import_type == 'child_parent':
+                    file_results, row_results, has_errors = \
+                        MultiFileBatchProcessor.process_child_parent_files_streaming(
+                            uploads, user_id, dispatch_area, True,
+                            progress_callback=tracker.progress,
+                            total_rows_callback=tracker.total_rows,
+                            file_callback=file_started
+                        )
+                else:
+                    file_results, has_errors = MultiFileBatchProcessor.process_parent_bill_files(
+                        uploads, user_id, file_callback=file_started
+                    )
+
+            if filenames:
+                tracker.finish_file()
+            db.session.remove()
+            for path in upload_paths:
+                os.remove(path)
+
+            result_file = None
+            error_report_file = None
+
+            result_bytes = MultiFileBatchProcessor.generate_detailed_result_file(file_results, row_results)
+            if result_bytes:
+                with open(os.path.join(directory, RESULT_FILE_NAME), 'wb') as f:
+                    f.write(result_bytes)
+                result_file = RESULT_FILE_NAME
+
+            if has_errors:
+                error_bytes = MultiFileBatchProcessor.generate_error_report(file_results)
+                if error_bytes:
+                    with open(os.path.join(directory, ERROR_REPORT_FILE_NAME), 'wb') as f:
+                        f.write(error_bytes)
+                    error_report_file = ERROR_REPORT_FILE_NAME
+
+            _update_job(db, job_id,
+                        status=ImportJobStatus.COMPLETED.value,
+                        progress_pct=100.0,
+                        rows_processed=tracker.rows_done,
+                        files_done=len(filenames),
+                        current_file=None,
+                        has_errors=has_errors,
+                        summary=json.dumps(file_results, default=str),
+                        result_file=result_file,
+                        error_report_file=error_report_file,
+                        finished_at=datetime.datetime.utcnow())
+            logger.info(f"Import job {job_id} completed: {len(filenames)} files, "
+                        f"{tracker.rows_done} rows in {time.time() - start_time:.1f}s")
+            return ImportJobStatus.COMPLETED.value
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Import job {job_id} failed: {e}", exc_info=True)
+            _update_job(db, job_id,
+                        status=ImportJobStatus.FAILED.value,
+                        has_errors=True,
+                        error_message=str(e)[:2000],
+                        summary=json.dumps(file_results, default=str),
+                        finished_at=datetime.datetime.utcnow())
+            return ImportJobStatus.FAILED.value
+        finally:
+            db.session.remove()
+
+
+def _upload_name(index: int, original_name: str) -> str:
+    """On-disk name for an uploaded file (index keeps duplicate names apart)"""
+    return f"upload_{index}_{secure_filename(original_name) or 'file.xlsx'}"
+
+
+class ImportJobQueue:
+    """Submits import jobs to a lazily created process pool"""
+
+    def __init__(self, app, db, max_workers: int = MAX_WORKERS):
+        """
+        Initialize import job queue
+
+        Args:
+            app: Flask application (for app context in pool callbacks)
+            db: SQLAlchemy database instance
+            max_workers: Pool processes per gunicorn worker
+        """
+        self.app = app
+        self.db = db
+        self.max_workers = max_workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self._lock = Lock()
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'crashed': 0
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self.executor is None:
+                # Pool processes import the app themselves instead of inheriting
+                # a copy of this threaded worker
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                    initializer=_init_worker_process
+                )
+                logger.info(f"Import job pool started with {self.max_workers} {START_METHOD} process(es)")
+            return self.executor
+
+    def submit(self, files, user_id: int, import_type: str, dispatch_area: Optional[str] = None) -> str:
+        """
+        Save uploads and queue an import job
+
+        Args:
+            files: Uploaded FileStorage objects
+            user_id: ID of user performing the import
+            import_type: 'child_parent' or 'parent_bill'
+            dispatch_area: Optional dispatch area for created bags
+
+        Returns:
+            Job id (uuid string)
+        """
+        from models import ImportJob
+
+        self.cleanup_old_jobs()
+
+        job_id = str(uuid.uuid4())
+        directory = job_dir(job_id)
+        os.makedirs(directory, exist_ok=True)
+
+        filenames = []
+        try:
+            for file in files:
+                if not file.filename:
+                    continue
+                file.save(os.path.join(directory, _upload_name(len(filenames), file.filename)))
+                filenames.append(file.filename)
+
+            job = ImportJob(
+                id=job_id,
+                user_id=user_id,
+                import_type=import_type,
+                dispatch_area=dispatch_area,
+                filenames=json.dumps(filenames),
+                files_total=len(filenames),
+                worker_id=worker_identity()
+            )
+            self.db.session.add(job)
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        self._enqueue(job_id)
+        logger.info(f"Import job {job_id} queued: {len(filenames)} {import_type} file(s) by user {user_id}")
+        return job_id
+
+    def _enqueue(self, job_id: str):
+        """Hand a queued job to the pool"""
+        future = self._get_executor().submit(run_import_job, job_id)
+        future.add_done_callback(lambda f: self._on_job_done(job_id, f))
+        self.stats['submitted'] += 1
+
+    def _on_job_done(self, job_id: str, future):
+        """Record the outcome; mark the job failed if the pool process died"""
+        from models import ImportJobStatus
+
+        if future.cancelled():
+            # Cancelled by shutdown() before it started - still queued, so the
+            # next worker on this host re-queues it
+            logger.info(f"Import job {job_id} left queued for recovery")
+            return
+
+        try:
+            status = future.result()
+            key = 'completed' if status == ImportJobStatus.COMPLETED.value else 'failed'
+            self.stats[key] += 1
+        except Exception as e:
+            self.stats['crashed'] += 1
+            logger.error(f"Import job {job_id} crashed: {e}")
+            try:
+                with self.app.app_context():
+                    _update_job(self.db, job_id,
+                                status=ImportJobStatus.FAILED.value,
+                                has_errors=True,
+                                error_message=f"Import process crashed: {e}",
+                                finished_at=datetime.datetime.utcnow())
+            except Exception as update_error:
+                logger.error(f"Import job {job_id}: could not record crash: {update_error}")
+
+            # A crashed pool is unusable - start a fresh one for the next job
+            with self._lock:
+                if self.executor is not None and getattr(self.executor, '_broken', False):
+                    self.executor = None
+
+    def recover_orphaned_jobs(self) -> Dict[str, int]:
+        """
+        Recover queued/running jobs whose owning worker has died.
+
+        A job is orphaned if its worker is on this host and no longer running, or
+        on another host and the job has not been updated for ORPHANED_AFTER_SECONDS.
+        Queued jobs with their uploads on this host are re-queued here; anything
+        else (running jobs may be half-imported) is marked failed. Each job is
+        claimed with a conditional update so concurrent workers never both act.
+
+        Returns:
+            Counts of requeued and failed jobs
+        """
+        from models import ImportJob, ImportJobStatus
+
+        table = ImportJob.__table__
+        me = worker_identity()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=ORPHANED_AFTER_SECONDS)
+        recovered = {'requeued': 0, 'failed': 0}
+
+        with self.app.app_context():
+            with self.db.engine.connect() as conn:
+                jobs = conn.execute(
+                    table.select()
+                    .with_only_columns(table.c.id, table.c.status, table.c.worker_id, table.c.updated_at)
+                    .where(table.c.status.in_([ImportJobStatus.QUEUED.value, ImportJobStatus.RUNNING.value]))
+                ).fetchall()
+
+            for job in jobs:
+                if job.worker_id == me:
+                    continue
+                alive = _worker_alive(job.worker_id)
+                if alive or (alive is None and job.updated_at and job.updated_at > cutoff):
+                    continue
+
+                requeue = (job.status == ImportJobStatus.QUEUED.value
+                           and os.path.isdir(job_dir(job.id)))
+                if requeue:
+                    values = {'worker_id': me}
+                else:
+                    values = {'status': ImportJobStatus.FAILED.value,
+                              'has_errors': True,
+                              'error_message': 'Import worker stopped before the job finished - '
+                                               'check the imported data and upload the remaining files again',
+                              'finished_at': datetime.datetime.utcnow()}
+                values['updated_at'] = datetime.datetime.utcnow()
+
+                owner = table.c.worker_id == job.worker_id if job.worker_id else table.c.worker_id.is_(None)
+                with self.db.engine.begin() as conn:
+                    claimed = conn.execute(
+                        table.update()
+                        .where(table.c.id == job.id, table.c.status == job.status, owner)
+                        .values(**values)
+                    ).rowcount
+                if not claimed:
+                    continue  # Another worker got there first
+
+                if requeue:
+                    self._enqueue(job.id)
+                    recovered['requeued'] += 1
+                else:
+                    recovered['failed'] += 1
+                logger.warning(f"Import job {job.id} orphaned by worker {job.worker_id}: "
+                               f"{'re-queued' if requeue else 'marked failed'}")
+
+        return recovered
+
+    def cleanup_old_jobs(self) -> int:
+        """Delete job directories older than JOB_RETENTION_HOURS. Returns directories removed."""
+        if not os.path.isdir(JOB_ROOT):
+            return 0
+
+        cutoff = time.time() - JOB_RETENTION_HOURS * 3600
+        removed = 0
+        for name in os.listdir(JOB_ROOT):
+            path = os.path.join(JOB_ROOT, name)
+            try:
+                if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Could not clean up import job directory {name}: {e}")
+        if removed:
+            logger.info(f"Cleaned up {removed} expired import job directories")
+        return removed
+
+    def shutdown(self):
+        """Stop accepting jobs (running imports finish; queued ones are recovered by the next worker)"""
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+                logger.info("Import job pool stopped")
+
+    def get_stats(self) -> Dict:
+        """Get queue statistics for monitoring"""
+        return dict(self.stats, max_workers=self.max_workers, pool_started=self.executor is not None)
+
+
+def job_status(job) -> Dict:
+    """Status payload for the polling endpoint"""
+    from models import ImportJobStatus
+
+    stalled = False
+    if job.status == ImportJobStatus.RUNNING.value and job.updated_at:
+        stalled = (datetime.datetime.utcnow() - job.updated_at).total_seconds() > STALLED_AFTER_SECONDS
+
+    status = {
+        'job_id': job.id,
+        'status': job.status,
+        'import_type': job.import_type,
+        'files_total': job.files_total or 0,
+        'files_done': job.files_done or 0,
+        'current_file': job.current_file,
+        'progress_pct': round(job.progress_pct or 0, 1),
+        'rows_total': job.rows_total or 0,
+        'rows_processed': job.rows_processed or 0,
+        'rows_per_sec': job.rows_per_sec(),
+        'eta_seconds': job.eta_seconds(),
+        'elapsed_seconds': round(job.elapsed_seconds(), 1),
+        'stalled': stalled,
+        'has_errors': bool(job.has_errors),
+        'error_message': job.error_message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if job.is_finished():
+        status['files'] = [
+            {key: result.get(key) for key in ('filename', 'status', 'summary')}
+            for result in json.loads(job.summary or '[]')
+        ]
+    return status
+
+
+# Global queue instance (created on first use)
+import_job_queue: Optional[ImportJobQueue] = None
+
+
+def get_import_job_queue() -> ImportJobQueue:
+    """Get the global import job queue, creating it on first use"""
+    global import_job_queue
+
+    if import_job_queue is None:
+        from app import app, db
+        from shutdown_handler import register_cleanup_callback
+
+        import_job_queue = ImportJobQueue(app, db)
+        register_cleanup_callback(import_job_queue.shutdown, "import_job_queue_shutdown")
+
+    return import_job_queue
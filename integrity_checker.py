@@ -0,0 +1,500 @@
+"""
+Incremental Data Integrity Checker
+Checks the invariants behind /admin/system-integrity without scanning bag and bill
+on every page view:
+
+- duplicate_bag_qr:  a QR code used by more than one bag
+- duplicate_bill_id: a bill id used by more than one bill
+- cross_duplicate:   a bag QR code that is also a bill id
+- multiple_parents:  a child bag linked to more than one parent
+- child_overflow:    a parent with more children than its type allows (30, or 15
+                     for Mxxx-xx bags - see get_parent_bag_specs)
+- bill_counters:     linked_parent_count / total_child_bags / total_weight_kg out of
+                     line with the bill's actual bill_bag and link rows
+
+A run checks only rows changed since the previous one: new rows by id watermark
+(kept in rollup_watermark under 'integrity:<table>', advanced with the same
+settle rule as the activity rollups) and updated bags/bills by updated_at, with
+an overlap window for transactions that were still open. Open findings are
+always rechecked, so a fixed problem is resolved on the next run. Deletes that
+break bill counters without touching the bill are only seen by a full run,
+which the background checker does every INTEGRITY_FULL_CHECK_HOURS.
+
+Findings live in integrity_finding and each run in integrity_run; the page
+renders the latest of both.
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from threading import Thread, Event
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock serializing integrity runs across workers
+INTEGRITY_LOCK_ID = 700000
+
+# Updated rows are rechecked this far back, covering transactions still open at the last run
+OVERLAP = timedelta(seconds=int(os.environ.get('INTEGRITY_OVERLAP_SECONDS', '600')))
+
+# Tables whose new rows (by id) feed the incremental run
+WATERMARK_TABLES = ('bag', 'bill', 'link', 'bill_bag')
+
+# Rows changed since the last run
+_CHANGED_BAGS = "(id > :bag_lo OR updated_at >= :since)"
+_CHANGED_BILLS = "(id > :bill_lo OR updated_at >= :since)"
+
+# Per check: entity type, the keys a change can affect (incremental runs only),
+# and the violations among keys passing {where}. Violation rows are (key, details json).
+CHECKS = {
+    'duplicate_bag_qr': {
+        'entity_type': 'bag',
+        'key_cast': 'text',
+        'candidates': f"SELECT qr_id FROM bag WHERE {_CHANGED_BAGS}",
+        'where': "WHERE qr_id IN ({candidates})",
+        'sql': """
+            SELECT qr_id, json_build_object('count', COUNT(*), 'bag_ids', array_agg(id ORDER BY id))
+            FROM bag {where}
+            GROUP BY qr_id HAVING COUNT(*) > 1
+        """,
+    },
+    'duplicate_bill_id': {
+        'entity_type': 'bill',
+        'key_cast': 'text',
+        'candidates': f"SELECT bill_id FROM bill WHERE {_CHANGED_BILLS}",
+        'where': "WHERE bill_id IN ({candidates})",
+        'sql': """
+            SELECT bill_id, json_build_object('count', COUNT(*), 'bill_ids', array_agg(id ORDER BY id))
+            FROM bill {where}
+            GROUP BY bill_id HAVING COUNT(*) > 1
+        """,
+    },
+    'cross_duplicate': {
+        'entity_type': 'bag',
+        'key_cast': 'text',
+        'candidates': f"""SELECT qr_id FROM bag WHERE {_CHANGED_BAGS}
+                          UNION SELECT upper(bill_id) FROM bill WHERE {_CHANGED_BILLS}""",
+        'where': "WHERE bag.qr_id IN ({candidates})",
+        'sql': """
+            SELECT bag.qr_id, json_build_object(
+                'bags', json_agg(DISTINCT jsonb_build_object('id', bag.id, 'type', bag.type)),
+                'bill_ids', array_agg(DISTINCT bill.id))
+            FROM bag JOIN bill ON upper(bill.bill_id) = bag.qr_id
+            {where}
+            GROUP BY bag.qr_id
+        """,
+    },
+    'multiple_parents': {
+        'entity_type': 'bag',
+        'key_cast': 'integer',
+        'candidates': f"""SELECT child_bag_id FROM link WHERE id > :link_lo
+                          UNION SELECT id FROM bag WHERE type = 'child' AND {_CHANGED_BAGS}""",
+        'where': "WHERE child_bag_id IN ({candidates})",
+        'sql': """
+            SELECT child_bag_id, json_build_object('parents', COUNT(*),
+                                                   'parent_bag_ids', array_agg(parent_bag_id ORDER BY parent_bag_id))
+            FROM link {where}
+            GROUP BY child_bag_id HAVING COUNT(*) > 1
+        """,
+    },
+    'child_overflow': {
+        'entity_type': 'bag',
+        'key_cast': 'integer',
+        'candidates': f"""SELECT parent_bag_id FROM link WHERE id > :link_lo
+                          UNION SELECT id FROM bag WHERE type = 'parent' AND {_CHANGED_BAGS}""",
+        'where': "WHERE p.id IN ({candidates})",
+        'sql': r"""
+            SELECT p.id, json_build_object('qr_id', p.qr_id, 'children', COUNT(*),
+                                           'max_children', CASE WHEN upper(p.qr_id) ~ '^M\d{{3,4}}-\d+' THEN 15 ELSE 30 END)
+            FROM bag p JOIN link l ON l.parent_bag_id = p.id
+            {where}
+            GROUP BY p.id, p.qr_id
+            HAVING COUNT(*) > CASE WHEN upper(p.qr_id) ~ '^M\d{{3,4}}-\d+' THEN 15 ELSE 30 END
+        """,
+    },
+    'bill_counters': {
+        'entity_type': 'bill',
+        'key_cast': 'integer',
+        'candidates': f"""SELECT id FROM bill WHERE {_CHANGED_BILLS}
+                          UNION SELECT bill_id FROM bill_bag WHERE id > :bill_bag_lo
+                          UNION SELECT bb.bill_id FROM bill_bag bb
+                                WHERE bb.bag_id IN (SELECT parent_bag_id FROM link WHERE id > :link_lo
+                                                    UNION SELECT id FROM bag WHERE {_CHANGED_BAGS})""",
+        'where': "WHERE b.id IN ({candidates})",
+        'actual_where': "WHERE bb.bill_id IN ({candidates})",
+        'sql': """
+            WITH actual AS (
+                SELECT bb.bill_id, COUNT(DISTINCT p.id) AS parents, COUNT(DISTINCT l.child_bag_id) AS children
+                FROM bill_bag bb
+                JOIN bag p ON p.id = bb.bag_id AND p.type = 'parent'
+                LEFT JOIN link l ON l.parent_bag_id = p.id
+                {actual_where}
+                GROUP BY bb.bill_id
+            )
+            SELECT b.id, json_build_object(
+                'bill_id', b.bill_id,
+                'linked_parent_count', b.linked_parent_count, 'actual_parents', COALESCE(a.parents, 0),
+                'total_child_bags', b.total_child_bags, 'actual_children', COALESCE(a.children, 0),
+                'total_weight_kg', b.total_weight_kg)
+            FROM bill b LEFT JOIN actual a ON a.bill_id = b.id
+            {where} {conjunction} (COALESCE(b.linked_parent_count, 0) <> COALESCE(a.parents, 0)
+                   OR COALESCE(b.total_child_bags, 0) <> COALESCE(a.children, 0)
+                   OR abs(COALESCE(b.total_weight_kg, 0) - COALESCE(a.children, 0)) > 0.001)
+        """,
+    },
+}
+
+
+def _watermark_source(table: str) -> str:
+    return f"integrity:{table}"
+
+
+def _advance_watermark(conn, table: str, xmin: int) -> int:
+    """
+    Id watermark for one table. Returns lo - this run checks ids > lo, which
+    includes every row not checked by an earlier run. last_id moves up to the
+    pending id once every transaction that could still commit a lower id has finished.
+    """
+    source = _watermark_source(table)
+    conn.execute(text("""
+        INSERT INTO rollup_watermark (source, last_id, updated_at)
+        VALUES (:source, 0, NOW())
+        ON CONFLICT (source) DO NOTHING
+    """), {'source': source})
+    lo, pending_id, pending_xmax = conn.execute(text("""
+        SELECT last_id, pending_id, pending_xmax FROM rollup_watermark WHERE source = :source
+    """), {'source': source}).fetchone()
+
+    last_id = lo
+    if pending_id is not None and xmin >= pending_xmax:
+        last_id = max(last_id, pending_id)
+        pending_id = None
+    if pending_id is None:
+        max_id, pending_xmax = conn.execute(text(
+            f"SELECT MAX(id), txid_snapshot_xmax(txid_current_snapshot()) FROM {table}"
+        )).fetchone()
+        pending_id = max_id if max_id and max_id > last_id else None
+
+    conn.execute(text("""
+        UPDATE rollup_watermark
+        SET last_id = :last_id, pending_id = :pending_id, pending_xmax = :pending_xmax, updated_at = NOW()
+        WHERE source = :source
+    """), {'source': source, 'last_id': last_id, 'pending_id': pending_id,
+           'pending_xmax': pending_xmax if pending_id is not None else None})
+    return lo
+
+
+def _run_check(conn, name: str, full: bool, params: Dict, now: datetime) -> Dict:
+    """Record one check's violations and resolve its open findings that no longer hold"""
+    check = CHECKS[name]
+    where = actual_where = ''
+    if not full:
+        # Open findings are always rechecked, so fixes are seen without a full run
+        candidates = (f"{check['candidates']} UNION SELECT entity_key::{check['key_cast']} "
+                      f"FROM integrity_finding WHERE check_name = :check AND resolved_at IS NULL")
+        where = check['where'].format(candidates=candidates)
+        actual_where = check.get('actual_where', '').format(candidates=candidates)
+    violations = check['sql'].format(where=where, actual_where=actual_where,
+                                     conjunction='AND' if where else 'WHERE')
+
+    recorded = conn.execute(text(f"""
+        INSERT INTO integrity_finding (check_name, entity_type, entity_key, details, first_seen_at, last_seen_at)
+        SELECT :check, :entity_type, v.key::text, v.details::text, :now, :now
+        FROM ({violations}) AS v(key, details)
+        ON CONFLICT (check_name, entity_key) WHERE resolved_at IS NULL
+        DO UPDATE SET details = EXCLUDED.details, last_seen_at = EXCLUDED.last_seen_at
+        RETURNING (xmax = 0) AS inserted
+    """), dict(params, check=name, entity_type=check['entity_type'], now=now)).fetchall()
+
+    # Every still-open violation was just seen; anything older is fixed
+    resolved = conn.execute(text("""
+        UPDATE integrity_finding SET resolved_at = :now
+        WHERE check_name = :check AND resolved_at IS NULL AND last_seen_at < :now
+    """), {'check': name, 'now': now}).rowcount
+
+    return {'seen': len(recorded), 'new': sum(1 for row in recorded if row.inserted), 'resolved': resolved}
+
+
+def run_integrity_check(conn, full: bool = False) -> Optional[Dict]:
+    """
+    Run every check once inside conn's transaction.
+
+    Args:
+        conn: connection with an open transaction
+        full: check all rows instead of the ones changed since the last run
+              (also forced for the first run)
+
+    Returns:
+        run summary dict, or None if another worker is running a check
+    """
+    if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {'id': INTEGRITY_LOCK_ID}).scalar():
+        return None
+
+    start = time.time()
+    now = datetime.utcnow()
+    previous = conn.execute(text("SELECT MAX(started_at) FROM integrity_run")).scalar()
+    full = full or previous is None
+    since = (previous - OVERLAP) if previous else now
+
+    xmin = conn.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+    params = {'since': since}
+    for table in WATERMARK_TABLES:
+        params[f"{table}_lo"] = _advance_watermark(conn, table, xmin)
+
+    results = {name: _run_check(conn, name, full, params, now) for name in CHECKS}
+    open_findings = conn.execute(text(
+        "SELECT COUNT(*) FROM integrity_finding WHERE resolved_at IS NULL"
+    )).scalar()
+
+    summary = {
+        'mode': 'full' if full else 'incremental',
+        'started_at': now,
+        'duration_ms': round((time.time() - start) * 1000, 2),
+        'new_findings': sum(r['new'] for r in results.values()),
+        'resolved_findings': sum(r['resolved'] for r in results.values()),
+        'open_findings': open_findings,
+        'checks': results
+    }
+    conn.execute(text("""
+        INSERT INTO integrity_run (mode, started_at, finished_at, duration_ms, new_findings,
+                                   resolved_findings, open_findings)
+        VALUES (:mode, :started_at, :finished_at, :duration_ms, :new_findings, :resolved_findings, :open_findings)
+    """), dict(summary, finished_at=datetime.utcnow()))
+    return summary
+
+
+def get_integrity_report(findings_per_check: int = 50) -> Dict:
+    """
+    Latest integrity run and open findings, shaped for admin_system_integrity.html.
+    Totals come from the statistics cache, so nothing here scans bag or bill.
+    """
+    import json
+    from app import db
+    from models import StatisticsCache
+
+    last_run = db.session.execute(text("""
+        SELECT mode, started_at, finished_at, duration_ms, new_findings, resolved_findings, open_findings
+        FROM integrity_run ORDER BY started_at DESC LIMIT 1
+    """)).mappings().fetchone()
+
+    rows = db.session.execute(text("""
+        SELECT check_name, entity_key, details, first_seen_at, open_count
+        FROM (
+            SELECT check_name, entity_key, details, first_seen_at,
+                   COUNT(*) OVER (PARTITION BY check_name) AS open_count,
+                   ROW_NUMBER() OVER (PARTITION BY check_name ORDER BY first_seen_at, id) AS position
+            FROM integrity_finding
+            WHERE resolved_at IS NULL
+        ) open_findings
+        WHERE position <= :limit
+        ORDER BY check_name, position
+    """), {'limit': findings_per_check}).fetchall()
+
+    findings = {name: [] for name in CHECKS}
+    open_counts = {name: 0 for name in CHECKS}
+    for check_name, key, details, first_seen_at, open_count in rows:
+        findings[check_name].append(dict(json.loads(details or '{}'), key=key, first_seen_at=first_seen_at))
+        open_counts[check_name] = open_count
+
+    counts = StatisticsCache.get_exact_counts()
+    if counts is None:
+        counts = {
+            'total_bags': db.session.execute(text("SELECT COUNT(*) FROM bag")).scalar() or 0,
+            'total_bills': db.session.execute(text("SELECT COUNT(*) FROM bill")).scalar() or 0,
+        }
+    total_bags, total_bills = counts['total_bags'], counts['total_bills']
+
+    bag_duplicates = [{'qr_id': f['key'], 'count': f['count'], 'bags': []} for f in findings['duplicate_bag_qr']]
+    bill_duplicates = [{'bill_id': f['key'], 'count': f['count'], 'bills': []} for f in findings['duplicate_bill_id']]
+    cross_duplicates = [
+        {'qr_id': f['key'], 'bags': f['bags'], 'bills': [{'id': bill_id} for bill_id in f['bill_ids']]}
+        for f in findings['cross_duplicate']
+    ]
+    extra_bags = sum(f['count'] - 1 for f in bag_duplicates)
+    extra_bills = sum(f['count'] - 1 for f in bill_duplicates)
+
+    issues = sum(open_counts.values())
+    total_records = total_bags + total_bills
+    integrity_score = 100 if total_records == 0 else max(0, min(100, int(100 - (issues / total_records) * 100)))
+
+    return {
+        'integrity_score': integrity_score,
+        'last_run': dict(last_run) if last_run else None,
+        'summary': {
+            'total_bags': total_bags,
+            'total_bills': total_bills,
+            'unique_bag_qr_codes': total_bags - extra_bags,
+            'unique_bill_ids': total_bills - extra_bills,
+            'has_duplicates': bool(open_counts['duplicate_bag_qr'] or open_counts['duplicate_bill_id']
+                                   or open_counts['cross_duplicate']),
+            'has_issues': issues > 0,
+            'open_findings': open_counts
+        },
+        'duplicates': {
+            'bag_duplicates': bag_duplicates,
+            'bill_duplicates': bill_duplicates,
+            'cross_duplicates': cross_duplicates
+        },
+        'relationships': {
+            'multiple_parents': findings['multiple_parents'],
+            'child_overflow': findings['child_overflow'],
+            'bill_counters': findings['bill_counters']
+        }
+    }
+
+
+class IntegrityChecker:
+    """Background thread running incremental integrity checks, with a periodic full run"""
+
+    # How often changed rows are checked (seconds)
+    INTERVAL = int(os.environ.get('INTEGRITY_CHECK_INTERVAL', '300'))
+
+    # How often every row is checked (hours) - catches deletes that skip the watermarks
+    FULL_CHECK_HOURS = int(os.environ.get('INTEGRITY_FULL_CHECK_HOURS', '24'))
+
+    def __init__(self, app, db, enabled=True):
+        """
+        Initialize integrity checker
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            enabled: Whether checking is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.stop_event = Event()
+        self.run_requested = Event()
+        self.checker_thread = None
+        self.last_full_run = None
+        self.stats = {
+            'runs': 0,
+            'full_runs': 0,
+            'skipped_busy': 0,
+            'open_findings': None,
+            'last_run_ms': None,
+            'errors': 0
+        }
+
+    def start(self):
+        """Start checking in background thread"""
+        if not self.enabled:
+            logger.info("Integrity checker is disabled")
+            return
+
+        if self.checker_thread and self.checker_thread.is_alive():
+            logger.warning("Integrity checker already running")
+            return
+
+        self.stop_event.clear()
+        self.checker_thread = Thread(target=self._check_loop, daemon=True, name='integrity-checker')
+        self.checker_thread.start()
+        logger.info(f"Integrity checker started - every {self.INTERVAL}s, "
+                    f"full check every {self.FULL_CHECK_HOURS}h")
+
+    def stop(self):
+        """Stop checking"""
+        if not self.checker_thread:
+            return
+
+        self.stop_event.set()
+        self.run_requested.set()
+        self.checker_thread.join(timeout=5)
+        logger.info("Integrity checker stopped")
+
+    def _check_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.is_set():
+            try:
+                full_due = (self.last_full_run is None or
+                            time.time() - self.last_full_run >= self.FULL_CHECK_HOURS * 3600)
+                self.check_once(full=full_due)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Integrity check error: {e}")
+
+            # Wait for next tick, a requested run or stop event
+            self.run_requested.wait(self.INTERVAL)
+            self.run_requested.clear()
+
+    def request_run(self) -> bool:
+        """
+        Run a check now in the background (the admin "Check Now" button) and return
+        immediately - a first run is a full scan that can outlast a request.
+        Returns False if a requested run is already pending.
+        """
+        if self.checker_thread and self.checker_thread.is_alive():
+            if self.run_requested.is_set():
+                return False
+            self.run_requested.set()
+            return True
+
+        # No checking loop in this worker (disabled) - run once in its own thread
+        Thread(target=self._run_requested_once, daemon=True, name='integrity-check-now').start()
+        return True
+
+    def _run_requested_once(self):
+        try:
+            self.check_once()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Integrity check error: {e}")
+
+    def check_once(self, full: bool = False) -> Optional[Dict]:
+        """Run the checks once. Returns the run summary, or None if another worker holds the lock."""
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                summary = run_integrity_check(conn, full=full)
+
+        if summary is None:
+            self.stats['skipped_busy'] += 1
+            return None
+
+        self.stats['runs'] += 1
+        if summary['mode'] == 'full':
+            self.stats['full_runs'] += 1
+            self.last_full_run = time.time()
+        self.stats['open_findings'] = summary['open_findings']
+        self.stats['last_run_ms'] = summary['duration_ms']
+        if summary['new_findings']:
+            logger.warning(f"Integrity check found {summary['new_findings']} new issue(s): "
+                           f"{ {name: r['new'] for name, r in summary['checks'].items() if r['new']} }")
+        return summary
+
+    def get_stats(self) -> Dict:
+        """Get checker statistics for monitoring"""
+        return dict(self.stats, running=bool(self.checker_thread and self.checker_thread.is_alive()))
+
+
+# Global checker instance (initialized in app.py)
+integrity_checker: Optional[IntegrityChecker] = None
+
+
+def get_integrity_checker() -> Optional[IntegrityChecker]:
+    """Get the global integrity checker instance"""
+    return integrity_checker
+
+
+def init_integrity_checker(app, db, enabled=True):
+    """
+    Initialize and start the global integrity checker
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable checking (default: True)
+    """
+    global integrity_checker
+
+    integrity_checker = IntegrityChecker(app, db, enabled=enabled)
+    integrity_checker.start()
+
+    from shutdown_handler import register_cleanup_callback
+    register_cleanup_callback(integrity_checker.stop, "integrity_checker_stop")
+
+    return integrity_checker
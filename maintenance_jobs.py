@@ -0,0 +1,784 @@
+"""
+Chunked Maintenance Jobs for TraitorTrack
+Runs admin backfills and data fixes as resumable background jobs instead of one
+request-long transaction over the whole bill or bag table.
+
+A job walks its table by primary key (keyset chunks: id > cursor ORDER BY id
+LIMIT chunk_size). Each chunk runs in its own transaction, and the job's cursor
+and counters are written to maintenance_job inside that same transaction, so an
+interrupted or paused job resumes right after the last committed chunk and never
+redoes or skips rows.
+
+Between chunks the runner sleeps so that chunk transactions take at most
+max_db_share of the job's running time (0.5 = sleep as long as the chunk took),
+leaving the database to live scanning. Progress, rows/sec and ETA come from the
+counters on the job row.
+
+Registered jobs (MAINTENANCE_TASKS):
+- bill_counters: recompute linked_parent_count / total_child_bags / total_weight_kg
+  from bill_bag and link, fixing counter drift (/admin/backfill-bill-counters)
+- bill_weights:  Bill.recalculate_weights() for every bill (/admin/recalculate-bill-weights)
+- canonical_qr:  rewrite bag QR codes into canonical form, the data fix from the
+  m9n0o1p2q3r4 migration, for rows written since by out-of-date clients
+- user_data:     delete the bags a user scanned with their scans, links and bill
+  links, walking the user's scans (/admin/execute-comprehensive-deletion)
+
+Pause and cancel are status changes on the job row; the runner checks the status
+before every chunk, so they work from any worker. One job per task runs at a time
+(session advisory lock MAINTENANCE_LOCK_ID + task lock offset).
+
+Jobs run in daemon threads of the worker that started them. A queued or running
+job holds a lease (maintenance_job.lease_expires_at) that is renewed with every
+chunk. If the worker dies the lease runs out, and the reclaim thread of any live
+worker claims the job and resumes it from its stored cursor. If the original
+runner is only slow, it still holds the task's advisory lock, so the claim
+backs off.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, update
+
+logger = logging.getLogger(__name__)
+
+# Session advisory lock base - one running job per task across all workers
+MAINTENANCE_LOCK_ID = 800000
+
+# Default rows per chunk transaction
+DEFAULT_CHUNK_SIZE = int(os.environ.get('MAINTENANCE_JOB_CHUNK_SIZE', '1000'))
+
+# Default maximum fraction of running time spent inside chunk transactions
+DEFAULT_MAX_DB_SHARE = float(os.environ.get('MAINTENANCE_JOB_MAX_DB_SHARE', '0.5'))
+
+# Lease length: a queued/running job whose lease is this long overdue is stalled and
+# is claimed by a live worker (the lease is renewed with every chunk)
+STALLED_AFTER_SECONDS = int(os.environ.get('MAINTENANCE_JOB_STALLED_AFTER', '300'))
+
+# How often each worker looks for jobs with an expired lease
+RECLAIM_INTERVAL = int(os.environ.get('MAINTENANCE_JOB_RECLAIM_INTERVAL', '60'))
+
+# Per-row errors kept in the job summary
+MAX_ERRORS_KEPT = 10
+
+
+def throttle_delay(chunk_seconds: float, max_db_share: float) -> float:
+    """Seconds to sleep after a chunk so chunk time stays at most max_db_share of running time"""
+    if max_db_share >= 1 or chunk_seconds <= 0:
+        return 0.0
+    share = max(max_db_share, 0.01)
+    return chunk_seconds * (1 - share) / share
+
+
+class MaintenanceTask:
+    """
+    One kind of chunked maintenance job.
+
+    Subclasses walk the rows of `table` matching `row_filter` by id: run_chunk()
+    processes the rows with cursor < id <= last_id inside the caller's transaction
+    and returns counters. Job params are bound into row_filter and every chunk.
+    """
+
+    name = None
+    description = None
+    table = None
+    row_filter = ''
+    required_params = ()
+    lock_offset = 0
+
+    def _where(self) -> str:
+        return f"id > :cursor AND {self.row_filter}" if self.row_filter else "id > :cursor"
+
+    def next_chunk(self, session, cursor: int, chunk_size: int, params: Dict):
+        """Returns (last_id, rows) of the next keyset chunk, or (None, 0) when done"""
+        row = session.execute(text(f"""
+            SELECT MAX(id), COUNT(*) FROM (
+                SELECT id FROM {self.table} WHERE {self._where()} ORDER BY id LIMIT :limit
+            ) chunk
+        """), dict(params, cursor=cursor, limit=chunk_size)).fetchone()
+        return (row[0], row[1]) if row[0] is not None else (None, 0)
+
+    def count_remaining(self, session, cursor: int, params: Dict) -> int:
+        """Rows still to process after cursor (index-only count on the key index)"""
+        return session.execute(text(f"SELECT COUNT(*) FROM {self.table} WHERE {self._where()}"),
+                               dict(params, cursor=cursor)).scalar() or 0
+
+    def run_chunk(self, session, cursor: int, last_id: int, params: Dict) -> Dict:
+        raise NotImplementedError
+
+    def finish(self, session, summary: Dict, params: Dict):
+        """Called once after the last chunk commits"""
+
+
+# Recompute bill counters for the bills matching {bills} (a condition on b.id).
+# "old" is the pre-update row, so RETURNING can tell drift from a plain refresh.
+BILL_COUNTERS_SQL = """
+    WITH actual AS (
+        SELECT b.id AS bill_id,
+               COUNT(DISTINCT bb.bag_id) AS parents,
+               COUNT(DISTINCT l.child_bag_id) AS children
+        FROM bill b
+        LEFT JOIN bill_bag bb ON bb.bill_id = b.id
+        LEFT JOIN link l ON l.parent_bag_id = bb.bag_id
+        WHERE {bills}
+        GROUP BY b.id
+    )
+    UPDATE bill
+    SET linked_parent_count = a.parents,
+        total_child_bags = a.children,
+        total_weight_kg = a.children,
+        status = CASE WHEN a.parents > 0 AND bill.status = 'new' THEN 'processing' ELSE bill.status END
+    FROM actual a, bill old
+    WHERE bill.id = a.bill_id AND old.id = bill.id
+      AND (COALESCE(old.linked_parent_count, 0) <> a.parents
+           OR COALESCE(old.total_child_bags, 0) <> a.children
+           OR COALESCE(old.total_weight_kg, 0) <> a.children
+           OR (a.parents > 0 AND old.status = 'new'))
+    RETURNING bill.id,
+              COALESCE(old.linked_parent_count, 0) <> a.parents AS parent_drift,
+              COALESCE(old.total_child_bags, 0) <> a.children AS child_drift,
+              old.status <> bill.status AS status_changed
+"""
+
+
+class BillCountersTask(MaintenanceTask):
+    name = 'bill_counters'
+    description = 'Recompute bill parent/child counters and fix counter drift'
+    table = 'bill'
+    lock_offset = 1
+
+    def run_chunk(self, session, cursor, last_id, params):
+        # Same per-bill lock as the scan paths (100000 + bill.id), taken in id order
+        session.execute(text("""
+            SELECT pg_advisory_xact_lock(100000 + id) FROM bill
+            WHERE id > :cursor AND id <= :last_id ORDER BY id
+        """), {'cursor': cursor, 'last_id': last_id})
+
+        updated = session.execute(text(BILL_COUNTERS_SQL.format(bills="b.id > :cursor AND b.id <= :last_id")),
+                                  {'cursor': cursor, 'last_id': last_id}).fetchall()
+
+        drift = [row for row in updated if row.parent_drift]
+        if drift:
+            logger.warning(f"Bill counter drift fixed for bills {[row.id for row in drift[:10]]}")
+        return {
+            'bills_updated': len(updated),
+            'drift_fixes': len(drift),
+            'child_counts_updated': sum(1 for row in updated if row.child_drift),
+            'status_updated': sum(1 for row in updated if row.status_changed)
+        }
+
+
+class BillWeightsTask(MaintenanceTask):
+    name = 'bill_weights'
+    description = 'Recalculate weights, counters and status for every bill'
+    table = 'bill'
+    lock_offset = 2
+
+    def run_chunk(self, session, cursor, last_id, params):
+        from models import Bill
+
+        counters = {'recalculated': 0, 'errors': 0, 'error_samples': []}
+        bills = Bill.query.filter(Bill.id > cursor, Bill.id <= last_id).order_by(Bill.id).all()
+        for bill in bills:
+            # A savepoint per bill keeps one bad bill from rolling back the chunk
+            try:
+                with session.begin_nested():
+                    bill.recalculate_weights()
+                counters['recalculated'] += 1
+            except Exception as e:
+                counters['errors'] += 1
+                counters['error_samples'].append(f'Bill {bill.bill_id}: {str(e)}')
+        return counters
+
+
+class CanonicalQrTask(MaintenanceTask):
+    name = 'canonical_qr'
+    description = 'Rewrite bag QR codes into canonical form (trimmed, uppercase)'
+    table = 'bag'
+    lock_offset = 3
+
+    CANONICAL_QR = "UPPER(BTRIM(bag.qr_id))"
+
+    def run_chunk(self, session, cursor, last_id, params):
+        bounds = {'cursor': cursor, 'last_id': last_id}
+        # Same collision policy as the migration: a row whose canonical form is taken gets a _DUP_ suffix
+        renamed = session.execute(text(f"""
+            UPDATE bag SET qr_id = {self.CANONICAL_QR} || '_DUP_' || bag.id::text
+            WHERE bag.id > :cursor AND bag.id <= :last_id
+              AND bag.qr_id <> {self.CANONICAL_QR}
+              AND EXISTS (SELECT 1 FROM bag other
+                          WHERE other.qr_id = {self.CANONICAL_QR} AND other.id <> bag.id)
+            RETURNING bag.id
+        """), bounds).fetchall()
+        normalized = session.execute(text(f"""
+            UPDATE bag SET qr_id = {self.CANONICAL_QR}
+            WHERE bag.id > :cursor AND bag.id <= :last_id
+              AND bag.qr_id <> {self.CANONICAL_QR}
+            RETURNING bag.id
+        """), bounds).fetchall()
+        return {'normalized': len(normalized), 'renamed_duplicates': len(renamed)}
+
+    def finish(self, session, summary, params):
+        if summary.get('normalized') or summary.get('renamed_duplicates'):
+            from query_optimizer import bag_identity_cache
+            bag_identity_cache.invalidate()
+
+
+class UserDataTask(MaintenanceTask):
+    """
+    Deletes every bag a user scanned, with all scans, links and bill links of those
+    bags, walking the user's scans by id. Each chunk takes the bill and parent bag
+    advisory locks the scan paths use, so a live scan never sees a half-deleted
+    parent, and recounts the bills it touched before committing.
+    """
+
+    name = 'user_data'
+    description = "Delete a user's scans and the bags they scanned (the account stays)"
+    table = 'scan'
+    row_filter = 'user_id = :user_id'
+    required_params = ('user_id',)
+    lock_offset = 4
+
+    def run_chunk(self, session, cursor, last_id, params):
+        bounds = {'user_id': params['user_id'], 'cursor': cursor, 'last_id': last_id}
+        bag_ids = [row[0] for row in session.execute(text("""
+            SELECT DISTINCT bag_id FROM (
+                SELECT parent_bag_id AS bag_id FROM scan
+                WHERE user_id = :user_id AND id > :cursor AND id <= :last_id
+                UNION
+                SELECT child_bag_id FROM scan
+                WHERE user_id = :user_id AND id > :cursor AND id <= :last_id
+            ) scanned
+            WHERE bag_id IS NOT NULL
+        """), bounds)]
+
+        counters = {'scans_deleted': 0, 'bags_deleted': 0, 'links_deleted': 0,
+                    'bill_links_deleted': 0, 'bills_recounted': 0}
+        bill_ids = []
+        if bag_ids:
+            ids = {'bag_ids': bag_ids}
+            # Parents losing a child or being deleted, and the bills holding them
+            parent_ids = [row[0] for row in session.execute(text("""
+                SELECT id FROM bag WHERE id = ANY(:bag_ids) AND type = 'parent'
+                UNION
+                SELECT parent_bag_id FROM link WHERE child_bag_id = ANY(:bag_ids)
+                ORDER BY 1
+            """), ids)]
+            bill_ids = [row[0] for row in session.execute(text("""
+                SELECT DISTINCT bill_id FROM bill_bag
+                WHERE bag_id = ANY(:bag_ids) OR bag_id = ANY(:parent_ids)
+                ORDER BY 1
+            """), dict(ids, parent_ids=parent_ids))]
+
+            # Same lock ids as acquire_bill_lock / acquire_bag_lock, in id order
+            session.execute(text("SELECT pg_advisory_xact_lock(100000 + id) FROM unnest(CAST(:ids AS integer[])) id ORDER BY id"),
+                            {'ids': bill_ids})
+            session.execute(text("SELECT pg_advisory_xact_lock(200000 + id) FROM unnest(CAST(:ids AS integer[])) id ORDER BY id"),
+                            {'ids': parent_ids})
+
+            counters['scans_deleted'] += session.execute(text("""
+                DELETE FROM scan WHERE parent_bag_id = ANY(:bag_ids) OR child_bag_id = ANY(:bag_ids)
+            """), ids).rowcount
+            counters['links_deleted'] = session.execute(text("""
+                DELETE FROM link WHERE parent_bag_id = ANY(:bag_ids) OR child_bag_id = ANY(:bag_ids)
+            """), ids).rowcount
+            counters['bill_links_deleted'] = session.execute(text("""
+                DELETE FROM bill_bag WHERE bag_id = ANY(:bag_ids)
+            """), ids).rowcount
+            counters['bags_deleted'] = session.execute(text("""
+                DELETE FROM bag WHERE id = ANY(:bag_ids)
+            """), ids).rowcount
+
+        # The user's remaining scans in this range (scans without a bag)
+        counters['scans_deleted'] += session.execute(text("""
+            DELETE FROM scan WHERE user_id = :user_id AND id > :cursor AND id <= :last_id
+        """), bounds).rowcount
+
+        if bill_ids:
+            counters['bills_recounted'] = len(session.execute(
+                text(BILL_COUNTERS_SQL.format(bills="b.id = ANY(:bill_ids)")), {'bill_ids': bill_ids}
+            ).fetchall())
+        return counters
+
+    def finish(self, session, summary, params):
+        from models import StatisticsCache
+        from audit_utils import log_audit
+
+        # Counter triggers queued one delta per DELETE; fold them so the dashboard is current now
+        try:
+            StatisticsCache.fold_deltas()
+        except Exception as e:
+            logger.warning(f"Statistics fold after user data deletion failed: {e}")
+
+        if summary.get('bags_deleted'):
+            from query_optimizer import bag_identity_cache
+            bag_identity_cache.invalidate()
+
+        log_audit('comprehensive_data_delete_success', 'user', params['user_id'], dict(
+            summary, username=params.get('username'), deleted_by=params.get('deleted_by')))
+        session.commit()
+
+
+MAINTENANCE_TASKS = {task.name: task for task in (BillCountersTask(), BillWeightsTask(), CanonicalQrTask(),
+                                                   UserDataTask())}
+
+
+def _merge_counters(summary: Dict, counters: Dict):
+    for key, value in counters.items():
+        if key == 'error_samples':
+            kept = summary.setdefault('error_samples', [])
+            kept.extend(value[:MAX_ERRORS_KEPT - len(kept)])
+        else:
+            summary[key] = summary.get(key, 0) + value
+
+
+def lease_until(extra_seconds: float = 0.0) -> datetime.datetime:
+    """Expiry for a lease taken or renewed now"""
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=STALLED_AFTER_SECONDS + extra_seconds)
+
+
+def _update_job(db, job_id: str, **values):
+    """Write maintenance_job columns in their own transaction (visible immediately)"""
+    from models import MaintenanceJob
+
+    values['updated_at'] = datetime.datetime.utcnow()
+    with db.engine.begin() as conn:
+        conn.execute(MaintenanceJob.__table__.update()
+                     .where(MaintenanceJob.__table__.c.id == job_id).values(**values))
+
+
+def run_maintenance_job(db, job_id: str, reclaim: bool = False) -> str:
+    """
+    Run (or resume) one maintenance job until it completes, is paused or cancelled, or fails.
+
+    reclaim: the job was claimed after its lease expired. If the task's lock is
+    still held, the original runner is alive (just slow), so the job is left alone
+    instead of being paused.
+
+    Must be called inside an app context. Returns the job status it stopped with.
+    """
+    from models import MaintenanceJob, MaintenanceJobStatus
+
+    job = db.session.get(MaintenanceJob, job_id)
+    if not job:
+        logger.error(f"Maintenance job {job_id} not found")
+        return MaintenanceJobStatus.FAILED.value
+    if job.is_finished() or job.status == MaintenanceJobStatus.PAUSED.value:
+        return job.status
+
+    task = MAINTENANCE_TASKS.get(job.name)
+    if task is None:
+        _update_job(db, job_id, status=MaintenanceJobStatus.FAILED.value,
+                    error_message=f"Unknown maintenance job '{job.name}'",
+                    finished_at=datetime.datetime.utcnow())
+        return MaintenanceJobStatus.FAILED.value
+
+    table = MaintenanceJob.__table__
+    chunk_size = job.chunk_size or DEFAULT_CHUNK_SIZE
+    max_db_share = job.max_db_share or DEFAULT_MAX_DB_SHARE
+    cursor = job.cursor or 0
+    params = json.loads(job.params or '{}')
+    summary = json.loads(job.summary or '{}')
+    rows_processed = job.rows_processed or 0
+    started_at = job.started_at or datetime.datetime.utcnow()
+    db.session.remove()
+
+    # Held on its own connection for the whole run; released when the connection closes
+    lock_conn = db.engine.connect()
+    try:
+        lock_id = MAINTENANCE_LOCK_ID + task.lock_offset
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id}).scalar():
+            if reclaim:
+                logger.info(f"Maintenance job {job_id}: {task.name} lock still held - original runner is alive")
+                return job.status
+            logger.warning(f"Maintenance job {job_id}: another {task.name} job is running")
+            _update_job(db, job_id, status=MaintenanceJobStatus.PAUSED.value,
+                        error_message=f"Another {task.name} job is running - resume this one when it finishes")
+            return MaintenanceJobStatus.PAUSED.value
+
+        remaining = task.count_remaining(db.session, cursor, params)
+        # Only a queued job starts running - a pause that arrived meanwhile wins
+        db.session.execute(update(table).where(
+            table.c.id == job_id,
+            table.c.status.in_([MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value])
+        ).values(status=MaintenanceJobStatus.RUNNING.value, rows_total=rows_processed + remaining,
+                 error_message=None, started_at=started_at, lease_expires_at=lease_until(),
+                 updated_at=datetime.datetime.utcnow()))
+        db.session.commit()
+        logger.info(f"Maintenance job {job_id} ({task.name}) running from cursor {cursor}: "
+                    f"{remaining} rows left, chunks of {chunk_size}, max DB share {max_db_share}")
+
+        while True:
+            status = db.session.execute(text("SELECT status FROM maintenance_job WHERE id = :id"),
+                                        {'id': job_id}).scalar()
+            db.session.commit()
+            if status in (MaintenanceJobStatus.PAUSED.value, MaintenanceJobStatus.CANCELLED.value):
+                if status == MaintenanceJobStatus.CANCELLED.value:
+                    _update_job(db, job_id, finished_at=datetime.datetime.utcnow())
+                logger.info(f"Maintenance job {job_id} {status} at cursor {cursor}")
+                return status
+
+            chunk_start = time.time()
+            last_id, rows = task.next_chunk(db.session, cursor, chunk_size, params)
+            if last_id is None:
+                db.session.commit()
+                break
+
+            counters = task.run_chunk(db.session, cursor, last_id, params)
+            _merge_counters(summary, counters)
+            chunk_seconds = time.time() - chunk_start
+            delay = throttle_delay(chunk_seconds, max_db_share)
+
+            # Cursor moves in the chunk's own transaction - resume can never skip or repeat it.
+            # The lease covers the throttle sleep that follows.
+            db.session.execute(update(table).where(table.c.id == job_id).values(
+                cursor=last_id,
+                lease_expires_at=lease_until(delay),
+                rows_processed=table.c.rows_processed + rows,
+                chunks_done=table.c.chunks_done + 1,
+                db_seconds=table.c.db_seconds + chunk_seconds,
+                active_seconds=table.c.active_seconds + chunk_seconds + delay,
+                summary=json.dumps(summary),
+                updated_at=datetime.datetime.utcnow()
+            ))
+            db.session.commit()
+            cursor = last_id
+            db.session.expunge_all()
+
+            if delay:
+                time.sleep(delay)
+
+        task.finish(db.session, summary, params)
+        _update_job(db, job_id, status=MaintenanceJobStatus.COMPLETED.value,
+                    summary=json.dumps(summary), finished_at=datetime.datetime.utcnow())
+        logger.info(f"Maintenance job {job_id} ({task.name}) completed: {summary}")
+        return MaintenanceJobStatus.COMPLETED.value
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Maintenance job {job_id} ({task.name}) failed at cursor {cursor}: {e}", exc_info=True)
+        _update_job(db, job_id, status=MaintenanceJobStatus.FAILED.value,
+                    error_message=str(e)[:2000], finished_at=datetime.datetime.utcnow())
+        return MaintenanceJobStatus.FAILED.value
+    finally:
+        db.session.remove()
+        lock_conn.close()
+
+
+def create_job(db, name: str, user_id: Optional[int] = None, chunk_size: Optional[int] = None,
+               max_db_share: Optional[float] = None, params: Optional[Dict] = None):
+    """
+    Insert a queued maintenance_job row (see MaintenanceJobRunner.submit for the arguments)
+
+    Raises:
+        ValueError: unknown task, or a job for this task is already queued or running
+    """
+    from models import MaintenanceJob, MaintenanceJobStatus
+
+    if name not in MAINTENANCE_TASKS:
+        raise ValueError(f"Unknown maintenance job '{name}'")
+    missing = [key for key in MAINTENANCE_TASKS[name].required_params if key not in (params or {})]
+    if missing:
+        raise ValueError(f"Maintenance job '{name}' needs {', '.join(missing)}")
+
+    active = MaintenanceJob.query.filter(
+        MaintenanceJob.name == name,
+        MaintenanceJob.status.in_([MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value])
+    ).first()
+    if active and not is_stalled(active):
+        raise ValueError(f"A {name} job is already {active.status} ({active.id})")
+
+    job = MaintenanceJob(
+        id=str(uuid.uuid4()),
+        name=name,
+        params=json.dumps(params) if params else None,
+        user_id=user_id,
+        chunk_size=max(1, chunk_size or DEFAULT_CHUNK_SIZE),
+        max_db_share=min(max(max_db_share or DEFAULT_MAX_DB_SHARE, 0.01), 1.0),
+        lease_expires_at=lease_until(),
+        rows_processed=0,
+        chunks_done=0,
+        db_seconds=0.0,
+        active_seconds=0.0
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+class MaintenanceJobRunner:
+    """Creates maintenance jobs, runs them in background threads of this worker and
+    claims jobs whose lease has expired"""
+
+    def __init__(self, app, db):
+        """
+        Initialize maintenance job runner
+
+        Args:
+            app: Flask application (for app context in job threads)
+            db: SQLAlchemy database instance
+        """
+        self.app = app
+        self.db = db
+        self.threads: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.reclaim_thread = None
+        self.stats = {
+            'submitted': 0,
+            'resumed': 0,
+            'reclaimed': 0,
+            'completed': 0,
+            'paused': 0,
+            'failed': 0
+        }
+
+    def submit(self, name: str, user_id: Optional[int] = None, chunk_size: Optional[int] = None,
+               max_db_share: Optional[float] = None, params: Optional[Dict] = None) -> str:
+        """
+        Create a maintenance job and start it
+
+        Args:
+            name: Registered task name (see MAINTENANCE_TASKS)
+            user_id: ID of the admin who started it
+            chunk_size: Rows per chunk transaction
+            max_db_share: Maximum fraction of running time inside chunk transactions (0-1]
+            params: Task parameters (e.g. user_id for user_data), bound into every chunk
+
+        Returns:
+            Job id (uuid string)
+
+        Raises:
+            ValueError: unknown task, or a job for this task is already queued or running
+        """
+        job = create_job(self.db, name, user_id, chunk_size=chunk_size, max_db_share=max_db_share,
+                         params=params)
+        self._start(job.id)
+        self.stats['submitted'] += 1
+        logger.info(f"Maintenance job {job.id} ({name}) queued by user {user_id}")
+        return job.id
+
+    def resume(self, job_id: str) -> bool:
+        """Resume a paused, failed or stalled job from its cursor. Returns False if it cannot be resumed."""
+        from models import MaintenanceJob, MaintenanceJobStatus
+
+        job = self.db.session.get(MaintenanceJob, job_id)
+        if not job or job.status in (MaintenanceJobStatus.COMPLETED.value, MaintenanceJobStatus.CANCELLED.value):
+            return False
+        if job.status in (MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value) \
+                and not is_stalled(job):
+            return False
+
+        job.status = MaintenanceJobStatus.QUEUED.value
+        job.finished_at = None
+        job.lease_expires_at = lease_until()
+        self.db.session.commit()
+        self._start(job_id)
+        self.stats['resumed'] += 1
+        return True
+
+    def pause(self, job_id: str) -> bool:
+        """Ask a queued or running job to stop after its current chunk"""
+        from models import MaintenanceJobStatus
+        return self._set_status(job_id, MaintenanceJobStatus.PAUSED.value,
+                                (MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value))
+
+    def cancel(self, job_id: str) -> bool:
+        """Stop a job for good (committed chunks stay applied)"""
+        from models import MaintenanceJobStatus
+        cancelled = self._set_status(job_id, MaintenanceJobStatus.CANCELLED.value,
+                                     (MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value,
+                                      MaintenanceJobStatus.PAUSED.value, MaintenanceJobStatus.FAILED.value))
+        if cancelled and job_id not in self.threads:
+            _update_job(self.db, job_id, finished_at=datetime.datetime.utcnow())
+        return cancelled
+
+    def _set_status(self, job_id: str, status: str, allowed) -> bool:
+        from models import MaintenanceJob
+
+        table = MaintenanceJob.__table__
+        with self.db.engine.begin() as conn:
+            result = conn.execute(table.update()
+                                  .where(table.c.id == job_id, table.c.status.in_(allowed))
+                                  .values(status=status, updated_at=datetime.datetime.utcnow()))
+        return result.rowcount > 0
+
+    def claim_expired_jobs(self) -> List[str]:
+        """
+        Claim queued/running jobs whose lease has expired (their worker died) and
+        resume them here from their cursor. A conditional update renews the lease,
+        so only one worker claims each job.
+
+        Returns:
+            Ids of the jobs claimed
+        """
+        from models import MaintenanceJob, MaintenanceJobStatus
+
+        table = MaintenanceJob.__table__
+        active = [MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value]
+        now = datetime.datetime.utcnow()
+        claimed = []
+
+        with self.app.app_context():
+            with self.db.engine.connect() as conn:
+                expired = conn.execute(
+                    table.select().with_only_columns(table.c.id, table.c.lease_expires_at)
+                    .where(table.c.status.in_(active), table.c.lease_expires_at < now)
+                ).fetchall()
+
+            for job in expired:
+                if job.id in self.threads:
+                    continue
+                with self.db.engine.begin() as conn:
+                    won = conn.execute(
+                        table.update()
+                        .where(table.c.id == job.id, table.c.status.in_(active),
+                               table.c.lease_expires_at == job.lease_expires_at)
+                        .values(lease_expires_at=lease_until(), updated_at=now)
+                    ).rowcount
+                if won:
+                    logger.warning(f"Maintenance job {job.id}: lease expired at {job.lease_expires_at} - "
+                                   f"resuming it in this worker")
+                    self._start(job.id, reclaim=True)
+                    self.stats['reclaimed'] += 1
+                    claimed.append(job.id)
+
+        return claimed
+
+    def start(self):
+        """Start the thread that claims jobs with an expired lease"""
+        if self.reclaim_thread and self.reclaim_thread.is_alive():
+            return
+
+        self.stop_event.clear()
+        self.reclaim_thread = threading.Thread(target=self._reclaim_loop, daemon=True,
+                                               name='maintenance-job-reclaim')
+        self.reclaim_thread.start()
+        logger.info(f"Maintenance job reclaim started - checking every {RECLAIM_INTERVAL}s")
+
+    def stop(self):
+        """Stop claiming jobs (running jobs keep their threads until the worker exits)"""
+        if not self.reclaim_thread:
+            return
+
+        self.stop_event.set()
+        self.reclaim_thread.join(timeout=5)
+
+    def _reclaim_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.wait(RECLAIM_INTERVAL):
+            try:
+                self.claim_expired_jobs()
+            except Exception as e:
+                logger.error(f"Maintenance job reclaim error: {e}")
+
+    def _start(self, job_id: str, reclaim: bool = False):
+        thread = threading.Thread(target=self._run, args=(job_id, reclaim), daemon=True,
+                                  name=f'maintenance-job-{job_id[:8]}')
+        with self._lock:
+            self.threads[job_id] = thread
+        thread.start()
+
+    def _run(self, job_id: str, reclaim: bool = False):
+        try:
+            with self.app.app_context():
+                status = run_maintenance_job(self.db, job_id, reclaim=reclaim)
+            if status in self.stats:
+                self.stats[status] += 1
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"Maintenance job {job_id} thread crashed: {e}")
+        finally:
+            with self._lock:
+                self.threads.pop(job_id, None)
+
+    def get_stats(self) -> Dict:
+        """Get runner statistics for monitoring"""
+        with self._lock:
+            running = list(self.threads)
+        return dict(self.stats, running_here=running)
+
+
+def is_stalled(job) -> bool:
+    """A queued/running job whose lease has expired (e.g. its worker died)"""
+    from models import MaintenanceJobStatus
+
+    if job.status not in (MaintenanceJobStatus.QUEUED.value, MaintenanceJobStatus.RUNNING.value):
+        return False
+    if job.lease_expires_at:
+        return job.lease_expires_at < datetime.datetime.utcnow()
+    if not job.updated_at:
+        return False
+    return (datetime.datetime.utcnow() - job.updated_at).total_seconds() > STALLED_AFTER_SECONDS
+
+
+def job_status(job) -> Dict:
+    """Status payload for the polling endpoint"""
+    task = MAINTENANCE_TASKS.get(job.name)
+    active = job.active_seconds or 0
+    return {
+        'job_id': job.id,
+        'name': job.name,
+        'description': task.description if task else None,
+        'status': job.status,
+        'params': json.loads(job.params or '{}'),
+        'cursor': job.cursor,
+        'chunk_size': job.chunk_size,
+        'max_db_share': job.max_db_share,
+        'progress_pct': job.progress_pct(),
+        'rows_total': job.rows_total or 0,
+        'rows_processed': job.rows_processed or 0,
+        'chunks_done': job.chunks_done or 0,
+        'rows_per_sec': job.rows_per_sec(),
+        'eta_seconds': job.eta_seconds(),
+        'db_share': round((job.db_seconds or 0) / active, 2) if active > 0 else 0.0,
+        'stalled': is_stalled(job),
+        'summary': json.loads(job.summary or '{}'),
+        'error_message': job.error_message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+# Global runner instance (created on first use)
+maintenance_job_runner: Optional[MaintenanceJobRunner] = None
+
+
+def get_maintenance_job_runner() -> MaintenanceJobRunner:
+    """Get the global maintenance job runner, creating it on first use"""
+    global maintenance_job_runner
+
+    if maintenance_job_runner is None:
+        from app import app, db
+        maintenance_job_runner = MaintenanceJobRunner(app, db)
+
+    return maintenance_job_runner
+
+
+def init_maintenance_job_runner(app, db, enabled=True):
+    """
+    Initialize the global maintenance job runner and start claiming expired jobs
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether this worker claims jobs with an expired lease (default: True)
+    """
+    global maintenance_job_runner
+
+    if maintenance_job_runner is None:
+        maintenance_job_runner = MaintenanceJobRunner(app, db)
+    if enabled:
+        maintenance_job_runner.start()
+
+        from shutdown_handler import register_cleanup_callback
+        register_cleanup_callback(maintenance_job_runner.stop, "maintenance_job_runner_stop")
+
+    return maintenance_job_runner
@@ -23,10 +23,20 @@ if __name__ == '__main__':
             print("  downgrade  - Rollback the last migration")
             print("  current    - Show current migration version")
             print("  history    - Show migration history")
+            print("  partition-table TABLE - Convert scan or audit_log to monthly partitions (locks the table")
+            print("                       for the whole copy - run it in a maintenance window)")
+            print("  archive-scans YYYY-MM - Detach scan partitions before a month to the scan_archive schema")
+            print("  run_audit_cleanup [--no-dry-run] - Apply audit log retention (dry run by default)")
+            print("  rebuild-bill-rollup - Recompute the daily bill rollup from the bill table")
+            print("  rebuild-activity-rollup - Recompute the hourly scan/audit rollups from the raw tables")
+            print("  check-integrity [--full] - Run the data integrity checks (changed rows only unless --full)")
+            print("  run-maintenance-job NAME|JOB_ID - Run a chunked maintenance job (bill_counters, bill_weights,")
+            print("                       canonical_qr) in the foreground, or resume one by id")
             print("\nExamples:")
             print("  python manage.py init")
             print("  python manage.py migrate -m 'Add user lockout columns'")
             print("  python manage.py upgrade")
+            print("  python manage.py archive-scans 2025-01")
             sys.exit(1)
         
         command = sys.argv[1]
@@ -60,6 +70,105 @@ if __name__ == '__main__':
             print("Migration history:")
             history()
             
+        elif command == 'partition-table':
+            from scan_partitions import PARTITIONED_TABLES, partition_table
+            if len(sys.argv) < 3 or sys.argv[2] not in PARTITIONED_TABLES:
+                print(f"Usage: python manage.py partition-table {'|'.join(PARTITIONED_TABLES)}")
+                sys.exit(1)
+            table = sys.argv[2]
+            print(f"Converting {table} to monthly partitions (writes to {table} wait until this finishes)...")
+            with db.engine.begin() as conn:
+                result = partition_table(conn, table)
+            if result is None:
+                print(f"{table} is already partitioned")
+            else:
+                print(f"Partitioned {table}: {len(result['partitions'])} monthly partitions, {result['rows']} rows")
+            
+        elif command == 'archive-scans':
+            from datetime import datetime
+            from scan_partitions import detach_scan_partitions
+            if len(sys.argv) < 3:
+                print("Usage: python manage.py archive-scans YYYY-MM")
+                sys.exit(1)
+            before = datetime.strptime(sys.argv[2], '%Y-%m').date()
+            print(f"Archiving scan partitions before {before:%Y-%m}...")
+            with db.engine.begin() as conn:
+                archived = detach_scan_partitions(conn, before)
+            for partition in archived:
+                print(f"  {partition['name']}: {partition['rows']} rows")
+            print(f"Archived {len(archived)} partition(s)")
+            
+        elif command == 'run_audit_cleanup':
+            from audit_retention import run_audit_cleanup
+            run_audit_cleanup(dry_run='--no-dry-run' not in sys.argv[2:])
+            
+        elif command == 'rebuild-bill-rollup':
+            from bill_rollup import rebuild_daily_bill_rollup
+            print("Rebuilding daily bill rollup...")
+            with db.engine.begin() as conn:
+                rows = rebuild_daily_bill_rollup(conn)
+            print(f"Daily bill rollup rebuilt: {rows} rows")
+            
+        elif command == 'rebuild-activity-rollup':
+            import time
+            from activity_rollup import ActivityRollupAggregator, reset_activity_rollups
+            print("Rebuilding hourly activity rollups...")
+            with db.engine.begin() as conn:
+                reset_activity_rollups(conn)
+            aggregator = ActivityRollupAggregator(app, db)
+            # The first pass records the current max ids; later passes consume up to them
+            targets = None
+            while True:
+                result = aggregator.aggregate_once()
+                if result is None:
+                    time.sleep(1)  # The app's aggregator holds the lock
+                    continue
+                targets = targets or {source: r['last_id'] + r['lag'] for source, r in result.items()}
+                if all(result[source]['last_id'] >= target for source, target in targets.items()):
+                    break
+                if not any(r['behind'] for r in result.values()):
+                    time.sleep(1)  # Waiting for in-flight transactions to finish
+            print(f"Activity rollups rebuilt: {aggregator.stats['ids_consumed']}")
+            
+        elif command == 'check-integrity':
+            from integrity_checker import run_integrity_check
+            full = '--full' in sys.argv[2:]
+            print(f"Running {'full' if full else 'incremental'} integrity check...")
+            with db.engine.begin() as conn:
+                summary = run_integrity_check(conn, full=full)
+            if summary is None:
+                print("Another integrity check is running - try again shortly")
+                sys.exit(1)
+            for name, result in summary['checks'].items():
+                print(f"  {name}: {result['seen']} found ({result['new']} new, {result['resolved']} resolved)")
+            print(f"Integrity check complete in {summary['duration_ms']}ms: {summary['open_findings']} open findings")
+            
+        elif command == 'run-maintenance-job':
+            from maintenance_jobs import MAINTENANCE_TASKS, create_job, run_maintenance_job, job_status
+            from models import MaintenanceJob, MaintenanceJobStatus
+            if len(sys.argv) < 3:
+                print(f"Usage: python manage.py run-maintenance-job NAME|JOB_ID  (names: {', '.join(MAINTENANCE_TASKS)})")
+                sys.exit(1)
+            target = sys.argv[2]
+            if target in MAINTENANCE_TASKS:
+                job_id = create_job(db, target).id
+            else:
+                job_id = target
+                job = db.session.get(MaintenanceJob, job_id)
+                if not job:
+                    print(f"No maintenance job {job_id}")
+                    sys.exit(1)
+                if job.status in (MaintenanceJobStatus.COMPLETED.value, MaintenanceJobStatus.CANCELLED.value):
+                    print(f"Maintenance job {job_id} is already {job.status}")
+                    sys.exit(1)
+                job.status = MaintenanceJobStatus.QUEUED.value
+                db.session.commit()
+            print(f"Running maintenance job {job_id} (Ctrl+C stops it; resume with this id)...")
+            status = run_maintenance_job(db, job_id)
+            result = job_status(db.session.get(MaintenanceJob, job_id))
+            print(f"Maintenance job {status}: {result['rows_processed']}/{result['rows_total']} rows, "
+                  f"{result['chunks_done']} chunks, {result['summary']}")
+            
         else:
             print(f"Unknown command: {command}")
             print("Run 'python manage.py' to see available commands")
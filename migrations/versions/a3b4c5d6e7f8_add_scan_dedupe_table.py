@@ -0,0 +1,46 @@
+"""Create the UNLOGGED scan_dedupe table
+
+Revision ID: a3b4c5d6e7f8
+Revises: z2a3b4c5d6e7
+Create Date: 2026-04-13 09:00:00.000000
+
+The 'postgres' scan de-duplication backend (scan_dedupe.py) used to create this
+table on its first scan, which meant running DDL from request handlers. It is now
+created here. Entries live for the scan cooldown only, so the table is UNLOGGED
+(no WAL). Databases where the backend already created the table keep it.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'a3b4c5d6e7f8'
+down_revision = 'z2a3b4c5d6e7'
+branch_labels = None
+depends_on = None
+
+
+def table_exists(table):
+    """Check if a table exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_name = :table AND table_schema = 'public'
+    """), {"table": table})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not table_exists('scan_dedupe'):
+        print("Creating UNLOGGED scan_dedupe table...")
+        op.execute(text("""
+            CREATE UNLOGGED TABLE scan_dedupe (
+                scan_key VARCHAR(300) PRIMARY KEY,
+                scanned_at TIMESTAMP NOT NULL
+            )
+        """))
+    op.execute(text("CREATE INDEX IF NOT EXISTS idx_scan_dedupe_scanned_at ON scan_dedupe (scanned_at)"))
+
+
+def downgrade():
+    op.execute(text("DROP TABLE IF EXISTS scan_dedupe"))
@@ -0,0 +1,63 @@
+"""Add prefix search indexes on bag.name, bill.description and user.email
+
+Revision ID: b4c5d6e7f8a9
+Revises: a3b4c5d6e7f8
+Create Date: 2026-04-14 09:00:00.000000
+
+Search terms shorter than three characters use the prefix strategy
+(search_utils.py). It matched only the identifier, so short terms stopped finding
+bags by name. The strategy now also matches the start of the secondary column,
+served by these C-collation btree indexes on its lowercased value. Built
+CONCURRENTLY so bag (1.8M rows) stays writable.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'b4c5d6e7f8a9'
+down_revision = 'a3b4c5d6e7f8'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, definition) - same set as search_utils.SEARCH_INDEXES
+SECONDARY_PREFIX_INDEXES = [
+    ('idx_bag_name_prefix', 'bag', '((lower(name)) COLLATE "C")'),
+    ('idx_bill_description_prefix', 'bill', '((lower(description)) COLLATE "C")'),
+    ('idx_user_email_prefix', '"user"', '((lower(email)) COLLATE "C")'),
+]
+
+
+def valid_index_exists(index_name):
+    """Check if an index exists and is valid (a failed CONCURRENTLY build leaves it invalid)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = :index AND i.indisvalid
+    """), {"index": index_name})
+    return result.fetchone() is not None
+
+
+def create_index_concurrently(name, table, definition):
+    if valid_index_exists(name):
+        print(f"{name} already exists")
+        return
+    op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    print(f"Creating {name} CONCURRENTLY (non-blocking)...")
+    op.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {table} {definition}"))
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, definition in SECONDARY_PREFIX_INDEXES:
+            create_index_concurrently(name, table, definition)
+
+    print("Migration complete: secondary prefix search indexes in place")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in SECONDARY_PREFIX_INDEXES:
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
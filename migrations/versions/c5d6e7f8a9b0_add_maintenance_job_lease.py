@@ -0,0 +1,47 @@
+"""Add a lease to maintenance jobs so a live worker can resume a dead worker's job
+
+Revision ID: c5d6e7f8a9b0
+Revises: b4c5d6e7f8a9
+Create Date: 2026-04-15 09:00:00.000000
+
+Maintenance jobs run in a thread of the worker that started them. The runner now
+renews maintenance_job.lease_expires_at with every chunk. Each worker's reclaim
+thread claims queued/running jobs whose lease has expired and resumes them from
+their cursor (see maintenance_jobs.py). Jobs that are active during the upgrade
+get a lease based on their last update.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'c5d6e7f8a9b0'
+down_revision = 'b4c5d6e7f8a9'
+branch_labels = None
+depends_on = None
+
+
+def column_exists(table_name, column_name):
+    """Check if a column exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column AND table_schema = 'public'
+    """), {"table": table_name, "column": column_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not column_exists('maintenance_job', 'lease_expires_at'):
+        print("Adding maintenance_job.lease_expires_at...")
+        op.add_column('maintenance_job', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.execute(text("""
+        UPDATE maintenance_job
+        SET lease_expires_at = COALESCE(updated_at, created_at) + INTERVAL '5 minutes'
+        WHERE status IN ('queued', 'running') AND lease_expires_at IS NULL
+    """))
+
+
+def downgrade():
+    if column_exists('maintenance_job', 'lease_expires_at'):
+        op.drop_column('maintenance_job', 'lease_expires_at')
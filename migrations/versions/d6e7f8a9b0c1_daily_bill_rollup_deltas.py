@@ -0,0 +1,144 @@
+"""Append-only deltas for the daily bill rollup
+
+Revision ID: d6e7f8a9b0c1
+Revises: c5d6e7f8a9b0
+Create Date: 2026-04-16 09:00:00.000000
+
+The bill triggers used to upsert into daily_bill_rollup. Every bill write of a
+day hit the same (day, creator, status) row, so concurrent writers queued on
+that row's lock. The triggers now append to daily_bill_rollup_delta. The
+statistics folder merges the deltas into daily_bill_rollup, the same pattern as
+statistics_delta.
+
+Only the trigger function is replaced - the triggers from t6u7v8w9x0y1 keep
+their names and the rollup they maintained stays exact, so no backfill runs.
+SQL is kept self-contained here (not imported from bill_rollup.py) so the
+migration keeps working if the module changes later.
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+revision = 'd6e7f8a9b0c1'
+down_revision = 'c5d6e7f8a9b0'
+branch_labels = None
+depends_on = None
+
+
+ROLLUP_COLUMNS = "day, created_by_id, status, bill_count, parent_bags, expected_bags, child_bags, weight_kg"
+
+BILL_CONTRIBUTION = """
+    SELECT created_at::date AS day,
+           COALESCE(created_by_id, 0) AS created_by_id,
+           COALESCE(status, 'new') AS status,
+           {sign} AS bill_count,
+           {sign} * COALESCE(linked_parent_count, 0) AS parent_bags,
+           {sign} * COALESCE(parent_bag_count, 0) AS expected_bags,
+           {sign} * COALESCE(total_child_bags, 0) AS child_bags,
+           {sign} * COALESCE(total_weight_kg, 0) AS weight_kg
+    FROM {rows}
+    WHERE created_at IS NOT NULL
+"""
+
+# Net deltas of the changed rows per rollup group
+NET_CHANGES = """
+    SELECT day, created_by_id, status, SUM(bill_count) AS bill_count, SUM(parent_bags) AS parent_bags,
+           SUM(expected_bags) AS expected_bags, SUM(child_bags) AS child_bags, SUM(weight_kg) AS weight_kg
+    FROM ({changes}) changes
+    GROUP BY day, created_by_id, status
+    HAVING SUM(bill_count) <> 0 OR SUM(parent_bags) <> 0 OR SUM(expected_bags) <> 0
+        OR SUM(child_bags) <> 0 OR SUM(weight_kg) <> 0
+"""
+
+# Adds to a rollup row already holding the group (t6u7v8w9x0y1's upsert)
+ROLLUP_UPSERT = """
+    ON CONFLICT (day, created_by_id, status) DO UPDATE SET
+        bill_count = r.bill_count + EXCLUDED.bill_count,
+        parent_bags = r.parent_bags + EXCLUDED.parent_bags,
+        expected_bags = r.expected_bags + EXCLUDED.expected_bags,
+        child_bags = r.child_bags + EXCLUDED.child_bags,
+        weight_kg = r.weight_kg + EXCLUDED.weight_kg,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def delta_insert_sql(*sources):
+    return f"""
+        INSERT INTO daily_bill_rollup_delta ({ROLLUP_COLUMNS})
+        {NET_CHANGES.format(changes=" UNION ALL ".join(sources))}
+    """
+
+
+def upsert_sql(*sources):
+    return f"""
+        INSERT INTO daily_bill_rollup AS r ({ROLLUP_COLUMNS}, updated_at)
+        SELECT *, NOW() FROM ({NET_CHANGES.format(changes=" UNION ALL ".join(sources))}) net
+        ORDER BY 1, 2, 3
+        {ROLLUP_UPSERT}
+    """
+
+
+def rollup_function_sql(statement):
+    """daily_bill_rollup_apply() with statement(*sources) applied per trigger operation"""
+    added = BILL_CONTRIBUTION.format(sign=1, rows='new_rows')
+    removed = BILL_CONTRIBUTION.format(sign=-1, rows='old_rows')
+    return f"""
+        CREATE OR REPLACE FUNCTION daily_bill_rollup_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {statement(added)};
+            ELSIF TG_OP = 'DELETE' THEN
+                {statement(removed)};
+            ELSE
+                {statement(added, removed)};
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    print("  Creating daily_bill_rollup_delta table...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS daily_bill_rollup_delta (
+            id BIGSERIAL PRIMARY KEY,
+            day DATE NOT NULL,
+            created_by_id INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(20) NOT NULL,
+            bill_count INTEGER NOT NULL DEFAULT 0,
+            parent_bags INTEGER NOT NULL DEFAULT 0,
+            expected_bags INTEGER NOT NULL DEFAULT 0,
+            child_bags INTEGER NOT NULL DEFAULT 0,
+            weight_kg DOUBLE PRECISION NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NOW()
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_daily_bill_rollup_delta_day ON daily_bill_rollup_delta (day)"))
+
+    print("  Switching the bill rollup triggers to append deltas...")
+    conn.execute(text(rollup_function_sql(delta_insert_sql)))
+    print("  ✓ Bill rollup triggers append to daily_bill_rollup_delta")
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    # Back to upserting, then fold what is still pending so nothing is lost
+    conn.execute(text("LOCK TABLE bill IN SHARE MODE"))
+    conn.execute(text(rollup_function_sql(upsert_sql)))
+    conn.execute(text(f"""
+        WITH folded AS (
+            DELETE FROM daily_bill_rollup_delta
+            RETURNING {ROLLUP_COLUMNS}
+        )
+        INSERT INTO daily_bill_rollup AS r ({ROLLUP_COLUMNS}, updated_at)
+        SELECT day, created_by_id, status, SUM(bill_count), SUM(parent_bags), SUM(expected_bags),
+               SUM(child_bags), SUM(weight_kg), NOW()
+        FROM folded
+        GROUP BY day, created_by_id, status
+        {ROLLUP_UPSERT}
+    """))
+    conn.execute(text("DROP TABLE IF EXISTS daily_bill_rollup_delta"))
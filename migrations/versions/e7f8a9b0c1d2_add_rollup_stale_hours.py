@@ -0,0 +1,108 @@
+"""Rebuild activity rollup hours when scans or audit rows go away
+
+Revision ID: e7f8a9b0c1d2
+Revises: d6e7f8a9b0c1
+Create Date: 2026-04-17 09:00:00.000000
+
+scan_hourly_rollup and audit_hourly_rollup only ever grew: deleted bags and
+user data, user_id SET NULL, archived scan partitions and dropped audit
+partitions stayed counted. Statement triggers on scan and audit_log now record
+the hours a DELETE or UPDATE touched in rollup_stale_hour, and the aggregator
+recomputes those hours from the raw rows.
+
+Every hour already in the rollups is marked stale, so existing over-counts are
+repaired by the aggregator in the background; readers count stale hours from
+the raw rows meanwhile. SQL is kept self-contained here (not imported from
+activity_rollup.py) so the migration keeps working if the module changes later.
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+revision = 'e7f8a9b0c1d2'
+down_revision = 'd6e7f8a9b0c1'
+branch_labels = None
+depends_on = None
+
+
+SOURCES = {'scan': 'scan_hourly_rollup', 'audit_log': 'audit_hourly_rollup'}
+
+# Raw columns whose change moves a row to another rollup group
+GROUP_CHANGED = {
+    'scan': ("o.timestamp <> n.timestamp OR o.user_id IS DISTINCT FROM n.user_id"
+             " OR o.parent_bag_id IS DISTINCT FROM n.parent_bag_id"
+             " OR o.child_bag_id IS DISTINCT FROM n.child_bag_id"),
+    'audit_log': "o.timestamp <> n.timestamp OR o.user_id IS DISTINCT FROM n.user_id OR o.action <> n.action",
+}
+
+# (trigger name suffix, event, transition tables)
+TRIGGERS = [
+    ('delete', 'DELETE', 'OLD TABLE AS old_rows'),
+    ('update', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+]
+
+
+def stale_function_sql(source):
+    return f"""
+        CREATE OR REPLACE FUNCTION {source}_rollup_mark_stale() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO rollup_stale_hour (source, hour)
+                SELECT DISTINCT '{source}', date_trunc('hour', timestamp) FROM old_rows
+                ON CONFLICT DO NOTHING;
+            ELSE
+                INSERT INTO rollup_stale_hour (source, hour)
+                SELECT DISTINCT '{source}', date_trunc('hour', moved.timestamp)
+                FROM old_rows o
+                JOIN new_rows n ON n.id = o.id
+                CROSS JOIN LATERAL (VALUES (o.timestamp), (n.timestamp)) AS moved(timestamp)
+                WHERE {GROUP_CHANGED[source]}
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    print("  Creating rollup_stale_hour table...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS rollup_stale_hour (
+            source VARCHAR(30) NOT NULL,
+            hour TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (source, hour)
+        )
+    """))
+
+    print("  Installing stale-hour triggers on scan and audit_log...")
+    for source in SOURCES:
+        conn.execute(text(stale_function_sql(source)))
+        for suffix, event, referencing in TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{source}_rollup_{suffix} ON {source}"))
+            conn.execute(text(f"""
+                CREATE TRIGGER trg_{source}_rollup_{suffix}
+                AFTER {event} ON {source}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {source}_rollup_mark_stale()
+            """))
+
+    marked = 0
+    for source, table in SOURCES.items():
+        marked += conn.execute(text(f"""
+            INSERT INTO rollup_stale_hour (source, hour)
+            SELECT DISTINCT :source, hour FROM {table}
+            ON CONFLICT DO NOTHING
+        """), {'source': source}).rowcount
+    print(f"  ✓ {marked} existing rollup hours queued for rebuild")
+
+
+def downgrade():
+    conn = op.get_bind()
+    for source in SOURCES:
+        for suffix, _, _ in TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{source}_rollup_{suffix} ON {source}"))
+        conn.execute(text(f"DROP FUNCTION IF EXISTS {source}_rollup_mark_stale()"))
+    conn.execute(text("DROP TABLE IF EXISTS rollup_stale_hour"))
@@ -0,0 +1,80 @@
+"""Give every bag a created_at and make the column NOT NULL
+
+Revision ID: f8a9b0c1d2e3
+Revises: e7f8a9b0c1d2
+Create Date: 2026-04-18 09:00:00.000000
+
+bag.created_at only had a Python default, so bags written by the raw-SQL
+importers have created_at NULL. The keyset-paginated bag lists order by
+(created_at DESC, id DESC) and compare (created_at, id) < cursor: NULL rows sort
+first and can never be a cursor, so those lists stopped after one page.
+
+This migration:
+1. Sets DEFAULT NOW() on bag.created_at (catalog-only change)
+2. Backfills NULL created_at from updated_at (else NOW()) in committed batches,
+   so no long row-lock transaction runs while the app is serving
+3. Makes the column NOT NULL through a NOT VALID check constraint validated
+   without blocking writes, so SET NOT NULL does not rescan bag under its lock
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'f8a9b0c1d2e3'
+down_revision = 'e7f8a9b0c1d2'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH = 10000
+
+
+def column_is_nullable(table_name, column_name):
+    """Check if a column allows NULL"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT is_nullable FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column AND table_schema = 'public'
+    """), {"table": table_name, "column": column_name})
+    return result.scalar() == 'YES'
+
+
+def upgrade():
+    op.execute(text("ALTER TABLE bag ALTER COLUMN created_at SET DEFAULT NOW()"))
+
+    if not column_is_nullable('bag', 'created_at'):
+        print("bag.created_at is already NOT NULL")
+        return
+
+    print("Backfilling bag.created_at...")
+    total = 0
+    with op.get_context().autocommit_block():
+        while True:
+            # NULLs are in idx_bag_created_id, so each batch is found by index
+            updated = op.get_bind().execute(text("""
+                UPDATE bag SET created_at = COALESCE(updated_at, NOW())
+                WHERE id IN (SELECT id FROM bag WHERE created_at IS NULL LIMIT :batch)
+            """), {"batch": BACKFILL_BATCH}).rowcount
+            if not updated:
+                break
+            total += updated
+            print(f"  {total} bags backfilled")
+
+        op.execute(text("ALTER TABLE bag DROP CONSTRAINT IF EXISTS bag_created_at_not_null"))
+        op.execute(text("""
+            ALTER TABLE bag ADD CONSTRAINT bag_created_at_not_null
+            CHECK (created_at IS NOT NULL) NOT VALID
+        """))
+        # Scans bag under SHARE UPDATE EXCLUSIVE - writes keep going
+        op.execute(text("ALTER TABLE bag VALIDATE CONSTRAINT bag_created_at_not_null"))
+        # Proven by the valid constraint, so no second scan under the exclusive lock
+        op.execute(text("ALTER TABLE bag ALTER COLUMN created_at SET NOT NULL"))
+        op.execute(text("ALTER TABLE bag DROP CONSTRAINT bag_created_at_not_null"))
+
+    print(f"Migration complete: bag.created_at is NOT NULL ({total} bags backfilled)")
+
+
+def downgrade():
+    op.execute(text("ALTER TABLE bag ALTER COLUMN created_at DROP NOT NULL"))
+    op.execute(text("ALTER TABLE bag ALTER COLUMN created_at DROP DEFAULT"))
@@ -0,0 +1,227 @@
+"""Add trigger-maintained incremental counters for statistics_cache
+
+Revision ID: l8m9n0o1p2q3
+Revises: k7l8m9n0o1p2
+Create Date: 2026-01-10 09:00:00.000000
+
+Replaces full COUNT(*) refreshes of statistics_cache with incremental counters:
+1. statistics_cache - single-row counter table (re-created; gains total_links)
+2. statistics_delta - append-only per-counter deltas
+3. Statement-level AFTER INSERT/DELETE triggers on bag, scan, bill, user and link
+   (plus AFTER UPDATE on bag for type changes) that append one delta row per
+   counter per statement using transition tables, so a 10,000-row import
+   writes one delta row instead of 10,000.
+
+Deltas are folded into statistics_cache by StatisticsCache.fold_deltas()
+(see statistics_folder.py) and verified by StatisticsCache.reconcile().
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'l8m9n0o1p2q3'
+down_revision = 'k7l8m9n0o1p2'
+branch_labels = None
+depends_on = None
+
+
+# (table, counter name) pairs for tables counted as a whole
+COUNTED_TABLES = [
+    ('scan', 'total_scans'),
+    ('bill', 'total_bills'),
+    ('"user"', 'total_users'),
+    ('link', 'total_links'),
+]
+
+
+def table_exists(table_name):
+    """Check if a table exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_name = :table AND table_schema = 'public'
+    """), {"table": table_name})
+    return result.fetchone() is not None
+
+
+def column_exists(table, column):
+    """Check if a column exists in a table"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column AND table_schema = 'public'
+    """), {"table": table, "column": column})
+    return result.fetchone() is not None
+
+
+def trigger_name(table, suffix):
+    """Build trigger name, e.g. trg_scan_stats_insert (quotes stripped from "user")"""
+    bare_table = table.strip('"')
+    return f"trg_{bare_table}_stats_{suffix}"
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    if not table_exists('statistics_cache'):
+        print("Creating statistics_cache table...")
+        op.create_table('statistics_cache',
+            sa.Column('id', sa.Integer(), server_default=sa.text('1'), autoincrement=False, nullable=False),
+            sa.Column('total_bags', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('parent_bags', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('child_bags', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('total_scans', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('total_bills', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('total_users', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('total_links', sa.Integer(), server_default=sa.text('0'), nullable=True),
+            sa.Column('last_updated', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+            sa.CheckConstraint('id = 1', name='single_row'),
+            sa.PrimaryKeyConstraint('id', name='statistics_cache_pkey')
+        )
+    elif not column_exists('statistics_cache', 'total_links'):
+        op.add_column('statistics_cache', sa.Column('total_links', sa.Integer(), server_default=sa.text('0'), nullable=True))
+        print("Added statistics_cache.total_links column")
+
+    if not table_exists('statistics_delta'):
+        print("Creating statistics_delta table...")
+        op.create_table('statistics_delta',
+            sa.Column('id', sa.BigInteger(), nullable=False),
+            sa.Column('counter', sa.String(length=30), nullable=False),
+            sa.Column('delta', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.text('NOW()'), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    # Generic statement-level trigger functions (transition tables new_rows/old_rows)
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION statistics_delta_rows_inserted() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO statistics_delta (counter, delta)
+            SELECT TG_ARGV[0], COUNT(*) FROM new_rows HAVING COUNT(*) > 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION statistics_delta_rows_deleted() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO statistics_delta (counter, delta)
+            SELECT TG_ARGV[0], -COUNT(*) FROM old_rows HAVING COUNT(*) > 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+
+    # Bag-specific functions also track per-type counters (parent_bags / child_bags)
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION statistics_delta_bag_inserted() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO statistics_delta (counter, delta)
+            SELECT 'total_bags', COUNT(*) FROM new_rows HAVING COUNT(*) > 0
+            UNION ALL
+            SELECT type || '_bags', COUNT(*) FROM new_rows
+            WHERE type IN ('parent', 'child') GROUP BY type;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION statistics_delta_bag_deleted() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO statistics_delta (counter, delta)
+            SELECT 'total_bags', -COUNT(*) FROM old_rows HAVING COUNT(*) > 0
+            UNION ALL
+            SELECT type || '_bags', -COUNT(*) FROM old_rows
+            WHERE type IN ('parent', 'child') GROUP BY type;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION statistics_delta_bag_updated() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO statistics_delta (counter, delta)
+            SELECT t.type || '_bags', SUM(t.delta) FROM (
+                SELECT type, 1 AS delta FROM new_rows
+                UNION ALL
+                SELECT type, -1 AS delta FROM old_rows
+            ) t
+            WHERE t.type IN ('parent', 'child')
+            GROUP BY t.type HAVING SUM(t.delta) <> 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+
+    triggers = [
+        (trigger_name('bag', 'insert'), 'bag', 'INSERT', 'NEW TABLE AS new_rows', 'statistics_delta_bag_inserted()'),
+        (trigger_name('bag', 'delete'), 'bag', 'DELETE', 'OLD TABLE AS old_rows', 'statistics_delta_bag_deleted()'),
+        (trigger_name('bag', 'update'), 'bag', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows', 'statistics_delta_bag_updated()'),
+    ]
+    for table, counter in COUNTED_TABLES:
+        triggers.append((trigger_name(table, 'insert'), table, 'INSERT', 'NEW TABLE AS new_rows', f"statistics_delta_rows_inserted('{counter}')"))
+        triggers.append((trigger_name(table, 'delete'), table, 'DELETE', 'OLD TABLE AS old_rows', f"statistics_delta_rows_deleted('{counter}')"))
+
+    for name, table, event, referencing, function in triggers:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        conn.execute(text(f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON {table}
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}
+        """))
+        print(f"  ✅ {name}")
+
+    # Seed the counters once; from here on only deltas are applied
+    print("Seeding statistics_cache with full counts (one-time)...")
+    conn.execute(text("""
+        WITH cleared AS (
+            DELETE FROM statistics_delta RETURNING id
+        )
+        INSERT INTO statistics_cache (
+            id, total_bags, parent_bags, child_bags, total_scans,
+            total_bills, total_users, total_links, last_updated
+        )
+        SELECT
+            1,
+            (SELECT COUNT(*) FROM bag),
+            (SELECT COUNT(*) FROM bag WHERE type = 'parent'),
+            (SELECT COUNT(*) FROM bag WHERE type = 'child'),
+            (SELECT COUNT(*) FROM scan),
+            (SELECT COUNT(*) FROM bill),
+            (SELECT COUNT(*) FROM "user"),
+            (SELECT COUNT(*) FROM link),
+            NOW()
+        FROM (SELECT COUNT(*) FROM cleared) c
+        ON CONFLICT (id) DO UPDATE SET
+            total_bags = EXCLUDED.total_bags,
+            parent_bags = EXCLUDED.parent_bags,
+            child_bags = EXCLUDED.child_bags,
+            total_scans = EXCLUDED.total_scans,
+            total_bills = EXCLUDED.total_bills,
+            total_users = EXCLUDED.total_users,
+            total_links = EXCLUDED.total_links,
+            last_updated = EXCLUDED.last_updated
+    """))
+
+    print("Statistics counter migration completed")
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    for table in ['bag'] + [t for t, _ in COUNTED_TABLES]:
+        for suffix in ('insert', 'delete', 'update'):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger_name(table, suffix)} ON {table}"))
+
+    for function in ('statistics_delta_rows_inserted', 'statistics_delta_rows_deleted',
+                     'statistics_delta_bag_inserted', 'statistics_delta_bag_deleted',
+                     'statistics_delta_bag_updated'):
+        conn.execute(text(f"DROP FUNCTION IF EXISTS {function}()"))
+
+    if table_exists('statistics_delta'):
+        op.drop_table('statistics_delta')
+
+    if table_exists('statistics_cache'):
+        op.drop_table('statistics_cache')
@@ -0,0 +1,134 @@
+"""Backfill canonical QR codes and add a plain unique index on bag.qr_id
+
+Revision ID: m9n0o1p2q3r4
+Revises: l8m9n0o1p2q3
+Create Date: 2026-01-17 09:00:00.000000
+
+Every write path now stores QR codes in canonical form
+(InputValidator.normalize_qr: trimmed, uppercase), so lookups compare with plain
+equality instead of lower(qr_id)/UPPER(qr_id) expressions. This migration:
+1. Renames rows whose canonical form collides with another row (_DUP_ suffix,
+   same policy as bc112eaa12f2)
+2. Backfills canonical values in id-range batches, committing each batch so
+   the bag table is never locked for the whole backfill
+3. Creates a plain unique index on bag(qr_id) CONCURRENTLY (unless one exists)
+4. Drops idx_bag_qr_id_lower - no query uses lower(qr_id) any more
+
+Runs in the background migration thread (background_migrations.py) after the
+server starts, so the new code serves requests before the backfill is done.
+Until idx_bag_qr_id_lower is dropped (step 4, after the backfill) lookups keep
+matching lower(qr_id) - see models.canonical_qr_ids(). Idempotent: re-running
+finds no rows to update.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'm9n0o1p2q3r4'
+down_revision = 'l8m9n0o1p2q3'
+branch_labels = None
+depends_on = None
+
+
+# Rows per backfill batch (one short transaction each)
+BACKFILL_BATCH_SIZE = 10000
+
+CANONICAL_QR = "UPPER(BTRIM(qr_id))"
+
+
+def index_exists(index_name):
+    """Check if an index exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_indexes
+        WHERE indexname = :index AND schemaname = 'public'
+    """), {"index": index_name})
+    return result.fetchone() is not None
+
+
+def plain_unique_qr_index_exists():
+    """Check for a valid unique index (or constraint) on exactly bag(qr_id)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'bag'::regclass
+          AND i.indisunique AND i.indisvalid
+          AND i.indnatts = 1
+          AND i.indexprs IS NULL
+          AND i.indpred IS NULL
+          AND a.attname = 'qr_id'
+    """))
+    return result.fetchone() is not None
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    dup_count = conn.execute(text(f"""
+        SELECT COUNT(*) FROM (
+            SELECT {CANONICAL_QR} FROM bag
+            GROUP BY {CANONICAL_QR} HAVING COUNT(*) > 1
+        ) x
+    """)).scalar()
+
+    if dup_count > 0:
+        print(f"Found {dup_count} QR codes that collide after trimming, renaming...")
+        conn.execute(text(f"""
+            WITH duplicates AS (
+                SELECT
+                    id,
+                    ROW_NUMBER() OVER (PARTITION BY {CANONICAL_QR} ORDER BY created_at DESC, id DESC) as rn
+                FROM bag
+            )
+            UPDATE bag
+            SET qr_id = {CANONICAL_QR} || '_DUP_' || duplicates.id::text
+            FROM duplicates
+            WHERE bag.id = duplicates.id AND duplicates.rn > 1
+        """))
+    else:
+        print("No colliding QR codes found")
+
+    bounds = conn.execute(text("SELECT MIN(id), MAX(id) FROM bag")).fetchone()
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        if bounds[0] is not None:
+            min_id, max_id = bounds
+            normalized = 0
+            for start in range(min_id, max_id + 1, BACKFILL_BATCH_SIZE):
+                result = conn.execute(text(f"""
+                    UPDATE bag SET qr_id = {CANONICAL_QR}
+                    WHERE id >= :start AND id < :end
+                      AND qr_id <> {CANONICAL_QR}
+                """), {"start": start, "end": start + BACKFILL_BATCH_SIZE})
+                normalized += result.rowcount
+            print(f"Normalized {normalized} QR codes to canonical form")
+
+        if plain_unique_qr_index_exists():
+            print("Plain unique index on bag(qr_id) already exists")
+        else:
+            # A failed CONCURRENTLY build leaves an INVALID index behind - rebuild it
+            op.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_bag_qr_id_canonical"))
+            print("Creating unique index idx_bag_qr_id_canonical CONCURRENTLY (non-blocking)...")
+            op.execute(text("""
+                CREATE UNIQUE INDEX CONCURRENTLY idx_bag_qr_id_canonical
+                ON bag (qr_id)
+            """))
+
+        if index_exists('idx_bag_qr_id_lower'):
+            print("Dropping unused functional index idx_bag_qr_id_lower...")
+            op.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_bag_qr_id_lower"))
+
+    print("Migration complete: bag.qr_id is canonical and uniquely indexed")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_bag_qr_id_canonical"))
+        op.execute(text("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bag_qr_id_lower
+            ON bag (lower(qr_id))
+        """))
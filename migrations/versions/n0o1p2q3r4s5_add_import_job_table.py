@@ -0,0 +1,79 @@
+"""Add import_job table for background bulk imports
+
+Revision ID: n0o1p2q3r4s5
+Revises: m9n0o1p2q3r4
+Create Date: 2026-01-24 09:00:00.000000
+
+/import/batch_multi now queues uploads as import jobs that run in a process pool
+(see import_jobs.py). import_job stores each job's status, progress (for the
+rows/sec and ETA shown by the status endpoint) and the result file names.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'n0o1p2q3r4s5'
+down_revision = 'm9n0o1p2q3r4'
+branch_labels = None
+depends_on = None
+
+
+def table_exists(table_name):
+    """Check if a table exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_name = :table AND table_schema = 'public'
+    """), {"table": table_name})
+    return result.fetchone() is not None
+
+
+def index_exists(index_name):
+    """Check if an index exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_indexes WHERE indexname = :name
+    """), {"name": index_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not table_exists('import_job'):
+        print("Creating import_job table...")
+        op.create_table('import_job',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('import_type', sa.String(length=30), nullable=False),
+            sa.Column('status', sa.String(length=20), server_default='queued', nullable=False),
+            sa.Column('dispatch_area', sa.String(length=50), nullable=True),
+            sa.Column('filenames', sa.Text(), nullable=True),
+            sa.Column('files_total', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('files_done', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('current_file', sa.String(length=255), nullable=True),
+            sa.Column('progress_pct', sa.Float(), server_default='0', nullable=True),
+            sa.Column('rows_total', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('rows_processed', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('has_errors', sa.Boolean(), server_default='false', nullable=True),
+            sa.Column('error_message', sa.Text(), nullable=True),
+            sa.Column('summary', sa.Text(), nullable=True),
+            sa.Column('result_file', sa.String(length=255), nullable=True),
+            sa.Column('error_report_file', sa.String(length=255), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        print("import_job table already exists")
+
+    if not index_exists('idx_import_job_user_created'):
+        op.create_index('idx_import_job_user_created', 'import_job', ['user_id', 'created_at'], unique=False)
+    if not index_exists('idx_import_job_status'):
+        op.create_index('idx_import_job_status', 'import_job', ['status'], unique=False)
+
+
+def downgrade():
+    if table_exists('import_job'):
+        op.drop_table('import_job')
@@ -0,0 +1,64 @@
+"""Widen bag created_at indexes to (created_at, id) for keyset pagination
+
+Revision ID: o1p2q3r4s5t6
+Revises: n0o1p2q3r4s5
+Create Date: 2026-01-31 09:00:00.000000
+
+bag_management and /api/v2/bags page with (created_at, id) < cursor ORDER BY
+created_at DESC, id DESC. This migration:
+1. Creates idx_bag_created_id (created_at, id) and
+   idx_bag_type_created_id (type, created_at, id) CONCURRENTLY
+2. Drops idx_bag_created_at and idx_bag_type_created - their columns are a
+   prefix of the new indexes, so they only add write cost to bulk imports
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'o1p2q3r4s5t6'
+down_revision = 'n0o1p2q3r4s5'
+branch_labels = None
+depends_on = None
+
+
+# (new index, columns, index it replaces)
+KEYSET_INDEXES = [
+    ('idx_bag_created_id', 'created_at, id', 'idx_bag_created_at'),
+    ('idx_bag_type_created_id', 'type, created_at, id', 'idx_bag_type_created'),
+]
+
+
+def valid_index_exists(index_name):
+    """Check if an index exists and is valid (a failed CONCURRENTLY build leaves it invalid)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = :index AND i.indisvalid
+    """), {"index": index_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, columns, replaced in KEYSET_INDEXES:
+            if valid_index_exists(name):
+                print(f"{name} already exists")
+            else:
+                op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                print(f"Creating {name} CONCURRENTLY (non-blocking)...")
+                op.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON bag ({columns})"))
+
+            print(f"Dropping {replaced} (prefix of {name})...")
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {replaced}"))
+
+    print("Migration complete: bag keyset indexes in place")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bag_created_at ON bag (created_at)"))
+        op.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bag_type_created ON bag (type, created_at)"))
+        for name, _, _ in KEYSET_INDEXES:
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
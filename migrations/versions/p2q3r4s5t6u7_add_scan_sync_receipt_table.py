@@ -0,0 +1,63 @@
+"""Add scan_sync_receipt table for idempotent offline scan sync
+
+Revision ID: p2q3r4s5t6u7
+Revises: o1p2q3r4s5t6
+Create Date: 2026-02-07 09:00:00.000000
+
+/api/v2/scans/sync replays a device's offline queue in one request. Every queued
+scan carries a client-generated UUID; scan_sync_receipt records the outcome under
+that UUID (primary key) so a retried batch returns the stored result instead of
+applying the scan again.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'p2q3r4s5t6u7'
+down_revision = 'o1p2q3r4s5t6'
+branch_labels = None
+depends_on = None
+
+
+def table_exists(table_name):
+    """Check if a table exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_name = :table AND table_schema = 'public'
+    """), {"table": table_name})
+    return result.fetchone() is not None
+
+
+def index_exists(index_name):
+    """Check if an index exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_indexes WHERE indexname = :name
+    """), {"name": index_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not table_exists('scan_sync_receipt'):
+        print("Creating scan_sync_receipt table...")
+        op.create_table('scan_sync_receipt',
+            sa.Column('client_scan_id', sa.String(length=36), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('status', sa.String(length=40), nullable=False),
+            sa.Column('result', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('client_scan_id')
+        )
+    else:
+        print("scan_sync_receipt table already exists")
+
+    if not index_exists('idx_scan_sync_receipt_created'):
+        op.create_index('idx_scan_sync_receipt_created', 'scan_sync_receipt', ['created_at'], unique=False)
+
+
+def downgrade():
+    if table_exists('scan_sync_receipt'):
+        op.drop_table('scan_sync_receipt')
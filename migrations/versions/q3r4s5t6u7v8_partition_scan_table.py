@@ -0,0 +1,120 @@
+"""Convert scan to a monthly range-partitioned table
+
+Revision ID: q3r4s5t6u7v8
+Revises: p2q3r4s5t6u7
+Create Date: 2026-02-14 09:00:00.000000
+
+scan grows without bound and every dashboard/report query filters on timestamp,
+so scan becomes PARTITION BY RANGE (timestamp) with PRIMARY KEY (id, timestamp)
+(the partition key must be part of the key) and one partition per month, plus
+the scan_default safety-net partition.
+
+The conversion copies every row with scan locked, and this upgrade runs at
+startup while the app is serving scans, so it does not convert here. Run
+`python manage.py partition-table scan` (scan_partitions.partition_table) in a
+maintenance window instead; until then scan works unpartitioned. Future months
+are created by the scan partition maintainer (scan_partitions.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'q3r4s5t6u7v8'
+down_revision = 'p2q3r4s5t6u7'
+branch_labels = None
+depends_on = None
+
+
+SCAN_INDEXES = [
+    ('idx_scan_timestamp', 'timestamp'),
+    ('idx_scan_parent_bag', 'parent_bag_id'),
+    ('idx_scan_child_bag', 'child_bag_id'),
+    ('idx_scan_user', 'user_id'),
+    ('idx_scan_user_timestamp', 'user_id, timestamp DESC'),
+    ('idx_scan_timestamp_user', 'timestamp, user_id'),
+]
+
+# Statement-level statistics triggers (functions from l8m9n0o1p2q3)
+SCAN_TRIGGERS = [
+    ('trg_scan_stats_insert', 'INSERT', 'NEW TABLE AS new_rows', "statistics_delta_rows_inserted('total_scans')"),
+    ('trg_scan_stats_delete', 'DELETE', 'OLD TABLE AS old_rows', "statistics_delta_rows_deleted('total_scans')"),
+]
+
+COLUMNS = 'id, timestamp, parent_bag_id, child_bag_id, user_id'
+
+
+def is_partitioned():
+    """Check if scan is already a partitioned table"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('scan')
+    """))
+    return result.fetchone() is not None
+
+
+def detach_scan_dependents(conn, table):
+    """Drop triggers and free the schema-wide index names held by the old table"""
+    for name, _, _, _ in SCAN_TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+    for name, _ in SCAN_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    conn.execute(text("ALTER INDEX IF EXISTS scan_pkey RENAME TO scan_old_pkey"))
+
+
+def attach_scan_dependents(conn):
+    """Create indexes and statistics triggers on the new scan table"""
+    for name, columns in SCAN_INDEXES:
+        print(f"  Creating {name}...")
+        conn.execute(text(f"CREATE INDEX {name} ON scan ({columns})"))
+    for name, event, referencing, function in SCAN_TRIGGERS:
+        conn.execute(text(f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON scan
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}
+        """))
+    conn.execute(text("ANALYZE scan"))
+
+
+def upgrade():
+    if is_partitioned():
+        print("scan is already partitioned")
+        return
+
+    # Locks scan for the whole copy - never done by the startup upgrade
+    print("scan is not partitioned - convert it in a maintenance window with "
+          "'python manage.py partition-table scan'")
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    if not is_partitioned():
+        return
+
+    conn.execute(text("LOCK TABLE scan IN ACCESS EXCLUSIVE MODE"))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('scan', 'id')")).scalar() or 'scan_id_seq'
+
+    conn.execute(text("ALTER TABLE scan RENAME TO scan_partitioned"))
+    detach_scan_dependents(conn, 'scan_partitioned')
+
+    conn.execute(text(f"""
+        CREATE TABLE scan (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'::regclass),
+            timestamp TIMESTAMP WITHOUT TIME ZONE,
+            parent_bag_id INTEGER REFERENCES bag (id),
+            child_bag_id INTEGER REFERENCES bag (id),
+            user_id INTEGER REFERENCES "user" (id) ON DELETE SET NULL,
+            CONSTRAINT scan_pkey PRIMARY KEY (id)
+        )
+    """))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY scan.id"))
+    conn.execute(text(f"""
+        INSERT INTO scan ({COLUMNS})
+        SELECT id, NULLIF(timestamp, 'epoch'::timestamp), parent_bag_id, child_bag_id, user_id
+        FROM scan_partitioned
+    """))
+
+    attach_scan_dependents(conn)
+    conn.execute(text("DROP TABLE scan_partitioned CASCADE"))
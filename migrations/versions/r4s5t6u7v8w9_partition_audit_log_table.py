@@ -0,0 +1,161 @@
+"""Convert audit_log to a monthly range-partitioned table
+
+Revision ID: r4s5t6u7v8w9
+Revises: q3r4s5t6u7v8
+Create Date: 2026-02-21 09:00:00.000000
+
+Retention used to run DELETE FROM audit_log WHERE timestamp < :cutoff, which
+bloats the table, writes WAL for every row and holds locks for minutes. With
+monthly partitions retention detaches and drops whole months instead
+(audit_retention.py).
+
+This migration creates audit_log_critical - the permanent, snapshot-free copy
+of critical actions that retention fills before dropping a month.
+
+Converting audit_log itself (PARTITION BY RANGE (timestamp), PRIMARY KEY
+(id, timestamp), one partition per month plus audit_log_default, indexes,
+foreign keys and triggers recreated from the catalog) copies every row with
+audit_log locked. This upgrade runs at startup while the app is writing audit
+logs, so it does not convert here. Run `python manage.py partition-table audit_log`
+(scan_partitions.partition_table) in a maintenance window instead. Until then
+retention deletes expired rows in batches. Future months are created by the
+partition maintainer (scan_partitions.py).
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'r4s5t6u7v8w9'
+down_revision = 'q3r4s5t6u7v8'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'id, timestamp, user_id, action, entity_type, entity_id, details, before_state, after_state, ip_address, request_id'
+
+
+def table_exists(name):
+    conn = op.get_bind()
+    return conn.execute(sa.text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def is_partitioned():
+    """Check if audit_log is already a partitioned table"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('audit_log')
+    """))
+    return result.fetchone() is not None
+
+
+def capture_dependents(conn):
+    """Index, foreign key and trigger definitions of the current audit_log (besides the primary key)"""
+    indexes = conn.execute(text("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 'audit_log'::regclass AND NOT x.indisprimary
+    """)).fetchall()
+    foreign_keys = conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = 'audit_log'::regclass AND contype = 'f'
+    """)).fetchall()
+    triggers = conn.execute(text("""
+        SELECT tgname, pg_get_triggerdef(oid)
+        FROM pg_trigger
+        WHERE tgrelid = 'audit_log'::regclass AND NOT tgisinternal
+    """)).fetchall()
+    return indexes, foreign_keys, triggers
+
+
+def detach_dependents(conn, table, indexes):
+    """Free the schema-wide index and primary key names held by the old table"""
+    for name, _ in indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    primary_key = conn.execute(text("""
+        SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'
+    """), {"table": table}).scalar()
+    if primary_key:
+        conn.execute(text(f'ALTER TABLE {table} RENAME CONSTRAINT "{primary_key}" TO {table}_pkey'))
+
+
+def attach_dependents(conn, indexes, foreign_keys, triggers):
+    """Recreate captured indexes, foreign keys and triggers on the new audit_log"""
+    for name, definition in indexes:
+        print(f"  Creating {name}...")
+        # Definitions read from a partitioned table say ON ONLY; build the index on every partition
+        conn.execute(text(definition.replace(' ON ONLY ', ' ON ')))
+    for name, definition in foreign_keys:
+        conn.execute(text(f'ALTER TABLE audit_log ADD CONSTRAINT "{name}" {definition}'))
+    for name, definition in triggers:
+        conn.execute(text(definition))
+    conn.execute(text("ANALYZE audit_log"))
+
+
+def create_critical_table():
+    if table_exists('audit_log_critical'):
+        print("  audit_log_critical already exists")
+        return
+    op.create_table(
+        'audit_log_critical',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('action', sa.String(length=50), nullable=False),
+        sa.Column('entity_type', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=True),
+        sa.Column('details', sa.Text(), nullable=True),
+        sa.Column('ip_address', sa.String(length=45), nullable=True),
+        sa.Column('request_id', sa.String(length=36), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_audit_critical_timestamp', 'audit_log_critical', ['timestamp'])
+    op.create_index('idx_audit_critical_entity', 'audit_log_critical', ['entity_type', 'entity_id'])
+    print("  Created audit_log_critical")
+
+
+def upgrade():
+    create_critical_table()
+
+    if is_partitioned():
+        print("audit_log is already partitioned")
+        return
+
+    # Locks audit_log for the whole copy - never done by the startup upgrade
+    print("audit_log is not partitioned - convert it in a maintenance window with "
+          "'python manage.py partition-table audit_log'")
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    if is_partitioned():
+        conn.execute(text("LOCK TABLE audit_log IN ACCESS EXCLUSIVE MODE"))
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('audit_log', 'id')")).scalar() or 'audit_log_id_seq'
+        indexes, foreign_keys, triggers = capture_dependents(conn)
+
+        conn.execute(text("ALTER TABLE audit_log RENAME TO audit_log_partitioned"))
+        detach_dependents(conn, 'audit_log_partitioned', indexes)
+
+        conn.execute(text("CREATE TABLE audit_log (LIKE audit_log_partitioned INCLUDING DEFAULTS)"))
+        conn.execute(text("ALTER TABLE audit_log ADD CONSTRAINT audit_log_pkey PRIMARY KEY (id)"))
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY audit_log.id"))
+        conn.execute(text(f"""
+            INSERT INTO audit_log ({COLUMNS})
+            SELECT {COLUMNS} FROM audit_log_partitioned
+        """))
+
+        attach_dependents(conn, indexes, foreign_keys, triggers)
+        conn.execute(text("DROP TABLE audit_log_partitioned CASCADE"))
+
+    # Critical actions whose partitions were dropped live only here - keep the table
+    # unless it is empty
+    if table_exists('audit_log_critical'):
+        remaining = conn.execute(text("SELECT COUNT(*) FROM audit_log_critical")).scalar()
+        if remaining:
+            print(f"  Keeping audit_log_critical ({remaining} rows)")
+        else:
+            op.drop_table('audit_log_critical')
@@ -0,0 +1,56 @@
+"""Add diff-only snapshot columns to audit_log
+
+Revision ID: s5t6u7v8w9x0
+Revises: r4s5t6u7v8w9
+Create Date: 2026-02-28 09:00:00.000000
+
+New audit rows store a JSON patch between the before/after snapshots
+(audit_snapshots.py) instead of two full JSON documents:
+- state_diff: the patch as JSON text
+- state_diff_zstd: the patch zstd-compressed (large diffs, when zstandard is installed)
+- changed_keys: comma-separated keys the patch touches
+
+before_state/after_state stay for existing rows; readers handle both formats.
+Adding nullable columns without defaults is a catalog-only change, so this is
+instant even on the partitioned table.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 's5t6u7v8w9x0'
+down_revision = 'r4s5t6u7v8w9'
+branch_labels = None
+depends_on = None
+
+
+NEW_COLUMNS = [
+    ('state_diff', sa.Text()),
+    ('state_diff_zstd', sa.LargeBinary()),
+    ('changed_keys', sa.Text()),
+]
+
+
+def column_exists(column):
+    conn = op.get_bind()
+    result = conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'audit_log' AND column_name = :column
+    """), {"column": column})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    for name, column_type in NEW_COLUMNS:
+        if not column_exists(name):
+            print(f"  Adding {name} column to audit_log...")
+            op.add_column('audit_log', sa.Column(name, column_type, nullable=True))
+        else:
+            print(f"  {name} column already exists")
+
+
+def downgrade():
+    for name, _ in reversed(NEW_COLUMNS):
+        if column_exists(name):
+            op.drop_column('audit_log', name)
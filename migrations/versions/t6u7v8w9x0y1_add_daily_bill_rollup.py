@@ -0,0 +1,138 @@
+"""Add trigger-maintained daily bill rollup
+
+Revision ID: t6u7v8w9x0y1
+Revises: s5t6u7v8w9x0
+Create Date: 2026-03-07 09:00:00.000000
+
+daily_bill_rollup holds per-day bill aggregates by creator and current status.
+Statement-level triggers on bill (with transition tables) apply net deltas per
+(day, creator, status) group, so EOD summaries no longer loop over the day's
+bills (see bill_rollup.py).
+
+The migration backfills the rollup from existing bills while holding a SHARE
+lock on bill, so no change slips between the backfill and the triggers.
+
+SQL is kept self-contained here (not imported from bill_rollup.py) so the
+migration keeps working if the module changes later.
+"""
+from alembic import op
+from sqlalchemy import text
+
+
+revision = 't6u7v8w9x0y1'
+down_revision = 's5t6u7v8w9x0'
+branch_labels = None
+depends_on = None
+
+
+BILL_CONTRIBUTION = """
+    SELECT created_at::date AS day,
+           COALESCE(created_by_id, 0) AS created_by_id,
+           COALESCE(status, 'new') AS status,
+           {sign} AS bill_count,
+           {sign} * COALESCE(linked_parent_count, 0) AS parent_bags,
+           {sign} * COALESCE(parent_bag_count, 0) AS expected_bags,
+           {sign} * COALESCE(total_child_bags, 0) AS child_bags,
+           {sign} * COALESCE(total_weight_kg, 0) AS weight_kg
+    FROM {rows}
+    WHERE created_at IS NOT NULL
+"""
+
+
+def upsert_sql(*sources):
+    changes = "\n    UNION ALL\n".join(sources)
+    return f"""
+        INSERT INTO daily_bill_rollup AS r
+            (day, created_by_id, status, bill_count, parent_bags, expected_bags, child_bags, weight_kg, updated_at)
+        SELECT day, created_by_id, status, SUM(bill_count), SUM(parent_bags), SUM(expected_bags),
+               SUM(child_bags), SUM(weight_kg), NOW()
+        FROM ({changes}) changes
+        GROUP BY day, created_by_id, status
+        HAVING SUM(bill_count) <> 0 OR SUM(parent_bags) <> 0 OR SUM(expected_bags) <> 0
+            OR SUM(child_bags) <> 0 OR SUM(weight_kg) <> 0
+        ORDER BY day, created_by_id, status
+        ON CONFLICT (day, created_by_id, status) DO UPDATE SET
+            bill_count = r.bill_count + EXCLUDED.bill_count,
+            parent_bags = r.parent_bags + EXCLUDED.parent_bags,
+            expected_bags = r.expected_bags + EXCLUDED.expected_bags,
+            child_bags = r.child_bags + EXCLUDED.child_bags,
+            weight_kg = r.weight_kg + EXCLUDED.weight_kg,
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+ADDED = BILL_CONTRIBUTION.format(sign=1, rows='new_rows')
+REMOVED = BILL_CONTRIBUTION.format(sign=-1, rows='old_rows')
+
+TRIGGERS = [
+    ('trg_bill_rollup_insert', 'INSERT', 'NEW TABLE AS new_rows'),
+    ('trg_bill_rollup_update', 'UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    ('trg_bill_rollup_delete', 'DELETE', 'OLD TABLE AS old_rows'),
+]
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    print("  Creating daily_bill_rollup table...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS daily_bill_rollup (
+            day DATE NOT NULL,
+            created_by_id INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(20) NOT NULL,
+            bill_count INTEGER NOT NULL DEFAULT 0,
+            parent_bags INTEGER NOT NULL DEFAULT 0,
+            expected_bags INTEGER NOT NULL DEFAULT 0,
+            child_bags INTEGER NOT NULL DEFAULT 0,
+            weight_kg DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP WITHOUT TIME ZONE,
+            PRIMARY KEY (day, created_by_id, status)
+        )
+    """))
+
+    # Block bill writes until the triggers exist, so the backfill is exact
+    conn.execute(text("LOCK TABLE bill IN SHARE MODE"))
+
+    print("  Creating rollup triggers on bill...")
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION daily_bill_rollup_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {upsert_sql(ADDED)};
+            ELSIF TG_OP = 'DELETE' THEN
+                {upsert_sql(REMOVED)};
+            ELSE
+                {upsert_sql(ADDED, REMOVED)};
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    for name, event, referencing in TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON bill"))
+        conn.execute(text(f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON bill
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION daily_bill_rollup_apply()
+        """))
+
+    print("  Backfilling daily_bill_rollup from bill...")
+    conn.execute(text("DELETE FROM daily_bill_rollup"))
+    result = conn.execute(text(f"""
+        INSERT INTO daily_bill_rollup
+            (day, created_by_id, status, bill_count, parent_bags, expected_bags, child_bags, weight_kg, updated_at)
+        SELECT day, created_by_id, status, SUM(bill_count), SUM(parent_bags), SUM(expected_bags),
+               SUM(child_bags), SUM(weight_kg), NOW()
+        FROM ({BILL_CONTRIBUTION.format(sign=1, rows='bill')}) bills
+        GROUP BY day, created_by_id, status
+    """))
+    print(f"  ✓ {result.rowcount} rollup rows")
+
+
+def downgrade():
+    conn = op.get_bind()
+    for name, _, _ in TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON bill"))
+    conn.execute(text("DROP FUNCTION IF EXISTS daily_bill_rollup_apply()"))
+    conn.execute(text("DROP TABLE IF EXISTS daily_bill_rollup"))
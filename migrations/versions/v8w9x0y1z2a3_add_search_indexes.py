@@ -0,0 +1,91 @@
+"""Add prefix and trigram search indexes for bag, bill and user
+
+Revision ID: v8w9x0y1z2a3
+Revises: u7v8w9x0y1z2
+Create Date: 2026-03-21 09:00:00.000000
+
+Bag, bill and user search (search_utils.py) picks exact match, prefix range scan
+or trigram match per term. This migration:
+1. Installs the pg_trgm extension (skipped with a warning if the role cannot -
+   trigram search then stays an unindexed ILIKE)
+2. Creates C-collation btree indexes on qr_id, lower(bill_id) and lower(username)
+   for exact/prefix lookups
+3. Creates pg_trgm GIN indexes on the identifier and secondary columns
+   (qr_id, name, bill_id, description, username, email)
+
+All indexes are built CONCURRENTLY so bag (1.8M rows) stays writable.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'v8w9x0y1z2a3'
+down_revision = 'u7v8w9x0y1z2'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, definition) - same set as search_utils.SEARCH_INDEXES
+PREFIX_INDEXES = [
+    ('idx_bag_qr_id_prefix', 'bag', '(qr_id COLLATE "C")'),
+    ('idx_bill_bill_id_prefix', 'bill', '((lower(bill_id)) COLLATE "C")'),
+    ('idx_user_username_prefix', '"user"', '((lower(username)) COLLATE "C")'),
+]
+
+TRIGRAM_INDEXES = [
+    ('idx_bag_qr_id_trgm', 'bag', 'USING gin (qr_id gin_trgm_ops)'),
+    ('idx_bag_name_trgm', 'bag', 'USING gin (name gin_trgm_ops) WHERE name IS NOT NULL'),
+    ('idx_bill_bill_id_trgm', 'bill', 'USING gin (bill_id gin_trgm_ops)'),
+    ('idx_bill_description_trgm', 'bill', 'USING gin (description gin_trgm_ops) WHERE description IS NOT NULL'),
+    ('idx_user_username_trgm', '"user"', 'USING gin (username gin_trgm_ops)'),
+    ('idx_user_email_trgm', '"user"', 'USING gin (email gin_trgm_ops)'),
+]
+
+
+def valid_index_exists(index_name):
+    """Check if an index exists and is valid (a failed CONCURRENTLY build leaves it invalid)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = :index AND i.indisvalid
+    """), {"index": index_name})
+    return result.fetchone() is not None
+
+
+def create_index_concurrently(name, table, definition):
+    if valid_index_exists(name):
+        print(f"{name} already exists")
+        return
+    op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    print(f"Creating {name} CONCURRENTLY (non-blocking)...")
+    op.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {table} {definition}"))
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        try:
+            op.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except Exception as e:
+            print(f"⚠️  Could not install pg_trgm ({e}) - trigram indexes skipped")
+        has_trigram = conn.execute(sa.text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+        )).fetchone() is not None
+
+        for name, table, definition in PREFIX_INDEXES:
+            create_index_concurrently(name, table, definition)
+
+        if has_trigram:
+            for name, table, definition in TRIGRAM_INDEXES:
+                create_index_concurrently(name, table, definition)
+
+    print("Migration complete: search indexes in place")
+
+
+def downgrade():
+    # pg_trgm is left installed - other objects may depend on it
+    with op.get_context().autocommit_block():
+        for name, _, _ in TRIGRAM_INDEXES + PREFIX_INDEXES:
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
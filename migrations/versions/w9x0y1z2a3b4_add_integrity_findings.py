@@ -0,0 +1,99 @@
+"""Add integrity findings and runs for the incremental integrity checker
+
+Revision ID: w9x0y1z2a3b4
+Revises: v8w9x0y1z2a3
+Create Date: 2026-03-28 09:00:00.000000
+
+- integrity_finding: open/resolved violations (one open finding per check and key)
+- integrity_run: one row per checker run
+- idx_bag_updated_at / idx_bill_updated_at (CONCURRENTLY): let incremental runs
+  find updated bags and bills without scanning them
+
+The first checker run is a full check and fills the tables; progress
+watermarks go in the existing rollup_watermark table.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'w9x0y1z2a3b4'
+down_revision = 'v8w9x0y1z2a3'
+branch_labels = None
+depends_on = None
+
+
+UPDATED_AT_INDEXES = [
+    ('idx_bag_updated_at', 'bag'),
+    ('idx_bill_updated_at', 'bill'),
+]
+
+
+def valid_index_exists(index_name):
+    """Check if an index exists and is valid (a failed CONCURRENTLY build leaves it invalid)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = :index AND i.indisvalid
+    """), {"index": index_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    print("  Creating integrity_finding table...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS integrity_finding (
+            id SERIAL PRIMARY KEY,
+            check_name VARCHAR(30) NOT NULL,
+            entity_type VARCHAR(20) NOT NULL,
+            entity_key VARCHAR(255) NOT NULL,
+            details TEXT,
+            first_seen_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            last_seen_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            resolved_at TIMESTAMP WITHOUT TIME ZONE
+        )
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_integrity_finding_open
+        ON integrity_finding (check_name, entity_key) WHERE resolved_at IS NULL
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_integrity_finding_resolved ON integrity_finding (resolved_at)"))
+
+    print("  Creating integrity_run table...")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS integrity_run (
+            id SERIAL PRIMARY KEY,
+            mode VARCHAR(20) NOT NULL,
+            started_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            finished_at TIMESTAMP WITHOUT TIME ZONE,
+            duration_ms DOUBLE PRECISION,
+            new_findings INTEGER NOT NULL DEFAULT 0,
+            resolved_findings INTEGER NOT NULL DEFAULT 0,
+            open_findings INTEGER NOT NULL DEFAULT 0
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_integrity_run_started ON integrity_run (started_at)"))
+
+    with op.get_context().autocommit_block():
+        for name, table in UPDATED_AT_INDEXES:
+            if valid_index_exists(name):
+                print(f"{name} already exists")
+                continue
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            print(f"Creating {name} CONCURRENTLY (non-blocking)...")
+            op.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {table} (updated_at)"))
+
+    print("  ✓ Integrity tables created - the first checker run is a full check")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _ in UPDATED_AT_INDEXES:
+            op.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE IF EXISTS integrity_run"))
+    conn.execute(text("DROP TABLE IF EXISTS integrity_finding"))
+    conn.execute(text("DELETE FROM rollup_watermark WHERE source LIKE 'integrity:%'"))
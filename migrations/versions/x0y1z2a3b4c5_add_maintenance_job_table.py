@@ -0,0 +1,77 @@
+"""Add maintenance_job table for chunked, resumable admin backfills
+
+Revision ID: x0y1z2a3b4c5
+Revises: w9x0y1z2a3b4
+Create Date: 2026-04-04 09:00:00.000000
+
+The bill counter backfill, bill weight recalculation and the canonical QR data
+fix now run as background maintenance jobs (see maintenance_jobs.py) that commit
+one keyset chunk at a time. maintenance_job stores each job's cursor (last id
+processed, committed with its chunk), throttle settings and progress counters.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'x0y1z2a3b4c5'
+down_revision = 'w9x0y1z2a3b4'
+branch_labels = None
+depends_on = None
+
+
+def table_exists(table_name):
+    """Check if a table exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_name = :table AND table_schema = 'public'
+    """), {"table": table_name})
+    return result.fetchone() is not None
+
+
+def index_exists(index_name):
+    """Check if an index exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_indexes WHERE indexname = :name
+    """), {"name": index_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not table_exists('maintenance_job'):
+        print("Creating maintenance_job table...")
+        op.create_table('maintenance_job',
+            sa.Column('id', sa.String(length=36), nullable=False),
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('status', sa.String(length=20), server_default='queued', nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('cursor', sa.BigInteger(), nullable=True),
+            sa.Column('chunk_size', sa.Integer(), server_default='1000', nullable=False),
+            sa.Column('max_db_share', sa.Float(), server_default='0.5', nullable=False),
+            sa.Column('rows_total', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('rows_processed', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('chunks_done', sa.Integer(), server_default='0', nullable=True),
+            sa.Column('db_seconds', sa.Float(), server_default='0', nullable=True),
+            sa.Column('active_seconds', sa.Float(), server_default='0', nullable=True),
+            sa.Column('summary', sa.Text(), nullable=True),
+            sa.Column('error_message', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        print("maintenance_job table already exists")
+
+    if not index_exists('idx_maintenance_job_status'):
+        op.create_index('idx_maintenance_job_status', 'maintenance_job', ['status'], unique=False)
+    if not index_exists('idx_maintenance_job_name_created'):
+        op.create_index('idx_maintenance_job_name_created', 'maintenance_job', ['name', 'created_at'], unique=False)
+
+
+def downgrade():
+    if table_exists('maintenance_job'):
+        op.drop_table('maintenance_job')
@@ -0,0 +1,87 @@
+"""Job parameters and a scan (user_id, id) index for chunked user data deletion
+
+Revision ID: y1z2a3b4c5d6
+Revises: x0y1z2a3b4c5
+Create Date: 2026-04-11 09:00:00.000000
+
+Comprehensive user data deletion now runs as the user_data maintenance job,
+which walks one user's scans in id order.
+- maintenance_job.params: JSON task parameters (the user being deleted)
+- idx_scan_user_id on scan (user_id, id): lets each chunk read the next
+  chunk_size scans of the user straight from the index. scan is partitioned, so
+  the parent index is created ON ONLY scan and each partition's index is built
+  CONCURRENTLY and attached - scanning is never blocked.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+revision = 'y1z2a3b4c5d6'
+down_revision = 'x0y1z2a3b4c5'
+branch_labels = None
+depends_on = None
+
+
+def column_exists(table_name, column_name):
+    """Check if a column exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column AND table_schema = 'public'
+    """), {"table": table_name, "column": column_name})
+    return result.fetchone() is not None
+
+
+def valid_index_exists(index_name):
+    """Check if an index exists and is valid (a partitioned index is valid once every partition is attached)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND indisvalid
+    """), {"name": index_name})
+    return result.fetchone() is not None
+
+
+def scan_partitions():
+    """Names of scan's partitions (empty if scan is not partitioned)"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('scan')
+        ORDER BY c.relname
+    """))
+    return [row[0] for row in result]
+
+
+def upgrade():
+    if not column_exists('maintenance_job', 'params'):
+        print("Adding maintenance_job.params...")
+        op.add_column('maintenance_job', sa.Column('params', sa.Text(), nullable=True))
+
+    if valid_index_exists('idx_scan_user_id'):
+        print("idx_scan_user_id already exists")
+        return
+
+    partitions = scan_partitions()
+    with op.get_context().autocommit_block():
+        if not partitions:
+            print("Creating idx_scan_user_id CONCURRENTLY (non-blocking)...")
+            op.execute(text("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_scan_user_id ON scan (user_id, id)"))
+            return
+
+        # Invalid until every partition's index is attached
+        op.execute(text("CREATE INDEX IF NOT EXISTS idx_scan_user_id ON ONLY scan (user_id, id)"))
+        for partition in partitions:
+            index_name = f"{partition}_user_id_idx"
+            print(f"Creating {index_name} CONCURRENTLY...")
+            op.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {partition} (user_id, id)"))
+            op.execute(text(f"ALTER INDEX idx_scan_user_id ATTACH PARTITION {index_name}"))
+
+    print("Migration complete: idx_scan_user_id covers every scan partition")
+
+
+def downgrade():
+    op.execute(text("DROP INDEX IF EXISTS idx_scan_user_id"))
+    if column_exists('maintenance_job', 'params'):
+        op.drop_column('maintenance_job', 'params')
@@ -0,0 +1,41 @@
+"""Record which gunicorn worker owns each import job
+
+Revision ID: z2a3b4c5d6e7
+Revises: y1z2a3b4c5d6
+Create Date: 2026-04-12 09:00:00.000000
+
+Import jobs run in a process pool owned by one gunicorn worker. If that worker
+dies (timeout kill, OOM, restart) its queued and running jobs are never picked
+up again. import_job.worker_id ('host:pid') lets a worker starting on the same
+host see that the owner is gone and recover the job (see
+ImportJobQueue.recover_orphaned_jobs).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = 'z2a3b4c5d6e7'
+down_revision = 'y1z2a3b4c5d6'
+branch_labels = None
+depends_on = None
+
+
+def column_exists(table_name, column_name):
+    """Check if a column exists"""
+    conn = op.get_bind()
+    result = conn.execute(sa.text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = :table AND column_name = :column AND table_schema = 'public'
+    """), {"table": table_name, "column": column_name})
+    return result.fetchone() is not None
+
+
+def upgrade():
+    if not column_exists('import_job', 'worker_id'):
+        print("Adding import_job.worker_id...")
+        op.add_column('import_job', sa.Column('worker_id', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    if column_exists('import_job', 'worker_id'):
+        op.drop_column('import_job', 'worker_id')
@@ -2,7 +2,11 @@ import datetime
 import enum
 import ujson as json  # Use ujson for faster JSON parsing (3-5x faster than stdlib)
 import os
+import time
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable, PrimaryKeyConstraint
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 
@@ -141,14 +145,17 @@ class Bag(db.Model):
     dispatch_area = db.Column(db.String(30), nullable=True)  # Area for area-based access control
     status = db.Column(db.String(20), default='pending')  # pending, completed (for parent bags)
     weight_kg = db.Column(db.Float, default=0.0)  # Weight in kg (1kg per child, 30kg for full parent)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # NOT NULL with a server default so raw-SQL inserts get one too - the keyset
+    # pages (created_at, id) skip rows whose created_at is NULL
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     # Ultra-optimized indexes for lightning-fast filtering
     __table_args__ = (
         db.Index('idx_bag_qr_id', 'qr_id'),
         db.Index('idx_bag_type', 'type'),
-        db.Index('idx_bag_created_at', 'created_at'),
-        db.Index('idx_bag_type_created', 'type', 'created_at'),
+        # (created_at, id) order the keyset-paginated bag lists
+        db.Index('idx_bag_created_id', 'created_at', 'id'),
+        db.Index('idx_bag_type_created_id', 'type', 'created_at', 'id'),
         db.Index('idx_bag_name_search', 'name'),
         db.Index('idx_bag_parent_id', 'parent_id'),
         db.Index('idx_bag_user_id', 'user_id'),  # Index for user ownership queries
@@ -158,6 +165,7 @@ class Bag(db.Model):
         # Composite indexes for common filter combinations
         db.Index('idx_bag_type_area_created', 'type', 'dispatch_area', 'created_at'),
         db.Index('idx_bag_user_type', 'user_id', 'type'),  # For user's bags by type
+        db.Index('idx_bag_updated_at', 'updated_at'),  # Incremental integrity checks
         # CHECK constraint to ensure weight is non-negative
         db.CheckConstraint('weight_kg >= 0', name='check_bag_weight_non_negative'),
     )
@@ -198,24 +206,81 @@ class Bag(db.Model):
         bill_link = BillBag.query.filter_by(bag_id=self.id).first()
         return bill_link.bill if bill_link else None
     
+    @classmethod
+    def qr_match(cls, qr_id):
+        """Filter for the bag stored under qr_id (see qr_match_sql)"""
+        canonical = InputValidator.normalize_qr(qr_id)
+        if canonical_qr_ids():
+            return cls.qr_id == canonical
+        return db.func.lower(cls.qr_id) == canonical.lower()
+    
+    @classmethod
+    def qr_match_any(cls, qr_ids):
+        """Filter for the bags stored under any of qr_ids"""
+        canonical = [InputValidator.normalize_qr(qr_id) for qr_id in qr_ids]
+        if canonical_qr_ids():
+            return cls.qr_id.in_(canonical)
+        return db.func.lower(cls.qr_id).in_([qr_id.lower() for qr_id in canonical])
+    
     def __repr__(self):
         return f"<Bag {self.qr_id} ({self.type})>"
 
 
 # SQLAlchemy event listeners for automatic QR code normalization
 from sqlalchemy import event
+from validation_utils import InputValidator
+
+# Seconds between checks while legacy QR codes may still be stored
+CANONICAL_QR_RECHECK_SECONDS = 60
+
+_canonical_qr = {'ready': False, 'checked_at': 0.0}
+
+
+def canonical_qr_ids():
+    """
+    Whether every bag.qr_id is stored in canonical form.
+    
+    Migration m9n0o1p2q3r4 canonicalizes legacy QR codes in the background
+    migration thread after the server starts, and drops idx_bag_qr_id_lower as
+    its last step. Until that index is gone, lookups keep the case-insensitive
+    lower(qr_id) match (served by that index) so legacy rows are still found.
+    Databases created from the models never had the index.
+    """
+    if _canonical_qr['ready']:
+        return True
+    now = time.monotonic()
+    if now - _canonical_qr['checked_at'] < CANONICAL_QR_RECHECK_SECONDS:
+        return False
+    _canonical_qr['checked_at'] = now
+    try:
+        from sqlalchemy import text
+        if db.session.get_bind().dialect.name != 'postgresql':
+            ready = True
+        else:
+            ready = db.session.execute(text("SELECT to_regclass('idx_bag_qr_id_lower') IS NULL")).scalar()
+    except Exception:
+        return False  # The case-insensitive match is always correct
+    _canonical_qr['ready'] = bool(ready)
+    return _canonical_qr['ready']
+
+
+def qr_match_sql(column, value):
+    """SQL condition matching a qr_id column against a canonical QR code expression"""
+    if canonical_qr_ids():
+        return f"{column} = {value}"
+    return f"lower({column}) = lower({value})"
 
 @event.listens_for(Bag, 'before_insert')
 @event.listens_for(Bag, 'before_update')
 def normalize_qr_code(mapper, connection, target):
     """
-    Automatically normalize QR codes to uppercase before saving to database.
+    Automatically normalize QR codes to canonical form before saving to database.
     
-    This ensures case-insensitive uniqueness and consistent data storage.
-    Works in conjunction with the database-level unique constraint on UPPER(qr_id).
+    This ensures case-insensitive uniqueness and consistent data storage, so
+    lookups can use plain equality on the unique qr_id index.
     """
     if target.qr_id:
-        target.qr_id = target.qr_id.upper()
+        target.qr_id = InputValidator.normalize_qr(target.qr_id)
 
 
 class Link(db.Model):
@@ -304,6 +369,7 @@ class Bill(db.Model):
         db.Index('idx_bill_created', 'created_at'),
         db.Index('idx_bill_status_created', 'status', 'created_at'),
         db.Index('idx_bill_linked_count', 'linked_parent_count'),  # Fast capacity queries
+        db.Index('idx_bill_updated_at', 'updated_at'),  # Incremental integrity checks
         # CHECK constraints to ensure weights are non-negative
         db.CheckConstraint('total_weight_kg >= 0', name='check_bill_total_weight_non_negative'),
         db.CheckConstraint('expected_weight_kg >= 0', name='check_bill_expected_weight_non_negative'),
@@ -515,6 +581,77 @@ class Bill(db.Model):
         # Advisory lock automatically released when transaction commits/rolls back
         return (actual_weight, expected_weight, parent_count, child_count, is_full)
 
+
+def _install_bill_rollup_triggers(target, connection, **kw):
+    """Fresh databases (create_all) get the daily rollup triggers on bill"""
+    if connection.dialect.name == 'postgresql':
+        from bill_rollup import install_bill_rollup_triggers
+        install_bill_rollup_triggers(connection)
+
+
+event.listen(Bill.__table__, 'after_create', _install_bill_rollup_triggers)
+
+
+def _create_search_indexes(target, connection, **kw):
+    """Fresh databases (create_all) get the prefix and trigram search indexes"""
+    if connection.dialect.name == 'postgresql':
+        from search_utils import create_search_indexes
+        create_search_indexes(connection, connection.dialect.identifier_preparer.format_table(target))
+
+
+for _searchable in (User, Bag, Bill):
+    event.listen(_searchable.__table__, 'after_create', _create_search_indexes)
+
+
+class DailyBillRollup(db.Model):
+    """
+    Per-day bill aggregates by creator and current status (see bill_rollup.py).
+    Folded from DailyBillRollupDelta rows by the statistics folder - never
+    written by request code. created_by_id 0 groups bills without a (surviving)
+    creator.
+    """
+    __tablename__ = 'daily_bill_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    created_by_id = db.Column(db.Integer, primary_key=True, default=0)
+    status = db.Column(db.String(20), primary_key=True)
+    bill_count = db.Column(db.Integer, nullable=False, default=0)
+    parent_bags = db.Column(db.Integer, nullable=False, default=0)  # Linked parent bags
+    expected_bags = db.Column(db.Integer, nullable=False, default=0)  # Sum of parent_bag_count
+    child_bags = db.Column(db.Integer, nullable=False, default=0)
+    weight_kg = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DailyBillRollup {self.day} user:{self.created_by_id} {self.status}: {self.bill_count}>"
+
+
+class DailyBillRollupDelta(db.Model):
+    """
+    Append-only deltas for DailyBillRollup.
+    
+    Written by statement-level triggers on bill (one row per rollup group per
+    statement) so concurrent bill writes never update a shared rollup row.
+    Folded into daily_bill_rollup and deleted by bill_rollup.fold_bill_rollup_deltas().
+    """
+    __tablename__ = 'daily_bill_rollup_delta'
+    id = db.Column(db.BigInteger, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    created_by_id = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False)
+    bill_count = db.Column(db.Integer, nullable=False, default=0)
+    parent_bags = db.Column(db.Integer, nullable=False, default=0)
+    expected_bags = db.Column(db.Integer, nullable=False, default=0)
+    child_bags = db.Column(db.Integer, nullable=False, default=0)
+    weight_kg = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, server_default=db.func.now())
+    
+    __table_args__ = (
+        db.Index('idx_daily_bill_rollup_delta_day', 'day'),
+    )
+    
+    def __repr__(self):
+        return f"<DailyBillRollupDelta {self.day} user:{self.created_by_id} {self.status}: {self.bill_count:+d}>"
+
 class BillBag(db.Model):
     """Association model for linking bills to parent bags"""
     __tablename__ = 'bill_bag'
@@ -535,10 +672,17 @@ class BillBag(db.Model):
         return f"<BillBag Bill:{self.bill_id} -> Bag:{self.bag_id}>"
 
 class Scan(db.Model):
-    """Scan model for tracking all scanning activities"""
+    """
+    Scan model for tracking all scanning activities.
+    
+    Range-partitioned by month on timestamp (see scan_partitions.py). The ORM key
+    is id; on PostgreSQL the table's primary key is (id, timestamp), as
+    partitioning requires (see _partitioned_primary_key). Filter on timestamp
+    ranges (not DATE(timestamp)) so queries prune to the months they need.
+    """
     __tablename__ = 'scan'
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, server_default=db.func.now())
     parent_bag_id = db.Column(db.Integer, db.ForeignKey('bag.id'), nullable=True)
     child_bag_id = db.Column(db.Integer, db.ForeignKey('bag.id'), nullable=True)
     # location_id removed - no longer tracking locations
@@ -558,11 +702,56 @@ class Scan(db.Model):
         # OPTIMIZED FOR 1.8M+ BAGS: Composite indexes for common queries
         db.Index('idx_scan_user_timestamp', 'user_id', 'timestamp'),  # User's scan history
         db.Index('idx_scan_timestamp_user', 'timestamp', 'user_id'),  # Recent scans by user
+        db.Index('idx_scan_user_id', 'user_id', 'id'),  # Keyset walk over one user's scans
+        {'postgresql_partition_by': 'RANGE (timestamp)', 'info': {'partition_key': 'timestamp'}},
     )
     
     def __repr__(self):
         return f"<Scan ID:{self.id} at {self.timestamp}>"
 
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _partitioned_primary_key(constraint, compiler, **kw):
+    """
+    Partitioned tables map id as their only primary key, which is what the ORM
+    and SQLite (autoincrement) need; PostgreSQL also requires the partition
+    column in the key, so add it there.
+    """
+    partition_key = constraint.table.info.get('partition_key')
+    if partition_key and partition_key not in constraint.columns.keys():
+        columns = ', '.join(compiler.preparer.quote(c.name) for c in constraint.columns)
+        return f"PRIMARY KEY ({columns}, {compiler.preparer.quote(partition_key)})"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+@compiles(CreateTable, 'postgresql')
+def _unlogged_table(create, compiler, **kw):
+    """Tables with info['unlogged'] are created UNLOGGED on PostgreSQL (no WAL)"""
+    sql = compiler.visit_create_table(create, **kw)
+    if create.element.info.get('unlogged'):
+        sql = sql.replace('CREATE TABLE', 'CREATE UNLOGGED TABLE', 1)
+    return sql
+
+
+def _create_month_partitions(target, connection, **kw):
+    """Fresh databases (create_all) get the default and current monthly partitions"""
+    if connection.dialect.name == 'postgresql':
+        from scan_partitions import ensure_partitions
+        ensure_partitions(connection, target.name)
+
+
+event.listen(Scan.__table__, 'after_create', _create_month_partitions)
+
+
+def _install_activity_rollup_triggers(target, connection, **kw):
+    """Fresh databases (create_all) get the rollup stale-hour triggers on scan and audit_log"""
+    if connection.dialect.name == 'postgresql':
+        from activity_rollup import install_activity_rollup_triggers
+        install_activity_rollup_triggers(connection, [target.name])
+
+
+event.listen(Scan.__table__, 'after_create', _install_activity_rollup_triggers)
+
 class PromotionRequest(db.Model):
     """Model for handling admin promotion requests"""
     __tablename__ = 'promotionrequest'
@@ -586,17 +775,26 @@ class PromotionRequest(db.Model):
         return f"<PromotionRequest {self.id}: {self.requested_by.username} - {self.status}>"
 
 class AuditLog(db.Model):
-    """Model for tracking all system changes and actions with before/after snapshots"""
+    """
+    Model for tracking all system changes and actions with before/after snapshots.
+    
+    Range-partitioned by month on timestamp like scan (same id ORM key and
+    PostgreSQL (id, timestamp) primary key); retention drops whole partitions
+    (audit_retention.py) after copying critical actions to AuditLogCritical.
+    """
     __tablename__ = 'audit_log'
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, server_default=db.func.now())
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
     action = db.Column(db.String(50), nullable=False)  # e.g., 'create_bill', 'link_bag', 'delete_bill'
     entity_type = db.Column(db.String(20), nullable=False)  # e.g., 'bill', 'bag', 'link'
     entity_id = db.Column(db.Integer, nullable=True)  # ID of the affected entity
     details = db.Column(db.Text, nullable=True)  # JSON string with additional details
-    before_state = db.Column(db.Text, nullable=True)  # JSON snapshot of entity state before change
-    after_state = db.Column(db.Text, nullable=True)  # JSON snapshot of entity state after change
+    before_state = db.Column(db.Text, nullable=True)  # Legacy: full JSON snapshot before change
+    after_state = db.Column(db.Text, nullable=True)  # Legacy: full JSON snapshot after change
+    state_diff = db.Column(db.Text, nullable=True)  # JSON patch before -> after (see audit_snapshots.py)
+    state_diff_zstd = db.Column(db.LargeBinary, nullable=True)  # Same patch, zstd-compressed (large diffs)
+    changed_keys = db.Column(db.Text, nullable=True)  # Comma-separated top-level keys the patch touches
     ip_address = db.Column(db.String(45), nullable=True)  # Support IPv6
     request_id = db.Column(db.String(36), nullable=True)  # UUID from request tracking
     user = db.relationship('User', backref=db.backref('audit_logs', lazy='dynamic'))
@@ -611,16 +809,27 @@ class AuditLog(db.Model):
         db.Index('idx_audit_user_timestamp', 'user_id', 'timestamp'),  # User audit history
         db.Index('idx_audit_action_timestamp', 'action', 'timestamp'),  # Action timeline
         db.Index('idx_audit_request_id', 'request_id'),  # Request correlation
+        {'postgresql_partition_by': 'RANGE (timestamp)', 'info': {'partition_key': 'timestamp'}},
     )
     
     def __repr__(self):
         return f"<AuditLog {self.id}: {self.action} by user {self.user_id} at {self.timestamp}>"
     
+    def get_state_patch(self):
+        """Decoded snapshot patch, or None for legacy rows and rows without snapshots"""
+        from audit_snapshots import decode_state_patch
+        return decode_state_patch(self.state_diff, self.state_diff_zstd)
+    
     def get_changes(self):
         """
         Compare before and after states to identify what changed.
         Returns a dict of field: (old_value, new_value) for changed fields.
         """
+        patch = self.get_state_patch()
+        if patch is not None:
+            from audit_snapshots import patch_changes
+            return patch_changes(patch)
+        
         if not self.before_state or not self.after_state:
             return None
         
@@ -641,6 +850,160 @@ class AuditLog(db.Model):
             return None
 
 
+event.listen(AuditLog.__table__, 'after_create', _create_month_partitions)
+event.listen(AuditLog.__table__, 'after_create', _install_activity_rollup_triggers)
+
+
+class AuditLogCritical(db.Model):
+    """
+    Permanent copy of critical audit actions (deletes, role changes).
+
+    Filled by audit retention before an audit_log partition is dropped; keeps the
+    original audit_log id but not the before/after snapshots.
+    """
+    __tablename__ = 'audit_log_critical'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # audit_log.id
+    timestamp = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    action = db.Column(db.String(50), nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=True)
+    details = db.Column(db.Text, nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    request_id = db.Column(db.String(36), nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_audit_critical_timestamp', 'timestamp'),
+        db.Index('idx_audit_critical_entity', 'entity_type', 'entity_id'),
+    )
+
+    def __repr__(self):
+        return f"<AuditLogCritical {self.id}: {self.action} at {self.timestamp}>"
+
+
+class ScanHourlyRollup(db.Model):
+    """
+    Scans per hour, user and dispatch area (see activity_rollup.py).
+    Written only by the rollup aggregator; user_id 0 / dispatch_area '' mean none.
+    Hours whose scans are deleted, re-assigned or archived are rebuilt from scan
+    (see RollupStaleHour), so counts follow the live table.
+    """
+    __tablename__ = 'scan_hourly_rollup'
+    hour = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, default=0)
+    dispatch_area = db.Column(db.String(30), primary_key=True, default='')
+    scan_count = db.Column(db.Integer, nullable=False, default=0)
+    parent_scans = db.Column(db.Integer, nullable=False, default=0)
+    child_scans = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_scan_rollup_user_hour', 'user_id', 'hour'),
+    )
+
+    def __repr__(self):
+        return f"<ScanHourlyRollup {self.hour} user:{self.user_id} {self.dispatch_area}: {self.scan_count}>"
+
+
+class AuditHourlyRollup(db.Model):
+    """
+    Audit events per hour, user and action (see activity_rollup.py).
+    Written only by the rollup aggregator; hours of deleted rows and dropped
+    audit_log partitions are rebuilt from audit_log (see RollupStaleHour).
+    """
+    __tablename__ = 'audit_hourly_rollup'
+    hour = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, default=0)
+    action = db.Column(db.String(50), primary_key=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_audit_rollup_action_hour', 'action', 'hour'),
+    )
+
+    def __repr__(self):
+        return f"<AuditHourlyRollup {self.hour} user:{self.user_id} {self.action}: {self.event_count}>"
+
+
+class RollupWatermark(db.Model):
+    """
+    Aggregation progress per rollup source table. Rows with id <= last_id are in
+    the rollup; pending_id is consumed once every transaction older than
+    pending_xmax has finished. The integrity checker keeps its per-table
+    progress here too, as 'integrity:<table>'.
+    """
+    __tablename__ = 'rollup_watermark'
+    source = db.Column(db.String(30), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    pending_id = db.Column(db.BigInteger, nullable=True)
+    pending_xmax = db.Column(db.BigInteger, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"<RollupWatermark {self.source}: {self.last_id}>"
+
+
+class RollupStaleHour(db.Model):
+    """
+    Rollup hours to recompute from their raw table (source 'scan' or 'audit_log').
+    Added by statement triggers on DELETE/UPDATE and by partition detach/drop;
+    readers count these hours from the raw rows until the aggregator rebuilds them.
+    """
+    __tablename__ = 'rollup_stale_hour'
+    source = db.Column(db.String(30), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+
+    def __repr__(self):
+        return f"<RollupStaleHour {self.source} {self.hour}>"
+
+
+class IntegrityFinding(db.Model):
+    """
+    Data integrity violation found by integrity_checker.py. At most one open
+    finding (resolved_at IS NULL) per check and entity key; it is resolved by the
+    first run that no longer sees the violation.
+    """
+    __tablename__ = 'integrity_finding'
+    id = db.Column(db.Integer, primary_key=True)
+    check_name = db.Column(db.String(30), nullable=False)
+    entity_type = db.Column(db.String(20), nullable=False)
+    entity_key = db.Column(db.String(255), nullable=False)  # QR code, bill id or row id
+    details = db.Column(db.Text, nullable=True)  # JSON string describing the violation
+    first_seen_at = db.Column(db.DateTime, nullable=False)
+    last_seen_at = db.Column(db.DateTime, nullable=False)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('uq_integrity_finding_open', 'check_name', 'entity_key', unique=True,
+                 postgresql_where=db.text('resolved_at IS NULL')),
+        db.Index('idx_integrity_finding_resolved', 'resolved_at'),
+    )
+
+    def __repr__(self):
+        return f"<IntegrityFinding {self.check_name}: {self.entity_key}>"
+
+
+class IntegrityRun(db.Model):
+    """One integrity checker run (incremental or full) - the page shows the latest"""
+    __tablename__ = 'integrity_run'
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(20), nullable=False)  # incremental, full
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Float, nullable=True)
+    new_findings = db.Column(db.Integer, nullable=False, default=0)
+    resolved_findings = db.Column(db.Integer, nullable=False, default=0)
+    open_findings = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('idx_integrity_run_started', 'started_at'),
+    )
+
+    def __repr__(self):
+        return f"<IntegrityRun {self.mode} at {self.started_at}>"
+
+
 class Notification(db.Model):
     """Model for in-app user notifications"""
     __tablename__ = 'notification'
@@ -695,7 +1058,11 @@ class StatisticsCache(db.Model):
     """
     Single-row table for ultra-fast dashboard statistics caching.
     Provides sub-10ms response time for dashboard analytics.
-    Updated automatically via database triggers or on-demand refresh.
+    
+    Counters are maintained incrementally: statement-level triggers on bag, scan,
+    bill, user and link append rows to statistics_delta, and fold_deltas()
+    periodically merges them into this row. Exact counts are always
+    cache row + pending deltas, so reads never scan the big tables.
     """
     __tablename__ = 'statistics_cache'
     
@@ -706,8 +1073,13 @@ class StatisticsCache(db.Model):
     total_scans = db.Column(db.Integer, default=0)
     total_bills = db.Column(db.Integer, default=0)
     total_users = db.Column(db.Integer, default=0)
+    total_links = db.Column(db.Integer, default=0)
     last_updated = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
+    # Counter columns kept in sync with statistics_delta.counter values
+    COUNTERS = ('total_bags', 'parent_bags', 'child_bags', 'total_scans',
+                'total_bills', 'total_users', 'total_links')
+    
     def __repr__(self):
         return f"<StatisticsCache updated at {self.last_updated}>"
     
@@ -722,11 +1094,173 @@ class StatisticsCache(db.Model):
             stats = StatisticsCache.refresh_cache()
         return stats
     
+    @staticmethod
+    def get_exact_counts():
+        """
+        Get exact counts as cache row + pending (not yet folded) deltas.
+        
+        Cost is proportional to the number of unfolded delta rows (one per
+        INSERT/DELETE statement since the last fold), never to table size.
+        
+        Returns:
+            dict keyed by COUNTERS plus 'last_updated', or None if the cache
+            row has not been seeded yet (caller should fall back to live counts).
+        """
+        from sqlalchemy import text
+        
+        row = db.session.execute(text("""
+            WITH pending AS (
+                SELECT counter, SUM(delta) AS delta
+                FROM statistics_delta
+                GROUP BY counter
+            )
+            SELECT 
+                sc.total_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'total_bags'), 0),
+                sc.parent_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'parent_bags'), 0),
+                sc.child_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'child_bags'), 0),
+                sc.total_scans + COALESCE((SELECT delta FROM pending WHERE counter = 'total_scans'), 0),
+                sc.total_bills + COALESCE((SELECT delta FROM pending WHERE counter = 'total_bills'), 0),
+                sc.total_users + COALESCE((SELECT delta FROM pending WHERE counter = 'total_users'), 0),
+                sc.total_links + COALESCE((SELECT delta FROM pending WHERE counter = 'total_links'), 0),
+                sc.last_updated
+            FROM statistics_cache sc
+            WHERE sc.id = 1
+        """)).fetchone()
+        
+        if not row:
+            return None
+        
+        counts = {name: int(row[i] or 0) for i, name in enumerate(StatisticsCache.COUNTERS)}
+        counts['last_updated'] = row[7]
+        return counts
+    
+    @staticmethod
+    def fold_deltas(commit=True):
+        """
+        Merge pending statistics_delta rows into the statistics_cache row.
+        
+        The DELETE ... RETURNING and the UPDATE run as one statement, so every
+        delta is either still pending or already folded - never both. Rows from
+        transactions that commit during the fold are left for the next run.
+        
+        CONCURRENCY: Skips (returns None) if another worker holds advisory lock 300000.
+        
+        Returns:
+            Number of delta rows folded, or None if the lock was busy.
+        """
+        from sqlalchemy import text
+        
+        try:
+            acquired = db.session.execute(text("SELECT pg_try_advisory_xact_lock(300000)")).scalar()
+            if not acquired:
+                return None
+            
+            folded = db.session.execute(text("""
+                WITH folded AS (
+                    DELETE FROM statistics_delta
+                    WHERE EXISTS (SELECT 1 FROM statistics_cache WHERE id = 1)
+                    RETURNING counter, delta
+                ), sums AS (
+                    SELECT counter, SUM(delta) AS delta, COUNT(*) AS row_count
+                    FROM folded GROUP BY counter
+                ), applied AS (
+                    UPDATE statistics_cache SET
+                        total_bags = total_bags + COALESCE((SELECT delta FROM sums WHERE counter = 'total_bags'), 0),
+                        parent_bags = parent_bags + COALESCE((SELECT delta FROM sums WHERE counter = 'parent_bags'), 0),
+                        child_bags = child_bags + COALESCE((SELECT delta FROM sums WHERE counter = 'child_bags'), 0),
+                        total_scans = total_scans + COALESCE((SELECT delta FROM sums WHERE counter = 'total_scans'), 0),
+                        total_bills = total_bills + COALESCE((SELECT delta FROM sums WHERE counter = 'total_bills'), 0),
+                        total_users = total_users + COALESCE((SELECT delta FROM sums WHERE counter = 'total_users'), 0),
+                        total_links = total_links + COALESCE((SELECT delta FROM sums WHERE counter = 'total_links'), 0),
+                        last_updated = NOW()
+                    WHERE id = 1
+                    RETURNING id
+                )
+                SELECT COALESCE(SUM(row_count), 0) FROM sums WHERE EXISTS (SELECT 1 FROM applied)
+            """)).scalar()
+            
+            if commit:
+                db.session.commit()
+            return int(folded or 0)
+        except Exception:
+            if commit:
+                db.session.rollback()
+            raise
+    
+    @staticmethod
+    def reconcile(commit=True):
+        """
+        Verify counters against real COUNT(*) values and correct any drift.
+        
+        Real counts and cache + pending deltas are read in ONE statement (same
+        snapshot), so concurrent writes cannot show up as false drift. Drift is
+        corrected by appending a compensating delta row rather than rewriting
+        the cache row, so no lock is held against the fold job.
+        
+        This is the only place that scans the full tables - run it rarely
+        (see STATS_RECONCILE_INTERVAL in statistics_folder.py).
+        
+        Returns:
+            dict of counter -> drift for counters that were corrected (empty if none).
+        """
+        from sqlalchemy import text
+        
+        try:
+            row = db.session.execute(text("""
+                WITH pending AS (
+                    SELECT counter, SUM(delta) AS delta FROM statistics_delta GROUP BY counter
+                ), actual AS (
+                    SELECT 
+                        (SELECT COUNT(*) FROM bag) AS total_bags,
+                        (SELECT COUNT(*) FROM bag WHERE type = 'parent') AS parent_bags,
+                        (SELECT COUNT(*) FROM bag WHERE type = 'child') AS child_bags,
+                        (SELECT COUNT(*) FROM scan) AS total_scans,
+                        (SELECT COUNT(*) FROM bill) AS total_bills,
+                        (SELECT COUNT(*) FROM "user") AS total_users,
+                        (SELECT COUNT(*) FROM link) AS total_links
+                )
+                SELECT 
+                    a.total_bags - (sc.total_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'total_bags'), 0)),
+                    a.parent_bags - (sc.parent_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'parent_bags'), 0)),
+                    a.child_bags - (sc.child_bags + COALESCE((SELECT delta FROM pending WHERE counter = 'child_bags'), 0)),
+                    a.total_scans - (sc.total_scans + COALESCE((SELECT delta FROM pending WHERE counter = 'total_scans'), 0)),
+                    a.total_bills - (sc.total_bills + COALESCE((SELECT delta FROM pending WHERE counter = 'total_bills'), 0)),
+                    a.total_users - (sc.total_users + COALESCE((SELECT delta FROM pending WHERE counter = 'total_users'), 0)),
+                    a.total_links - (sc.total_links + COALESCE((SELECT delta FROM pending WHERE counter = 'total_links'), 0))
+                FROM actual a
+                LEFT JOIN statistics_cache sc ON sc.id = 1
+            """)).fetchone()
+            
+            if row is None or row[0] is None:
+                # Cache row missing - seed it from scratch instead
+                StatisticsCache.refresh_cache(commit=commit)
+                return {}
+            
+            drift = {name: int(row[i]) for i, name in enumerate(StatisticsCache.COUNTERS) if row[i]}
+            
+            for counter, delta in drift.items():
+                db.session.execute(
+                    text("INSERT INTO statistics_delta (counter, delta) VALUES (:counter, :delta)"),
+                    {'counter': counter, 'delta': delta}
+                )
+            
+            if drift:
+                import logging
+                logging.warning(f"Statistics counter drift corrected: {drift}")
+            
+            if commit:
+                db.session.commit()
+            return drift
+        except Exception:
+            if commit:
+                db.session.rollback()
+            raise
+    
     @staticmethod
     def refresh_cache(commit=True):
         """
-        Recalculate and update all statistics in cache.
-        This is called by database triggers or can be manually invoked.
+        Recalculate all statistics from scratch and discard pending deltas.
+        Used to seed the cache row; day-to-day maintenance is fold_deltas().
         
         Args:
             commit: If True, commits the changes immediately. If False, caller must commit.
@@ -739,6 +1273,8 @@ class StatisticsCache(db.Model):
         CONCURRENCY: Uses PostgreSQL advisory lock (ID 300000) to prevent concurrent refreshes.
         Only one refresh operation can run at a time across all workers/processes.
         Advisory lock is automatically released on transaction commit or rollback.
+        Counts and the cleared deltas come from the same statement snapshot, so
+        writes committing concurrently are neither lost nor double-counted.
         """
         from sqlalchemy import text
         
@@ -748,29 +1284,64 @@ class StatisticsCache(db.Model):
             # pg_advisory_xact_lock automatically releases on transaction end (commit/rollback)
             db.session.execute(text("SELECT pg_advisory_xact_lock(300000)"))
             
-            stats = StatisticsCache.query.first()
-            if not stats:
-                stats = StatisticsCache()
-                stats.id = 1
-                db.session.add(stats)
-            
-            stats.total_bags = Bag.query.count()
-            stats.parent_bags = Bag.query.filter_by(type=BagType.PARENT.value).count()
-            stats.child_bags = Bag.query.filter_by(type=BagType.CHILD.value).count()
-            stats.total_scans = Scan.query.count()
-            stats.total_bills = Bill.query.count()
-            stats.total_users = User.query.count()
-            stats.last_updated = datetime.datetime.utcnow()
+            db.session.execute(text("""
+                WITH cleared AS (
+                    DELETE FROM statistics_delta RETURNING id
+                )
+                INSERT INTO statistics_cache (
+                    id, total_bags, parent_bags, child_bags, total_scans,
+                    total_bills, total_users, total_links, last_updated
+                )
+                SELECT 
+                    1,
+                    (SELECT COUNT(*) FROM bag),
+                    (SELECT COUNT(*) FROM bag WHERE type = 'parent'),
+                    (SELECT COUNT(*) FROM bag WHERE type = 'child'),
+                    (SELECT COUNT(*) FROM scan),
+                    (SELECT COUNT(*) FROM bill),
+                    (SELECT COUNT(*) FROM "user"),
+                    (SELECT COUNT(*) FROM link),
+                    NOW()
+                FROM (SELECT COUNT(*) FROM cleared) c
+                ON CONFLICT (id) DO UPDATE SET
+                    total_bags = EXCLUDED.total_bags,
+                    parent_bags = EXCLUDED.parent_bags,
+                    child_bags = EXCLUDED.child_bags,
+                    total_scans = EXCLUDED.total_scans,
+                    total_bills = EXCLUDED.total_bills,
+                    total_users = EXCLUDED.total_users,
+                    total_links = EXCLUDED.total_links,
+                    last_updated = EXCLUDED.last_updated
+            """))
             
             if commit:
                 db.session.commit()
-            return stats
+            return StatisticsCache.query.get(1)
         except Exception as e:
             if commit:
                 db.session.rollback()
             raise
 
 
+class StatisticsDelta(db.Model):
+    """
+    Append-only counter deltas for StatisticsCache.
+    
+    Written by statement-level triggers (one row per counter per INSERT/DELETE
+    statement, so bulk imports add one row, not one per bag). Folded into
+    statistics_cache and deleted by StatisticsCache.fold_deltas().
+    """
+    __tablename__ = 'statistics_delta'
+    
+    id = db.Column(db.BigInteger, primary_key=True)
+    counter = db.Column(db.String(30), nullable=False)  # One of StatisticsCache.COUNTERS
+    delta = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, server_default=db.func.now())
+    
+    def __repr__(self):
+        return f"<StatisticsDelta {self.counter} {self.delta:+d}>"
+
+
 class ReturnTicketStatus(enum.Enum):
     OPEN = "open"
     COMMITTED = "committed"
@@ -902,4 +1473,195 @@ def acquire_return_ticket_lock(ticket_id):
     """Acquire PostgreSQL advisory lock for return ticket operations."""
     from sqlalchemy import text
     advisory_lock_id = 400000 + ticket_id
-    db.session.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {'lock_id': advisory_lock_id})
\ No newline at end of file
+    db.session.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {'lock_id': advisory_lock_id})
+
+class ImportJobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class ImportJob(db.Model):
+    """
+    Background bulk import job (see import_jobs.py).
+    
+    Created by the /import/batch_multi submit endpoint and updated by the process-pool
+    worker running the import. Progress columns are written from a separate short
+    transaction so they are visible while the import transaction is still open.
+    """
+    __tablename__ = 'import_job'
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    import_type = db.Column(db.String(30), nullable=False)  # 'child_parent' or 'parent_bill'
+    status = db.Column(db.String(20), default=ImportJobStatus.QUEUED.value, nullable=False)
+    dispatch_area = db.Column(db.String(50), nullable=True)
+    filenames = db.Column(db.Text, nullable=True)  # JSON list of original upload names
+    files_total = db.Column(db.Integer, default=0)
+    files_done = db.Column(db.Integer, default=0)
+    current_file = db.Column(db.String(255), nullable=True)
+    progress_pct = db.Column(db.Float, default=0.0)  # Whole job, 0-100
+    rows_total = db.Column(db.Integer, default=0)  # Rows in files started so far
+    rows_processed = db.Column(db.Integer, default=0)
+    has_errors = db.Column(db.Boolean, default=False)
+    error_message = db.Column(db.Text, nullable=True)
+    summary = db.Column(db.Text, nullable=True)  # JSON list of per-file results
+    result_file = db.Column(db.String(255), nullable=True)  # Detailed per-row result workbook
+    error_report_file = db.Column(db.String(255), nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)  # 'host:pid' of the gunicorn worker owning the job
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('import_jobs', lazy='dynamic'))
+    
+    __table_args__ = (
+        db.Index('idx_import_job_user_created', 'user_id', 'created_at'),
+        db.Index('idx_import_job_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f"<ImportJob {self.id} ({self.status})>"
+    
+    def is_finished(self):
+        return self.status in (ImportJobStatus.COMPLETED.value, ImportJobStatus.FAILED.value)
+    
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or datetime.datetime.utcnow()
+        return max((end - self.started_at).total_seconds(), 0.0)
+    
+    def rows_per_sec(self):
+        elapsed = self.elapsed_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed > 0 else 0.0
+    
+    def eta_seconds(self):
+        """Estimated seconds remaining, extrapolated from overall progress (None if unknown)"""
+        if self.is_finished():
+            return 0
+        progress = self.progress_pct or 0
+        elapsed = self.elapsed_seconds()
+        if progress <= 0 or elapsed <= 0:
+            return None
+        return int(elapsed * (100 - progress) / progress)
+
+
+class ScanSyncReceipt(db.Model):
+    """
+    Outcome of one offline-queued scan replayed through /api/v2/scans/sync.
+    
+    Keyed by the client-generated scan UUID so a device that retries a batch after
+    a dropped response gets the stored result back instead of scanning twice. The
+    receipt is written in the same transaction as the scan it records.
+    """
+    __tablename__ = 'scan_sync_receipt'
+    client_scan_id = db.Column(db.String(36), primary_key=True)  # uuid from the device queue
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'child' or 'bill_parent'
+    status = db.Column(db.String(40), nullable=False)  # 'success' or the scan error_type
+    result = db.Column(db.Text, nullable=True)  # JSON response returned for the scan
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, server_default=db.func.now())
+    
+    __table_args__ = (
+        db.Index('idx_scan_sync_receipt_created', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f"<ScanSyncReceipt {self.client_scan_id} ({self.status})>"
+
+
+class ScanDedupe(db.Model):
+    """
+    Recent (bill, bag) scans for the 'postgres' scan de-duplication backend
+    (see scan_dedupe.py).
+    
+    UNLOGGED: entries only live for the scan cooldown, so there is nothing worth
+    writing to WAL or recovering after a crash.
+    """
+    __tablename__ = 'scan_dedupe'
+    scan_key = db.Column(db.String(300), primary_key=True)  # scan_dedupe.scan_key(bill_id, qr_code)
+    scanned_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_scan_dedupe_scanned_at', 'scanned_at'),
+        {'info': {'unlogged': True}},
+    )
+    
+    def __repr__(self):
+        return f"<ScanDedupe {self.scan_key}>"
+
+
+class MaintenanceJobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    PAUSED = "paused"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class MaintenanceJob(db.Model):
+    """
+    Chunked, resumable maintenance job such as a bill counter backfill (see maintenance_jobs.py).
+    
+    cursor is the last key processed; it is written in the same transaction as
+    the chunk it covers, so a paused, interrupted or failed job resumes exactly
+    after the last committed chunk.
+    """
+    __tablename__ = 'maintenance_job'
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    name = db.Column(db.String(50), nullable=False)  # Registered job name, e.g. 'bill_counters'
+    params = db.Column(db.Text, nullable=True)  # JSON task parameters, e.g. {"user_id": 7}
+    status = db.Column(db.String(20), default=MaintenanceJobStatus.QUEUED.value, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
+    cursor = db.Column(db.BigInteger, nullable=True)  # Last key processed (keyset position)
+    chunk_size = db.Column(db.Integer, nullable=False, default=1000)
+    max_db_share = db.Column(db.Float, nullable=False, default=0.5)  # Throttle: max fraction of time in DB work
+    rows_total = db.Column(db.Integer, default=0)  # Rows left at start/resume plus rows already done
+    rows_processed = db.Column(db.Integer, default=0)
+    chunks_done = db.Column(db.Integer, default=0)
+    db_seconds = db.Column(db.Float, default=0.0)  # Time spent inside chunk transactions
+    active_seconds = db.Column(db.Float, default=0.0)  # Time spent running (chunks + throttle sleeps)
+    summary = db.Column(db.Text, nullable=True)  # JSON job counters (e.g. drift fixes)
+    error_message = db.Column(db.Text, nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # Renewed every chunk; expired = runner died
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('maintenance_jobs', lazy='dynamic'))
+    
+    __table_args__ = (
+        db.Index('idx_maintenance_job_status', 'status'),
+        db.Index('idx_maintenance_job_name_created', 'name', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f"<MaintenanceJob {self.name} {self.id} ({self.status})>"
+    
+    def is_finished(self):
+        return self.status in (MaintenanceJobStatus.COMPLETED.value, MaintenanceJobStatus.FAILED.value,
+                               MaintenanceJobStatus.CANCELLED.value)
+    
+    def progress_pct(self):
+        if self.status == MaintenanceJobStatus.COMPLETED.value:
+            return 100.0
+        if not self.rows_total:
+            return 0.0
+        return round(min((self.rows_processed or 0) / self.rows_total * 100, 100.0), 1)
+    
+    def rows_per_sec(self):
+        active = self.active_seconds or 0
+        return round((self.rows_processed or 0) / active, 1) if active > 0 else 0.0
+    
+    def eta_seconds(self):
+        """Estimated running seconds remaining at the current (throttled) rate (None if unknown)"""
+        if self.is_finished():
+            return 0
+        rate = self.rows_per_sec()
+        if rate <= 0 or not self.rows_total:
+            return None
+        return int(max(self.rows_total - (self.rows_processed or 0), 0) / rate)
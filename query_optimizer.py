@@ -3,43 +3,236 @@ High-Performance Query Optimizer for TraitorTrack
 Optimizes critical scanner and linking operations for sub-50ms response times
 """
 from sqlalchemy import text
+from collections import OrderedDict, namedtuple
+import json
+import os
 import logging
+import tempfile
+import threading
+
+from validation_utils import InputValidator
 
 logger = logging.getLogger(__name__)
 
+# Counts up to this many rows are exact; larger result sets use the planner's estimate
+COUNT_EXACT_LIMIT = int(os.environ.get('COUNT_EXACT_LIMIT', '10000'))
+
+# Immutable part of a bag - safe to cache because id, type and qr_id never change after creation
+BagIdentity = namedtuple('BagIdentity', ['id', 'type', 'qr_id'])
+
+
+class BagIdentityCache:
+    """
+    Bounded per-worker LRU of canonical QR -> BagIdentity.
+    
+    Repeated scans of the same bag (e.g. one parent at a station receiving 30 children)
+    resolve to a bag id without touching the qr_id index. Entries are dropped by
+    QueryOptimizer.invalidate_cache() when bags are deleted; the invalidation also
+    touches a shared epoch file in /dev/shm so every other worker clears its copy on
+    its next lookup (one stat() per lookup, no database access).
+    
+    Callers must still treat a cached id as a hint: if the row is gone they invalidate
+    the entry and fall back to the QR lookup.
+    """
+    
+    MAX_SIZE = int(os.environ.get('QR_CACHE_SIZE', '20000'))  # Default: 20k bags (~3MB)
+    
+    def __init__(self, max_size=None, epoch_path=None):
+        self.max_size = max_size or self.MAX_SIZE
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if epoch_path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            epoch_path = os.path.join(base, 'traitortrack-qr-cache.epoch')
+        self.epoch_path = epoch_path
+        self._epoch = self._read_epoch()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'remote_invalidations': 0
+        }
+    
+    @staticmethod
+    def normalize(qr_id):
+        """Canonical cache key (same form as stored in bag.qr_id)"""
+        return InputValidator.normalize_qr(qr_id)
+    
+    def _read_epoch(self):
+        # Each bump replaces the file, so the inode changes even within one mtime tick
+        try:
+            st = os.stat(self.epoch_path)
+            return (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            return None
+    
+    def _check_epoch(self):
+        """Clear local entries if another worker invalidated since our last lookup (lock held)"""
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            self._epoch = epoch
+            if self._entries:
+                self._entries.clear()
+                self.stats['remote_invalidations'] += 1
+    
+    def _bump_epoch(self):
+        tmp_path = f"{self.epoch_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(str(os.getpid()))
+            os.replace(tmp_path, self.epoch_path)
+            self._epoch = self._read_epoch()
+        except OSError as e:
+            logger.debug(f"QR cache epoch update failed: {e}")
+    
+    def get(self, qr_id):
+        key = self.normalize(qr_id)
+        with self._lock:
+            self._check_epoch()
+            identity = self._entries.get(key)
+            if identity is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return identity
+    
+    def put(self, identity):
+        key = self.normalize(identity.qr_id)
+        with self._lock:
+            self._entries[key] = identity
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, qr_id=None):
+        """Drop one QR (or everything) here, and signal other workers to clear theirs"""
+        with self._lock:
+            if qr_id:
+                self._entries.pop(self.normalize(qr_id), None)
+            else:
+                self._entries.clear()
+            self.stats['invalidations'] += 1
+            self._bump_epoch()
+    
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                size=len(self._entries),
+                max_size=self.max_size,
+                hit_rate=round(self.stats['hits'] / lookups * 100, 1) if lookups else 0.0
+            )
+
+
+# Global per-worker identity cache (shared by all QueryOptimizer instances in the process)
+bag_identity_cache = BagIdentityCache()
+
+
 class QueryOptimizer:
     """Optimized database operations for maximum performance"""
     
     def __init__(self, db):
         self.db = db
     
+    def resolve_bag(self, qr_id):
+        """
+        Resolve a QR code to BagIdentity(id, type, qr_id).
+        Served from the per-worker LRU when possible; otherwise one equality lookup on
+        the unique qr_id index whose result is cached.
+        Target: <0.1ms cached, <5ms uncached
+        
+        Returns:
+            BagIdentity or None if no such bag
+        """
+        identity = bag_identity_cache.get(qr_id)
+        if identity:
+            return identity
+        
+        from models import qr_match_sql
+        
+        row = self.db.session.execute(
+            text(f"SELECT id, type, qr_id FROM bag WHERE {qr_match_sql('qr_id', ':qr_id')} LIMIT 1"),
+            {"qr_id": InputValidator.normalize_qr(qr_id)}
+        ).fetchone()
+        if not row:
+            return None
+        
+        identity = BagIdentity(row[0], row[1], row[2])
+        bag_identity_cache.put(identity)
+        return identity
+    
     def get_bag_by_qr(self, qr_id, bag_type=None):
         """
         Fast bag lookup using optimized SQL query with indexes
-        Uses lower() on column to match the idx_bag_qr_id_lower functional index
-        The input qr_id is pre-normalized to lowercase to avoid double lower()
+        Checks the QR identity cache first and loads by primary key on a hit;
+        otherwise compares the canonical QR with plain equality on the unique qr_id index
         Target: <10ms with proper indexing
         """
         from models import Bag
-        from sqlalchemy import func
         
-        # Pre-normalize input to lowercase to match index expression exactly
-        # This ensures SQL emits: lower(qr_id) = :normalized_qr (uses index)
-        # Instead of: lower(qr_id) = lower(:qr) (may not use index efficiently)
-        qr_id_normalized = qr_id.lower() if qr_id else ''
+        identity = bag_identity_cache.get(qr_id)
+        if identity:
+            if bag_type and identity.type != bag_type:
+                return None
+            bag = self.db.session.get(Bag, identity.id)
+            if bag:
+                return bag
+            # Bag was deleted since it was cached - fall through to the index lookup
+            bag_identity_cache.invalidate(qr_id)
         
+        # Plain equality on the unique qr_id index once QR codes are canonical
         if bag_type:
             bag = Bag.query.filter(
-                func.lower(Bag.qr_id) == qr_id_normalized,
+                Bag.qr_match(qr_id),
                 Bag.type == bag_type
             ).first()
         else:
             bag = Bag.query.filter(
-                func.lower(Bag.qr_id) == qr_id_normalized
+                Bag.qr_match(qr_id)
             ).first()
         
+        if bag:
+            bag_identity_cache.put(BagIdentity(bag.id, bag.type, bag.qr_id))
         return bag
     
+    def count_with_estimate(self, query, exact_limit=None):
+        """
+        Count the rows of an ORM query without a full COUNT(*) on huge result sets.
+        
+        Counts exactly up to exact_limit rows (a bounded scan); above that, returns
+        the planner's row estimate from EXPLAIN, which costs no table access.
+        
+        Returns:
+            Tuple of (count, is_exact)
+        """
+        from sqlalchemy import func
+        
+        exact_limit = COUNT_EXACT_LIMIT if exact_limit is None else exact_limit
+        query = query.order_by(None)
+        
+        bounded = query.limit(exact_limit + 1).subquery()
+        count = self.db.session.query(func.count()).select_from(bounded).scalar() or 0
+        if count <= exact_limit:
+            return count, True
+        
+        try:
+            compiled = query.statement.compile(dialect=self.db.engine.dialect)
+            plan = self.db.session.connection().exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            logger.warning(f"Planner row estimate failed: {e}")
+            estimate = 0
+        
+        return max(estimate, count), False
+    
     def get_child_count_fast(self, parent_bag_id):
         """
         Lightning-fast child count using raw SQL
@@ -344,9 +537,23 @@ class QueryOptimizer:
             return False, str(e)
     
     def invalidate_cache(self, qr_id=None, bag_type=None):
-        """Invalidate cache for a specific bag or all bags (legacy method for compatibility)"""
-        # Cache invalidation calls removed
-        pass
+        """
+        Invalidate the QR identity cache for a specific bag or all bags.
+        Call after deleting bags; other workers clear their caches on their next lookup.
+        """
+        bag_identity_cache.invalidate(qr_id)
+    
+    def get_cached_bag(self, qr_id):
+        """Return the cached BagIdentity for a QR code, or None (never queries the database)"""
+        return bag_identity_cache.get(qr_id)
+    
+    def cache_bag(self, bag_id, bag_type, qr_id):
+        """Remember a bag's identity after a lookup that did not go through resolve_bag()"""
+        bag_identity_cache.put(BagIdentity(bag_id, bag_type, qr_id))
+    
+    def get_identity_cache_stats(self):
+        """QR identity cache size and hit-rate metrics for monitoring"""
+        return bag_identity_cache.get_stats()
     
     def create_bag_optimized(self, qr_id, bag_type, user_id, dispatch_area=None, name=None, weight_kg=None):
         """
@@ -364,7 +571,7 @@ class QueryOptimizer:
                     RETURNING id
                 """),
                 {
-                    "qr_id": qr_id,
+                    "qr_id": InputValidator.normalize_qr(qr_id),
                     "type": bag_type,
                     "user_id": user_id,
                     "dispatch_area": dispatch_area,
@@ -447,23 +654,29 @@ class QueryOptimizer:
             self.db.session.rollback()
             return False
     
-    def ultra_fast_bill_parent_scan(self, bill_id, qr_code, user_id):
+    def ultra_fast_child_scan(self, parent_qr, child_qr, user_id):
         """
-        Ultra-optimized bill parent bag scanning in a SINGLE database transaction.
+        Ultra-optimized child bag scanning in ONE round trip.
         
-        Consolidates 8-10 ORM queries into ONE atomic transaction:
-        1. Acquires advisory lock for bill
-        2. Validates bill exists and has capacity
-        3. Finds parent bag using indexed lower(qr_id) lookup
-        4. Checks for existing links (same bill, other bills)
-        5. Creates BillBag link and Scan record
-        6. Updates bill counters atomically
+        Replaces ~6 ORM queries (parent lock, link count, child lookup, link check,
+        child flush, link + scan insert) with two statements sent together:
+        1. Acquires advisory lock for the parent bag (200000 + bag_id)
+        2. One data-modifying CTE that validates the parent (exists, not completed,
+           under 30 children) and the child (not a parent, not already linked),
+           creates the child bag if new, inserts the link and scan, and updates
+           parent child_count/weight/status atomically
         
-        Target: <50ms P95 response time
+        The CTE runs as a separate statement after the lock is held, so its snapshot
+        includes every scan committed by the previous lock holder (no 31st child).
+        Concurrent creation/linking of the same child by another parent is caught by
+        ON CONFLICT DO NOTHING (no conflict target, so it matches either the plain
+        qr_id constraint or the UPPER(qr_id) unique index) and link.child_bag_id.
+        
+        Target: <15ms P95 response time
         
         Args:
-            bill_id: Integer bill ID
-            qr_code: Parent bag QR code (will be normalized to uppercase)
+            parent_qr: Parent bag QR code (from session)
+            child_qr: Child bag QR code (validated, uppercase)
             user_id: ID of user performing the scan
             
         Returns:
@@ -471,254 +684,821 @@ class QueryOptimizer:
             - success: bool
             - error_type: str (for error responses)
             - message: str
-            - bag_id, child_count, linked_count, expected_count, etc. (for success)
+            - child_qr, parent_qr, child_count (for success)
         """
-        qr_code = qr_code.strip().upper()
-        
         try:
-            # Single transaction with advisory lock
-            result = self.db.session.execute(
-                text("""
-                    WITH
-                    -- Step 1: Acquire advisory lock for this bill (prevents concurrent modifications)
-                    lock_acquired AS (
-                        SELECT pg_advisory_xact_lock(100000 + :bill_id) AS locked
-                    ),
-                    -- Step 2: Get bill info with capacity check
-                    bill_info AS (
-                        SELECT 
-                            id,
-                            bill_id,
-                            status,
-                            COALESCE(parent_bag_count, 1) AS parent_bag_count,
-                            COALESCE(linked_parent_count, 0) AS linked_parent_count,
-                            COALESCE(total_weight_kg, 0) AS total_weight_kg,
-                            COALESCE(expected_weight_kg, 0) AS expected_weight_kg,
-                            COALESCE(total_child_bags, 0) AS total_child_bags
-                        FROM bill
-                        WHERE id = :bill_id
-                        FOR UPDATE
-                    ),
-                    -- Step 3: Find parent bag using indexed lower() lookup
-                    parent_bag_info AS (
-                        SELECT 
-                            b.id,
-                            b.qr_id,
-                            b.type,
-                            b.child_count,
-                            COALESCE((SELECT COUNT(*) FROM link WHERE parent_bag_id = b.id), 0) AS actual_child_count
-                        FROM bag b
-                        WHERE lower(b.qr_id) = lower(:qr_code)
-                        FOR UPDATE
-                    ),
-                    -- Step 4: Check if already linked to THIS bill
-                    existing_same_bill AS (
-                        SELECT bb.id, bb.bill_id, bb.bag_id
-                        FROM bill_bag bb
-                        JOIN parent_bag_info p ON bb.bag_id = p.id
-                        WHERE bb.bill_id = :bill_id
-                    ),
-                    -- Step 5: Check if linked to ANY OTHER bill (bags can only be linked to one bill ever)
-                    existing_other_bill AS (
-                        SELECT bb.id, bb.bill_id, b.bill_id AS other_bill_id
-                        FROM bill_bag bb
-                        JOIN parent_bag_info p ON bb.bag_id = p.id
-                        JOIN bill b ON bb.bill_id = b.id
-                        WHERE bb.bill_id != :bill_id
-                    )
-                    -- Return validation results
-                    SELECT 
-                        (SELECT id FROM bill_info) AS bill_pk,
-                        (SELECT bill_id FROM bill_info) AS bill_code,
-                        (SELECT status FROM bill_info) AS bill_status,
-                        (SELECT parent_bag_count FROM bill_info) AS capacity,
-                        (SELECT linked_parent_count FROM bill_info) AS linked_count,
-                        (SELECT total_weight_kg FROM bill_info) AS current_weight,
-                        (SELECT expected_weight_kg FROM bill_info) AS expected_weight,
-                        (SELECT total_child_bags FROM bill_info) AS child_bags_total,
-                        (SELECT id FROM parent_bag_info) AS bag_id,
-                        (SELECT qr_id FROM parent_bag_info) AS bag_qr,
-                        (SELECT type FROM parent_bag_info) AS bag_type,
-                        (SELECT actual_child_count FROM parent_bag_info) AS child_count,
-                        (SELECT id FROM existing_same_bill) IS NOT NULL AS already_linked_same,
-                        (SELECT other_bill_id FROM existing_other_bill) AS linked_to_other_bill
-                """),
-                {
-                    "bill_id": int(bill_id),
-                    "qr_code": qr_code
-                }
-            ).fetchone()
+            result, stale_parent = self._child_scan_once(parent_qr, child_qr, user_id)
+            if stale_parent:
+                # Cached parent was deleted - drop the entry and retry with the QR lookup
+                self.db.session.rollback()
+                bag_identity_cache.invalidate(parent_qr)
+                return self.ultra_fast_child_scan(parent_qr, child_qr, user_id)
+            
+            if result["success"]:
+                self.db.session.commit()
+            else:
+                self.db.session.rollback()
+            return result
             
-            if not result:
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Ultra fast child scan failed: parent={parent_qr}, child={child_qr}, error={str(e)}", exc_info=True)
+            return {
+                "success": False,
+                "error_type": "server_error",
+                "message": "Error processing scan"
+            }
+    
+    def _child_scan_once(self, parent_qr, child_qr, user_id):
+        """
+        Run the child scan statement in the current transaction without committing.
+        
+        Returns:
+            Tuple of (result dict, stale_parent). stale_parent is True when the cached
+            parent id no longer exists - the caller rolls back, invalidates and retries.
+            On failure the caller must roll back (the statement may have created the child).
+        """
+        from models import qr_match_sql
+        
+        parent_qr = InputValidator.normalize_qr(parent_qr)
+        child_qr = InputValidator.normalize_qr(child_qr)
+        
+        # The station keeps scanning into the same parent - resolve it from the identity
+        # cache so neither statement touches the qr_id index
+        identity = bag_identity_cache.get(parent_qr)
+        if identity and identity.type == 'parent':
+            lock_target = ":cached_parent_id"
+            parent_lookup = "id = :cached_parent_id"
+        else:
+            identity = None
+            parent_lookup = qr_match_sql('qr_id', ':parent_qr')
+            lock_target = f"(SELECT id FROM bag WHERE {parent_lookup} AND type = 'parent' LIMIT 1)"
+        
+        result = self.db.session.execute(
+            text(f"""
+                -- Step 1: Acquire advisory lock for this parent bag (serializes scans per parent)
+                SELECT pg_advisory_xact_lock(200000 + COALESCE({lock_target}, 0));
+                
+                WITH
+                -- Step 2: Lock parent row and count its children
+                parent AS (
+                    SELECT id, qr_id, status, dispatch_area
+                    FROM bag
+                    WHERE {parent_lookup} AND type = 'parent'
+                    LIMIT 1
+                    FOR UPDATE
+                ),
+                parent_links AS (
+                    SELECT COUNT(*) AS link_count
+                    FROM link
+                    WHERE parent_bag_id = (SELECT id FROM parent)
+                ),
+                -- Step 3: Look up child (if it already exists) and its link
+                existing_child AS (
+                    SELECT b.id, b.type,
+                           EXISTS (SELECT 1 FROM link l WHERE l.child_bag_id = b.id) AS is_linked
+                    FROM bag b
+                    WHERE {qr_match_sql('b.qr_id', ':child_qr')}
+                    LIMIT 1
+                ),
+                checks AS (
+                    SELECT 
+                        p.id AS parent_id,
+                        p.qr_id AS parent_qr,
+                        p.status AS parent_status,
+                        p.dispatch_area,
+                        pl.link_count,
+                        ec.id AS child_id,
+                        ec.type AS child_type,
+                        COALESCE(ec.is_linked, false) AS child_linked
+                    FROM parent p
+                    CROSS JOIN parent_links pl
+                    LEFT JOIN existing_child ec ON true
+                ),
+                -- Step 4: Only proceed when every validation passes
+                valid AS (
+                    SELECT * FROM checks
+                    WHERE parent_status IS DISTINCT FROM 'completed'
+                      AND link_count < 30
+                      AND (child_id IS NULL OR (child_type = 'child' AND NOT child_linked))
+                ),
+                -- Step 5: Create child bag if new
+                new_child AS (
+                    INSERT INTO bag (qr_id, type, dispatch_area, status, weight_kg, created_at, updated_at)
+                    SELECT :child_qr, 'child', dispatch_area, 'pending', 0.0, NOW(), NOW()
+                    FROM valid
+                    WHERE child_id IS NULL
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                ),
+                -- Step 6: Link child to parent and record scan
+                new_link AS (
+                    INSERT INTO link (parent_bag_id, child_bag_id, created_at)
+                    SELECT v.parent_id, COALESCE(v.child_id, nc.id), NOW()
+                    FROM valid v
+                    LEFT JOIN new_child nc ON true
+                    WHERE COALESCE(v.child_id, nc.id) IS NOT NULL
+                    ON CONFLICT DO NOTHING
+                    RETURNING child_bag_id
+                ),
+                new_scan AS (
+                    INSERT INTO scan (child_bag_id, user_id, timestamp)
+                    SELECT child_bag_id, :user_id, NOW()
+                    FROM new_link
+                    RETURNING id
+                ),
+                -- Step 7: Update parent count/weight, auto-complete at 30
+                parent_update AS (
+                    UPDATE bag
+                    SET child_count = v.link_count + 1,
+                        weight_kg = v.link_count + 1,
+                        status = CASE WHEN v.link_count + 1 >= 30 THEN 'completed' ELSE bag.status END,
+                        updated_at = NOW()
+                    FROM valid v
+                    WHERE bag.id = v.parent_id
+                      AND EXISTS (SELECT 1 FROM new_link)
+                    RETURNING bag.child_count
+                )
+                SELECT 
+                    c.parent_id,
+                    c.parent_qr,
+                    c.parent_status,
+                    c.link_count,
+                    c.child_id,
+                    c.child_type,
+                    c.child_linked,
+                    (SELECT child_count FROM parent_update) AS new_count,
+                    (SELECT id FROM new_scan) AS scan_id
+                FROM (SELECT 1) AS one
+                LEFT JOIN checks c ON true
+            """),
+            {
+                "parent_qr": parent_qr,
+                "child_qr": child_qr,
+                "user_id": int(user_id),
+                "cached_parent_id": identity.id if identity else None
+            }
+        ).fetchone()
+        
+        if not result:
+            return {
+                "success": False,
+                "error_type": "query_failed",
+                "message": "Error processing scan"
+            }, False
+        
+        (parent_id, parent_bag_qr, parent_status, link_count, child_id, child_type,
+         child_linked, new_count, scan_id) = result
+        
+        if not parent_id and identity:
+            return None, True
+        
+        if parent_id and not identity:
+            bag_identity_cache.put(BagIdentity(parent_id, 'parent', parent_bag_qr))
+        
+        # Nothing was written if new_count is NULL - work out why (no extra queries needed)
+        if new_count is None:
+            if not parent_id:
+                logger.error(f"Child scan: parent bag not found: {parent_qr}")
                 return {
                     "success": False,
-                    "error_type": "query_failed",
-                    "message": "Database query failed. Please try again."
+                    "error_type": "parent_not_found",
+                    "message": "Parent bag not found"
                 }
             
-            # Unpack results
-            (bill_pk, bill_code, bill_status, capacity, linked_count, 
-             current_weight, expected_weight, child_bags_total,
-             bag_id, bag_qr, bag_type, child_count,
-             already_linked_same, linked_to_other_bill) = result
-            
-            # Validation checks
-            if not bill_pk:
+            if parent_status == 'completed':
                 return {
                     "success": False,
-                    "error_type": "bill_not_found",
-                    "message": f"Bill #{bill_id} not found. Please refresh the page."
+                    "error_type": "parent_completed",
+                    "message": "Parent bag already completed (30/30 limit reached)"
                 }
             
-            if not bag_id:
+            if link_count >= 30:
                 return {
                     "success": False,
-                    "error_type": "bag_not_found",
-                    "message": f"Bag {qr_code} not registered in system. Please scan a registered parent bag."
+                    "error_type": "capacity_reached",
+                    "message": "Maximum 30 child bags reached!"
                 }
             
-            if bag_type != 'parent':
+            if child_id and child_type != 'child':
                 return {
                     "success": False,
-                    "error_type": "wrong_bag_type",
-                    "message": f"{qr_code} is registered as a {bag_type} bag, not a parent bag."
+                    "error_type": "child_is_parent",
+                    "message": f"DUPLICATE: {child_qr} is already a parent bag"
                 }
             
-            if already_linked_same:
-                return {
-                    "success": False,
-                    "error_type": "already_linked_same_bill",
-                    "message": f"{qr_code} already linked to this bill (contains {child_count} children)."
-                }
+            # Already linked, or created/linked concurrently by another scanner
+            return {
+                "success": False,
+                "error_type": "already_linked",
+                "message": f"DUPLICATE: {child_qr} already linked to parent"
+            }, False
+        
+        return {
+            "success": True,
+            "error_type": "success",
+            "message": f"✓ {child_qr} linked! ({new_count}/30)",
+            "child_qr": child_qr,
+            "parent_qr": parent_qr,
+            "child_count": new_count,
+            "is_complete": new_count >= 30
+        }, False
+    
+    def ultra_fast_bill_parent_scan(self, bill_id, qr_code, user_id):
+        """
+        Ultra-optimized bill parent bag scanning in a SINGLE database transaction.
+        
+        Consolidates 8-10 ORM queries into ONE atomic transaction:
+        1. Acquires advisory lock for bill
+        2. Validates bill exists and has capacity
+        3. Finds parent bag using the unique qr_id index
+        4. Checks for existing links (same bill, other bills)
+        5. Creates BillBag link and Scan record
+        6. Updates bill counters atomically
+        
+        Target: <50ms P95 response time
+        
+        Args:
+            bill_id: Integer bill ID
+            qr_code: Parent bag QR code (will be normalized to uppercase)
+            user_id: ID of user performing the scan
             
-            if linked_to_other_bill:
-                return {
-                    "success": False,
-                    "error_type": "already_linked_other_bill",
-                    "message": f"{qr_code} already linked to Bill #{linked_to_other_bill}. Cannot link to multiple bills."
-                }
+        Returns:
+            dict with keys:
+            - success: bool
+            - error_type: str (for error responses)
+            - message: str
+            - bag_id, child_count, linked_count, expected_count, etc. (for success)
+        """
+        try:
+            result, stale_bag = self._bill_parent_scan_once(bill_id, qr_code, user_id)
+            if stale_bag:
+                # Cached bag was deleted - drop the entry and retry with the QR lookup
+                self.db.session.rollback()
+                bag_identity_cache.invalidate(qr_code)
+                return self.ultra_fast_bill_parent_scan(bill_id, qr_code, user_id)
+            
+            # Failed validations write nothing except a counter drift correction, which is kept
+            self.db.session.commit()
+            return result
+            
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Ultra fast bill parent scan failed: bill_id={bill_id}, qr={qr_code}, error={str(e)}", exc_info=True)
+            return {
+                "success": False,
+                "error_type": "server_error",
+                "message": f"Error processing scan: {str(e)}"
+            }
+    
+    def _bill_parent_scan_once(self, bill_id, qr_code, user_id):
+        """
+        Run the bill parent scan statements in the current transaction without committing.
+        
+        Returns:
+            Tuple of (result dict, stale_bag). stale_bag is True when the cached bag id
+            no longer exists - the caller rolls back, invalidates and retries.
+        """
+        from models import qr_match_sql
+        
+        qr_code = InputValidator.normalize_qr(qr_code)
+        
+        # Repeated scans of a known bag skip the qr_id index and lock the row by primary key
+        identity = bag_identity_cache.get(qr_code)
+        bag_lookup = "b.id = :cached_bag_id" if identity else qr_match_sql('b.qr_id', ':qr_code')
+        
+        # Single transaction with advisory lock
+        result = self.db.session.execute(
+            text(f"""
+                WITH
+                -- Step 1: Acquire advisory lock for this bill (prevents concurrent modifications)
+                lock_acquired AS (
+                    SELECT pg_advisory_xact_lock(100000 + :bill_id) AS locked
+                ),
+                -- Step 2: Get bill info with capacity check
+                bill_info AS (
+                    SELECT 
+                        id,
+                        bill_id,
+                        status,
+                        COALESCE(parent_bag_count, 1) AS parent_bag_count,
+                        COALESCE(linked_parent_count, 0) AS linked_parent_count,
+                        COALESCE(total_weight_kg, 0) AS total_weight_kg,
+                        COALESCE(expected_weight_kg, 0) AS expected_weight_kg,
+                        COALESCE(total_child_bags, 0) AS total_child_bags
+                    FROM bill
+                    WHERE id = :bill_id
+                    FOR UPDATE
+                ),
+                -- Step 3: Find parent bag by cached id, or unique qr_id index lookup
+                parent_bag_info AS (
+                    SELECT 
+                        b.id,
+                        b.qr_id,
+                        b.type,
+                        b.child_count,
+                        COALESCE((SELECT COUNT(*) FROM link WHERE parent_bag_id = b.id), 0) AS actual_child_count
+                    FROM bag b
+                    WHERE {bag_lookup}
+                    FOR UPDATE
+                ),
+                -- Step 4: Check if already linked to THIS bill
+                existing_same_bill AS (
+                    SELECT bb.id, bb.bill_id, bb.bag_id
+                    FROM bill_bag bb
+                    JOIN parent_bag_info p ON bb.bag_id = p.id
+                    WHERE bb.bill_id = :bill_id
+                ),
+                -- Step 5: Check if linked to ANY OTHER bill (bags can only be linked to one bill ever)
+                existing_other_bill AS (
+                    SELECT bb.id, bb.bill_id, b.bill_id AS other_bill_id
+                    FROM bill_bag bb
+                    JOIN parent_bag_info p ON bb.bag_id = p.id
+                    JOIN bill b ON bb.bill_id = b.id
+                    WHERE bb.bill_id != :bill_id
+                )
+                -- Return validation results
+                SELECT 
+                    (SELECT id FROM bill_info) AS bill_pk,
+                    (SELECT bill_id FROM bill_info) AS bill_code,
+                    (SELECT status FROM bill_info) AS bill_status,
+                    (SELECT parent_bag_count FROM bill_info) AS capacity,
+                    (SELECT linked_parent_count FROM bill_info) AS linked_count,
+                    (SELECT total_weight_kg FROM bill_info) AS current_weight,
+                    (SELECT expected_weight_kg FROM bill_info) AS expected_weight,
+                    (SELECT total_child_bags FROM bill_info) AS child_bags_total,
+                    (SELECT id FROM parent_bag_info) AS bag_id,
+                    (SELECT qr_id FROM parent_bag_info) AS bag_qr,
+                    (SELECT type FROM parent_bag_info) AS bag_type,
+                    (SELECT actual_child_count FROM parent_bag_info) AS child_count,
+                    (SELECT id FROM existing_same_bill) IS NOT NULL AS already_linked_same,
+                    (SELECT other_bill_id FROM existing_other_bill) AS linked_to_other_bill
+            """),
+            {
+                "bill_id": int(bill_id),
+                "qr_code": qr_code,
+                "cached_bag_id": identity.id if identity else None
+            }
+        ).fetchone()
+        
+        if not result:
+            return {
+                "success": False,
+                "error_type": "query_failed",
+                "message": "Database query failed. Please try again."
+            }, False
+        
+        # Unpack results
+        (bill_pk, bill_code, bill_status, capacity, linked_count, 
+         current_weight, expected_weight, child_bags_total,
+         bag_id, bag_qr, bag_type, child_count,
+         already_linked_same, linked_to_other_bill) = result
+        
+        # Validation checks
+        if not bill_pk:
+            return {
+                "success": False,
+                "error_type": "bill_not_found",
+                "message": f"Bill #{bill_id} not found. Please refresh the page."
+            }, False
+        
+        if not bag_id and identity:
+            return None, True
+        
+        if not bag_id:
+            return {
+                "success": False,
+                "error_type": "bag_not_found",
+                "message": f"Bag {qr_code} not registered in system. Please scan a registered parent bag."
+            }, False
+        
+        if not identity:
+            bag_identity_cache.put(BagIdentity(bag_id, bag_type, bag_qr))
+        
+        if bag_type != 'parent':
+            return {
+                "success": False,
+                "error_type": "wrong_bag_type",
+                "message": f"{qr_code} is registered as a {bag_type} bag, not a parent bag."
+            }, False
+        
+        if already_linked_same:
+            return {
+                "success": False,
+                "error_type": "already_linked_same_bill",
+                "message": f"{qr_code} already linked to this bill (contains {child_count} children)."
+            }, False
+        
+        if linked_to_other_bill:
+            return {
+                "success": False,
+                "error_type": "already_linked_other_bill",
+                "message": f"{qr_code} already linked to Bill #{linked_to_other_bill}. Cannot link to multiple bills."
+            }, False
+        
+        # Check capacity - with DRIFT DETECTION AND AUTO-CORRECTION
+        if linked_count >= capacity:
+            # CRITICAL FIX: Verify actual BillBag count before rejecting
+            # The denormalized linked_parent_count can drift out of sync under concurrent usage
+            actual_count_result = self.db.session.execute(
+                text("SELECT COUNT(*) FROM bill_bag WHERE bill_id = :bill_id"),
+                {"bill_id": int(bill_pk)}
+            ).scalar()
+            actual_linked_count = actual_count_result or 0
             
-            # Check capacity - with DRIFT DETECTION AND AUTO-CORRECTION
-            if linked_count >= capacity:
-                # CRITICAL FIX: Verify actual BillBag count before rejecting
-                # The denormalized linked_parent_count can drift out of sync under concurrent usage
-                actual_count_result = self.db.session.execute(
-                    text("SELECT COUNT(*) FROM bill_bag WHERE bill_id = :bill_id"),
-                    {"bill_id": int(bill_pk)}
-                ).scalar()
-                actual_linked_count = actual_count_result or 0
+            # Check if there's drift between denormalized counter and actual count
+            if actual_linked_count < linked_count:
+                # DRIFT DETECTED: Auto-correct the counter
+                logger.warning(f"Bill {bill_id} counter drift detected: linked_parent_count={linked_count}, actual={actual_linked_count}. Auto-correcting.")
                 
-                # Check if there's drift between denormalized counter and actual count
-                if actual_linked_count < linked_count:
-                    # DRIFT DETECTED: Auto-correct the counter
-                    logger.warning(f"Bill {bill_id} counter drift detected: linked_parent_count={linked_count}, actual={actual_linked_count}. Auto-correcting.")
-                    
-                    # Update the denormalized counter to match reality
-                    self.db.session.execute(
-                        text("UPDATE bill SET linked_parent_count = :actual WHERE id = :bill_id"),
-                        {"actual": actual_linked_count, "bill_id": int(bill_pk)}
-                    )
-                    self.db.session.commit()
-                    
-                    # Recheck capacity with corrected count
-                    linked_count = actual_linked_count
-                    if linked_count >= capacity:
-                        return {
-                            "success": False,
-                            "error_type": "capacity_reached",
-                            "is_at_capacity": True,
-                            "message": f"Bill capacity reached ({linked_count}/{capacity} parent bags). Cannot add more bags."
-                        }
-                    # Counter was corrected and we're now under capacity - proceed with scan
-                    logger.info(f"Bill {bill_id} counter corrected. Now at {linked_count}/{capacity}. Proceeding with scan.")
-                else:
-                    # No drift - capacity truly reached
+                # Update the denormalized counter to match reality
+                self.db.session.execute(
+                    text("UPDATE bill SET linked_parent_count = :actual WHERE id = :bill_id"),
+                    {"actual": actual_linked_count, "bill_id": int(bill_pk)}
+                )
+                
+                # Recheck capacity with corrected count
+                linked_count = actual_linked_count
+                if linked_count >= capacity:
                     return {
                         "success": False,
                         "error_type": "capacity_reached",
                         "is_at_capacity": True,
                         "message": f"Bill capacity reached ({linked_count}/{capacity} parent bags). Cannot add more bags."
-                    }
-            
-            # All validations passed - create the link and update counters atomically
-            # Calculate weight delta based on bag type (SB = 30kg expected, Mxxx-xx = 15kg expected)
-            if qr_code.startswith('SB'):
-                expected_weight_delta = 30.0
-            elif qr_code.startswith('M') and '-' in qr_code:
-                expected_weight_delta = 15.0
+                    }, False
+                # Counter was corrected and we're now under capacity - proceed with scan
+                logger.info(f"Bill {bill_id} counter corrected. Now at {linked_count}/{capacity}. Proceeding with scan.")
             else:
-                expected_weight_delta = 30.0  # Default
-            
-            # Insert BillBag, Scan, and update Bill in one atomic operation
-            self.db.session.execute(
-                text("""
-                    -- Insert bill-bag link
-                    INSERT INTO bill_bag (bill_id, bag_id, created_at)
-                    VALUES (:bill_id, :bag_id, NOW());
+                # No drift - capacity truly reached
+                return {
+                    "success": False,
+                    "error_type": "capacity_reached",
+                    "is_at_capacity": True,
+                    "message": f"Bill capacity reached ({linked_count}/{capacity} parent bags). Cannot add more bags."
+                }, False
+        
+        # All validations passed - create the link and update counters atomically
+        # Calculate weight delta based on bag type (SB = 30kg expected, Mxxx-xx = 15kg expected)
+        if qr_code.startswith('SB'):
+            expected_weight_delta = 30.0
+        elif qr_code.startswith('M') and '-' in qr_code:
+            expected_weight_delta = 15.0
+        else:
+            expected_weight_delta = 30.0  # Default
+        
+        # Insert BillBag, Scan, and update Bill in one atomic operation
+        self.db.session.execute(
+            text("""
+                -- Insert bill-bag link
+                INSERT INTO bill_bag (bill_id, bag_id, created_at)
+                VALUES (:bill_id, :bag_id, NOW());
+                
+                -- Insert scan record
+                INSERT INTO scan (parent_bag_id, user_id, timestamp)
+                VALUES (:bag_id, :user_id, NOW());
+                
+                -- Update bag child_count and weight
+                UPDATE bag 
+                SET child_count = :child_count, 
+                    weight_kg = :child_count,
+                    status = CASE WHEN :child_count >= 30 THEN 'completed' ELSE 'in_progress' END
+                WHERE id = :bag_id;
+                
+                -- Update bill counters atomically
+                UPDATE bill 
+                SET linked_parent_count = COALESCE(linked_parent_count, 0) + 1,
+                    total_weight_kg = COALESCE(total_weight_kg, 0) + :child_count,
+                    expected_weight_kg = COALESCE(expected_weight_kg, 0) + :expected_delta,
+                    total_child_bags = COALESCE(total_child_bags, 0) + :child_count,
+                    status = CASE WHEN status = 'new' THEN 'processing' ELSE status END
+                WHERE id = :bill_id;
+            """),
+            {
+                "bill_id": int(bill_pk),
+                "bag_id": int(bag_id),
+                "user_id": int(user_id),
+                "child_count": int(child_count or 0),
+                "expected_delta": expected_weight_delta
+            }
+        )
+        
+        # Calculate new values
+        new_linked_count = linked_count + 1
+        new_total_weight = current_weight + (child_count or 0)
+        new_expected_weight = expected_weight + expected_weight_delta
+        is_at_capacity = new_linked_count >= capacity
+        
+        capacity_message = " Bill is now at capacity!" if is_at_capacity else ""
+        
+        return {
+            "success": True,
+            "error_type": "success",
+            "message": f"{bag_qr} linked successfully! Contains {child_count} children ({new_linked_count}/{capacity} bags total){capacity_message}",
+            "bag_qr": bag_qr,
+            "bag_id": bag_id,
+            "child_count": child_count or 0,
+            "linked_count": new_linked_count,
+            "expected_count": capacity,
+            "actual_weight": new_total_weight,
+            "expected_weight": new_expected_weight,
+            "is_at_capacity": is_at_capacity,
+            "remaining_capacity": max(0, capacity - new_linked_count),
+            "bill_status": "processing" if bill_status == "new" else bill_status
+        }, False
+    
+    def sync_scan_group(self, kind, target, items, user_id):
+        """
+        Apply an ordered group of offline-queued scans in ONE transaction.
+        
+        Used by /api/v2/scans/sync. A group is every queued scan for one parent bag
+        (kind 'child', target = parent QR) or one bill (kind 'bill_parent', target =
+        bill primary key). Each scan runs in a savepoint together with the insert of
+        its scan_sync_receipt, so a scan UUID can only ever be applied once: if the
+        receipt already exists (the same batch replayed concurrently) the savepoint is
+        rolled back and the stored result is returned instead.
+        
+        Args:
+            kind: 'child' or 'bill_parent'
+            target: Parent bag QR code or bill primary key
+            items: List of (client_scan_id, qr_code) in device scan order
+            user_id: ID of user performing the scans
+        
+        Returns:
+            List of (client_scan_id, result dict, replayed) in the same order, where
+            replayed is True when the result came from an existing receipt.
+            server_error results have no receipt so the device retries them.
+        """
+        run_once = self._child_scan_once if kind == 'child' else self._bill_parent_scan_once
+        outcomes = []
+        
+        try:
+            for client_scan_id, qr_code in items:
+                savepoint = self.db.session.begin_nested()
+                try:
+                    result, stale = run_once(target, qr_code, user_id)
+                    if stale:
+                        # Cached bag was deleted - drop the entry and rerun with the QR lookup
+                        savepoint.rollback()
+                        bag_identity_cache.invalidate(target if kind == 'child' else qr_code)
+                        savepoint = self.db.session.begin_nested()
+                        result, _ = run_once(target, qr_code, user_id)
                     
-                    -- Insert scan record
-                    INSERT INTO scan (parent_bag_id, user_id, timestamp)
-                    VALUES (:bag_id, :user_id, NOW());
+                    if kind == 'child' and not result["success"]:
+                        # A rejected child scan may have created the child bag - undo it
+                        savepoint.rollback()
+                        savepoint = self.db.session.begin_nested()
                     
-                    -- Update bag child_count and weight
-                    UPDATE bag 
-                    SET child_count = :child_count, 
-                        weight_kg = :child_count,
-                        status = CASE WHEN :child_count >= 30 THEN 'completed' ELSE 'in_progress' END
-                    WHERE id = :bag_id;
+                    recorded = self.db.session.execute(
+                        text("""
+                            INSERT INTO scan_sync_receipt (client_scan_id, user_id, kind, status, result, created_at)
+                            VALUES (:client_scan_id, :user_id, :kind, :status, :result, NOW())
+                            ON CONFLICT (client_scan_id) DO NOTHING
+                            RETURNING 1
+                        """),
+                        {
+                            "client_scan_id": client_scan_id,
+                            "user_id": int(user_id),
+                            "kind": kind,
+                            "status": result.get("error_type") or ("success" if result["success"] else "failed"),
+                            "result": json.dumps(result, default=str)
+                        }
+                    ).scalar()
                     
-                    -- Update bill counters atomically
-                    UPDATE bill 
-                    SET linked_parent_count = COALESCE(linked_parent_count, 0) + 1,
-                        total_weight_kg = COALESCE(total_weight_kg, 0) + :child_count,
-                        expected_weight_kg = COALESCE(expected_weight_kg, 0) + :expected_delta,
-                        total_child_bags = COALESCE(total_child_bags, 0) + :child_count,
-                        status = CASE WHEN status = 'new' THEN 'processing' ELSE status END
-                    WHERE id = :bill_id;
-                """),
-                {
-                    "bill_id": int(bill_pk),
-                    "bag_id": int(bag_id),
-                    "user_id": int(user_id),
-                    "child_count": int(child_count or 0),
-                    "expected_delta": expected_weight_delta
-                }
-            )
+                    if recorded:
+                        savepoint.commit()
+                        outcomes.append((client_scan_id, result, False))
+                        continue
+                    
+                    savepoint.rollback()
+                    stored = self.db.session.execute(
+                        text("SELECT result FROM scan_sync_receipt WHERE client_scan_id = :client_scan_id"),
+                        {"client_scan_id": client_scan_id}
+                    ).scalar()
+                    outcomes.append((client_scan_id, json.loads(stored) if stored else {"success": True}, True))
+                
+                except Exception as e:
+                    savepoint.rollback()
+                    logger.error(f"Scan sync item failed: kind={kind}, target={target}, qr={qr_code}, error={str(e)}", exc_info=True)
+                    outcomes.append((client_scan_id, {
+                        "success": False,
+                        "error_type": "server_error",
+                        "message": "Error processing scan"
+                    }, False))
             
             self.db.session.commit()
-            
-            # Calculate new values
-            new_linked_count = linked_count + 1
-            new_total_weight = current_weight + (child_count or 0)
-            new_expected_weight = expected_weight + expected_weight_delta
-            is_at_capacity = new_linked_count >= capacity
-            
-            capacity_message = " Bill is now at capacity!" if is_at_capacity else ""
-            
-            return {
-                "success": True,
-                "error_type": "success",
-                "message": f"{bag_qr} linked successfully! Contains {child_count} children ({new_linked_count}/{capacity} bags total){capacity_message}",
-                "bag_qr": bag_qr,
-                "bag_id": bag_id,
-                "child_count": child_count or 0,
-                "linked_count": new_linked_count,
-                "expected_count": capacity,
-                "actual_weight": new_total_weight,
-                "expected_weight": new_expected_weight,
-                "is_at_capacity": is_at_capacity,
-                "remaining_capacity": max(0, capacity - new_linked_count),
-                "bill_status": "processing" if bill_status == "new" else bill_status
+            return outcomes
+        
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error(f"Scan sync group failed: kind={kind}, target={target}, error={str(e)}", exc_info=True)
+            error = {
+                "success": False,
+                "error_type": "server_error",
+                "message": "Error processing scan"
             }
+            return [(client_scan_id, error, False) for client_scan_id, _ in items]
+    
+    # Per-child outcome messages for batch_link_children
+    BATCH_LINK_MESSAGES = {
+        "linked": "Linked",
+        "duplicate_in_batch": "Listed more than once in this batch",
+        "circular": "Cannot link a bag into its own parent chain",
+        "wrong_bag_type": "Registered as a parent bag, not a child bag",
+        "already_linked": "Already linked to this parent",
+        "linked_to_other_parent": "Already linked to another parent bag",
+        "capacity_reached": "Parent bag is full (30/30 children)",
+        "parent_completed": "Parent bag is already completed",
+        "parent_not_found": "Parent bag not found",
+        "conflict": "Changed by another scan - please scan again"
+    }
+    
+    def batch_link_children(self, parent_qr, child_qrs, user_id):
+        """
+        Link up to 30 children to one parent in a SINGLE statement.
+        
+        Bulk counterpart of ultra_fast_child_scan (same advisory lock, same rules):
+        duplicates, bag types, existing links, cycles (one recursive ancestor walk
+        for the whole batch instead of one per pair) and the 30-child capacity are
+        all checked set-wise; accepted children are created if new, then linked and
+        scanned with one multi-row INSERT each. Children are accepted in request
+        order until the parent is full.
+        
+        Args:
+            parent_qr: Parent bag QR code
+            child_qrs: List of child QR codes (already format-validated)
+            user_id: ID of user performing the scans
+        
+        Returns:
+            dict with keys:
+            - success: bool (False only on server error)
+            - linked_count: int, child_count: int (parent after the batch)
+            - results: list of {qr_code, status, success, created, message} in request order
+        """
+        from models import qr_match_sql
+        
+        parent_qr = InputValidator.normalize_qr(parent_qr)
+        child_qrs = [InputValidator.normalize_qr(qr) for qr in child_qrs]
+        parent_lookup = qr_match_sql('qr_id', ':parent_qr')
+        
+        try:
+            rows = self.db.session.execute(
+                text(f"""
+                    -- Step 1: Same per-parent advisory lock as ultra_fast_child_scan
+                    SELECT pg_advisory_xact_lock(200000 + COALESCE(
+                        (SELECT id FROM bag WHERE {parent_lookup} AND type = 'parent' LIMIT 1), 0));
+                    
+                    WITH RECURSIVE
+                    -- Step 2: Lock parent row and count its children
+                    parent AS (
+                        SELECT id, status, dispatch_area
+                        FROM bag
+                        WHERE {parent_lookup} AND type = 'parent'
+                        LIMIT 1
+                        FOR UPDATE
+                    ),
+                    parent_links AS (
+                        SELECT COUNT(*) AS link_count
+                        FROM link
+                        WHERE parent_bag_id = (SELECT id FROM parent)
+                    ),
+                    -- Step 3: Every bag above the parent - linking one of them would close a cycle
+                    ancestors AS (
+                        SELECT l.parent_bag_id AS id
+                        FROM link l
+                        WHERE l.child_bag_id = (SELECT id FROM parent)
+                        UNION
+                        SELECT l.parent_bag_id
+                        FROM link l
+                        JOIN ancestors a ON l.child_bag_id = a.id
+                    ),
+                    requested AS (
+                        SELECT r.qr, r.ord,
+                               ROW_NUMBER() OVER (PARTITION BY r.qr ORDER BY r.ord) AS occurrence
+                        FROM unnest(CAST(:child_qrs AS text[])) WITH ORDINALITY AS r(qr, ord)
+                    ),
+                    -- Step 4: Classify every requested child in one pass
+                    checked AS (
+                        SELECT rq.qr, rq.ord, b.id AS child_id,
+                               CASE
+                                   WHEN rq.occurrence > 1 THEN 'duplicate_in_batch'
+                                   WHEN b.id = (SELECT id FROM parent)
+                                        OR b.id IN (SELECT id FROM ancestors) THEN 'circular'
+                                   WHEN b.id IS NOT NULL AND b.type <> 'child' THEN 'wrong_bag_type'
+                                   WHEN EXISTS (SELECT 1 FROM link l
+                                                WHERE l.child_bag_id = b.id
+                                                  AND l.parent_bag_id = (SELECT id FROM parent)) THEN 'already_linked'
+                                   WHEN EXISTS (SELECT 1 FROM link l WHERE l.child_bag_id = b.id) THEN 'linked_to_other_parent'
+                                   ELSE 'ok'
+                               END AS outcome
+                        FROM requested rq
+                        LEFT JOIN bag b ON {qr_match_sql('b.qr_id', 'rq.qr')}
+                    ),
+                    ranked AS (
+                        SELECT c.*,
+                               ROW_NUMBER() OVER (PARTITION BY c.outcome = 'ok' ORDER BY c.ord) AS slot
+                        FROM checked c
+                    ),
+                    -- Step 5: Accept valid children in request order up to the 30-child limit
+                    accepted AS (
+                        SELECT r.qr, r.ord, r.child_id
+                        FROM ranked r
+                        CROSS JOIN parent p
+                        CROSS JOIN parent_links pl
+                        WHERE r.outcome = 'ok'
+                          AND p.status IS DISTINCT FROM 'completed'
+                          AND r.slot <= 30 - pl.link_count
+                    ),
+                    -- Step 6: Create new children, then link and scan with multi-row INSERTs
+                    new_children AS (
+                        INSERT INTO bag (qr_id, type, dispatch_area, status, weight_kg, created_at, updated_at)
+                        SELECT a.qr, 'child', p.dispatch_area, 'pending', 0.0, NOW(), NOW()
+                        FROM accepted a
+                        CROSS JOIN parent p
+                        WHERE a.child_id IS NULL
+                        ORDER BY a.ord
+                        ON CONFLICT DO NOTHING
+                        RETURNING id, qr_id
+                    ),
+                    new_links AS (
+                        INSERT INTO link (parent_bag_id, child_bag_id, created_at)
+                        SELECT p.id, COALESCE(a.child_id, nc.id), NOW()
+                        FROM accepted a
+                        CROSS JOIN parent p
+                        LEFT JOIN new_children nc ON nc.qr_id = a.qr
+                        WHERE COALESCE(a.child_id, nc.id) IS NOT NULL
+                        ORDER BY a.ord
+                        ON CONFLICT DO NOTHING
+                        RETURNING child_bag_id
+                    ),
+                    new_scans AS (
+                        INSERT INTO scan (child_bag_id, user_id, timestamp)
+                        SELECT child_bag_id, :user_id, NOW()
+                        FROM new_links
+                        RETURNING id
+                    ),
+                    -- Step 7: Update parent count/weight once, auto-complete at 30
+                    parent_update AS (
+                        UPDATE bag
+                        SET child_count = pl.link_count + n.linked,
+                            weight_kg = pl.link_count + n.linked,
+                            status = CASE WHEN pl.link_count + n.linked >= 30 THEN 'completed' ELSE bag.status END,
+                            updated_at = NOW()
+                        FROM parent_links pl,
+                             (SELECT COUNT(*) AS linked FROM new_links) n
+                        WHERE bag.id = (SELECT id FROM parent)
+                          AND n.linked > 0
+                        RETURNING bag.child_count
+                    )
+                    SELECT
+                        r.qr,
+                        CASE
+                            WHEN (SELECT id FROM parent) IS NULL THEN 'parent_not_found'
+                            WHEN r.outcome <> 'ok' THEN r.outcome
+                            WHEN (SELECT status FROM parent) = 'completed' THEN 'parent_completed'
+                            WHEN a.ord IS NULL THEN 'capacity_reached'
+                            WHEN EXISTS (
+                                SELECT 1 FROM new_links nl
+                                LEFT JOIN new_children nc ON nc.id = nl.child_bag_id
+                                WHERE nl.child_bag_id = a.child_id OR nc.qr_id = a.qr
+                            ) THEN 'linked'
+                            ELSE 'conflict'
+                        END AS status,
+                        a.ord IS NOT NULL AND a.child_id IS NULL AS created,
+                        COALESCE((SELECT child_count FROM parent_update),
+                                 (SELECT link_count FROM parent_links)) AS child_count
+                    FROM ranked r
+                    LEFT JOIN accepted a ON a.ord = r.ord
+                    ORDER BY r.ord
+                """),
+                {"parent_qr": parent_qr, "child_qrs": child_qrs, "user_id": int(user_id)}
+            ).fetchall()
             
+            self.db.session.commit()
+        
         except Exception as e:
             self.db.session.rollback()
-            logger.error(f"Ultra fast bill parent scan failed: bill_id={bill_id}, qr={qr_code}, error={str(e)}", exc_info=True)
+            logger.error(f"Batch link failed: parent={parent_qr}, children={len(child_qrs)}, error={str(e)}", exc_info=True)
             return {
                 "success": False,
                 "error_type": "server_error",
-                "message": f"Error processing scan: {str(e)}"
+                "message": "Error processing batch"
             }
+        
+        results = [{
+            "qr_code": qr,
+            "status": status,
+            "success": status == "linked",
+            "created": bool(created) and status == "linked",
+            "message": self.BATCH_LINK_MESSAGES[status]
+        } for qr, status, created, _ in rows]
+        
+        return {
+            "success": True,
+            "parent_qr": parent_qr,
+            "linked_count": sum(1 for r in results if r["success"]),
+            "child_count": int(rows[0][3] or 0) if rows else 0,
+            "results": results
+        }
     
     def ultra_fast_remove_bag_from_bill(self, bill_id, qr_code, user_id):
         """
@@ -741,12 +1521,14 @@ class QueryOptimizer:
         Returns:
             dict with success, message, and updated counters
         """
-        qr_code = qr_code.strip().upper()
+        from models import qr_match_sql
+        
+        qr_code = InputValidator.normalize_qr(qr_code)
         
         try:
             # Single query to get all info needed with advisory lock
             result = self.db.session.execute(
-                text("""
+                text(f"""
                     WITH
                     lock_acquired AS (
                         SELECT pg_advisory_xact_lock(100000 + :bill_id) AS locked
@@ -768,7 +1550,7 @@ class QueryOptimizer:
                             b.id, b.qr_id, b.type,
                             COALESCE(b.child_count, 0) AS child_count
                         FROM bag b
-                        WHERE lower(b.qr_id) = lower(:qr_code) AND b.type = 'parent'
+                        WHERE {qr_match_sql('b.qr_id', ':qr_code')} AND b.type = 'parent'
                         FOR UPDATE
                     ),
                     existing_link AS (
@@ -884,20 +1666,23 @@ class QueryOptimizer:
             dict with success, error_type, message, and operation details
         """
         try:
-            qr_code_normalized = qr_code.strip().upper() if qr_code else ''
+            qr_code_normalized = InputValidator.normalize_qr(qr_code)
             
             if not qr_code_normalized:
                 return {"success": False, "error_type": "invalid_input", "message": "QR code cannot be empty."}
             
+            from models import qr_match_sql
+            bag_lookup = qr_match_sql('qr_id', ':qr_code')
+            
             result = self.db.session.execute(
-                text("""
+                text(f"""
                     WITH 
                     -- First acquire advisory locks for ticket and bag atomically
                     locks AS (
                         SELECT 
                             pg_advisory_xact_lock(400000 + :ticket_id),
                             pg_advisory_xact_lock(200000 + COALESCE(
-                                (SELECT id FROM bag WHERE lower(qr_id) = lower(:qr_code) LIMIT 1), 0
+                                (SELECT id FROM bag WHERE {bag_lookup} LIMIT 1), 0
                             ))
                     ),
                     -- Get ticket info
@@ -911,7 +1696,7 @@ class QueryOptimizer:
                         SELECT b.id, b.qr_id, b.type, b.weight_kg,
                                (SELECT COUNT(*) FROM link WHERE parent_bag_id = b.id) as child_count
                         FROM bag b
-                        WHERE lower(b.qr_id) = lower(:qr_code)
+                        WHERE {qr_match_sql('b.qr_id', ':qr_code')}
                     ),
                     -- Get current bill link
                     bill_link AS (
@@ -22,7 +22,7 @@ from audit_utils import (
 )
 
 # Import email notification utilities
-from email_utils import EmailService, EmailConfig
+from email_utils import EmailService, EmailConfig, EmailTemplate
 # Create a current_user proxy for compatibility
 class CurrentUserProxy:
     @property
@@ -78,8 +78,7 @@ def query_optimizer_fallback():
         @staticmethod
         def get_bag_by_qr(qr_id, bag_type=None):
             from models import Bag
-            from sqlalchemy import func
-            query = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id))
+            query = Bag.query.filter(Bag.qr_match(qr_id))
             if bag_type:
                 query = query.filter(Bag.type == bag_type)
             return query.first()
@@ -152,6 +151,18 @@ def query_optimizer_fallback():
         @staticmethod
         def invalidate_all_cache():
             pass  # No caching in fallback mode
+        
+        @staticmethod
+        def invalidate_cache(qr_id=None, bag_type=None):
+            pass  # No caching in fallback mode
+        
+        @staticmethod
+        def get_cached_bag(qr_id):
+            return None  # No caching in fallback mode
+        
+        @staticmethod
+        def cache_bag(bag_id, bag_type, qr_id):
+            pass  # No caching in fallback mode
             
         @staticmethod
         def bulk_commit():
@@ -163,6 +174,82 @@ def query_optimizer_fallback():
                 db.session.rollback()
                 return False
         
+        @staticmethod
+        def ultra_fast_child_scan(parent_qr, child_qr, user_id):
+            """Fallback implementation of ultra-fast child scanning (ORM, row-locked parent)."""
+            from models import Bag, Link, Scan
+            from app import db
+            from sqlalchemy import func
+            
+            try:
+                # CRITICAL: Use SELECT FOR UPDATE to prevent race conditions on 30-child limit
+                parent_bag = Bag.query.filter(
+                    Bag.qr_match(parent_qr),
+                    Bag.type == 'parent'
+                ).with_for_update().first()
+                
+                if not parent_bag:
+                    return {"success": False, "error_type": "parent_not_found", "message": "Parent bag not found"}
+                
+                if parent_bag.status == 'completed':
+                    db.session.rollback()
+                    return {"success": False, "error_type": "parent_completed", "message": "Parent bag already completed (30/30 limit reached)"}
+                
+                current_count = Link.query.filter_by(parent_bag_id=parent_bag.id).count()
+                if current_count >= 30:
+                    db.session.rollback()
+                    return {"success": False, "error_type": "capacity_reached", "message": "Maximum 30 child bags reached!"}
+                
+                child_bag = Bag.query.filter(Bag.qr_match(child_qr)).first()
+                if child_bag:
+                    if child_bag.type == 'parent':
+                        db.session.rollback()
+                        return {"success": False, "error_type": "child_is_parent", "message": f"DUPLICATE: {child_qr} is already a parent bag"}
+                    if Link.query.filter_by(child_bag_id=child_bag.id).first():
+                        db.session.rollback()
+                        return {"success": False, "error_type": "already_linked", "message": f"DUPLICATE: {child_qr} already linked to parent"}
+                else:
+                    child_bag = Bag()
+                    child_bag.qr_id = child_qr
+                    child_bag.type = 'child'
+                    child_bag.dispatch_area = parent_bag.dispatch_area
+                    db.session.add(child_bag)
+                    db.session.flush()
+                
+                link = Link()
+                link.parent_bag_id = parent_bag.id
+                link.child_bag_id = child_bag.id
+                scan = Scan()
+                scan.user_id = user_id
+                scan.child_bag_id = child_bag.id
+                db.session.add(link)
+                db.session.add(scan)
+                
+                new_count = current_count + 1
+                parent_bag.child_count = new_count
+                parent_bag.weight_kg = float(new_count)  # 1kg per child bag
+                if new_count == 30:
+                    parent_bag.status = 'completed'
+                
+                db.session.commit()
+                
+                return {
+                    "success": True,
+                    "error_type": "success",
+                    "message": f"✓ {child_qr} linked! ({new_count}/30)",
+                    "child_qr": child_qr,
+                    "parent_qr": parent_qr,
+                    "child_count": new_count,
+                    "is_complete": new_count >= 30
+                }
+            except Exception as e:
+                db.session.rollback()
+                return {
+                    "success": False,
+                    "error_type": "error",
+                    "message": "Error processing scan"
+                }
+        
         @staticmethod
         def ultra_fast_bill_parent_scan(bill_id, qr_code, user_id):
             """Fallback implementation of ultra-fast bill parent scanning.
@@ -187,7 +274,7 @@ def query_optimizer_fallback():
                         "message": f"Bill #{bill_id} not found."
                     }
                 
-                bag = Bag.query.filter(func.upper(Bag.qr_id) == qr_code).first()
+                bag = Bag.query.filter(Bag.qr_match(qr_code)).first()
                 if not bag:
                     return {
                         "success": False,
@@ -332,6 +419,7 @@ except ImportError:
 # Using Flask-Login's login_required decorator directly
 
 from sqlalchemy import desc, func, and_, or_, text
+from search_utils import match_condition, match_filter
 from datetime import datetime, timedelta
 
 from app import app, db, limiter, csrf, csrf_compat, get_admin_rate_limit_key
@@ -381,7 +469,8 @@ from models import (
     Link, Bill, BillBag, 
     Scan, AuditLog, 
     PromotionRequest, PromotionRequestStatus,
-    DispatchArea
+    DispatchArea, StatisticsCache, MaintenanceJob,
+    qr_match_sql
 )
 
 # Fast scanning routes removed - functionality consolidated
@@ -1277,44 +1366,29 @@ def preview_user_deletion():
         
         # No need to check for last admin since we're not deleting the account
         
-        # Get all scans by this user
-        user_scans = Scan.query.filter_by(user_id=user.id).all()
-        
-        # Collect unique bag IDs from scans
-        scanned_bag_ids = set()
-        for scan in user_scans:
-            if scan.parent_bag_id:
-                scanned_bag_ids.add(scan.parent_bag_id)
-            if scan.child_bag_id:
-                scanned_bag_ids.add(scan.child_bag_id)
-        
-        # Get bag details
-        bags_to_delete = Bag.query.filter(Bag.id.in_(scanned_bag_ids)).all() if scanned_bag_ids else []
-        
-        # Count related data
-        parent_bags = sum(1 for bag in bags_to_delete if bag.type == 'parent')
-        child_bags = sum(1 for bag in bags_to_delete if bag.type == 'child')
-        
-        # Check for bills that would be affected
-        affected_bills = []
-        if parent_bags > 0:
-            parent_bag_ids = [bag.id for bag in bags_to_delete if bag.type == 'parent']
-            bill_links = BillBag.query.filter(BillBag.bag_id.in_(parent_bag_ids)).all()
-            for link in bill_links:
-                if link.bill:
-                    affected_bills.append({
-                        'id': link.bill.id,
-                        'bill_id': link.bill.bill_id,
-                        'description': link.bill.description or 'No description'
-                    })
-        
-        # Count links that would be deleted
-        link_count = 0
-        if scanned_bag_ids:
-            link_count = Link.query.filter(
-                (Link.parent_bag_id.in_(scanned_bag_ids)) | 
-                (Link.child_bag_id.in_(scanned_bag_ids))
-            ).count()
+        # Scan totals are counted on the live scan table (idx_scan_user_id), so rows
+        # already deleted never show up; parent/child scan counts bound the bag counts.
+        total_scans, parent_scans, child_scans = db.session.execute(text("""
+            SELECT COUNT(*), COUNT(*) FILTER (WHERE child_bag_id IS NULL),
+                   COUNT(*) FILTER (WHERE child_bag_id IS NOT NULL)
+            FROM scan WHERE user_id = :user_id
+        """), {'user_id': user.id}).fetchone()
+        
+        # Samples for display, bounded by LIMIT
+        bag_sample = db.session.execute(text("""
+            SELECT b.qr_id, b.type, b.name FROM bag b
+            WHERE b.id IN (SELECT COALESCE(child_bag_id, parent_bag_id) FROM scan
+                           WHERE user_id = :user_id ORDER BY id LIMIT 50)
+            LIMIT 11
+        """), {'user_id': user.id}).fetchall()
+        affected_bills = db.session.execute(text("""
+            SELECT DISTINCT bill.id, bill.bill_id, bill.description FROM bill
+            JOIN bill_bag bb ON bb.bill_id = bill.id
+            WHERE bb.bag_id IN (SELECT parent_bag_id FROM scan
+                                WHERE user_id = :user_id AND parent_bag_id IS NOT NULL
+                                ORDER BY id LIMIT 1000)
+            LIMIT 50
+        """), {'user_id': user.id}).fetchall()
         
         return jsonify({
             'success': True,
@@ -1326,22 +1400,29 @@ def preview_user_deletion():
                 'created_at': format_datetime_ist(user.created_at, 'full') if user.created_at else 'Unknown'
             },
             'deletion_summary': {
-                'total_scans': len(user_scans),
-                'parent_bags': parent_bags,
-                'child_bags': child_bags,
-                'total_bags': len(bags_to_delete),
-                'links': link_count,
+                'estimated': True,
+                'total_scans': int(total_scans or 0),
+                'parent_bags': int(parent_scans or 0),
+                'child_bags': int(child_scans or 0),
+                'total_bags': int((parent_scans or 0) + (child_scans or 0)),
+                'links': int(child_scans or 0),
                 'affected_bills': len(affected_bills)
             },
-            'affected_bills': affected_bills,
+            'affected_bills': [
+                {
+                    'id': bill.id,
+                    'bill_id': bill.bill_id,
+                    'description': bill.description or 'No description'
+                } for bill in affected_bills
+            ],
             'bag_details': [
                 {
                     'qr_id': bag.qr_id,
                     'type': bag.type,
                     'name': bag.name or 'Unnamed'
-                } for bag in bags_to_delete[:10]  # Show first 10 bags
+                } for bag in bag_sample[:10]  # Show first 10 bags
             ],
-            'more_bags': len(bags_to_delete) > 10
+            'more_bags': len(bag_sample) > 10
         })
         
     except Exception as e:
@@ -1392,72 +1473,23 @@ def execute_comprehensive_deletion():
             'deleted_by': current_user.username
         })
         
-        # Step 1: Get all scans by this user
-        user_scans = Scan.query.filter_by(user_id=user.id).all()
-        scan_count = len(user_scans)
-        
-        # Step 2: Collect unique bag IDs from scans
-        bags_to_delete_ids = set()
-        for scan in user_scans:
-            if scan.parent_bag_id:
-                bags_to_delete_ids.add(scan.parent_bag_id)
-            if scan.child_bag_id:
-                bags_to_delete_ids.add(scan.child_bag_id)
-        
-        # Step 3: Delete all scans by this user
-        Scan.query.filter_by(user_id=user.id).delete()
-        
-        # Step 4: Delete ALL scans that reference these bags (not just user's scans)
-        # This prevents foreign key constraint violations
-        if bags_to_delete_ids:
-            # Delete scans that reference these bags as parent or child
-            Scan.query.filter(
-                (Scan.parent_bag_id.in_(bags_to_delete_ids)) | 
-                (Scan.child_bag_id.in_(bags_to_delete_ids))
-            ).delete(synchronize_session=False)
-            
-            # Step 5: Delete links associated with these bags
-            Link.query.filter(
-                (Link.parent_bag_id.in_(bags_to_delete_ids)) | 
-                (Link.child_bag_id.in_(bags_to_delete_ids))
-            ).delete(synchronize_session=False)
-            
-            # Step 6: Delete bill associations
-            BillBag.query.filter(BillBag.bag_id.in_(bags_to_delete_ids)).delete(synchronize_session=False)
-            
-            # Step 7: Now safe to delete the bags themselves
-            bags_deleted = Bag.query.filter(Bag.id.in_(bags_to_delete_ids)).delete(synchronize_session=False)
-        else:
-            bags_deleted = 0
-        
-        # Step 7: User account remains intact - we've deleted all their data
-        # No need to delete the user
-        
-        # Store user info before committing
-        user_id = user.id
-        user_role = user.role
-        user_email = user.email
-        
-        # Commit all changes
-        db.session.commit()
-        
-        # Log successful data deletion
-        log_audit('comprehensive_data_delete_success', 'user', user_id, {
-            'username': username,
-            'email': user_email,
-            'scans_deleted': scan_count,
-            'bags_deleted': bags_deleted,
-            'deleted_by': current_user.username
-        })
+        # Runs in keyset chunks in the background; the job logs comprehensive_data_delete_success
+        from maintenance_jobs import get_maintenance_job_runner
+        try:
+            job_id = get_maintenance_job_runner().submit('user_data', current_user.id, params={
+                'user_id': user.id,
+                'username': username,
+                'deleted_by': current_user.username
+            })
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
         
         return jsonify({
             'success': True,
-            'message': f'All data for user {username} has been permanently deleted. The user account remains intact.',
-            'stats': {
-                'scans_deleted': scan_count,
-                'bags_deleted': bags_deleted
-            }
-        })
+            'message': f'Deletion of all data for user {username} has started. The user account remains intact.',
+            'job_id': job_id,
+            'status_url': url_for('admin_maintenance_job_status', job_id=job_id)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -1473,193 +1505,142 @@ def execute_comprehensive_deletion():
         
         return jsonify({'success': False, 'message': f'Error during deletion: {str(e)}'})
 
+def _submit_maintenance_job(name, audit_action):
+    """Queue a chunked maintenance job and answer 202 with its status URL"""
+    from maintenance_jobs import get_maintenance_job_runner
+    
+    try:
+        chunk_size = request.form.get('chunk_size', type=int)
+        max_db_share = request.form.get('max_db_share', type=float)
+        job_id = get_maintenance_job_runner().submit(name, current_user.id, chunk_size=chunk_size,
+                                                     max_db_share=max_db_share)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    
+    log_audit(audit_action, 'system', None, {
+        'job_id': job_id,
+        'triggered_by': current_user.username
+    })
+    return jsonify({
+        'success': True,
+        'message': 'Job queued - it runs in chunks in the background; poll status_url for progress.',
+        'job_id': job_id,
+        'status_url': url_for('admin_maintenance_job_status', job_id=job_id)
+    }), 202
+
+
 @app.route('/admin/backfill-bill-counters', methods=['POST'])
 @login_required
 def admin_backfill_bill_counters():
     """
-    PRODUCTION FIX: Efficient batch backfill of bill counters for large databases.
-    Uses a single efficient SQL query to update all bills at once.
-    Designed to handle 10+ lakh bags without timeout.
+    Queue the bill counter backfill (linked_parent_count, total_child_bags,
+    total_weight_kg, drift fixes) as a chunked background job.
+    Optional form fields: chunk_size, max_db_share.
     """
     if not current_user.is_admin():
         return jsonify({'success': False, 'message': 'Admin access required'}), 403
     
+    return _submit_maintenance_job('bill_counters', 'batch_bill_counters_backfill')
+
+
+@app.route('/admin/recalculate-bill-weights', methods=['POST'])
+@login_required
+def admin_recalculate_bill_weights():
+    """Recalculate weights for one bill now, or queue a chunked job for all bills"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    bill_id = request.form.get('bill_id')
+    if not bill_id:
+        return _submit_maintenance_job('bill_weights', 'all_bill_weights_recalculated')
+    
     try:
-        from sqlalchemy import text
-        
-        # Step 1: Calculate all parent counts and child counts in ONE efficient query
-        # This avoids the N+1 problem that caused timeouts
-        app.logger.info("Starting batch backfill of bill counters...")
-        
-        # STEP 1: Fix counter DRIFT - reset linked_parent_count to actual count
-        # This catches cases where the denormalized counter is HIGHER than actual (causes premature capacity errors)
-        drift_fixes = db.session.execute(text("""
-            UPDATE bill 
-            SET linked_parent_count = COALESCE(sub.actual_count, 0)
-            FROM (
-                SELECT b.id as bill_id, COUNT(bb.bag_id) as actual_count
-                FROM bill b
-                LEFT JOIN bill_bag bb ON bb.bill_id = b.id
-                GROUP BY b.id
-            ) sub
-            WHERE bill.id = sub.bill_id
-            AND COALESCE(bill.linked_parent_count, 0) != sub.actual_count
-            RETURNING bill.id, bill.linked_parent_count as old_count, sub.actual_count as new_count
-        """)).fetchall()
-        
-        if drift_fixes:
-            app.logger.warning(f"DRIFT DETECTED AND FIXED: {len(drift_fixes)} bills had incorrect linked_parent_count values")
-            for row in drift_fixes[:10]:  # Log first 10
-                app.logger.warning(f"  Bill {row.id}: {row.old_count} -> {row.new_count}")
-        
-        # STEP 2: Efficient query to get parent counts per bill (for bills with links)
-        parent_counts = db.session.execute(text("""
-            UPDATE bill 
-            SET linked_parent_count = COALESCE(sub.parent_count, 0)
-            FROM (
-                SELECT bb.bill_id, COUNT(bb.bag_id) as parent_count
-                FROM bill_bag bb
-                GROUP BY bb.bill_id
-            ) sub
-            WHERE bill.id = sub.bill_id
-            RETURNING bill.id
-        """)).fetchall()
-        
-        app.logger.info(f"Updated parent counts for {len(parent_counts)} bills")
-        
-        # Efficient query to get child counts per bill
-        child_counts = db.session.execute(text("""
-            UPDATE bill 
-            SET total_child_bags = COALESCE(sub.child_count, 0),
-                total_weight_kg = COALESCE(sub.child_count, 0)
-            FROM (
-                SELECT bb.bill_id, COUNT(DISTINCT l.child_bag_id) as child_count
-                FROM bill_bag bb
-                LEFT JOIN link l ON l.parent_bag_id = bb.bag_id
-                GROUP BY bb.bill_id
-            ) sub
-            WHERE bill.id = sub.bill_id
-            RETURNING bill.id
-        """)).fetchall()
-        
-        app.logger.info(f"Updated child counts for {len(child_counts)} bills")
-        
-        # Set bills with linked bags to 'processing' if still 'new'
-        status_updates = db.session.execute(text("""
-            UPDATE bill 
-            SET status = 'processing'
-            WHERE linked_parent_count > 0 AND status = 'new'
-            RETURNING bill.id
-        """)).fetchall()
+        bill = Bill.query.filter_by(bill_id=bill_id).first()
+        if not bill:
+            return jsonify({'success': False, 'message': f'Bill {bill_id} not found'})
         
+        actual, expected, parent_count, child_count, _ = bill.recalculate_weights()
         db.session.commit()
         
-        log_audit('batch_bill_counters_backfill', 'system', None, {
-            'drift_fixes': len(drift_fixes),
-            'parent_counts_updated': len(parent_counts),
-            'child_counts_updated': len(child_counts),
-            'status_updated': len(status_updates),
-            'triggered_by': current_user.username
+        log_audit('bill_weight_recalculated', 'bill', bill.id, {
+            'bill_id': bill_id,
+            'actual_weight': actual,
+            'expected_weight': expected,
+            'parent_count': parent_count,
+            'child_count': child_count,
+            'recalculated_by': current_user.username
         })
         
-        drift_msg = f" Fixed {len(drift_fixes)} bills with counter drift." if drift_fixes else ""
         return jsonify({
             'success': True,
-            'message': f'Backfill complete.{drift_msg} Updated {len(parent_counts)} bills with parent counts, {len(child_counts)} with child counts.',
-            'stats': {
-                'drift_fixes': len(drift_fixes),
-                'parent_counts_updated': len(parent_counts),
-                'child_counts_updated': len(child_counts),
-                'status_updated': len(status_updates)
+            'message': f'Bill {bill_id} weights recalculated successfully',
+            'bill': {
+                'bill_id': bill_id,
+                'actual_weight': actual,
+                'expected_weight': expected,
+                'parent_count': parent_count,
+                'child_count': child_count
             }
         })
-        
+    
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f'Error in batch backfill: {str(e)}')
-        import traceback
-        app.logger.error(f'Backfill traceback: {traceback.format_exc()}')
+        app.logger.error(f'Error recalculating bill weights: {str(e)}')
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
 
-@app.route('/admin/recalculate-bill-weights', methods=['POST'])
+@app.route('/admin/maintenance-jobs')
 @login_required
-def admin_recalculate_bill_weights():
-    """Admin endpoint to recalculate weights for all bills or a specific bill"""
+def admin_maintenance_jobs():
+    """Recent maintenance jobs with progress (admin only)"""
     if not current_user.is_admin():
         return jsonify({'success': False, 'message': 'Admin access required'}), 403
     
-    try:
-        bill_id = request.form.get('bill_id')
-        
-        if bill_id:
-            # Recalculate single bill
-            bill = Bill.query.filter_by(bill_id=bill_id).first()
-            if not bill:
-                return jsonify({'success': False, 'message': f'Bill {bill_id} not found'})
-            
-            actual, expected, parent_count, child_count = bill.recalculate_weights()
-            db.session.commit()
-            
-            log_audit('bill_weight_recalculated', 'bill', bill.id, {
-                'bill_id': bill_id,
-                'actual_weight': actual,
-                'expected_weight': expected,
-                'parent_count': parent_count,
-                'child_count': child_count,
-                'recalculated_by': current_user.username
-            })
-            
-            return jsonify({
-                'success': True,
-                'message': f'Bill {bill_id} weights recalculated successfully',
-                'bill': {
-                    'bill_id': bill_id,
-                    'actual_weight': actual,
-                    'expected_weight': expected,
-                    'parent_count': parent_count,
-                    'child_count': child_count
-                }
-            })
-        else:
-            # Recalculate all bills
-            bills = Bill.query.all()
-            recalculated_count = 0
-            errors = []
-            
-            for bill in bills:
-                try:
-                    bill.recalculate_weights()
-                    recalculated_count += 1
-                except Exception as e:
-                    errors.append(f'Bill {bill.bill_id}: {str(e)}')
-            
-            db.session.commit()
-            
-            log_audit('all_bill_weights_recalculated', 'system', None, {
-                'bills_recalculated': recalculated_count,
-                'errors': len(errors),
-                'recalculated_by': current_user.username
-            })
-            
-            if errors:
-                return jsonify({
-                    'success': True,
-                    'message': f'Recalculated {recalculated_count} bills with {len(errors)} errors',
-                    'recalculated': recalculated_count,
-                    'errors': errors[:10]  # Return first 10 errors
-                })
-            else:
-                return jsonify({
-                    'success': True,
-                    'message': f'All {recalculated_count} bills recalculated successfully',
-                    'recalculated': recalculated_count
-                })
+    from maintenance_jobs import job_status
+    jobs = MaintenanceJob.query.order_by(MaintenanceJob.created_at.desc()).limit(20).all()
+    return jsonify({'success': True, 'jobs': [job_status(job) for job in jobs]})
+
+
+@app.route('/admin/maintenance-jobs/<job_id>')
+@login_required
+def admin_maintenance_job_status(job_id):
+    """Maintenance job status: cursor, progress, rows/sec, ETA and DB time share"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
     
-    except Exception as e:
-        db.session.rollback()
-        app.logger.error(f'Error recalculating bill weights: {str(e)}')
-        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    job = db.session.get(MaintenanceJob, job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Maintenance job not found'}), 404
+    
+    from maintenance_jobs import job_status
+    return jsonify(dict(job_status(job), success=True))
+
+
+@app.route('/admin/maintenance-jobs/<job_id>/<action>', methods=['POST'])
+@login_required
+def admin_maintenance_job_action(job_id, action):
+    """Pause, resume or cancel a maintenance job (resume continues from its cursor)"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    from maintenance_jobs import get_maintenance_job_runner
+    runner = get_maintenance_job_runner()
+    actions = {'pause': runner.pause, 'resume': runner.resume, 'cancel': runner.cancel}
+    if action not in actions:
+        return jsonify({'success': False, 'message': f'Unknown action: {action}'}), 400
+    
+    if not actions[action](job_id):
+        return jsonify({'success': False, 'message': f'Job cannot {action} in its current state'}), 409
+    
+    log_audit(f'maintenance_job_{action}', 'system', None, {
+        'job_id': job_id,
+        'by': current_user.username
+    })
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('admin_maintenance_job_status', job_id=job_id)
+    })
 
 @app.route('/create_user', methods=['POST'])
 @login_required
@@ -1731,71 +1712,9 @@ def admin_system_integrity():
         return redirect(url_for('dashboard'))
     
     try:
-        # Get counts from database
-        from sqlalchemy import func, text
-        
-        total_bags = db.session.execute(text("SELECT COUNT(*) FROM bag")).scalar() or 0
-        total_bills = db.session.execute(text("SELECT COUNT(*) FROM bill")).scalar() or 0
-        unique_bag_qr_codes = db.session.execute(text("SELECT COUNT(DISTINCT qr_id) FROM bag")).scalar() or 0
-        unique_bill_ids = db.session.execute(text("SELECT COUNT(DISTINCT bill_id) FROM bill")).scalar() or 0
-        
-        # Check for duplicates
-        bag_duplicates = []
-        bill_duplicates = []
-        cross_duplicates = []
-        
-        # Find duplicate bag QR codes
-        dup_bags = db.session.execute(text("""
-            SELECT qr_id, COUNT(*) as cnt FROM bag 
-            GROUP BY qr_id HAVING COUNT(*) > 1
-        """)).fetchall()
-        
-        for row in dup_bags:
-            bag_duplicates.append({
-                'qr_id': row[0],
-                'count': row[1],
-                'bags': []  # Simplified - not fetching full details
-            })
-        
-        # Find duplicate bill IDs
-        dup_bills = db.session.execute(text("""
-            SELECT bill_id, COUNT(*) as cnt FROM bill 
-            GROUP BY bill_id HAVING COUNT(*) > 1
-        """)).fetchall()
-        
-        for row in dup_bills:
-            bill_duplicates.append({
-                'bill_id': row[0],
-                'count': row[1],
-                'bills': []  # Simplified
-            })
-        
-        has_duplicates = len(bag_duplicates) > 0 or len(bill_duplicates) > 0 or len(cross_duplicates) > 0
-        
-        # Calculate integrity score
-        if total_bags == 0 and total_bills == 0:
-            integrity_score = 100
-        else:
-            issues = len(bag_duplicates) + len(bill_duplicates) + len(cross_duplicates)
-            total_records = total_bags + total_bills
-            integrity_score = max(0, min(100, int(100 - (issues / max(1, total_records)) * 100)))
-        
-        # Build comprehensive report
-        report = {
-            'integrity_score': integrity_score,
-            'summary': {
-                'total_bags': total_bags,
-                'total_bills': total_bills,
-                'unique_bag_qr_codes': unique_bag_qr_codes,
-                'unique_bill_ids': unique_bill_ids,
-                'has_duplicates': has_duplicates
-            },
-            'duplicates': {
-                'bag_duplicates': bag_duplicates,
-                'bill_duplicates': bill_duplicates,
-                'cross_duplicates': cross_duplicates
-            }
-        }
+        # Latest findings from the incremental integrity checker - no table scans here
+        from integrity_checker import get_integrity_report
+        report = get_integrity_report()
         
         return render_template('admin_system_integrity.html', report=report)
         
@@ -1804,6 +1723,26 @@ def admin_system_integrity():
         flash('Error generating system integrity report.', 'error')
         return redirect(url_for('dashboard'))
 
+@app.route('/admin/system-integrity/run', methods=['POST'])
+@login_required
+def admin_system_integrity_run():
+    """Start an integrity check in the background (admin only) - results appear on the report"""
+    if not current_user.is_admin():
+        flash('Admin access required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    try:
+        from integrity_checker import IntegrityChecker, get_integrity_checker
+        checker = get_integrity_checker() or IntegrityChecker(app, db, enabled=False)
+        if checker.request_run():
+            flash('Integrity check started - refresh in a moment to see the results.', 'info')
+        else:
+            flash('An integrity check is already queued - refresh in a moment.', 'info')
+    except Exception as e:
+        app.logger.error(f'Integrity check error: {str(e)}')
+        flash('Error starting integrity check.', 'error')
+    return redirect(url_for('admin_system_integrity'))
+
 @app.route('/admin/debug/db-indexes')
 @login_required
 def admin_debug_db_indexes():
@@ -2202,7 +2141,7 @@ def link_to_bill(qr_id):
     """Link parent bag to bill"""
     try:
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(qr_id),
+            Bag.qr_match(qr_id),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -2286,7 +2225,7 @@ def log_scan():
             return redirect(url_for('scan'))
         
         # Find the bag by QR ID (case-insensitive)
-        bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id)).first()
+        bag = Bag.query.filter(Bag.qr_match(qr_id)).first()
         if not bag:
             flash(f'Bag with QR ID {qr_id} not found', 'error')
             return redirect(url_for('scan'))
@@ -2752,7 +2691,7 @@ def api_fast_parent_scan():
     try:
         # Fast SQL query
         result = db.session.execute(
-            text("SELECT id, type FROM bag WHERE UPPER(qr_id) = UPPER(:qr_id) LIMIT 1"),
+            text(f"SELECT id, type FROM bag WHERE {qr_match_sql('qr_id', ':qr_id')} LIMIT 1"),
             {'qr_id': qr_code}
         ).fetchone()
         
@@ -2976,7 +2915,7 @@ def process_child_scan():
         # Use query_optimizer for better performance with atomic locking
         # CRITICAL: Use SELECT FOR UPDATE to prevent race conditions on 30-child limit
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).with_for_update().first()
         
@@ -3246,14 +3185,6 @@ def ajax_scan_parent_bag():
 @limiter.exempt  # Exempt from rate limiting for fast scanning
 def process_child_scan_fast():
     """Ultra-fast child bag processing with CSRF exemption for JSON requests"""
-    # Import optimized handler
-    try:
-        # Skip optimized handler - use standard processing
-        optimized_child_scan_handler = None
-    except ImportError:
-        # Fallback to original implementation if optimization not available
-        pass
-    
     try:
         # Get QR code from JSON or form data
         if request.content_type and 'application/json' in request.content_type:
@@ -3279,81 +3210,18 @@ def process_child_scan_fast():
         if qr_id == parent_qr:
             return jsonify({'success': False, 'message': 'Cannot link to itself'})
         
-        # Fallback to ORM queries (optimized handler not available)
-        # CRITICAL: Use SELECT FOR UPDATE to prevent race conditions on 30-child limit
-        parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
-            Bag.type == 'parent'
-        ).with_for_update().first()
-        
-        if not parent_bag:
-            app.logger.error(f'[FAST_SCAN] Parent bag not found: {parent_qr}')
-            return jsonify({'success': False, 'message': 'Parent bag not found'})
-        
-        # CRITICAL: Check if parent is already completed (prevents 31st+ scans)
-        app.logger.info(f'[FAST_SCAN] Parent {parent_qr} (ID:{parent_bag.id}) status={parent_bag.status}')
-        if parent_bag.status == 'completed':
-            app.logger.warning(f'[FAST_SCAN] REJECTED: Parent {parent_qr} already completed - child {qr_id} blocked')
-            return jsonify({'success': False, 'message': 'Parent bag already completed (30/30 limit reached)'})
-        
-        # Check current count and enforce 30-bag limit (atomic with lock above)
-        current_count = Link.query.filter_by(parent_bag_id=parent_bag.id).count()
-        app.logger.info(f'[FAST_SCAN] Parent {parent_qr} current_count={current_count}, attempting to link {qr_id}')
-        if current_count >= 30:
-            app.logger.warning(f'[FAST_SCAN] REJECTED: Parent {parent_qr} at {current_count}/30 limit - child {qr_id} blocked')
-            return jsonify({'success': False, 'message': 'Maximum 30 child bags reached!'}) 
-        
-        # Check/create child bag (case-insensitive)
-        child_bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id)).first()
-        if child_bag:
-            if child_bag.type == 'parent':
-                return jsonify({'success': False, 'message': f'DUPLICATE: {qr_id} is already a parent bag'})
-            # STRICT DUPLICATE PREVENTION: Check if already linked
-            existing_link = Link.query.filter_by(child_bag_id=child_bag.id).first()
-            if existing_link:
-                return jsonify({'success': False, 'message': f'DUPLICATE: {qr_id} already linked to parent'})
-        else:
-            # Create new child bag
-            child_bag = Bag()
-            child_bag.qr_id = qr_id
-            child_bag.type = 'child'
-            child_bag.dispatch_area = parent_bag.dispatch_area
-            db.session.add(child_bag)
-            db.session.flush()
-        
-        # Create link and scan record
-        link = Link()
-        link.parent_bag_id = parent_bag.id
-        link.child_bag_id = child_bag.id
-        scan = Scan()
-        scan.user_id = current_user.id
-        scan.child_bag_id = child_bag.id
-        db.session.add(link)
-        db.session.add(scan)
+        # ULTRA-FAST: Lock, validate, create child, link, scan and update parent in one round trip
+        result = query_optimizer.ultra_fast_child_scan(parent_qr, qr_id, current_user.id)
         
-        # CRITICAL: Calculate new count BEFORE commit to set status atomically
-        # This prevents race condition where 31st scan slips in before status is set
-        new_count = current_count + 1
-        
-        # UPDATE PARENT BAG COUNT AND WEIGHT ON EVERY SCAN
-        parent_bag.child_count = new_count
-        parent_bag.weight_kg = float(new_count)  # 1kg per child bag
-        
-        # AUTO-COMPLETE WHEN 30 CHILDREN ARE LINKED
-        # This MUST happen BEFORE commit to maintain atomic lock
-        if new_count == 30:
-            parent_bag.status = 'completed'
-            app.logger.info(f'[FAST_SCAN] Parent {parent_qr} auto-completing with 30th child {qr_id}')
-        
-        # Single atomic commit (includes link, scan, AND status update if 30th child)
-        db.session.commit()
+        if not result['success']:
+            return jsonify({'success': False, 'message': result['message']})
         
         return jsonify({
             'success': True,
             'child_qr': qr_id,
             'parent_qr': parent_qr,
-            'child_count': new_count,
-            'message': f'✓ {qr_id} linked! ({new_count}/30)'
+            'child_count': result['child_count'],
+            'message': result['message']
         })
         
     except Exception as e:
@@ -3379,7 +3247,7 @@ def api_unlink_child():
         
         # Get parent bag
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -3388,7 +3256,7 @@ def api_unlink_child():
         # If QR code provided, find specific child. Otherwise, find most recent link.
         if qr_id:
             # Specific child bag
-            child_bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id)).first()
+            child_bag = Bag.query.filter(Bag.qr_match(qr_id)).first()
             if not child_bag:
                 return jsonify({'success': False, 'message': 'Child bag not found'})
             
@@ -3448,6 +3316,7 @@ def api_unlink_child():
         db.session.delete(child_bag)
         
         db.session.commit()
+        query_optimizer.invalidate_cache(qr_id)
         
         # Get new count
         new_count = Link.query.filter_by(parent_bag_id=parent_bag.id).count()
@@ -3484,7 +3353,7 @@ def complete_parent_scan():
         
         # Get parent bag
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -3567,12 +3436,12 @@ def scan_child():
                 
                 # OPTIMIZED: Get parent bag efficiently - try direct query first
                 parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
                 if not parent_bag:
                     # Try without type restriction as fallback
-                    parent_bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(parent_qr)).first()
+                    parent_bag = Bag.query.filter(Bag.qr_match(parent_qr)).first()
                     if parent_bag and parent_bag.type != 'parent':
                         app.logger.error(f'Bag {parent_qr} exists but is type {parent_bag.type}, not parent')
                         return jsonify({'success': False, 'message': f'QR {parent_qr} is not a parent bag. Please scan a parent bag first.'})
@@ -3729,13 +3598,13 @@ def scan_child():
         if parent_qr:
             # Single optimized query to get parent and children
             parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
             
             if not parent_bag:
                 # Try without type restriction to check if bag exists with wrong type
-                parent_bag_any = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(parent_qr)).first()
+                parent_bag_any = Bag.query.filter(Bag.qr_match(parent_qr)).first()
                 if parent_bag_any:
                     app.logger.error(f'CHILD SCAN PAGE: Bag {parent_qr} exists but has type {parent_bag_any.type}, not parent. Clearing invalid session data.')
                     # SECURITY FIX: Never auto-convert bag types as it corrupts data integrity
@@ -3798,7 +3667,7 @@ def scan_complete():
         
         # Get parent bag details
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -3915,7 +3784,7 @@ def child_lookup():
             app.logger.info(f'Lookup request for QR ID: {qr_id}')
             
             # Try to find as a bag first (case-insensitive)
-            bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id)).first()
+            bag = Bag.query.filter(Bag.qr_match(qr_id)).first()
             
             # If not found as bag, check if it's a bill
             bill = None
@@ -4020,7 +3889,7 @@ def scan_history():
         query = query.join(Bag, or_(
             Scan.parent_bag_id == Bag.id,
             Scan.child_bag_id == Bag.id
-        )).filter(Bag.qr_id.contains(search_query))
+        )).filter(match_filter('bag', search_query))
     
     # Paginate results
     scans = query.order_by(desc(Scan.timestamp)).paginate(
@@ -4146,6 +4015,8 @@ def delete_bag(bag_id):
         db.session.delete(bag)
         db.session.commit()
         
+        query_optimizer.invalidate_cache(bag_qr)
+        
         return jsonify({
             'success': True,
             'message': f'Bag {bag.qr_id} deleted successfully'
@@ -4159,20 +4030,69 @@ def delete_bag(bag_id):
             'message': f'Error deleting bag: {str(e)}'
         })
 
+def _parse_bag_cursor(cursor):
+    """Parse a "created_at_iso|id" keyset cursor (as used by /api/v2/bags); None if absent or invalid"""
+    if not cursor:
+        return None
+    try:
+        created_at, bag_id = cursor.split('|')
+        return datetime.fromisoformat(created_at), int(bag_id)
+    except (ValueError, TypeError):
+        app.logger.warning(f"Ignoring invalid bag cursor: {cursor[:60]}")
+        return None
+
+
+class KeysetPagination:
+    """Pagination for keyset (cursor) pages - prev/next only, no page jumps"""
+    
+    def __init__(self, items, page, per_page, total, has_prev, has_next, total_is_exact=True):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.total_is_exact = total_is_exact
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_num = page - 1 if has_prev else None
+        self.next_num = page + 1 if has_next else None
+        self.prev_cursor = self._cursor(items[0]) if has_prev and items else None
+        self.next_cursor = self._cursor(items[-1]) if has_next and items else None
+        if has_next and not self.next_cursor:
+            self.has_next = False
+        if has_prev and not self.prev_cursor:
+            self.has_prev = False
+    
+    @staticmethod
+    def _cursor(bag):
+        return f"{bag.created_at.isoformat()}|{bag.id}" if bag.created_at else None
+    
+    @property
+    def first_index(self):
+        return (self.page - 1) * self.per_page + 1 if self.items else 0
+    
+    @property
+    def last_index(self):
+        return (self.page - 1) * self.per_page + len(self.items)
+    
+    def __bool__(self):
+        """Return True if there are items"""
+        return len(self.items) > 0
+
+
 @app.route('/bags')
 @app.route('/bag_management')  # Alias for compatibility
 @login_required
 def bag_management():
     """Ultra-fast bag management with caching and optimized filtering"""
     import time
-    from sqlalchemy import and_, or_, func
+    from sqlalchemy import and_, or_, func, tuple_
     from sqlalchemy.orm import joinedload, selectinload
     from models import Bag, Link, BillBag, Bill
     
     start_time = time.time()
     
     # Get parameters
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     bag_type = request.args.get('type', 'all')
     search_query = request.args.get('search', '').strip()
     date_from = request.args.get('date_from', '').strip()
@@ -4224,15 +4144,15 @@ def bag_management():
             elif bag_type == 'child':
                 filters.append(Bag.type == 'child')
         
-        # Search filter - exact match first, then partial match
+        # Search filter - exact match first, then prefix / trigram match
         if search_query:
             # Try exact match first (case-insensitive)
-            exact_match = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(search_query)).first()
+            exact_match = Bag.query.filter(Bag.qr_match(search_query)).first()
             if exact_match:
-                filters.append(func.upper(Bag.qr_id) == func.upper(search_query))
+                filters.append(Bag.qr_match(search_query))
             else:
-                # Fall back to partial match
-                filters.append(Bag.qr_id.ilike(f'%{search_query}%'))
+                # Fall back to an index-backed partial match
+                filters.append(match_filter('bag', search_query))
         
         # Date range filter
         if date_from and not date_error:
@@ -4304,42 +4224,39 @@ def bag_management():
             bags_with_bills = db.session.query(BillBag.bag_id).distinct().subquery()
             query = query.filter(~Bag.id.in_(bags_with_bills))
         
-        # Use more efficient count for pagination - OPTIMIZED FOR 1.8M+ BAGS
-        # CRITICAL: For very large datasets, exact counts are expensive
-        # Use fast estimate if total is likely to be large
-        if search_query or date_from or date_to:
-            # If filtered, do exact count (smaller result set)
-            total_filtered = db.session.query(func.count()).select_from(query.subquery()).scalar() or 0
-        else:
-            # For unfiltered queries on large datasets, use optimized count
-            # This avoids expensive COUNT(*) on 1.8M+ rows
-            if bag_type == 'parent':
-                total_filtered = db.session.query(func.count(Bag.id)).filter(Bag.type == 'parent').scalar() or 0
-            elif bag_type == 'child':
-                total_filtered = db.session.query(func.count(Bag.id)).filter(Bag.type == 'child').scalar() or 0
-            else:
-                total_filtered = db.session.query(func.count(Bag.id)).scalar() or 0
+        # Approximate count: exact up to COUNT_EXACT_LIMIT rows, planner estimate beyond
+        # (an exact COUNT(*) over 1.8M+ bags costs more than the page itself)
+        from query_optimizer import query_optimizer
+        total_filtered, total_is_exact = query_optimizer.count_with_estimate(query)
         
-        # Order by creation date (newest first)
-        query = query.order_by(Bag.created_at.desc())
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 200)
         
-        # Apply pagination - OPTIMIZED FOR 1.8M+ BAGS
-        # Allow configurable page size with strict 200 max limit
-        per_page = min(request.args.get('per_page', 20, type=int), 200)
-        offset = (page - 1) * per_page
+        # KEYSET PAGINATION on (created_at, id) - same cost on page 1 and page 50,000.
+        # cursor = last row of the previous page (go older), before = first row of
+        # the next page (go newer). page is only the number shown to the user.
+        after_key = _parse_bag_cursor(request.args.get('cursor', ''))
+        before_key = _parse_bag_cursor(request.args.get('before', ''))
         
-        # PERFORMANCE: For large datasets, cap offset to prevent slow queries
-        # At 1.8M records, large offsets become expensive
-        max_offset = 10000  # Limit to first 10k records for deep pagination
-        if offset > max_offset:
-            flash(f'Page number too high. Showing results from page {max_offset // per_page}', 'warning')
-            offset = max_offset
-            page = (max_offset // per_page) + 1
-        
-        # No eager loading needed for performance - we'll use a single optimized query
+        if before_key:
+            page_query = query.filter(tuple_(Bag.created_at, Bag.id) > before_key).order_by(
+                Bag.created_at.asc(), Bag.id.asc()
+            )
+        else:
+            if after_key:
+                query = query.filter(tuple_(Bag.created_at, Bag.id) < after_key)
+            page_query = query.order_by(Bag.created_at.desc(), Bag.id.desc())
+        
+        rows = page_query.limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        bags_result = rows[:per_page]
+        if before_key:
+            bags_result.reverse()
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = after_key is not None, has_more
+        if not has_prev:
+            page = 1
         
-        # Get bag IDs first for batch queries
-        bags_result = query.limit(per_page).offset(offset).all()
         bag_ids = [bag.id for bag in bags_result]
         
         # Log query performance metrics
@@ -4424,27 +4341,23 @@ def bag_management():
             }
             bags_data.append(bag_data)
         
-        # Use single optimized query for all stats
-        stats_query = db.session.query(
-            func.count(Bag.id).label('total'),
-            func.sum(func.cast(Bag.type == 'parent', db.Integer)).label('parents'),
-            func.sum(func.cast(Bag.type == 'child', db.Integer)).label('children')
-        )
-        
-        if dispatch_area:
-            stats_query = stats_query.filter(Bag.dispatch_area == dispatch_area)
-        
-        stats_result = stats_query.first()
-        
-        total_bags = stats_result.total if stats_result and hasattr(stats_result, 'total') else 0
-        parent_bags = stats_result.parents if stats_result and hasattr(stats_result, 'parents') else 0
-        child_bags = stats_result.children if stats_result and hasattr(stats_result, 'children') else 0
+        # Header totals from the trigger-maintained counters; dispatchers see their
+        # area only, which the counters don't track, so use the bounded count/estimate
+        counts = None if dispatch_area else StatisticsCache.get_exact_counts()
+        if counts:
+            total_bags, parent_bags, child_bags = counts['total_bags'], counts['parent_bags'], counts['child_bags']
+        else:
+            area_query = Bag.query.filter(Bag.dispatch_area == dispatch_area) if dispatch_area else Bag.query
+            total_bags = query_optimizer.count_with_estimate(area_query)[0]
+            parent_bags = query_optimizer.count_with_estimate(area_query.filter(Bag.type == 'parent'))[0]
+            child_bags = query_optimizer.count_with_estimate(area_query.filter(Bag.type == 'child'))[0]
         
         stats = {
             'total_bags': total_bags,
             'parent_bags': parent_bags,
             'child_bags': child_bags,
-            'filtered_count': total_filtered
+            'filtered_count': total_filtered,
+            'filtered_count_exact': total_is_exact
         }
         
         # Convert dictionary data to template-compatible MockBag objects
@@ -4527,35 +4440,8 @@ def bag_management():
         
         bag_objects = [TemplateBag(bag_dict) for bag_dict in bags_data]
         
-        # Create pagination object manually
-        class SimplePagination:
-            def __init__(self, items, page, per_page, total):
-                self.items = items
-                self.page = page
-                self.per_page = per_page
-                self.total = total
-                self.pages = (total + per_page - 1) // per_page if total > 0 else 1
-                self.has_prev = page > 1
-                self.has_next = page < self.pages
-                self.prev_num = page - 1 if self.has_prev else None
-                self.next_num = page + 1 if self.has_next else None
-            
-            def __bool__(self):
-                """Return True if there are items"""
-                return len(self.items) > 0
-            
-            def iter_pages(self, left_edge=2, left_current=2, right_current=3, right_edge=2):
-                last = 0
-                for num in range(1, self.pages + 1):
-                    if num <= left_edge or \
-                       (self.page - left_current - 1 < num < self.page + right_current) or \
-                       num > self.pages - right_edge:
-                        if last + 1 != num:
-                            yield None
-                        yield num
-                        last = num
-        
-        bags = SimplePagination(bag_objects, page, 20, total_filtered)
+        bags = KeysetPagination(bag_objects, page, per_page, total_filtered, has_prev, has_next,
+                                total_is_exact=total_is_exact)
         
         # Update filtered count in stats
         stats['filtered_count'] = total_filtered
@@ -4587,9 +4473,9 @@ def bag_management():
                 )
             )
         
-        bags = query.order_by(desc(Bag.created_at)).paginate(
-            page=page, per_page=20, error_out=False
-        )
+        # First page only - cursors from the failed request may be what broke it
+        rows = query.order_by(Bag.created_at.desc(), Bag.id.desc()).limit(21).all()
+        bags = KeysetPagination(rows[:20], 1, 20, query.count(), False, len(rows) > 20)
         
         # Basic stats - use raw SQL to avoid model import issues
         total_result = db.session.execute(db.text('SELECT COUNT(*) FROM bag')).scalar()
@@ -4670,7 +4556,7 @@ def search_bag():
     recent_scans = []
     
     if query:
-        bag = Bag.query.filter(func.upper(Bag.qr_id) == query).first()
+        bag = Bag.query.filter(Bag.qr_match(query)).first()
         
         if bag:
             if bag.type == 'parent':
@@ -4858,7 +4744,7 @@ def bill_management():
         bills_query = Bill.query.order_by(Bill.created_at.desc())
         
         if search_bill_id:
-            bills_query = bills_query.filter(Bill.bill_id.ilike(f'%{search_bill_id}%'))
+            bills_query = bills_query.filter(match_filter('bill', search_bill_id))
         
         if status_filter != 'all':
             bills_query = bills_query.filter(Bill.status == status_filter)
@@ -4946,8 +4832,9 @@ def bill_management():
             params = {}
             
             if search_bill_id:
-                where_clauses.append("b.bill_id ILIKE :search")
-                params['search'] = f'%{search_bill_id}%'
+                condition, search_params = match_condition('bill', search_bill_id, alias='b.', include_secondary=False)
+                where_clauses.append(condition)
+                params.update(search_params)
             
             if status_filter and status_filter != 'all':
                 where_clauses.append("b.status = :status")
@@ -5485,7 +5372,7 @@ def remove_bag_from_bill():
     
     Consolidates multiple ORM queries into ONE atomic database transaction:
     - Single advisory lock acquisition
-    - Indexed case-insensitive QR lookup using lower(qr_id)
+    - Canonical QR lookup on the unique qr_id index
     - Atomic deletion and counter updates
     
     Target: <50ms P95 response time
@@ -5757,37 +5644,14 @@ def reopen_bill():
         return jsonify({'success': False, 'message': 'Error reopening bill.'})
 
 # ===== SCAN DEDUPLICATION: Prevent rapid double-submits from ANY user =====
-# Key by bill+bag only (not per-user) to prevent race conditions between devices
-import time as _time
-import threading as _threading
-_recent_scans = {}  # Key: (bill_id, qr_code) -> timestamp
-_scan_lock = _threading.Lock()  # Thread-safe access
-SCAN_COOLDOWN_SECONDS = 3  # Block duplicate scans within 3 seconds
-MAX_CACHE_SIZE = 5000  # Limit cache size to prevent memory bloat
+# Key by bill+bag only (not per-user) to prevent race conditions between devices.
+# The store is shared by all workers (see scan_dedupe.py), so a double-scan that
+# lands on another worker is caught here too.
+from scan_dedupe import get_scan_deduplicator, SCAN_COOLDOWN_SECONDS
 
 def _is_duplicate_scan(bill_id, qr_code):
-    """Check if this bag was scanned for this bill within the cooldown period.
-    Thread-safe implementation with bounded cache size."""
-    key = (int(bill_id), qr_code.upper().strip())
-    now = _time.time()
-    
-    with _scan_lock:
-        last_scan = _recent_scans.get(key)
-        
-        if last_scan and (now - last_scan) < SCAN_COOLDOWN_SECONDS:
-            return True
-        
-        # Record this scan attempt
-        _recent_scans[key] = now
-        
-        # Cleanup: only run if cache is large or every 100 scans
-        if len(_recent_scans) > MAX_CACHE_SIZE:
-            cutoff = now - 30  # 30 seconds
-            expired_keys = [k for k, t in _recent_scans.items() if t < cutoff]
-            for k in expired_keys:
-                del _recent_scans[k]
-    
-    return False
+    """Check if this bag was scanned for this bill within the cooldown period (any worker)."""
+    return get_scan_deduplicator().is_duplicate(bill_id, qr_code)
 
 @app.route('/fast/bill_parent_scan', methods=['POST'])
 def ultra_fast_bill_parent_scan():
@@ -5795,7 +5659,7 @@ def ultra_fast_bill_parent_scan():
     
     This endpoint consolidates 8-10 ORM queries into ONE atomic database transaction:
     - Single advisory lock acquisition
-    - Indexed case-insensitive QR lookup using lower(qr_id)
+    - Canonical QR lookup on the unique qr_id index
     - All validations (bill exists, bag exists, capacity, duplicates) in one query
     - Atomic insert and counter updates
     
@@ -5836,7 +5700,7 @@ def ultra_fast_bill_parent_scan():
         app.logger.info(f'Duplicate scan blocked: bill={bill_id}, qr={qr_code}, user={username}')
         return jsonify({
             'success': False,
-            'message': f'{qr_code} was just scanned. Please wait 3 seconds before re-scanning.',
+            'message': f'{qr_code} was just scanned. Please wait {SCAN_COOLDOWN_SECONDS:g} seconds before re-scanning.',
             'error_type': 'duplicate_scan'
         })
     
@@ -5919,16 +5783,16 @@ def process_bill_parent_scan():
     # FAST PRE-CHECK: Validate bill exists, bag exists, and bag isn't linked to another bill
     # All in one query WITHOUT acquiring advisory lock to avoid lock contention
     from sqlalchemy import text
-    precheck = db.session.execute(text("""
+    precheck = db.session.execute(text(f"""
         SELECT 
             (SELECT id FROM bill WHERE id = :bill_id) as bill_exists,
             b.id as bag_id,
             b.type as bag_type,
             (SELECT bb2.bill_id FROM bill_bag bb2 WHERE bb2.bag_id = b.id AND bb2.bill_id != :bill_id LIMIT 1) as other_bill_id
         FROM bag b
-        WHERE lower(b.qr_id) = lower(:qr_code)
+        WHERE {qr_match_sql('b.qr_id', ':qr_code')}
         LIMIT 1
-    """), {"bill_id": bill_id_int, "qr_code": qr_code}).fetchone()
+    """), {"bill_id": bill_id_int, "qr_code": InputValidator.normalize_qr(qr_code)}).fetchone()
     
     # Check if bag exists first
     if not precheck:
@@ -5980,6 +5844,49 @@ def process_bill_parent_scan():
     
     return jsonify(result)
 
+def _bag_details_query(qr_id, identity=None):
+    """Fetch a bag with its children, parent and bills in one round trip (by cached id when known)"""
+    bag_lookup = "id = :bag_id" if identity else qr_match_sql('qr_id', ':qr_id')
+    return db.session.execute(text(f"""
+        WITH bag_data AS (
+            SELECT id, qr_id, type, name, status, dispatch_area, created_at
+            FROM bag
+            WHERE {bag_lookup}
+            LIMIT 1
+        ),
+        child_data AS (
+            SELECT b.id, b.qr_id, b.name, b.created_at
+            FROM bag b
+            JOIN link l ON l.child_bag_id = b.id
+            WHERE l.parent_bag_id = (SELECT id FROM bag_data WHERE type = 'parent')
+            ORDER BY b.created_at DESC
+            LIMIT 100
+        ),
+        parent_data AS (
+            SELECT pb.id, pb.qr_id, pb.name, pb.type
+            FROM link l
+            JOIN bag pb ON pb.id = l.parent_bag_id
+            WHERE l.child_bag_id = (SELECT id FROM bag_data WHERE type = 'child')
+            LIMIT 1
+        ),
+        bill_data AS (
+            SELECT bill.id, bill.bill_id, bill.description, bill.created_at, bill.status
+            FROM bill
+            JOIN bill_bag bb ON bb.bill_id = bill.id
+            WHERE bb.bag_id IN (
+                SELECT id FROM bag_data WHERE type = 'parent'
+                UNION ALL
+                SELECT id FROM parent_data
+            )
+            LIMIT 10
+        )
+        SELECT 
+            (SELECT row_to_json(bag_data) FROM bag_data) as bag,
+            (SELECT json_agg(row_to_json(child_data)) FROM child_data) as children,
+            (SELECT row_to_json(parent_data) FROM parent_data) as parent,
+            (SELECT json_agg(row_to_json(bill_data)) FROM bill_data) as bills
+    """), {'qr_id': InputValidator.normalize_qr(qr_id), 'bag_id': identity.id if identity else None}).fetchone()
+
 @app.route('/bag/<path:qr_id>')
 @login_required
 def bag_details(qr_id):
@@ -5990,45 +5897,14 @@ def bag_details(qr_id):
     
     try:
         # ULTRA-OPTIMIZED: Single CTE query to fetch all related data in one roundtrip
-        result = db.session.execute(text("""
-            WITH bag_data AS (
-                SELECT id, qr_id, type, name, status, dispatch_area, created_at
-                FROM bag
-                WHERE UPPER(qr_id) = UPPER(:qr_id)
-                LIMIT 1
-            ),
-            child_data AS (
-                SELECT b.id, b.qr_id, b.name, b.created_at
-                FROM bag b
-                JOIN link l ON l.child_bag_id = b.id
-                WHERE l.parent_bag_id = (SELECT id FROM bag_data WHERE type = 'parent')
-                ORDER BY b.created_at DESC
-                LIMIT 100
-            ),
-            parent_data AS (
-                SELECT pb.id, pb.qr_id, pb.name, pb.type
-                FROM link l
-                JOIN bag pb ON pb.id = l.parent_bag_id
-                WHERE l.child_bag_id = (SELECT id FROM bag_data WHERE type = 'child')
-                LIMIT 1
-            ),
-            bill_data AS (
-                SELECT bill.id, bill.bill_id, bill.description, bill.created_at, bill.status
-                FROM bill
-                JOIN bill_bag bb ON bb.bill_id = bill.id
-                WHERE bb.bag_id IN (
-                    SELECT id FROM bag_data WHERE type = 'parent'
-                    UNION ALL
-                    SELECT id FROM parent_data
-                )
-                LIMIT 10
-            )
-            SELECT 
-                (SELECT row_to_json(bag_data) FROM bag_data) as bag,
-                (SELECT json_agg(row_to_json(child_data)) FROM child_data) as children,
-                (SELECT row_to_json(parent_data) FROM parent_data) as parent,
-                (SELECT json_agg(row_to_json(bill_data)) FROM bill_data) as bills
-        """), {'qr_id': qr_id}).fetchone()
+        # Known bags are looked up by primary key via the QR identity cache
+        identity = query_optimizer.get_cached_bag(qr_id)
+        result = _bag_details_query(qr_id, identity)
+        if identity and not (result and result[0]):
+            # Cached bag was deleted - drop the entry and retry with the QR lookup
+            query_optimizer.invalidate_cache(qr_id)
+            identity = None
+            result = _bag_details_query(qr_id)
         
         if not result or not result[0]:
             flash('Bag not found', 'error')
@@ -6048,6 +5924,9 @@ def bag_details(qr_id):
             flash('Bag not found', 'error')
             return redirect(url_for('bag_management'))
         
+        if not identity:
+            query_optimizer.cache_bag(bag_data['id'], bag_data['type'], bag_data['qr_id'])
+        
         # Collect all IDs for single bulk fetch - ZERO per-item queries
         all_bag_ids = [bag_data['id']]
         all_bill_ids = []
@@ -6458,107 +6337,95 @@ def two_fa_verify():
     return render_template('two_fa_verify.html', username=user.username)
 
 # API endpoints for dashboard data - Redirect to ultra-fast version
-# Simple in-memory cache for stats
-stats_cache = {'data': None, 'timestamp': 0}
+def _compute_api_stats():
+    """Summary counts for /api/stats (cached across workers via dashboard_cache)"""
+    # OPTIMIZED FOR 1.8M+ BAGS: Trigger-maintained counters (cache row + pending deltas)
+    # Exact counts in O(1) regardless of table size; falls back to real-time counts
+    # if the counter tables have not been migrated/seeded yet
+    try:
+        counts = StatisticsCache.get_exact_counts()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Statistics counters unavailable, using live counts: {e}")
+        counts = None
+    
+    if counts:
+        return {
+            'total_parent_bags': counts['parent_bags'],
+            'total_child_bags': counts['child_bags'],
+            'total_scans': counts['total_scans'],
+            'total_bills': counts['total_bills'],
+            'total_products': counts['total_bags'],
+            'active_dispatchers': 0,
+            'status_counts': {
+                'active': counts['total_bags'],
+                'scanned': counts['total_scans']
+            },
+            'cache_updated': counts['last_updated'].isoformat() if counts['last_updated'] else None
+        }
+    
+    # Fallback to real-time counts (slower but works if cache table doesn't exist)
+    stats_result_fallback = db.session.execute(text("""
+        WITH bag_counts AS (
+            SELECT 
+                COUNT(*) FILTER (WHERE type = 'parent') as parent_count,
+                COUNT(*) FILTER (WHERE type = 'child') as child_count,
+                COUNT(*) as total_count
+            FROM bag
+        )
+        SELECT 
+            bc.parent_count::int,
+            bc.child_count::int,
+            bc.total_count::int,
+            (SELECT COUNT(*) FROM scan)::int as scan_count,
+            (SELECT COUNT(*) FROM bill)::int as bill_count
+        FROM bag_counts bc
+    """)).fetchone()
+    
+    return {
+        'total_parent_bags': stats_result_fallback.parent_count if stats_result_fallback else 0,
+        'total_child_bags': stats_result_fallback.child_count if stats_result_fallback else 0,
+        'total_scans': stats_result_fallback.scan_count if stats_result_fallback else 0,
+        'total_bills': stats_result_fallback.bill_count if stats_result_fallback else 0,
+        'total_products': (stats_result_fallback.parent_count if stats_result_fallback else 0) + (stats_result_fallback.child_count if stats_result_fallback else 0),
+        'active_dispatchers': 0,
+        'status_counts': {
+            'active': stats_result_fallback.total_count if stats_result_fallback else 0,
+            'scanned': stats_result_fallback.scan_count if stats_result_fallback else 0
+        }
+    }
+
+from dashboard_refresher import register_section as register_dashboard_section
+from dashboard_cache import API_STATS_CACHE_TTL
+register_dashboard_section('api_stats', API_STATS_CACHE_TTL, _compute_api_stats)
 
 @app.route('/api/stats')
 @app.route('/api/v2/stats')  # Support v2 endpoint as well
 @login_required
 def api_dashboard_stats():
-    """Ultra-fast cached stats endpoint with simple in-memory caching"""
-    import time
-    
-    # Check simple in-memory cache (30 second TTL)
-    current_time = time.time()
-    if stats_cache['data'] and (current_time - stats_cache['timestamp'] < 30):
-        return jsonify({
-            'success': True,
-            'statistics': stats_cache['data'],
-            'cached': True,
-            'cache_age': current_time - stats_cache['timestamp']
-        })
+    """Ultra-fast cached stats endpoint (30s TTL, shared by all workers)"""
+    from dashboard_cache import get_dashboard_cache
     
+    cache = get_dashboard_cache()
     try:
-        # OPTIMIZED FOR 1.8M+ BAGS: Use statistics cache table (sub-10ms at any scale!)
-        # Falls back to real-time counts if cache table doesn't exist
-        stats_result = db.session.execute(text("""
-            SELECT 
-                parent_bags::int,
-                child_bags::int,
-                total_bags::int,
-                total_scans::int,
-                total_bills::int,
-                last_updated
-            FROM statistics_cache
-            WHERE id = 1
-        """)).fetchone()
-        
-        # PRODUCTION: Debug logging disabled to reduce log volume
-        
-        if stats_result:
-            # Use cached statistics (instant!) - Access by index for reliability
-            stats = {
-                'total_parent_bags': int(stats_result[0]) if stats_result[0] is not None else 0,
-                'total_child_bags': int(stats_result[1]) if stats_result[1] is not None else 0,
-                'total_scans': int(stats_result[3]) if stats_result[3] is not None else 0,
-                'total_bills': int(stats_result[4]) if stats_result[4] is not None else 0,
-                'total_products': int(stats_result[2]) if stats_result[2] is not None else 0,
-                'active_dispatchers': 0,
-                'status_counts': {
-                    'active': int(stats_result[2]) if stats_result[2] is not None else 0,
-                    'scanned': int(stats_result[3]) if stats_result[3] is not None else 0
-                },
-                'cache_updated': stats_result[5].isoformat() if stats_result[5] else None
-            }
-            # PRODUCTION: Debug logging disabled to reduce log volume
-        else:
-            # Fallback to real-time counts (slower but works if cache table doesn't exist)
-            stats_result_fallback = db.session.execute(text("""
-                WITH bag_counts AS (
-                    SELECT 
-                        COUNT(*) FILTER (WHERE type = 'parent') as parent_count,
-                        COUNT(*) FILTER (WHERE type = 'child') as child_count,
-                        COUNT(*) as total_count
-                    FROM bag
-                )
-                SELECT 
-                    bc.parent_count::int,
-                    bc.child_count::int,
-                    bc.total_count::int,
-                    (SELECT COUNT(*) FROM scan)::int as scan_count,
-                    (SELECT COUNT(*) FROM bill)::int as bill_count
-                FROM bag_counts bc
-            """)).fetchone()
-            
-            stats = {
-                'total_parent_bags': stats_result_fallback.parent_count if stats_result_fallback else 0,
-                'total_child_bags': stats_result_fallback.child_count if stats_result_fallback else 0,
-                'total_scans': stats_result_fallback.scan_count if stats_result_fallback else 0,
-                'total_bills': stats_result_fallback.bill_count if stats_result_fallback else 0,
-                'total_products': (stats_result_fallback.parent_count if stats_result_fallback else 0) + (stats_result_fallback.child_count if stats_result_fallback else 0),
-                'active_dispatchers': 0,
-                'status_counts': {
-                    'active': stats_result_fallback.total_count if stats_result_fallback else 0,
-                    'scanned': stats_result_fallback.scan_count if stats_result_fallback else 0
-                }
-            }
-        
-        # Update cache
-        stats_cache['data'] = stats
-        stats_cache['timestamp'] = current_time
+        stats, cached, cache_age = cache.get_or_compute('api_stats', API_STATS_CACHE_TTL, _compute_api_stats)
         
-        return jsonify({
+        response = {
             'success': True,
             'statistics': stats,
-            'cached': False
-        })
+            'cached': cached
+        }
+        if cached:
+            response['cache_age'] = cache_age
+        return jsonify(response)
     except Exception as e:
         app.logger.error(f"Stats API error: {str(e)}")
         # Return last cached data if available
-        if stats_cache['data']:
+        stale = cache.peek('api_stats')
+        if stale:
             return jsonify({
                 'success': True,
-                'statistics': stats_cache['data'],
+                'statistics': stale[0],
                 'cached': True,
                 'stale': True
             })
@@ -6652,6 +6519,53 @@ def api_system_health():
             'type': 'database',
             'message': 'Using database-level StatisticsCache'
         }
+        try:
+            from statistics_folder import get_statistics_folder
+            folder = get_statistics_folder()
+            if folder:
+                cache_stats['counter_folding'] = folder.get_stats()
+        except Exception:
+            pass
+        try:
+            from scan_partitions import get_scan_partition_maintainer
+            maintainer = get_scan_partition_maintainer()
+            if maintainer:
+                cache_stats['scan_partitions'] = maintainer.get_stats()
+        except Exception:
+            pass
+        try:
+            from audit_writer import get_audit_writer
+            writer = get_audit_writer()
+            if writer:
+                cache_stats['audit_writer'] = writer.get_stats()
+        except Exception:
+            pass
+        try:
+            from activity_rollup import get_activity_rollup_aggregator
+            aggregator = get_activity_rollup_aggregator()
+            if aggregator:
+                cache_stats['activity_rollup'] = aggregator.get_stats()
+        except Exception:
+            pass
+        try:
+            from integrity_checker import get_integrity_checker
+            checker = get_integrity_checker()
+            if checker:
+                cache_stats['integrity_checker'] = checker.get_stats()
+        except Exception:
+            pass
+        try:
+            from dashboard_cache import get_dashboard_cache
+            cache_stats['dashboard_cache'] = get_dashboard_cache().get_stats()
+            if hasattr(query_optimizer, 'get_identity_cache_stats'):
+                cache_stats['qr_identity_cache'] = query_optimizer.get_identity_cache_stats()
+            cache_stats['scan_dedupe'] = get_scan_deduplicator().get_stats()
+            from dashboard_refresher import get_dashboard_refresher
+            refresher = get_dashboard_refresher()
+            if refresher:
+                cache_stats['dashboard_refresher'] = refresher.get_stats()
+        except Exception:
+            pass
         
         # Database size
         db_stats = {}
@@ -6812,8 +6726,9 @@ def api_recent_scans():
     try:
         limit = min(request.args.get('limit', 10, type=int), 50)
         
-        # Get real scans from database
-        result = db.session.execute(text("""
+        # Get real scans from database - look in the last week first so only the
+        # newest scan partition(s) are read; fall back to all history if it is quiet
+        recent_scans_sql = """
             SELECT 
                 s.id,
                 s.timestamp,
@@ -6825,9 +6740,17 @@ def api_recent_scans():
             LEFT JOIN bag pb ON s.parent_bag_id = pb.id
             LEFT JOIN bag cb ON s.child_bag_id = cb.id
             LEFT JOIN "user" u ON s.user_id = u.id
+            {where}
             ORDER BY s.timestamp DESC
             LIMIT :limit
-        """), {'limit': limit})
+        """
+        from datetime import datetime, timedelta
+        result = db.session.execute(
+            text(recent_scans_sql.format(where="WHERE s.timestamp >= :since")),
+            {'limit': limit, 'since': datetime.utcnow() - timedelta(days=7)}
+        ).fetchall()
+        if len(result) < limit:
+            result = db.session.execute(text(recent_scans_sql.format(where="")), {'limit': limit}).fetchall()
         
         scans = []
         for row in result:
@@ -6864,30 +6787,14 @@ def api_activity_stats(days):
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=days-1)
         
-        # Use raw SQL to avoid model imports
-        sql = """
-        SELECT 
-            DATE(timestamp) as date,
-            COUNT(id) as scan_count
-        FROM scan 
-        WHERE DATE(timestamp) >= :start_date 
-          AND DATE(timestamp) <= :end_date
-        GROUP BY DATE(timestamp)
-        """
+        # Daily totals from the hourly scan rollup - cost does not grow with scan history
+        from activity_rollup import get_daily_scans
+        daily_scans = get_daily_scans(start_date, end_date)
         
-        result = db.session.execute(db.text(sql), {
-            'start_date': start_date,
-            'end_date': end_date
-        })
-        activity_data = result.fetchall()
-        
-        # Convert to list of dictionaries
-        activity_list = []
-        for date_obj, count in activity_data:
-            activity_list.append({
-                'date': date_obj.isoformat(),
-                'scan_count': count
-            })
+        activity_list = [
+            {'date': day.isoformat(), 'scan_count': count}
+            for day, count in daily_scans.items()
+        ]
         
         return jsonify({
             'success': True,
@@ -6932,7 +6839,7 @@ def api_scanned_children():
         parent_qr = session.get('current_parent_qr')
         if parent_qr:
             parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         
@@ -7018,7 +6925,7 @@ def api_delete_child_scan():
             })
         
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -7082,7 +6989,7 @@ def api_delete_bag():
         from models import acquire_bag_lock, acquire_bill_lock
         
         # ULTRA-OPTIMIZED: Single CTE query for all validation checks
-        validation_result = db.session.execute(text("""
+        validation_result = db.session.execute(text(f"""
             WITH bag_info AS (
                 SELECT 
                     b.id, 
@@ -7093,7 +7000,7 @@ def api_delete_bag():
                 FROM bag b
                 LEFT JOIN bill_bag bb ON bb.bag_id = b.id
                 LEFT JOIN bill ON bill.id = bb.bill_id
-                WHERE UPPER(b.qr_id) = UPPER(:qr_code)
+                WHERE {qr_match_sql('b.qr_id', ':qr_code')}
                 LIMIT 1
             ),
             child_links AS (
@@ -7134,7 +7041,7 @@ def api_delete_bag():
             FROM bag_info bi
             LEFT JOIN child_links cl ON bi.type = 'parent'
             LEFT JOIN parent_link_info pli ON bi.type = 'child'
-        """), {'qr_code': qr_code}).fetchone()
+        """), {'qr_code': InputValidator.normalize_qr(qr_code)}).fetchone()
         
         if not validation_result or not validation_result[0]:
             return jsonify({'success': False, 'message': 'Bag not found'})
@@ -7206,6 +7113,9 @@ def api_delete_bag():
         
         db.session.commit()
         
+        # Parent deletion also removed its children - clear everything rather than per-QR
+        query_optimizer.invalidate_cache(None if bag_type == 'parent' and child_ids else bag_qr)
+        
         log_audit('delete_bag', 'bag', bag_id, {
             'qr_id': bag_qr, 'bag_type': bag_type,
             'child_bags_deleted': child_count if bag_type == 'parent' else 0,
@@ -7229,7 +7139,7 @@ def edit_parent_children(parent_qr):
         return redirect(url_for('bag_management'))
     
     parent_bag = Bag.query.filter(
-        func.upper(Bag.qr_id) == func.upper(parent_qr),
+        Bag.qr_match(parent_qr),
         Bag.type == 'parent'
     ).first_or_404()
     
@@ -7267,7 +7177,7 @@ def api_edit_parent_children():
             })
         
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -7355,7 +7265,7 @@ def api_get_parent_children(parent_qr):
     """Get the list of child QR codes for a parent bag"""
     try:
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(parent_qr),
+            Bag.qr_match(parent_qr),
             Bag.type == 'parent'
         ).first()
         if not parent_bag:
@@ -7467,7 +7377,7 @@ def manual_parent_entry():
         # Check if parent bag exists
         app.logger.info(f'Checking if parent bag exists: {manual_qr}')
         parent_bag = Bag.query.filter(
-            func.upper(Bag.qr_id) == func.upper(manual_qr),
+            Bag.qr_match(manual_qr),
             Bag.type == 'parent'
         ).first()
         
@@ -7589,6 +7499,24 @@ def manual_parent_entry():
 # Bill summary functionality moved to bill_management route
 # Old route commented out to prevent conflicts - functionality integrated into bill_management
 
+from bill_rollup import get_eod_summary, get_daily_bill_totals
+
+
+def _eod_report_day():
+    """
+    Report day for the EOD endpoints: optional 'date' (YYYY-MM-DD) from the query
+    string or JSON body, default today. Returns (day, error_message).
+    """
+    value = request.args.get('date')
+    if not value and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('date')
+    if not value:
+        return None, None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date(), None
+    except (TypeError, ValueError):
+        return None, 'Invalid date - use YYYY-MM-DD'
+
 
 @app.route('/api/bill_summary/eod')
 @login_required
@@ -7598,61 +7526,11 @@ def eod_bill_summary():
         return jsonify({'error': 'Admin access required for EOD summary'}), 403
     
     try:
-        # Get today's date range
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        tomorrow = today + timedelta(days=1)
-        
-        # Get all bills created today
-        bills = Bill.query.filter(
-            Bill.created_at >= today,
-            Bill.created_at < tomorrow
-        ).all()
-        
-        # Compile EOD report data
-        eod_data = {
-            'report_date': format_datetime_ist(today, 'date'),
-            'generated_at': datetime.now().isoformat(),
-            'total_bills': len(bills),
-            'bills_by_status': {},
-            'bills_by_user': {},
-            'total_parent_bags': 0,
-            'total_child_bags': 0,
-            'total_weight_kg': 0,
-            'detailed_bills': []
-        }
-        
-        # Process each bill
-        for bill in bills:
-            # Get creator
-            creator = User.query.get(bill.created_by_id) if bill.created_by_id else None
-            creator_name = creator.username if creator else 'Unknown'
-            
-            # Get linked bags count
-            parent_count = BillBag.query.filter_by(bill_id=bill.id).count()
-            
-            # Update totals
-            eod_data['total_parent_bags'] += parent_count
-            eod_data['total_child_bags'] += getattr(bill, 'total_child_bags', 0) or 0
-            eod_data['total_weight_kg'] += bill.total_weight_kg or 0
-            
-            # Count by status
-            status = bill.status or 'new'
-            eod_data['bills_by_status'][status] = eod_data['bills_by_status'].get(status, 0) + 1
-            
-            # Count by user
-            eod_data['bills_by_user'][creator_name] = eod_data['bills_by_user'].get(creator_name, 0) + 1
-            
-            # Add detailed bill info
-            eod_data['detailed_bills'].append({
-                'bill_id': bill.bill_id,
-                'created_by': creator_name,
-                'created_at': bill.created_at.isoformat(),
-                'status': status,
-                'parent_bags': parent_count,
-                'expected_bags': bill.parent_bag_count,
-                'child_bags': getattr(bill, 'total_child_bags', 0) or 0,
-                'weight_kg': bill.total_weight_kg or 0
-            })
+        # Totals come from the daily rollup - two queries however many bills the day has
+        report_day, error = _eod_report_day()
+        if error:
+            return jsonify({'error': error}), 400
+        eod_data = get_eod_summary(report_day)
         
         return jsonify(eod_data)
         
@@ -7660,6 +7538,28 @@ def eod_bill_summary():
         app.logger.error(f'EOD summary error: {str(e)}')
         return jsonify({'error': 'Error generating EOD summary'}), 500
 
+@app.route('/api/bill_summary/daily')
+@login_required
+def daily_bill_totals():
+    """Per-day bill totals for the last N days (default 30, max 366) from the daily rollup"""
+    if not current_user.is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        days = max(1, min(request.args.get('days', 30, type=int), 366))
+        end = datetime.utcnow().date()
+        start = end - timedelta(days=days - 1)
+
+        return jsonify({
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'days': get_daily_bill_totals(start, end)
+        })
+
+    except Exception as e:
+        app.logger.error(f'Daily bill totals error: {str(e)}')
+        return jsonify({'error': 'Error generating daily bill totals'}), 500
+
 @app.route('/api/bill_summary/send_eod', methods=['POST'])
 @login_required
 def send_eod_summaries():
@@ -7677,52 +7577,11 @@ def send_eod_summaries():
                 'alternative_url': '/eod_summary_preview'
             }), 503
         
-        # Get EOD data using same logic as eod_bill_summary endpoint
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        tomorrow = today + timedelta(days=1)
-        
-        bills = Bill.query.filter(
-            Bill.created_at >= today,
-            Bill.created_at < tomorrow
-        ).all()
-        
-        # Compile EOD report data
-        eod_data = {
-            'report_date': format_datetime_ist(today, 'date'),
-            'generated_at': datetime.now().isoformat(),
-            'total_bills': len(bills),
-            'bills_by_status': {},
-            'bills_by_user': {},
-            'total_parent_bags': 0,
-            'total_child_bags': 0,
-            'total_weight_kg': 0,
-            'detailed_bills': []
-        }
-        
-        # Process each bill
-        for bill in bills:
-            creator = User.query.get(bill.created_by_id) if bill.created_by_id else None
-            creator_name = creator.username if creator else 'Unknown'
-            parent_count = BillBag.query.filter_by(bill_id=bill.id).count()
-            
-            eod_data['total_parent_bags'] += parent_count
-            eod_data['total_child_bags'] += getattr(bill, 'total_child_bags', 0) or 0
-            eod_data['total_weight_kg'] += bill.total_weight_kg or 0
-            
-            status = bill.status or 'new'
-            eod_data['bills_by_status'][status] = eod_data['bills_by_status'].get(status, 0) + 1
-            eod_data['bills_by_user'][creator_name] = eod_data['bills_by_user'].get(creator_name, 0) + 1
-            
-            eod_data['detailed_bills'].append({
-                'bill_id': bill.bill_id,
-                'created_by': creator_name,
-                'created_at': bill.created_at.isoformat(),
-                'status': status,
-                'parent_bags': parent_count,
-                'expected_bags': bill.parent_bag_count,
-                'child_bags': getattr(bill, 'total_child_bags', 0) or 0,
-                'weight_kg': bill.total_weight_kg or 0
-            })
+        # EOD data from the daily rollup (same source as eod_bill_summary)
+        report_day, error = _eod_report_day()
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        eod_data = get_eod_summary(report_day)
         
         # Get recipient list: all admins and billers
         recipients = User.query.filter(
@@ -7775,13 +7634,14 @@ def eod_summary_preview():
         return redirect(url_for('dashboard'))
     
     try:
-        # Email functionality removed - show simple message
-        html_content = """
-        <div style="padding: 20px; background: #f8f9fa; text-align: center;">
-            <h2>Email functionality is not configured</h2>
-            <p>Use the EOD Summary API endpoint to view report data.</p>
-        </div>
-        """
+        report_day, error = _eod_report_day()
+        if error:
+            flash(error, 'error')
+            return redirect(url_for('bill_summary'))
+        
+        # Rollup-backed, so rendering the real email is cheap even on busy days
+        eod_data = get_eod_summary(report_day)
+        _, html_content = EmailTemplate.eod_bill_summary(eod_data['report_date'], eod_data)
         
         # Return the HTML directly for preview
         return f"""
@@ -7838,6 +7698,7 @@ def eod_summary_preview():
                         fetch('/api/bill_summary/send_eod', {{
                             method: 'POST',
                             headers: {{'Content-Type': 'application/json'}},
+                            body: JSON.stringify({{date: '{eod_data['date']}'}})
                         }})
                         .then(response => response.json())
                         .then(data => {{
@@ -7884,52 +7745,11 @@ def schedule_eod_summary():
         
         app.logger.info("Scheduled EOD summary triggered")
         
-        # Get EOD data using same logic as eod_bill_summary endpoint
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        tomorrow = today + timedelta(days=1)
-        
-        bills = Bill.query.filter(
-            Bill.created_at >= today,
-            Bill.created_at < tomorrow
-        ).all()
-        
-        # Compile EOD report data
-        eod_data = {
-            'report_date': format_datetime_ist(today, 'date'),
-            'generated_at': datetime.now().isoformat(),
-            'total_bills': len(bills),
-            'bills_by_status': {},
-            'bills_by_user': {},
-            'total_parent_bags': 0,
-            'total_child_bags': 0,
-            'total_weight_kg': 0,
-            'detailed_bills': []
-        }
-        
-        # Process each bill
-        for bill in bills:
-            creator = User.query.get(bill.created_by_id) if bill.created_by_id else None
-            creator_name = creator.username if creator else 'Unknown'
-            parent_count = BillBag.query.filter_by(bill_id=bill.id).count()
-            
-            eod_data['total_parent_bags'] += parent_count
-            eod_data['total_child_bags'] += getattr(bill, 'total_child_bags', 0) or 0
-            eod_data['total_weight_kg'] += bill.total_weight_kg or 0
-            
-            status = bill.status or 'new'
-            eod_data['bills_by_status'][status] = eod_data['bills_by_status'].get(status, 0) + 1
-            eod_data['bills_by_user'][creator_name] = eod_data['bills_by_user'].get(creator_name, 0) + 1
-            
-            eod_data['detailed_bills'].append({
-                'bill_id': bill.bill_id,
-                'created_by': creator_name,
-                'created_at': bill.created_at.isoformat(),
-                'status': status,
-                'parent_bags': parent_count,
-                'expected_bags': bill.parent_bag_count,
-                'child_bags': getattr(bill, 'total_child_bags', 0) or 0,
-                'weight_kg': bill.total_weight_kg or 0
-            })
+        # EOD data from the daily rollup (same source as eod_bill_summary)
+        report_day, error = _eod_report_day()
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        eod_data = get_eod_summary(report_day)
         
         # Get recipient list: all admins and billers
         recipients = User.query.filter(
@@ -8062,7 +7882,7 @@ def api_bags_endpoint():
             query = query.filter(Bag.type == bag_type)
         
         if search:
-            query = query.filter(Bag.qr_id.ilike(f'%{search}%'))
+            query = query.filter(match_filter('bag', search))
         
         # Order by creation date (newest first) for consistent pagination
         query = query.order_by(Bag.created_at.desc(), Bag.id.desc())
@@ -8148,7 +7968,18 @@ def api_bag_detail(qr_id):
         from models import Bag
         from sqlalchemy import func
         
-        bag = Bag.query.filter(func.upper(Bag.qr_id) == func.upper(qr_id)).first()
+        # Known bags load by primary key via the QR identity cache
+        bag = None
+        identity = query_optimizer.get_cached_bag(qr_id)
+        if identity:
+            bag = db.session.get(Bag, identity.id)
+            if not bag:
+                query_optimizer.invalidate_cache(qr_id)
+        
+        if not bag:
+            bag = Bag.query.filter(Bag.qr_match(qr_id)).first()
+            if bag:
+                query_optimizer.cache_bag(bag.id, bag.type, bag.qr_id)
         
         if not bag:
             return jsonify({
@@ -8704,6 +8535,29 @@ def import_batch_multi():
                     flash(f'Invalid file type: {file.filename}. Only Excel files (.xlsx, .xls, .xlsm) are allowed.', 'error')
                     return redirect(url_for('import_batch_multi'))
         
+        if import_type not in ('child_parent', 'parent_bill'):
+            flash('Invalid import type.', 'error')
+            return redirect(url_for('import_batch_multi'))
+        
+        # Queue the import as a background job - the request returns immediately with a job id
+        if os.environ.get('IMPORT_JOBS_ENABLED', 'true').lower() == 'true':
+            from import_jobs import get_import_job_queue
+            dispatch_area = request.form.get('dispatch_area', '').strip() or None
+            job_id = get_import_job_queue().submit(
+                files, current_user.id, import_type,  # type: ignore
+                dispatch_area=dispatch_area if import_type == 'child_parent' else None
+            )
+            
+            if request.accept_mimetypes.best == 'application/json' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'status_url': url_for('api_import_job_status', job_id=job_id)
+                }), 202
+            
+            flash(f'Import of {len(files)} file(s) started. This page updates as the import runs.', 'info')
+            return redirect(url_for('import_job_status', job_id=job_id))
+        
         # Process files based on import type - use streaming for large file support
         all_row_results = []
         
@@ -8815,6 +8669,79 @@ def import_batch_multi():
         return redirect(url_for('import_batch_multi'))
 
 
+def _get_owned_import_job(job_id):
+    """Load an import job visible to the current admin user, or None"""
+    from models import ImportJob
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.user_id != current_user.id:  # type: ignore
+        return None
+    return job
+
+
+@app.route('/import/jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    """Progress page for a background import job (polls the status API)"""
+    if not current_user.is_admin():
+        flash('Admin access required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    job = _get_owned_import_job(job_id)
+    if not job:
+        flash('Import job not found or expired.', 'error')
+        return redirect(url_for('import_batch_multi'))
+    
+    return render_template('import_job_status.html', job=job)
+
+
+@app.route('/api/import/jobs/<job_id>')
+@login_required
+def api_import_job_status(job_id):
+    """Import job status: progress, rows/sec, ETA and download links once finished"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    job = _get_owned_import_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Import job not found'}), 404
+    
+    from import_jobs import job_status
+    status = job_status(job)
+    status['downloads'] = {
+        kind: url_for('download_import_job_file', job_id=job_id, kind=kind)
+        for kind, filename in (('results', job.result_file), ('errors', job.error_report_file))
+        if filename
+    }
+    return jsonify(dict(status, success=True))
+
+
+@app.route('/import/jobs/<job_id>/download/<kind>')
+@login_required
+def download_import_job_file(job_id, kind):
+    """Download a finished import job's result workbook or error report"""
+    if not current_user.is_admin():
+        flash('Admin access required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    job = _get_owned_import_job(job_id)
+    filename = None
+    if job:
+        filename = {'results': job.result_file, 'errors': job.error_report_file}.get(kind)
+    
+    from import_jobs import job_dir
+    file_path = os.path.join(job_dir(job_id), filename) if filename else None
+    if not file_path or not os.path.exists(file_path):
+        flash('Import report not found. It may have expired or been cleaned up.', 'error')
+        return redirect(url_for('import_batch_multi'))
+    
+    return send_file(
+        file_path,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'import_{kind}_{job_id[:8]}.xlsx'
+    )
+
+
 @app.route('/import/batch_multi/results/<report_id>')
 @login_required
 def import_batch_multi_results(report_id):
@@ -9094,46 +9021,41 @@ def user_activity_dashboard():
         recent_logins = recent_logins_query.order_by(AuditLog.timestamp.desc()).limit(50).all()
         
         # ===== SECTION 2: LOGIN STATISTICS =====
-        login_stats_query = text("""
-            WITH login_events AS (
-                SELECT 
-                    user_id,
-                    action,
-                    COUNT(*) as count
-                FROM audit_log
-                WHERE timestamp >= :start_date
-                AND action IN ('login_success', 'login_failed_invalid_password', 
-                              'login_blocked_account_locked', '2fa_verify_success_login_complete')
-                GROUP BY user_id, action
-            ),
-            user_login_stats AS (
-                SELECT 
-                    u.id,
-                    u.username,
-                    u.role,
-                    COALESCE(MAX(CASE WHEN le.action IN ('login_success', '2fa_verify_success_login_complete') 
-                                     THEN le.count END), 0) as successful_logins,
-                    COALESCE(MAX(CASE WHEN le.action = 'login_failed_invalid_password' 
-                                     THEN le.count END), 0) as failed_logins,
-                    COALESCE(MAX(CASE WHEN le.action = 'login_blocked_account_locked' 
-                                     THEN le.count END), 0) as locked_attempts
-                FROM "user" u
-                LEFT JOIN login_events le ON u.id = le.user_id
-                GROUP BY u.id, u.username, u.role
-                HAVING COALESCE(MAX(CASE WHEN le.action IN ('login_success', '2fa_verify_success_login_complete') 
-                                        THEN le.count END), 0) > 0
-                   OR COALESCE(MAX(CASE WHEN le.action = 'login_failed_invalid_password' 
-                                        THEN le.count END), 0) > 0
-            )
-            SELECT * FROM user_login_stats
-            ORDER BY successful_logins DESC
-            LIMIT 20
-        """)
+        # Per-user login counts from the hourly audit rollup (window rounded to whole hours)
+        from activity_rollup import get_audit_counts, floor_hour
+        rollup_end = floor_hour(end_date) + timedelta(hours=1)
+        login_counts = get_audit_counts(
+            start_date, rollup_end, group_by=('user_id', 'action'),
+            actions=['login_success', 'login_failed_invalid_password',
+                     'login_blocked_account_locked', '2fa_verify_success_login_complete']
+        )
         
-        login_stats = db.session.execute(
-            login_stats_query,
-            {'start_date': start_date}
-        ).fetchall()
+        per_user = {}
+        for user_id, action, count in login_counts:
+            if not user_id:
+                continue
+            counts = per_user.setdefault(user_id, {'successful_logins': 0, 'failed_logins': 0, 'locked_attempts': 0})
+            if action in ('login_success', '2fa_verify_success_login_complete'):
+                # Same as before: the larger of the two success counts, not their sum
+                counts['successful_logins'] = max(counts['successful_logins'], count)
+            elif action == 'login_failed_invalid_password':
+                counts['failed_logins'] = count
+            else:
+                counts['locked_attempts'] = count
+        per_user = {user_id: counts for user_id, counts in per_user.items()
+                    if counts['successful_logins'] > 0 or counts['failed_logins'] > 0}
+        
+        login_users = {
+            user.id: user for user in
+            User.query.filter(User.id.in_(list(per_user))).all()
+        } if per_user else {}
+        login_stats = sorted(
+            (
+                dict(counts, id=user_id, username=login_users[user_id].username, role=login_users[user_id].role)
+                for user_id, counts in per_user.items() if user_id in login_users
+            ),
+            key=lambda stat: stat['successful_logins'], reverse=True
+        )[:20]
         
         # ===== SECTION 3: CURRENTLY ACTIVE USERS =====
         # Consider users active if they have ANY audit log activity in last hour
@@ -9205,19 +9127,13 @@ def user_activity_dashboard():
         twofa_events = twofa_events_query.all()
         
         # ===== SECTION 7: AGGREGATE STATISTICS =====
-        total_logins_today = AuditLog.query.filter(
-            and_(
-                AuditLog.timestamp >= datetime.utcnow() - timedelta(days=1),
-                AuditLog.action.in_(['login_success', '2fa_verify_success_login_complete'])
-            )
-        ).count()
-        
-        total_failed_today = AuditLog.query.filter(
-            and_(
-                AuditLog.timestamp >= datetime.utcnow() - timedelta(days=1),
-                AuditLog.action == 'login_failed_invalid_password'
-            )
-        ).count()
+        last_day_counts = dict(get_audit_counts(
+            rollup_end - timedelta(days=1), rollup_end, group_by=('action',),
+            actions=['login_success', '2fa_verify_success_login_complete', 'login_failed_invalid_password']
+        ))
+        total_logins_today = (last_day_counts.get('login_success', 0) +
+                              last_day_counts.get('2fa_verify_success_login_complete', 0))
+        total_failed_today = last_day_counts.get('login_failed_invalid_password', 0)
         
         unique_active_users = len(active_users)
         
@@ -9295,8 +9211,9 @@ def reports_page():
         today = datetime.now()
         week_ago = today - timedelta(days=7)
         
-        # Recent activity stats
-        recent_scans = db.session.query(Scan).filter(Scan.timestamp >= week_ago).count()
+        # Recent activity stats (scans from the hourly rollup)
+        from activity_rollup import get_scan_counts
+        recent_scans = get_scan_counts(week_ago, today + timedelta(hours=1))[0][0]
         recent_bills = db.session.query(Bill).filter(Bill.created_at >= week_ago).count()
         
         report_data = {
@@ -0,0 +1,322 @@
+"""
+Scan De-duplication Store - Cross-Worker Double-Scan Protection
+
+Blocks a (bill, bag) pair that was already scanned within SCAN_COOLDOWN_SECONDS,
+before /fast/bill_parent_scan opens its database transaction.
+
+DESIGN DECISIONS:
+- Pluggable backend so a double-scan is caught whichever gunicorn worker it lands on:
+  - 'shared' (default): a time wheel in a memory-mapped file in /dev/shm, shared by
+    every worker on the host (flock() serialises check-and-record)
+  - 'postgres': the UNLOGGED scan_dedupe table (created by migration) for multi-node
+    deployments (one INSERT ... ON CONFLICT round-trip per scan, no WAL)
+  - 'memory': per-process time wheel (previous per-worker behaviour, used as the fallback)
+- Time wheel expiry: one bucket per second, WHEEL_SLOTS buckets in a ring. Writing into
+  a bucket whose second has passed resets just that bucket - there is never a sweep
+  over all entries, and memory is fixed.
+- Fails open: if the store errors the scan proceeds; ultra_fast_bill_parent_scan still
+  rejects real duplicates inside its transaction.
+"""
+import os
+import mmap
+import math
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from validation_utils import InputValidator
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+SCAN_COOLDOWN_SECONDS = float(os.environ.get('SCAN_COOLDOWN_SECONDS', '3'))  # Block duplicate scans within 3 seconds
+WHEEL_SLOTS = int(math.ceil(SCAN_COOLDOWN_SECONDS)) + 2  # One-second buckets covering the cooldown window
+BUCKET_CAPACITY = int(os.environ.get('SCAN_DEDUPE_BUCKET_CAPACITY', '4096'))  # Scans recorded per second (shared backend)
+POSTGRES_CLEANUP_EVERY = 200  # Postgres backend: delete a batch of expired rows every N scans
+POSTGRES_CLEANUP_BATCH = 1000
+
+
+def scan_key(bill_id, qr_code) -> str:
+    """Canonical key for a (bill, bag) pair"""
+    return f"{int(bill_id)}|{InputValidator.normalize_qr(qr_code)}"
+
+
+class LocalMemoryBackend:
+    """Per-process time wheel (only shared between threads of one worker)"""
+
+    name = 'memory'
+
+    def __init__(self, cooldown: float = SCAN_COOLDOWN_SECONDS):
+        self.cooldown = cooldown
+        self.slots = int(math.ceil(cooldown)) + 2
+        self._lock = threading.Lock()
+        self._seconds = [-1] * self.slots
+        self._buckets = [dict() for _ in range(self.slots)]
+
+    def check_and_record(self, key: str, now: float) -> bool:
+        """Return True if key was recorded within the cooldown, otherwise record it"""
+        second = int(now)
+        with self._lock:
+            for offset in range(self.slots - 1):
+                index = (second - offset) % self.slots
+                if self._seconds[index] != second - offset:
+                    continue
+                scanned_at = self._buckets[index].get(key)
+                if scanned_at is not None and now - scanned_at < self.cooldown:
+                    return True
+
+            index = second % self.slots
+            if self._seconds[index] != second:
+                self._seconds[index] = second
+                self._buckets[index] = {}
+            self._buckets[index][key] = now
+            return False
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(len(bucket) for bucket in self._buckets)
+
+
+class SharedMemoryBackend:
+    """
+    Host-wide time wheel in a memory-mapped file in /dev/shm (tmpfs, never touches disk).
+
+    Layout: WHEEL_SLOTS buckets, each an 8-byte second stamp followed by
+    BUCKET_CAPACITY open-addressing slots of (8-byte key hash, 8-byte scanned_at ms).
+    A bucket whose stamp is not the current second is zeroed before it is reused.
+    """
+
+    name = 'shared'
+    HEADER = struct.Struct('<q')
+    SLOT = struct.Struct('<QQ')
+
+    def __init__(self, path: Optional[str] = None, cooldown: float = SCAN_COOLDOWN_SECONDS,
+                 capacity: int = BUCKET_CAPACITY):
+        if path is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(base, 'traitortrack-scan-dedupe.wheel')
+        self.path = path
+        self.cooldown_ms = int(cooldown * 1000)
+        self.slots = int(math.ceil(cooldown)) + 2
+        self.capacity = capacity
+        self.bucket_size = self.HEADER.size + capacity * self.SLOT.size
+        self.overflows = 0
+
+        size = self.slots * self.bucket_size
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                # New file, or one sized for another configuration: start empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()  # flock() does not exclude threads sharing our fd
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+        return digest or 1  # 0 marks an empty slot
+
+    def _find(self, offset: int, key_hash: int):
+        """Probe one bucket. Returns (slot_offset, scanned_at_ms), (free_offset, None) or (None, None) if full"""
+        start = key_hash % self.capacity
+        for probe in range(self.capacity):
+            slot_offset = offset + self.HEADER.size + ((start + probe) % self.capacity) * self.SLOT.size
+            slot_hash, scanned_at = self.SLOT.unpack_from(self._map, slot_offset)
+            if slot_hash == key_hash:
+                return slot_offset, scanned_at
+            if slot_hash == 0:
+                return slot_offset, None
+        return None, None
+
+    def check_and_record(self, key: str, now: float) -> bool:
+        """Return True if key was recorded within the cooldown, otherwise record it"""
+        key_hash = self._hash(key)
+        now_ms = int(now * 1000)
+        second = int(now)
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for back in range(self.slots - 1):
+                    offset = ((second - back) % self.slots) * self.bucket_size
+                    if self.HEADER.unpack_from(self._map, offset)[0] != second - back:
+                        continue
+                    _, scanned_at = self._find(offset, key_hash)
+                    if scanned_at is not None and now_ms - scanned_at < self.cooldown_ms:
+                        return True
+
+                offset = (second % self.slots) * self.bucket_size
+                if self.HEADER.unpack_from(self._map, offset)[0] != second:
+                    # Rotate the wheel: reset only this bucket
+                    self._map[offset:offset + self.bucket_size] = bytes(self.bucket_size)
+                    self.HEADER.pack_into(self._map, offset, second)
+
+                slot_offset, _ = self._find(offset, key_hash)
+                if slot_offset is None:
+                    self.overflows += 1  # More than BUCKET_CAPACITY scans this second - fail open
+                else:
+                    self.SLOT.pack_into(self._map, slot_offset, key_hash, now_ms)
+                return False
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def size(self) -> int:
+        """Entries recorded in the live buckets"""
+        second = int(time.time())
+        count = 0
+        with self._lock:
+            for back in range(self.slots - 1):
+                offset = ((second - back) % self.slots) * self.bucket_size
+                if self.HEADER.unpack_from(self._map, offset)[0] != second - back:
+                    continue
+                for i in range(self.capacity):
+                    if self.SLOT.unpack_from(self._map, offset + self.HEADER.size + i * self.SLOT.size)[0]:
+                        count += 1
+        return count
+
+
+class PostgresBackend:
+    """
+    Backend for multi-node deployments: an UNLOGGED table keyed by (bill, bag).
+
+    The upsert only overwrites a row older than the cooldown, so RETURNING yields a row
+    exactly when the scan is new. Expired rows are removed in small batches via the
+    scanned_at index - never a full-table sweep.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, db, cooldown: float = SCAN_COOLDOWN_SECONDS):
+        self.db = db
+        self.cooldown = cooldown
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def check_and_record(self, key: str, now: float) -> bool:
+        """Return True if key was recorded within the cooldown, otherwise record it"""
+        from sqlalchemy import text
+
+        with self._lock:
+            self._calls += 1
+            cleanup = self._calls % POSTGRES_CLEANUP_EVERY == 0
+
+        # Own short transaction - never part of the request's session
+        with self.db.engine.begin() as conn:
+            recorded = conn.execute(text("""
+                INSERT INTO scan_dedupe (scan_key, scanned_at)
+                VALUES (:key, clock_timestamp())
+                ON CONFLICT (scan_key) DO UPDATE SET scanned_at = EXCLUDED.scanned_at
+                WHERE scan_dedupe.scanned_at < EXCLUDED.scanned_at - make_interval(secs => :cooldown)
+                RETURNING 1
+            """), {'key': key, 'cooldown': self.cooldown}).fetchone()
+
+            if cleanup:
+                conn.execute(text("""
+                    DELETE FROM scan_dedupe
+                    WHERE scan_key IN (
+                        SELECT scan_key FROM scan_dedupe
+                        WHERE scanned_at < clock_timestamp() - make_interval(secs => :cooldown)
+                        LIMIT :batch
+                    )
+                """), {'cooldown': self.cooldown, 'batch': POSTGRES_CLEANUP_BATCH})
+
+        return recorded is None
+
+    def size(self) -> Optional[int]:
+        return None  # Not tracked - counting would scan the table
+
+
+def create_backend(backend_name: Optional[str] = None):
+    """
+    Create the configured de-duplication backend (SCAN_DEDUPE_BACKEND: shared|postgres|memory).
+    Falls back to the per-process memory backend if the requested one is unavailable.
+    """
+    backend_name = (backend_name or os.environ.get('SCAN_DEDUPE_BACKEND', 'shared')).lower()
+
+    try:
+        if backend_name == 'postgres':
+            from app import db
+            return PostgresBackend(db)
+        elif backend_name == 'shared':
+            if FCNTL_AVAILABLE:
+                return SharedMemoryBackend(os.environ.get('SCAN_DEDUPE_FILE'))
+            logger.warning("Shared scan de-duplication requires fcntl - using memory backend")
+    except Exception as e:
+        logger.warning(f"Scan dedupe backend '{backend_name}' failed to initialize ({e}) - using memory backend")
+
+    return LocalMemoryBackend()
+
+
+class ScanDeduplicator:
+    """Cross-worker check-and-record of recent (bill, bag) scans with hit/miss counters."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'hits': 0,  # Duplicate scans blocked
+            'misses': 0,  # New scans recorded
+            'backend_errors': 0
+        }
+
+    def _count(self, metric: str) -> None:
+        with self._metrics_lock:
+            self._metrics[metric] += 1
+
+    def is_duplicate(self, bill_id, qr_code) -> bool:
+        """Check if this bag was scanned for this bill within the cooldown, recording it if not"""
+        try:
+            duplicate = self.backend.check_and_record(scan_key(bill_id, qr_code), time.time())
+        except Exception as e:
+            self._count('backend_errors')
+            logger.warning(f"Scan dedupe check failed ({self.backend.name}): {e}")
+            return False
+
+        self._count('hits' if duplicate else 'misses')
+        return duplicate
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get de-duplication statistics for monitoring (metrics are per worker)."""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        checks = metrics['hits'] + metrics['misses']
+        try:
+            size = self.backend.size()
+        except Exception:
+            size = None
+
+        return {
+            'backend': self.backend.name,
+            'cooldown_seconds': SCAN_COOLDOWN_SECONDS,
+            'entries': size,
+            'overflows': getattr(self.backend, 'overflows', 0),
+            'hit_rate': round(metrics['hits'] / checks * 100, 1) if checks else 0.0,
+            **metrics
+        }
+
+
+_scan_deduplicator = None
+_init_lock = threading.Lock()
+
+
+def get_scan_deduplicator() -> ScanDeduplicator:
+    """Get the global scan deduplicator (backend created on first use, after any fork)."""
+    global _scan_deduplicator
+    if _scan_deduplicator is None:
+        with _init_lock:
+            if _scan_deduplicator is None:
+                _scan_deduplicator = ScanDeduplicator()
+    return _scan_deduplicator
@@ -0,0 +1,491 @@
+"""
+Monthly Table Partition Maintenance
+The scan and audit_log tables are range-partitioned by month on timestamp
+(<table>_yYYYYmMM) with a DEFAULT partition (<table>_default) as a safety net, so
+a row is never rejected because its month is missing.
+
+Every worker runs a maintainer thread that keeps the current month and the next
+SCAN_PARTITION_MONTHS_AHEAD months created for each table in PARTITIONED_TABLES;
+pg_try_advisory_xact_lock makes sure only one worker does DDL at a time.
+Time-bounded queries prune to the partitions they touch, so per-partition indexes
+stay small no matter how much history exists.
+
+Databases created before partitioning are converted with partition_table()
+(manage.py partition-table, in a maintenance window - it locks the table for the
+whole copy). Until then both tables work unpartitioned and the maintainer skips them.
+
+Old scan months are taken out of the live table with detach_scan_partitions(),
+which moves them into the scan_archive schema (kept, queryable, droppable later).
+Old audit_log months are dropped by audit_retention.py.
+
+The same thread purges scan_sync_receipt rows older than SCAN_SYNC_RECEIPT_TTL_DAYS
+(a device only replays a batch to recover a lost response, so old receipts are
+never read again).
+"""
+
+import logging
+import os
+from datetime import date, datetime, timedelta
+from threading import Thread, Event
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from activity_rollup import mark_stale_hours
+
+logger = logging.getLogger(__name__)
+
+# Months of future partitions kept ready (the current month is always created)
+SCAN_PARTITION_MONTHS_AHEAD = int(os.environ.get('SCAN_PARTITION_MONTHS_AHEAD', '3'))
+
+# Months of scans kept in the live table; older partitions are detached to the archive
+# schema by the maintainer. 0 disables automatic archiving.
+SCAN_PARTITION_RETAIN_MONTHS = int(os.environ.get('SCAN_PARTITION_RETAIN_MONTHS', '0'))
+
+SCAN_ARCHIVE_SCHEMA = 'scan_archive'
+
+# Days offline-sync receipts are kept - longer than any device stays offline
+# with an unacknowledged batch. 0 disables purging.
+SCAN_SYNC_RECEIPT_TTL_DAYS = int(os.environ.get('SCAN_SYNC_RECEIPT_TTL_DAYS', '14'))
+
+# Receipts deleted per transaction
+SCAN_SYNC_RECEIPT_PURGE_BATCH = int(os.environ.get('SCAN_SYNC_RECEIPT_PURGE_BATCH', '5000'))
+
+# Tables partitioned by RANGE (timestamp) whose future months the maintainer creates
+PARTITIONED_TABLES = ('scan', 'audit_log')
+
+# Advisory lock serializing partition DDL across workers
+PARTITION_LOCK_ID = 500000
+
+
+def month_start(value) -> date:
+    """First day of the month containing value (date or datetime)"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    """Shift a first-of-month date by count months"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date, table: str = 'scan') -> str:
+    """Partition table name for a month, e.g. scan_y2026m02"""
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def default_partition_name(table: str = 'scan') -> str:
+    """Name of the DEFAULT partition of a table, e.g. scan_default"""
+    return f"{table}_default"
+
+
+def partition_month(name: str, table: str = 'scan') -> Optional[date]:
+    """Month covered by a monthly partition name, or None for any other partition"""
+    suffix = name[len(table):]
+    if not name.startswith(table) or len(suffix) != 9 or not suffix.startswith('_y'):
+        return None
+    try:
+        return date(int(suffix[2:6]), int(suffix[7:9]), 1)
+    except ValueError:
+        return None
+
+
+def is_partitioned(conn, table: str = 'scan') -> bool:
+    """True when table is a partitioned table (False on SQLite or before the migration)"""
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)
+    """), {"table": table}).fetchone() is not None
+
+
+def is_scan_partitioned(conn) -> bool:
+    """True when scan is a partitioned table"""
+    return is_partitioned(conn, 'scan')
+
+
+def list_partitions(conn, table: str = 'scan') -> List[Dict]:
+    """Attached partitions with their bounds, planner row estimate and total size"""
+    rows = conn.execute(text("""
+        SELECT c.relname,
+               pg_get_expr(c.relpartbound, c.oid) AS bounds,
+               GREATEST(c.reltuples, 0)::bigint AS estimated_rows,
+               pg_total_relation_size(c.oid) AS total_bytes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+        ORDER BY c.relname
+    """), {"table": table}).fetchall()
+    return [
+        {'name': r[0], 'bounds': r[1], 'estimated_rows': r[2], 'total_bytes': r[3]}
+        for r in rows
+    ]
+
+
+def list_scan_partitions(conn) -> List[Dict]:
+    """Attached scan partitions"""
+    return list_partitions(conn, 'scan')
+
+
+def create_month_partition(conn, month: date, table: str = 'scan') -> bool:
+    """
+    Create the partition for one month. Returns True if it was created.
+
+    Rows for that month already sitting in the DEFAULT partition (the month was
+    missing when they arrived) are moved into the new partition; the move goes
+    through the partitions directly, so statement triggers on the parent (the
+    scan statistics counters) do not count them twice.
+    """
+    name = partition_name(month, table)
+    default_partition = default_partition_name(table)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+
+    bounds = {"start": month, "end": add_months(month, 1)}
+    has_default = conn.execute(text("SELECT to_regclass(:name)"), {"name": default_partition}).scalar()
+    strays = has_default and conn.execute(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {default_partition}
+            WHERE timestamp >= :start AND timestamp < :end
+        )
+    """), bounds).scalar()
+
+    range_sql = f"FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+    if not strays:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {range_sql}"))
+        return True
+
+    logger.warning(f"Moving {table} rows for {month:%Y-%m} out of {default_partition} into {name}")
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {default_partition}
+            WHERE timestamp >= :start AND timestamp < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds)
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {range_sql}"))
+    return True
+
+
+def ensure_partitions(conn, table: str = 'scan', months_ahead: Optional[int] = None,
+                      today: Optional[date] = None) -> List[str]:
+    """
+    Make sure the DEFAULT partition and the partitions from the current month through
+    months_ahead months from now exist. Idempotent; returns the partitions created.
+    """
+    if months_ahead is None:
+        months_ahead = SCAN_PARTITION_MONTHS_AHEAD
+    current = month_start(today or datetime.utcnow())
+
+    created = []
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {default_partition_name(table)} PARTITION OF {table} DEFAULT"))
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if create_month_partition(conn, month, table):
+            created.append(partition_name(month, table))
+    return created
+
+
+def ensure_scan_partitions(conn, months_ahead: Optional[int] = None, today: Optional[date] = None) -> List[str]:
+    """Make sure the scan DEFAULT partition and upcoming monthly partitions exist"""
+    return ensure_partitions(conn, 'scan', months_ahead, today)
+
+
+def partition_table(conn, table: str, months_ahead: Optional[int] = None) -> Optional[Dict]:
+    """
+    Convert an unpartitioned table (one of PARTITIONED_TABLES) to monthly range
+    partitions in place. Same columns and defaults, PRIMARY KEY (id, timestamp), one
+    partition per month from the oldest row through months_ahead plus the DEFAULT
+    partition; the indexes, foreign keys and triggers the old table had are read
+    from the catalog and recreated after the copy (so statistics triggers do not
+    count the copied rows again). Rows without a timestamp land in the DEFAULT
+    partition at the epoch.
+
+    Holds an ACCESS EXCLUSIVE lock on table for the whole copy, so it is run
+    explicitly (manage.py partition-table) in a maintenance window - never from
+    the migrations applied at startup.
+
+    Returns:
+        {partitions, rows} for the conversion, or None if table is already partitioned
+    """
+    if is_partitioned(conn, table):
+        return None
+
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    old = f"{table}_unpartitioned"
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                            {"table": table}).scalar() or f"{table}_id_seq"
+    oldest = conn.execute(text(f"SELECT MIN(timestamp) FROM {table}")).scalar()
+    columns = [row[0] for row in conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """), {"table": table})]
+    # Definitions are read before the rename, so they name the new table
+    indexes = conn.execute(text("""
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = to_regclass(:table) AND NOT x.indisprimary
+    """), {"table": table}).fetchall()
+    foreign_keys = conn.execute(text("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(:table) AND contype = 'f'
+    """), {"table": table}).fetchall()
+    triggers = conn.execute(text("""
+        SELECT pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = to_regclass(:table) AND NOT tgisinternal
+    """), {"table": table}).fetchall()
+    primary_key = conn.execute(text("""
+        SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype = 'p'
+    """), {"table": table}).scalar()
+
+    # Free the schema-wide index and constraint names held by the old table
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    for name, _ in indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    if primary_key:
+        conn.execute(text(f'ALTER TABLE {old} RENAME CONSTRAINT "{primary_key}" TO {old}_pkey'))
+
+    conn.execute(text(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"))
+    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN timestamp SET DEFAULT NOW()"))
+    conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, timestamp)"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+    partitions = []
+    current = month_start(datetime.utcnow())
+    month = month_start(oldest) if oldest else current
+    while month < current:
+        create_month_partition(conn, month, table)
+        partitions.append(partition_name(month, table))
+        month = add_months(month, 1)
+    partitions.extend(ensure_partitions(conn, table, months_ahead))
+
+    column_list = ', '.join(columns)
+    select_list = ', '.join("COALESCE(timestamp, 'epoch'::timestamp)" if c == 'timestamp' else c for c in columns)
+    rows = conn.execute(text(f"INSERT INTO {table} ({column_list}) SELECT {select_list} FROM {old}")).rowcount
+
+    for name, definition in indexes:
+        conn.execute(text(definition.replace(' ON ONLY ', ' ON ')))
+    for name, definition in foreign_keys:
+        conn.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'))
+    for (definition,) in triggers:
+        conn.execute(text(definition))
+    conn.execute(text(f"DROP TABLE {old}"))
+    conn.execute(text(f"ANALYZE {table}"))
+
+    logger.info(f"Partitioned {table}: {len(partitions)} monthly partitions, {rows} rows copied")
+    return {'partitions': partitions, 'rows': rows}
+
+
+def detach_scan_partitions(conn, before: date, archive_schema: str = SCAN_ARCHIVE_SCHEMA) -> List[Dict]:
+    """
+    Detach every monthly partition that ends on or before `before` and move it to
+    archive_schema. The detached rows leave the live scan table, so their count is
+    subtracted from the total_scans statistic with one statistics_delta row and
+    their hours are marked stale in the activity rollup.
+
+    Returns:
+        List of {name, rows} for the archived partitions
+    """
+    cutoff = month_start(before)
+    archived = []
+    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+
+    for partition in list_scan_partitions(conn):
+        name = partition['name']
+        month = partition_month(name, 'scan')
+        if month is None or add_months(month, 1) > cutoff:
+            continue
+
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar() or 0
+        conn.execute(text(f"ALTER TABLE scan DETACH PARTITION {name}"))
+        conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+        if rows:
+            conn.execute(text("""
+                INSERT INTO statistics_delta (counter, delta) VALUES ('total_scans', :delta)
+            """), {"delta": -rows})
+            mark_stale_hours(conn, 'scan', datetime.combine(month, datetime.min.time()),
+                             datetime.combine(add_months(month, 1), datetime.min.time()))
+        archived.append({'name': f"{archive_schema}.{name}", 'rows': rows})
+        logger.info(f"Archived scan partition {name} ({rows} rows) to {archive_schema}")
+
+    return archived
+
+
+def purge_sync_receipts(engine, ttl_days: int = SCAN_SYNC_RECEIPT_TTL_DAYS,
+                        batch_size: int = SCAN_SYNC_RECEIPT_PURGE_BATCH) -> int:
+    """
+    Delete scan_sync_receipt rows older than ttl_days, oldest first, one short
+    transaction per batch (idx_scan_sync_receipt_created finds each batch).
+
+    Returns:
+        Number of receipts deleted
+    """
+    cutoff = datetime.utcnow() - timedelta(days=ttl_days)
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            deleted = conn.execute(text("""
+                DELETE FROM scan_sync_receipt WHERE client_scan_id IN (
+                    SELECT client_scan_id FROM scan_sync_receipt
+                    WHERE created_at < :cutoff
+                    ORDER BY created_at
+                    LIMIT :batch_size
+                )
+            """), {"cutoff": cutoff, "batch_size": batch_size}).rowcount
+        total += deleted
+        if deleted < batch_size:
+            break
+    if total:
+        logger.info(f"Purged {total} scan sync receipts older than {ttl_days} days")
+    return total
+
+
+class ScanPartitionMaintainer:
+    """Background thread that keeps future monthly partitions created, optionally archives old scans
+    and purges expired offline-sync receipts"""
+
+    # How often partitions are checked (seconds) - creation is a no-op once they exist
+    CHECK_INTERVAL = int(os.environ.get('SCAN_PARTITION_CHECK_INTERVAL', '21600'))  # Default: 6 hours
+
+    def __init__(self, app, db, enabled=True):
+        """
+        Initialize partition maintainer
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            enabled: Whether maintenance is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.stop_event = Event()
+        self.maintainer_thread = None
+        self.stats = {
+            'runs': 0,
+            'skipped_busy': 0,
+            'partitions_created': 0,
+            'partitions_archived': 0,
+            'receipts_purged': 0,
+            'last_run': None,
+            'errors': 0
+        }
+
+    def start(self):
+        """Start maintenance in background thread"""
+        if not self.enabled:
+            logger.info("Scan partition maintainer is disabled")
+            return
+
+        if self.maintainer_thread and self.maintainer_thread.is_alive():
+            logger.warning("Scan partition maintainer already running")
+            return
+
+        self.stop_event.clear()
+        self.maintainer_thread = Thread(target=self._maintain_loop, daemon=True, name='scan-partitions')
+        self.maintainer_thread.start()
+        logger.info(f"Scan partition maintainer started - checking every {self.CHECK_INTERVAL}s, "
+                    f"{SCAN_PARTITION_MONTHS_AHEAD} months ahead")
+
+    def stop(self):
+        """Stop maintenance"""
+        if not self.maintainer_thread:
+            return
+
+        self.stop_event.set()
+        self.maintainer_thread.join(timeout=5)
+        logger.info("Scan partition maintainer stopped")
+
+    def _maintain_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.is_set():
+            try:
+                self.maintain_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Scan partition maintenance error: {e}")
+
+            try:
+                self.purge_receipts_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Scan sync receipt purge error: {e}")
+
+            # Wait for next tick or stop event
+            self.stop_event.wait(self.CHECK_INTERVAL)
+
+    def maintain_once(self) -> Optional[Dict]:
+        """Run one maintenance pass. Returns what was done, or None if skipped."""
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                tables = [table for table in PARTITIONED_TABLES if is_partitioned(conn, table)]
+                if not tables:
+                    return None
+
+                # Another worker is already doing this pass
+                if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:id)"),
+                                    {"id": PARTITION_LOCK_ID}).scalar():
+                    self.stats['skipped_busy'] += 1
+                    return None
+
+                created = []
+                for table in tables:
+                    created.extend(ensure_partitions(conn, table))
+                archived = []
+                if SCAN_PARTITION_RETAIN_MONTHS > 0 and 'scan' in tables:
+                    cutoff = add_months(month_start(datetime.utcnow()), -SCAN_PARTITION_RETAIN_MONTHS)
+                    archived = detach_scan_partitions(conn, cutoff)
+
+        self.stats['runs'] += 1
+        self.stats['partitions_created'] += len(created)
+        self.stats['partitions_archived'] += len(archived)
+        self.stats['last_run'] = datetime.utcnow().isoformat()
+        if created:
+            logger.info(f"Created scan partitions: {', '.join(created)}")
+        return {'created': created, 'archived': archived}
+
+    def purge_receipts_once(self) -> int:
+        """Purge expired scan sync receipts. Returns receipts deleted."""
+        if SCAN_SYNC_RECEIPT_TTL_DAYS <= 0:
+            return 0
+        with self.app.app_context():
+            purged = purge_sync_receipts(self.db.engine)
+        self.stats['receipts_purged'] += purged
+        return purged
+
+    def get_stats(self) -> Dict:
+        """Get maintainer statistics for monitoring"""
+        return dict(self.stats, running=bool(self.maintainer_thread and self.maintainer_thread.is_alive()))
+
+
+# Global maintainer instance (initialized in app.py)
+scan_partition_maintainer: Optional[ScanPartitionMaintainer] = None
+
+
+def get_scan_partition_maintainer() -> Optional[ScanPartitionMaintainer]:
+    """Get the global scan partition maintainer instance"""
+    return scan_partition_maintainer
+
+
+def init_scan_partition_maintainer(app, db, enabled=True):
+    """
+    Initialize and start the global scan partition maintainer
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable maintenance (default: True)
+    """
+    global scan_partition_maintainer
+
+    scan_partition_maintainer = ScanPartitionMaintainer(app, db, enabled=enabled)
+    scan_partition_maintainer.start()
+
+    from shutdown_handler import register_cleanup_callback
+    register_cleanup_callback(scan_partition_maintainer.stop, "scan_partition_maintainer_stop")
+
+    return scan_partition_maintainer
@@ -0,0 +1,264 @@
+"""
+Substring Search for Bags, Bills and Users
+Replaces ILIKE '%term%' (a sequential scan of 1.8M bags) with a strategy chosen per
+term, each backed by an index:
+
+- exact:   the whole term is an identifier - equality on a unique/expression index
+- prefix:  terms shorter than TRIGRAM_MIN_LENGTH (too short for trigrams) - range
+           scans on C-collation btrees over the identifier (qr_id, lower(bill_id),
+           lower(username)) and the lowercased secondary column. A short term
+           matches the start of a name/description/email, not any substring of it.
+- trigram: ILIKE '%term%' answered by pg_trgm GIN indexes on the identifier and
+           secondary columns (name, description, email)
+
+search() ranks results (exact, then prefix, then trigram similarity, then shorter
+identifiers) with a top-N sort over the matches and runs inside a per-query latency
+budget; a query that overruns is cancelled and returns what earlier phases found.
+
+Indexes are created by migrations v8w9x0y1z2a3 and b4c5d6e7f8a9 and checked by
+ensure_indexes.py.
+Without pg_trgm, trigram matching still works as a plain ILIKE (unindexed, as before).
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Shorter terms have no complete trigram, so they are matched as a prefix instead
+TRIGRAM_MIN_LENGTH = 3
+
+# Per-query latency budget for search() (statement_timeout inside a savepoint)
+SEARCH_BUDGET_MS = int(os.environ.get('SEARCH_BUDGET_MS', '300'))
+
+# Searchable entities: identifier column, how it is case-folded, secondary column
+SEARCH_FIELDS = {
+    'bag': {'table': 'bag', 'key': 'qr_id', 'fold': 'upper', 'secondary': 'name'},
+    'bill': {'table': 'bill', 'key': 'bill_id', 'fold': 'lower', 'secondary': 'description'},
+    'user': {'table': '"user"', 'key': 'username', 'fold': 'lower', 'secondary': 'email'},
+}
+
+# (index name, table, definition) - the migration creates the same set
+SEARCH_INDEXES = [
+    ('idx_bag_qr_id_prefix', 'bag', '(qr_id COLLATE "C")'),
+    ('idx_bag_qr_id_trgm', 'bag', 'USING gin (qr_id gin_trgm_ops)'),
+    ('idx_bag_name_trgm', 'bag', 'USING gin (name gin_trgm_ops) WHERE name IS NOT NULL'),
+    ('idx_bag_name_prefix', 'bag', '((lower(name)) COLLATE "C")'),
+    ('idx_bill_bill_id_prefix', 'bill', '((lower(bill_id)) COLLATE "C")'),
+    ('idx_bill_bill_id_trgm', 'bill', 'USING gin (bill_id gin_trgm_ops)'),
+    ('idx_bill_description_trgm', 'bill', 'USING gin (description gin_trgm_ops) WHERE description IS NOT NULL'),
+    ('idx_bill_description_prefix', 'bill', '((lower(description)) COLLATE "C")'),
+    ('idx_user_username_prefix', '"user"', '((lower(username)) COLLATE "C")'),
+    ('idx_user_username_trgm', '"user"', 'USING gin (username gin_trgm_ops)'),
+    ('idx_user_email_trgm', '"user"', 'USING gin (email gin_trgm_ops)'),
+    ('idx_user_email_prefix', '"user"', '((lower(email)) COLLATE "C")'),
+]
+
+_trigram_available: Optional[bool] = None
+
+
+def create_search_indexes(conn, table: str):
+    """
+    Create one table's search indexes (fresh databases - the migration builds them
+    CONCURRENTLY on existing data). Trigram indexes need pg_trgm; if the extension
+    cannot be created they are skipped and trigram search stays an unindexed ILIKE.
+    """
+    has_trigram = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+    if not has_trigram:
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            has_trigram = True
+        except Exception as e:
+            logger.warning(f"pg_trgm unavailable - trigram search indexes skipped: {e}")
+
+    for name, index_table, definition in SEARCH_INDEXES:
+        if index_table != table or ('gin_trgm_ops' in definition and not has_trigram):
+            continue
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}"))
+
+
+def trigram_available(session=None) -> bool:
+    """Whether the pg_trgm extension is installed (checked once per process)"""
+    global _trigram_available
+    if _trigram_available is None:
+        if session is None:
+            from app import db
+            session = db.session
+        try:
+            _trigram_available = bool(session.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+            )).scalar())
+        except Exception:
+            _trigram_available = False
+    return _trigram_available
+
+
+def choose_strategy(term: str) -> str:
+    """'prefix' for terms too short for trigrams, otherwise 'trigram'"""
+    return 'prefix' if 0 < len(term) < TRIGRAM_MIN_LENGTH else 'trigram'
+
+
+def _fold(entity: str, term: str) -> str:
+    return term.upper() if SEARCH_FIELDS[entity]['fold'] == 'upper' else term.lower()
+
+
+def _folded_key(entity: str, alias: str = '') -> str:
+    """The identifier expression the exact/prefix indexes are built on"""
+    fields = SEARCH_FIELDS[entity]
+    column = f"{alias}{fields['key']}"
+    if fields['fold'] == 'upper':
+        return f'{column} COLLATE "C"'  # qr_id is stored canonical (uppercase)
+    return f'lower({column}) COLLATE "C"'
+
+
+def escape_like(term: str) -> str:
+    """Escape LIKE wildcards so the term matches literally"""
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix (C collation)"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def match_condition(entity: str, term: str, strategy: Optional[str] = None,
+                    alias: str = '', include_secondary: bool = True) -> Tuple[str, Dict]:
+    """
+    SQL condition (and its bind params) matching term with the given strategy.
+    Usable in raw SQL and, wrapped in text(), as an ORM filter.
+
+    Args:
+        entity: 'bag', 'bill' or 'user'
+        term: sanitized search term
+        strategy: 'exact', 'prefix' or 'trigram' (default: choose_strategy(term))
+        alias: table alias prefix including the dot, e.g. 'b.'
+        include_secondary: also match the secondary column (prefix and trigram)
+    """
+    fields = SEARCH_FIELDS[entity]
+    strategy = strategy or choose_strategy(term)
+    folded = _fold(entity, term)
+    param = f"search_{entity}"
+
+    if strategy == 'exact':
+        return f"{_folded_key(entity, alias)} = :{param}", {param: folded}
+
+    if strategy == 'prefix':
+        key = _folded_key(entity, alias)
+        condition = f"{key} >= :{param}_lo AND {key} < :{param}_hi"
+        params = {f"{param}_lo": folded, f"{param}_hi": prefix_upper_bound(folded)}
+        if include_secondary and fields['secondary']:
+            secondary = f'lower({alias}{fields["secondary"]}) COLLATE "C"'
+            condition = (f"(({condition}) OR ({secondary} >= :{param}_secondary_lo "
+                         f"AND {secondary} < :{param}_secondary_hi))")
+            params.update({f"{param}_secondary_lo": term.lower(),
+                           f"{param}_secondary_hi": prefix_upper_bound(term.lower())})
+        return condition, params
+
+    pattern = f"%{escape_like(term)}%"
+    condition = f"{alias}{fields['key']} ILIKE :{param}_pattern"
+    if include_secondary and fields['secondary']:
+        condition = f"({condition} OR {alias}{fields['secondary']} ILIKE :{param}_pattern)"
+    return condition, {f"{param}_pattern": pattern}
+
+
+def match_filter(entity: str, term: str, strategy: Optional[str] = None, include_secondary: bool = False):
+    """match_condition() on the entity's identifier as an ORM filter clause"""
+    alias = f"{SEARCH_FIELDS[entity]['table']}."
+    condition, params = match_condition(entity, term, strategy, alias=alias, include_secondary=include_secondary)
+    return text(condition).bindparams(**params)
+
+
+def _phase_sql(entity: str, phase: str, columns: str, condition: str, extra: str, exclude: str) -> str:
+    """One strategy's query - trigram matches are ranked before the limit (a top-N sort)"""
+    fields = SEARCH_FIELDS[entity]
+    if phase != 'trigram':
+        return f"""
+            SELECT {columns} FROM {fields['table']}
+            WHERE {condition} {extra} {exclude}
+            ORDER BY {_folded_key(entity)}
+            LIMIT :limit
+        """
+
+    key, secondary = fields['key'], fields['secondary']
+    similarity = ''
+    if trigram_available():
+        similarity = f"GREATEST(similarity({key}, :term), similarity(COALESCE({secondary}, ''), :term)) DESC, "
+    return f"""
+        SELECT {columns} FROM {fields['table']}
+        WHERE {condition} {extra} {exclude}
+        ORDER BY {key} ILIKE :prefix DESC, {similarity}length({key}), {key}
+        LIMIT :limit
+    """
+
+
+def search(entity: str, term: str, columns: str, limit: int = 20,
+           where: str = '', params: Optional[Dict] = None,
+           budget_ms: Optional[int] = None, session=None) -> Dict:
+    """
+    Ranked search of one entity: exact match first, then the term's strategy
+    (prefix or trigram) for the remaining rows.
+
+    Args:
+        entity: 'bag', 'bill' or 'user'
+        term: sanitized search term (non-empty)
+        columns: select list of unqualified columns, starting with id
+        limit: maximum rows returned
+        where: extra SQL condition (e.g. "type = 'parent'"), its binds in params
+        budget_ms: latency budget for the whole search (default SEARCH_BUDGET_MS)
+
+    Returns:
+        {'rows': [...], 'strategy': 'exact'|'prefix'|'trigram', 'truncated': bool,
+         'elapsed_ms': float}
+    """
+    if session is None:
+        from app import db
+        session = db.session
+
+    budget_ms = SEARCH_BUDGET_MS if budget_ms is None else budget_ms
+    extra = f"AND ({where})" if where else ''
+    strategy = choose_strategy(term)
+    start = time.monotonic()
+    rows, matched, truncated = [], None, False
+
+    # Both phases share one statement_timeout; it is SET LOCAL inside a savepoint,
+    # so cancelling a phase rolls back only the savepoint, not the caller's transaction
+    previous_timeout = session.execute(text("SELECT current_setting('statement_timeout')")).scalar()
+    savepoint = session.begin_nested()
+    try:
+        session.execute(text("SELECT set_config('statement_timeout', :ms, true)"),
+                        {'ms': str(max(1, budget_ms))})
+        for phase in ('exact', strategy):
+            if len(rows) >= limit:
+                break
+            condition, phase_params = match_condition(entity, term, phase)
+            seen = [row[0] for row in rows]
+            exclude = "AND id <> ALL(:seen)" if seen else ''
+            phase_params.update(params or {}, limit=limit - len(rows), seen=seen, term=term,
+                                prefix=f"{escape_like(term)}%")
+            phase_rows = session.execute(text(_phase_sql(entity, phase, columns, condition, extra, exclude)),
+                                         phase_params).fetchall()
+            if phase_rows and matched is None:
+                matched = phase
+            rows.extend(phase_rows)
+        session.execute(text("SELECT set_config('statement_timeout', :ms, true)"), {'ms': previous_timeout})
+        savepoint.commit()
+    except OperationalError as e:
+        savepoint.rollback()
+        if getattr(e.orig, 'pgcode', None) != '57014':  # query_canceled
+            raise
+        truncated = True
+        logger.warning(f"{entity} search for {term!r} exceeded its {budget_ms}ms budget - "
+                       f"returning {len(rows)} rows from earlier phases")
+
+    return {
+        'rows': rows,
+        'strategy': matched or strategy,
+        'truncated': truncated,
+        'elapsed_ms': round((time.monotonic() - start) * 1000, 2)
+    }
@@ -214,7 +214,15 @@ def init_graceful_shutdown(app, db, timeout: int = GracefulShutdownHandler.DEFAU
         """Ensure all audit logs are written to database"""
         try:
             logger.info("Flushing audit logs...")
-            db.session.commit()
+            with app.app_context():
+                db.session.commit()
+                
+                # Stop the buffered writer and write everything still queued
+                from audit_writer import get_audit_writer
+                writer = get_audit_writer()
+                if writer:
+                    writer.stop()
+                    logger.info(f"Audit writer drained - {writer.stats['rows_written']} rows written")
             logger.info("Audit logs flushed")
         except Exception as e:
             logger.error(f"Error flushing audit logs: {e}")
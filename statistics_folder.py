@@ -0,0 +1,186 @@
+"""
+Statistics Counter Folder
+Periodically folds trigger-written statistics_delta rows into statistics_cache
+(and daily_bill_rollup_delta rows into daily_bill_rollup) and reconciles the
+counters against real table counts.
+
+Every worker runs a folder thread, but both folds use pg_try_advisory_xact_lock,
+so only one worker folds at a time and the others simply skip that tick.
+"""
+
+import logging
+import os
+import time
+from threading import Thread, Event
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StatisticsFolder:
+    """Background thread that keeps statistics_cache counters folded and verified"""
+
+    # How often pending deltas are merged into statistics_cache (seconds)
+    FOLD_INTERVAL = int(os.environ.get('STATS_FOLD_INTERVAL', '15'))  # Default: 15s
+
+    # How often counters are verified against full COUNT(*) (seconds)
+    # This is the only full-table scan left - keep it rare
+    RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', '21600'))  # Default: 6 hours
+
+    def __init__(self, app, db, enabled=True):
+        """
+        Initialize statistics folder
+
+        Args:
+            app: Flask application (for app context in background thread)
+            db: SQLAlchemy database instance
+            enabled: Whether folding is enabled (default: True)
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.stop_event = Event()
+        self.folder_thread = None
+        self.last_reconcile = time.time()
+        self.stats = {
+            'folds': 0,
+            'rows_folded': 0,
+            'bill_rollup_rows_folded': 0,
+            'skipped_busy': 0,
+            'reconciles': 0,
+            'last_drift': {},
+            'last_fold_ms': None,
+            'errors': 0
+        }
+
+    def start(self):
+        """Start folding in background thread"""
+        if not self.enabled:
+            logger.info("Statistics folder is disabled")
+            return
+
+        if self.folder_thread and self.folder_thread.is_alive():
+            logger.warning("Statistics folder already running")
+            return
+
+        self.stop_event.clear()
+        self.folder_thread = Thread(target=self._fold_loop, daemon=True, name='statistics-folder')
+        self.folder_thread.start()
+        logger.info(f"Statistics folder started - folding every {self.FOLD_INTERVAL}s, "
+                    f"reconciling every {self.RECONCILE_INTERVAL}s")
+
+    def stop(self):
+        """Stop folding (runs one final fold so pending deltas are not left behind)"""
+        if not self.folder_thread:
+            return
+
+        self.stop_event.set()
+        self.folder_thread.join(timeout=5)
+        try:
+            self.fold_once()
+        except Exception as e:
+            logger.error(f"Final statistics fold failed: {e}")
+        logger.info("Statistics folder stopped")
+
+    def _fold_loop(self):
+        """Main loop - runs in background thread"""
+        while not self.stop_event.is_set():
+            try:
+                self.fold_once()
+                self.fold_bill_rollup_once()
+
+                if time.time() - self.last_reconcile >= self.RECONCILE_INTERVAL:
+                    self.reconcile_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Statistics folder error: {e}")
+
+            # Wait for next tick or stop event
+            self.stop_event.wait(self.FOLD_INTERVAL)
+
+    def fold_once(self) -> Optional[int]:
+        """Fold pending deltas once. Returns rows folded, or None if another worker held the lock."""
+        from models import StatisticsCache
+
+        with self.app.app_context():
+            start = time.time()
+            try:
+                # Seed the cache row on first run (e.g. fresh database)
+                if not self.db.session.get(StatisticsCache, 1):
+                    StatisticsCache.refresh_cache()
+
+                folded = StatisticsCache.fold_deltas()
+            finally:
+                self.db.session.remove()
+
+            if folded is None:
+                self.stats['skipped_busy'] += 1
+                return None
+
+            self.stats['folds'] += 1
+            self.stats['rows_folded'] += folded
+            self.stats['last_fold_ms'] = round((time.time() - start) * 1000, 2)
+            return folded
+
+    def fold_bill_rollup_once(self) -> Optional[int]:
+        """Fold pending daily bill rollup deltas once. Returns rows folded, or None if busy."""
+        from bill_rollup import fold_bill_rollup_deltas
+
+        with self.app.app_context():
+            with self.db.engine.begin() as conn:
+                folded = fold_bill_rollup_deltas(conn)
+
+        if folded is None:
+            self.stats['skipped_busy'] += 1
+            return None
+
+        self.stats['bill_rollup_rows_folded'] += folded
+        return folded
+
+    def reconcile_once(self) -> Dict[str, int]:
+        """Verify counters against real counts and correct drift"""
+        from models import StatisticsCache
+
+        self.last_reconcile = time.time()
+        with self.app.app_context():
+            try:
+                drift = StatisticsCache.reconcile()
+            finally:
+                self.db.session.remove()
+
+        self.stats['reconciles'] += 1
+        self.stats['last_drift'] = drift
+        return drift
+
+    def get_stats(self) -> Dict:
+        """Get folder statistics for monitoring"""
+        return dict(self.stats, running=bool(self.folder_thread and self.folder_thread.is_alive()))
+
+
+# Global folder instance (initialized in app.py)
+statistics_folder: Optional[StatisticsFolder] = None
+
+
+def get_statistics_folder() -> Optional[StatisticsFolder]:
+    """Get the global statistics folder instance"""
+    return statistics_folder
+
+
+def init_statistics_folder(app, db, enabled=True):
+    """
+    Initialize and start the global statistics folder
+
+    Args:
+        app: Flask application
+        db: SQLAlchemy database instance
+        enabled: Whether to enable folding (default: True)
+    """
+    global statistics_folder
+
+    statistics_folder = StatisticsFolder(app, db, enabled=enabled)
+    statistics_folder.start()
+
+    from shutdown_handler import register_cleanup_callback
+    register_cleanup_callback(statistics_folder.stop, "statistics_folder_stop")
+
+    return statistics_folder
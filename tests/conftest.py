@@ -8,16 +8,29 @@ os.environ['DATABASE_URL'] = os.environ.get('DATABASE_URL', 'sqlite:///test.db')
 os.environ['SESSION_SECRET'] = 'test-secret-key-for-testing-only'
 os.environ['ADMIN_PASSWORD'] = 'admin123'
 os.environ['TESTING'] = 'True'
+os.environ['DASHBOARD_CACHE_BACKEND'] = 'memory'  # Keep test cache out of the shared /dev/shm cache
 
 # Add parent directory to path so we can import app and models
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app import app as flask_app, db
-from models import User, Bag, Bill, Link, BillBag, Scan
+from models import (User, Bag, Bill, Link, BillBag, Scan, ScanSyncReceipt, MaintenanceJob,
+                    DailyBillRollup, DailyBillRollupDelta)
 
 # Import routes to register them with the app
 import routes
 import api
+import api_optimized
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip requires_postgres tests (advisory locks, triggers, partitions, COPY) on SQLite"""
+    if os.environ['DATABASE_URL'].startswith(('postgres://', 'postgresql')):
+        return
+    skip_postgres = pytest.mark.skip(reason='needs PostgreSQL (DATABASE_URL is not a postgres URL)')
+    for item in items:
+        if 'requires_postgres' in item.keywords:
+            item.add_marker(skip_postgres)
 
 @pytest.fixture(scope='session')
 def app():
@@ -49,12 +62,17 @@ def db_session(app):
     """Create a new database session for a test"""
     with app.app_context():
         # Clear all tables
+        db.session.query(ScanSyncReceipt).delete()
+        db.session.query(MaintenanceJob).delete()
         db.session.query(Scan).delete()
         db.session.query(BillBag).delete()
         db.session.query(Link).delete()
         db.session.query(Bill).delete()
         db.session.query(Bag).delete()
         db.session.query(User).delete()
+        # After bill: its triggers append rollup deltas for the deleted rows
+        db.session.query(DailyBillRollupDelta).delete()
+        db.session.query(DailyBillRollup).delete()
         db.session.commit()
         
         yield db.session
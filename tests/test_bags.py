@@ -81,3 +81,257 @@ class TestBagScanning:
         }, follow_redirects=True)
         
         assert response.status_code == 200
+
+class TestBagExport:
+    def test_csv_export_streams_all_bags(self, authenticated_client, parent_bag, child_bags):
+        """Test the bag CSV export is streamed and not truncated"""
+        response = authenticated_client.get('/export/bags/csv')
+        assert response.status_code == 200
+        assert response.is_streamed
+        
+        lines = response.get_data(as_text=True).strip().splitlines()
+        assert lines[0] == 'QR ID,Type,Children Count,Linked to Bill,Created At'
+        assert len(lines) == 1 + 6
+        assert any(line.startswith(f'{parent_bag.qr_id},PARENT,5,') for line in lines)
+    
+    def test_excel_export_streams_workbook(self, authenticated_client, parent_bag, child_bags):
+        """Test the bag Excel export produces a readable write-only workbook"""
+        import io
+        from openpyxl import load_workbook
+        
+        response = authenticated_client.get('/export/bags/excel?type=child')
+        assert response.status_code == 200
+        
+        ws = load_workbook(io.BytesIO(response.get_data())).active
+        rows = list(ws.iter_rows(values_only=True))
+        assert rows[0][0] == 'QR ID'
+        assert len(rows) == 1 + 5
+
+
+class TestBagIdentityCache:
+    def test_lru_eviction_and_invalidation(self, tmp_path):
+        """Test QR identity cache evicts least recently used entries and honours invalidation"""
+        from query_optimizer import BagIdentityCache, BagIdentity
+        
+        cache = BagIdentityCache(max_size=2, epoch_path=str(tmp_path / 'epoch'))
+        cache.put(BagIdentity(1, 'parent', 'SB00001'))
+        cache.put(BagIdentity(2, 'child', 'CHILD01'))
+        assert cache.get('sb00001').id == 1  # Case-insensitive, marks SB00001 as recent
+        
+        cache.put(BagIdentity(3, 'child', 'CHILD02'))
+        assert cache.get('CHILD01') is None  # Least recently used was evicted
+        assert cache.get_stats()['evictions'] == 1
+        
+        cache.invalidate('SB00001')
+        assert cache.get('SB00001') is None
+        assert cache.get('CHILD02').id == 3
+    
+    def test_invalidation_reaches_other_workers(self, tmp_path):
+        """Test invalidation in one worker clears caches sharing the epoch file"""
+        from query_optimizer import BagIdentityCache, BagIdentity
+        
+        epoch_path = str(tmp_path / 'epoch')
+        worker_a = BagIdentityCache(epoch_path=epoch_path)
+        worker_b = BagIdentityCache(epoch_path=epoch_path)
+        worker_b.put(BagIdentity(1, 'parent', 'SB00001'))
+        
+        worker_a.invalidate('SB00001')
+        assert worker_b.get('SB00001') is None
+
+
+class TestCanonicalQrLookup:
+    def test_legacy_qr_found_until_canonical(self, db_session, monkeypatch):
+        """Test lookups match a legacy lowercase QR code until migration m9n0o1p2q3r4 has run"""
+        import time
+        import models
+        from sqlalchemy import text
+        from app import db
+        from query_optimizer import QueryOptimizer, bag_identity_cache
+
+        # Raw SQL bypasses the ORM listener, like the old importers did
+        db_session.execute(text("INSERT INTO bag (qr_id, type, weight_kg) VALUES ('sblegacy01', 'parent', 0)"))
+        db_session.commit()
+
+        monkeypatch.setitem(models._canonical_qr, 'ready', False)
+        monkeypatch.setitem(models._canonical_qr, 'checked_at', time.monotonic())
+        assert Bag.query.filter(Bag.qr_match(' SBLEGACY01 ')).one().qr_id == 'sblegacy01'
+        assert Bag.query.filter(Bag.qr_match_any(['SBLEGACY01'])).count() == 1
+        assert QueryOptimizer(db).resolve_bag('SBLEGACY01').qr_id == 'sblegacy01'
+        bag_identity_cache.invalidate('SBLEGACY01')
+
+        monkeypatch.setitem(models._canonical_qr, 'ready', True)
+        assert Bag.query.filter(Bag.qr_match('SBLEGACY01')).first() is None
+
+
+class TestBagManagementPagination:
+    def test_keyset_pages_do_not_overlap(self, authenticated_client, db_session):
+        """Test next/previous cursors walk the bag list without repeating or skipping bags"""
+        import re
+        from datetime import datetime, timedelta
+        from html import unescape
+
+        base = datetime(2025, 1, 1)
+        for i in range(25):
+            # Pairs share a timestamp so the id tie-breaker is exercised
+            db_session.add(Bag(qr_id=f'KEYSET{i:03d}', type='parent', created_at=base + timedelta(minutes=i // 2)))
+        db_session.commit()
+
+        def page(url):
+            html = unescape(authenticated_client.get(url).get_data(as_text=True))
+            links = {rel: href for href, rel in re.findall(r'href="([^"]*)"[^>]*>\s*(?:<span aria-hidden="true">.</span> )?(Previous|Next)', html)}
+            return re.findall(r'KEYSET\d{3}', html), links
+
+        first, links = page('/bag_management?search=KEYSET&per_page=10')
+        second, links = page(links['Next'])
+        third, links = page(links['Next'])
+        first_seen = list(dict.fromkeys(first))
+        assert first_seen == [f'KEYSET{i:03d}' for i in range(24, 14, -1)]
+        assert list(dict.fromkeys(second)) == [f'KEYSET{i:03d}' for i in range(14, 4, -1)]
+        assert list(dict.fromkeys(third)) == [f'KEYSET{i:03d}' for i in range(4, -1, -1)]
+
+        back, _ = page(links['Previous'])
+        assert list(dict.fromkeys(back)) == list(dict.fromkeys(second))
+
+    def test_raw_sql_bags_get_created_at(self, db_session):
+        """Test bags inserted without created_at (raw-SQL importers) still get a keyset key"""
+        from sqlalchemy import text
+
+        db_session.execute(text("INSERT INTO bag (qr_id, type, weight_kg) VALUES ('RAWBAG001', 'parent', 0)"))
+        db_session.commit()
+        assert Bag.query.filter_by(qr_id='RAWBAG001').one().created_at is not None
+
+
+class TestOfflineScanSync:
+    @pytest.mark.requires_postgres
+    def test_sync_batch_is_idempotent(self, authenticated_client, parent_bag, bill, db_session):
+        """Test a replayed offline batch applies each scan id once and returns stored results"""
+        import uuid
+        from models import BillBag, ScanSyncReceipt
+
+        bill.parent_bag_count = 5
+        db_session.add(Bag(qr_id='SB09001', type='parent'))
+        db_session.commit()
+        ids = [str(uuid.uuid4()) for _ in range(4)]
+        scans = [
+            {'id': ids[0], 'type': 'child', 'parent_qr': 'parent001', 'qr_code': 'SYNC001'},
+            {'id': ids[1], 'type': 'bill_parent', 'bill_id': bill.id, 'qr_code': 'sb09001'},
+            {'id': ids[2], 'type': 'child', 'parent_qr': 'PARENT001', 'qr_code': 'SYNC002'},
+            {'id': ids[0], 'type': 'child', 'parent_qr': 'PARENT001', 'qr_code': 'SYNC001'},
+            {'id': ids[3], 'type': 'child', 'parent_qr': 'PARENT001', 'qr_code': 'PARENT001'},
+        ]
+
+        data = authenticated_client.post('/api/v2/scans/sync', json={'scans': scans}).get_json()
+        assert data['success'] and data['applied'] == 3 and data['failed'] == 1
+        assert [r['id'] for r in data['results']] == [s['id'] for s in scans]
+        assert data['results'][2]['child_count'] == 2
+        assert data['results'][3] == dict(data['results'][0], replayed=True)  # repeated id applied once
+        assert data['results'][4]['error_type'] == 'invalid_format'
+
+        replay = authenticated_client.post('/api/v2/scans/sync', json={'scans': scans}).get_json()
+        assert replay['applied'] == 0 and replay['replayed'] == 4
+        assert replay['results'][2]['child_count'] == 2
+
+        db_session.expire_all()
+        assert Link.query.filter_by(parent_bag_id=parent_bag.id).count() == 2
+        assert BillBag.query.filter_by(bill_id=bill.id).count() == 1
+        assert ScanSyncReceipt.query.count() == 3
+
+    def test_sync_answers_bad_and_synced_scans_without_applying(self, authenticated_client, db_session, monkeypatch):
+        """Test invalid scans and ids with a stored receipt are answered without a scan group transaction"""
+        import json
+        import uuid
+        from models import ScanSyncReceipt
+        from query_optimizer import query_optimizer
+
+        def fail(*args, **kwargs):
+            raise AssertionError("sync_scan_group should not be called")
+        monkeypatch.setattr(query_optimizer, 'sync_scan_group', fail)
+        synced = str(uuid.uuid4())
+        stored = {'success': True, 'child_count': 7, 'message': 'Linked'}
+        db_session.add(ScanSyncReceipt(client_scan_id=synced, kind='child', status='success', result=json.dumps(stored)))
+        db_session.commit()
+        scans = [
+            {'id': 'not-a-uuid', 'type': 'child', 'parent_qr': 'SB09001', 'qr_code': 'SYNC001'},
+            {'id': str(uuid.uuid4()), 'type': 'unlink', 'qr_code': 'SYNC001'},
+            {'id': str(uuid.uuid4()), 'type': 'child', 'parent_qr': 'sb09001', 'qr_code': 'SB09001'},
+            {'id': synced, 'type': 'child', 'parent_qr': 'SB09001', 'qr_code': 'SYNC001'},
+        ]
+
+        data = authenticated_client.post('/api/v2/scans/sync', json={'scans': scans}).get_json()
+        assert data['success'] and data['applied'] == 0 and data['replayed'] == 1 and data['failed'] == 3
+        assert [r.get('error_type') for r in data['results'][:3]] == ['invalid_request', 'invalid_request', 'invalid_format']
+        assert data['results'][3] == dict(stored, replayed=True, id=synced)
+
+        too_many = [{'id': str(uuid.uuid4()), 'type': 'child', 'parent_qr': 'SB09001', 'qr_code': 'SYNC001'}] * 501
+        response = authenticated_client.post('/api/v2/scans/sync', json={'scans': too_many})
+        assert response.status_code == 400
+
+    def test_expired_receipts_are_purged(self, db_session):
+        """Test receipts past the TTL are purged in batches and recent ones kept"""
+        from datetime import datetime, timedelta
+        from app import db
+        from models import ScanSyncReceipt
+        from scan_partitions import purge_sync_receipts
+
+        old = datetime.utcnow() - timedelta(days=30)
+        for n in range(5):
+            db_session.add(ScanSyncReceipt(client_scan_id=f'old-{n}', kind='child', status='success', created_at=old))
+        db_session.add(ScanSyncReceipt(client_scan_id='recent', kind='child', status='success'))
+        db_session.commit()
+
+        assert purge_sync_receipts(db.engine, ttl_days=14, batch_size=2) == 5
+        db_session.expire_all()
+        assert [r.client_scan_id for r in ScanSyncReceipt.query.all()] == ['recent']
+
+
+class TestBatchLinkValidation:
+    def test_batch_link_rejects_bad_requests_before_the_database(self, authenticated_client, monkeypatch):
+        """Test bad batches and malformed child codes are answered without a link statement"""
+        from query_optimizer import query_optimizer
+
+        def fail(*args, **kwargs):
+            raise AssertionError("batch_link_children should not be called")
+        monkeypatch.setattr(query_optimizer, 'batch_link_children', fail)
+
+        data = authenticated_client.post('/api/v2/batch/link', json={
+            'parent_qr': 'sb09002', 'child_qrs': ['bad qr!', '', None]
+        }).get_json()
+        assert data['success'] and data['parent_qr'] == 'SB09002'
+        assert data['linked_count'] == 0 and data['child_count'] is None
+        assert [r['status'] for r in data['results']] == ['invalid_format'] * 3
+
+        response = authenticated_client.post('/api/v2/batch/link', json={'child_qrs': ['BATCH001']})
+        assert response.status_code == 400
+        response = authenticated_client.post('/api/v2/batch/link', json={
+            'parent_qr': 'SB09002', 'child_qrs': [f'BATCH{n:03d}' for n in range(31)]
+        })
+        assert response.status_code == 400
+
+
+@pytest.mark.requires_postgres
+class TestBatchLink:
+    def test_batch_link_reports_each_child(self, authenticated_client, parent_bag, child_bags, db_session):
+        """Test one batch links new children and reports duplicates, existing links and bad codes"""
+        other_parent = Bag(qr_id='SB09002', type='parent')
+        db_session.add(other_parent)
+        db_session.commit()
+
+        response = authenticated_client.post('/api/v2/batch/link', json={
+            'parent_qr': 'sb09002',
+            'child_qrs': ['BATCH001', 'batch002', 'BATCH001', 'CHILD001', 'SB09002', 'bad qr!']
+        })
+        data = response.get_json()
+        assert data['success'] and data['linked_count'] == 2 and data['child_count'] == 2
+        assert [r['status'] for r in data['results']] == [
+            'linked', 'linked', 'duplicate_in_batch', 'linked_to_other_parent', 'circular', 'invalid_format'
+        ]
+        assert data['results'][0]['created']
+
+        db_session.expire_all()
+        assert Link.query.filter_by(parent_bag_id=other_parent.id).count() == 2
+        assert db_session.get(Bag, other_parent.id).child_count == 2
+
+        again = authenticated_client.post('/api/v2/batch/link', json={
+            'parent_qr': 'SB09002', 'child_qrs': ['BATCH002']
+        }).get_json()
+        assert again['results'][0]['status'] == 'already_linked' and again['child_count'] == 2
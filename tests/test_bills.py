@@ -106,3 +106,36 @@ class TestBillStatus:
         }, follow_redirects=True)
         
         assert response.status_code == 200
+
+
+class TestScanDeduplication:
+    def test_shared_wheel_catches_double_scan_across_workers(self, tmp_path):
+        """Test a scan recorded by one worker blocks the same bill+bag on another until the cooldown passes"""
+        from scan_dedupe import SharedMemoryBackend, scan_key
+
+        path = str(tmp_path / 'wheel')
+        worker_a = SharedMemoryBackend(path, cooldown=3, capacity=64)
+        worker_b = SharedMemoryBackend(path, cooldown=3, capacity=64)
+        key = scan_key(7, ' sb00001 ')
+
+        assert worker_a.check_and_record(key, 1000.2) is False
+        assert worker_b.check_and_record(scan_key(7, 'SB00001'), 1002.9) is True
+        assert worker_b.check_and_record(scan_key(8, 'SB00001'), 1002.9) is False  # Other bill
+        assert worker_b.check_and_record(key, 1003.3) is False  # Cooldown elapsed
+
+        # The wheel reuses buckets without sweeping: old seconds are simply ignored
+        assert worker_a.check_and_record(key, 1010.0) is False
+
+    @pytest.mark.requires_postgres
+    def test_postgres_backend_and_counters(self, db_session):
+        """Test the UNLOGGED-table backend and hit/miss counters"""
+        from app import db
+        from scan_dedupe import ScanDeduplicator, PostgresBackend
+
+        dedupe = ScanDeduplicator(PostgresBackend(db, cooldown=3))
+        assert dedupe.is_duplicate(42, 'SBDEDUPE') is False
+        assert dedupe.is_duplicate(42, 'sbdedupe') is True
+
+        stats = dedupe.get_stats()
+        assert stats['backend'] == 'postgres'
+        assert stats['hits'] == 1 and stats['misses'] == 1
@@ -0,0 +1,237 @@
+import json
+import uuid
+import pytest
+from openpyxl import Workbook
+from models import Bag, Link, ImportJob
+
+pytestmark = pytest.mark.integration  # Mark all tests as integration tests
+
+
+@pytest.fixture
+def job_root(tmp_path, monkeypatch):
+    import import_jobs
+    monkeypatch.setattr(import_jobs, 'JOB_ROOT', str(tmp_path))
+    return tmp_path
+
+
+def create_job(db_session, job_root, user, filename='batch.xlsx'):
+    """Queue a child->parent job by hand (run_import_job is called directly, not via the pool)"""
+    from import_jobs import job_dir, _upload_name
+
+    job = ImportJob(id=str(uuid.uuid4()), user_id=user.id,
+                    import_type='child_parent', filenames=json.dumps([filename]), files_total=1)
+    db_session.add(job)
+    db_session.commit()
+
+    directory = job_root / job.id
+    directory.mkdir()
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['SR NO', 'QR CODE'])
+    for n in range(1, 4):
+        ws.append([n, f'LABEL NO. : 9000{n}'])
+    ws.append(['Parent Code', 'SB77777'])
+    wb.save(str(directory / _upload_name(0, filename)))
+    assert job_dir(job.id) == str(directory)
+    return job
+
+
+class TestImportJobs:
+    def test_job_imports_file_and_records_progress(self, db_session, job_root, admin_user):
+        """Test a queued job imports its file and leaves progress and results behind"""
+        from import_jobs import run_import_job
+
+        job = create_job(db_session, job_root, admin_user)
+        assert run_import_job(job.id) == 'completed'
+
+        db_session.expire_all()
+        job = db_session.get(ImportJob, job.id)
+        assert job.status == 'completed'
+        assert job.progress_pct == 100.0
+        assert job.files_done == 1
+        assert job.rows_total == job.rows_processed > 0
+        assert job.eta_seconds() == 0
+        assert job.result_file and (job_root / job.id / job.result_file).exists()
+
+        parent = Bag.query.filter_by(qr_id='SB77777').one()
+        assert Link.query.filter_by(parent_bag_id=parent.id).count() == 3
+
+    def test_status_endpoint_reports_downloads(self, authenticated_client, db_session, job_root, admin_user):
+        """Test the status API reports progress and offers the result download"""
+        from import_jobs import run_import_job
+
+        job = create_job(db_session, job_root, admin_user)
+        run_import_job(job.id)
+        db_session.expire_all()  # job progress is written on its own connection
+
+        data = authenticated_client.get(f'/api/import/jobs/{job.id}').get_json()
+        assert data['success'] and data['status'] == 'completed'
+        assert data['progress_pct'] == 100.0
+        assert 'rows_per_sec' in data and data['eta_seconds'] == 0
+        assert 'results' in data['downloads']
+
+        response = authenticated_client.get(data['downloads']['results'])
+        assert response.status_code == 200
+        assert response.data[:2] == b'PK'  # xlsx is a zip archive
+
+    def test_orphaned_jobs_are_recovered(self, db_session, job_root, admin_user, monkeypatch):
+        """Test jobs of a dead worker are re-queued (queued) or failed (running)"""
+        import socket
+        import subprocess
+        import sys
+        from app import app, db
+        from import_jobs import ImportJobQueue, worker_identity
+
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        dead_worker = f"{socket.gethostname()}:{process.pid}"
+
+        queued = create_job(db_session, job_root, admin_user)
+        running = create_job(db_session, job_root, admin_user)
+        mine = create_job(db_session, job_root, admin_user)
+        queued.worker_id = dead_worker
+        running.worker_id = dead_worker
+        running.status = 'running'
+        mine.worker_id = worker_identity()
+        db_session.commit()
+
+        queue = ImportJobQueue(app, db)
+        enqueued = []
+        monkeypatch.setattr(queue, '_enqueue', enqueued.append)
+        assert queue.recover_orphaned_jobs() == {'requeued': 1, 'failed': 1}
+        assert enqueued == [queued.id]
+
+        db_session.expire_all()
+        assert db_session.get(ImportJob, queued.id).worker_id == worker_identity()
+        assert db_session.get(ImportJob, running.id).status == 'failed'
+        assert db_session.get(ImportJob, mine.id).status == 'queued'
+        assert queue.recover_orphaned_jobs() == {'requeued': 0, 'failed': 0}
+
+
+class TestParallelExcelParser:
+    def test_pool_parse_matches_inline_parse(self, tmp_path, monkeypatch):
+        """Test files and sheets parsed in the process pool merge back in file and sheet order"""
+        import import_utils
+        from import_utils import ParallelExcelParser
+
+        paths = []
+        for n in range(2):
+            wb = Workbook()
+            for sheet in range(2):
+                ws = wb.active if sheet == 0 else wb.create_sheet(f'Sheet{sheet + 1}')
+                ws.append(['SR NO', 'QR CODE'])
+                ws.append([1, f'LABEL NO. : 8{n}{sheet}01'])
+                ws.append([2, f'LABEL NO. : 8{n}{sheet}02'])
+                ws.append(['Parent Code', f'SB8{n}{sheet}00'])
+            ws.append([3, 'LABEL NO. : 89999'])  # Orphaned at the end of the last sheet
+            path = tmp_path / f'file{n}.xlsx'
+            wb.save(str(path))
+            paths.append(str(path))
+
+        monkeypatch.setattr(import_utils, 'PARSE_WORKERS', 1)
+        inline = list(ParallelExcelParser.parse_child_parent_files(paths))
+        monkeypatch.setattr(import_utils, 'PARSE_WORKERS', 4)
+        pooled = list(ParallelExcelParser.parse_child_parent_files(paths))
+
+        assert [index for index, _ in pooled] == [0, 1]
+        for (_, expected), (_, parsed) in zip(inline, pooled):
+            assert [b['parent_code'] for b in parsed['batches']] == [b['parent_code'] for b in expected['batches']]
+            assert (parsed['rows'], parsed['errors']) == (expected['rows'], expected['errors']) == (7, 1)
+        assert [b['sheet'] for b in pooled[1][1]['batches']] == ['Sheet', 'Sheet2']
+
+    def test_unreadable_file_fails_alone(self, tmp_path):
+        """Test a corrupt workbook is reported per file without failing the others"""
+        from import_utils import ParallelExcelParser
+
+        good = tmp_path / 'good.xlsx'
+        wb = Workbook()
+        wb.active.append(['SR NO', 'QR CODE'])
+        wb.active.append([1, 'LABEL NO. : 70001'])
+        wb.active.append(['Parent Code', 'SB70000'])
+        wb.save(str(good))
+        bad = tmp_path / 'bad.xlsx'
+        bad.write_bytes(b'not a workbook')
+
+        parsed = dict(ParallelExcelParser.parse_child_parent_files([str(bad), str(good)]))
+        assert 'error' in parsed[0]
+        assert len(parsed[1]['batches']) == 1
+
+
+@pytest.mark.requires_postgres
+class TestCopyBulkLoader:
+    def test_copy_loader_merges_against_existing_bags(self, db_session, admin_user, parent_bag):
+        """Test the COPY loader links new children and reports database and in-file duplicates"""
+        from import_utils import LargeScaleChildParentImporter, RowResult
+
+        existing_child = Bag(qr_id='COPYDUP01', type='child')
+        db_session.add(existing_child)
+        db_session.commit()
+
+        def children(*labels, start=1):
+            return [{'row_num': start + i, 'label': label, 'sheet': 'S1'} for i, label in enumerate(labels)]
+
+        batches = [
+            {'parent_code': 'sbcopy01', 'parent_row_num': 4, 'sheet': 'S1',
+             'children': children('COPY001', 'COPY002', 'copydup01')},
+            {'parent_code': parent_bag.qr_id, 'parent_row_num': 8, 'sheet': 'S1',
+             'children': children('COPY003', 'COPY001', start=5)},
+            {'parent_code': 'SBCOPY01', 'parent_row_num': 10, 'sheet': 'S1',
+             'children': children('COPY004', start=9)},
+        ]
+
+        assert LargeScaleChildParentImporter._copy_supported()
+        stats, results = LargeScaleChildParentImporter._copy_process_all_batches(batches, admin_user.id, None)
+        db_session.commit()
+
+        assert stats['parents_created'] == 1 and stats['parents_found'] == 1
+        assert stats['parents_rejected_duplicate'] == 1
+        assert stats['children_created'] == stats['links_created'] == 3
+        assert stats['children_existing'] == 2
+        statuses = {(r.row_num, r.status) for r in results}
+        assert (3, RowResult.ERROR) in statuses  # COPYDUP01 already in database
+        assert (6, RowResult.ERROR) in statuses  # COPY001 repeated in file
+        assert (9, RowResult.ERROR) in statuses  # child of the duplicate parent
+
+        new_parent = Bag.query.filter_by(qr_id='SBCOPY01').one()
+        assert new_parent.child_count == 2 and new_parent.weight_kg == 2.0
+        assert Link.query.filter_by(parent_bag_id=new_parent.id).count() == 2
+        assert Link.query.filter_by(parent_bag_id=parent_bag.id).count() == 1
+        assert Bag.query.filter_by(qr_id='COPY004').first() is None
+
+
+class TestStreamingImport:
+    def test_parent_groups_are_written_in_chunks(self, db_session, admin_user, monkeypatch):
+        """Test the single-pass importer flushes per chunk and still rejects a parent repeated in a later chunk"""
+        from io import BytesIO
+        from werkzeug.datastructures import FileStorage
+        from import_utils import LargeScaleChildParentImporter, RowResult
+
+        monkeypatch.setattr(LargeScaleChildParentImporter, 'CHUNK_SIZE', 2)
+
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['SR NO', 'QR CODE'])
+        for parent, labels in (('SBSTRM01', ('61001', '61002')), ('SBSTRM02', ('61003', '61004')),
+                               ('SBSTRM01', ('61005',))):
+            for n, label in enumerate(labels, start=1):
+                ws.append([n, f'LABEL NO. : {label}'])
+            ws.append(['Parent Code', parent])
+        stream = BytesIO()
+        wb.save(stream)
+
+        reported = []
+        stats, results = LargeScaleChildParentImporter.process_file_streaming(
+            FileStorage(stream=stream, filename='stream.xlsx'), admin_user.id,
+            total_rows_callback=reported.append
+        )
+
+        assert stats['total_rows'] == reported[-1] == 8
+        assert stats['batches_processed'] == 3 and stats['parents_created'] == 2
+        assert stats['parents_rejected_duplicate'] == 1
+        assert stats['children_created'] == 4
+        errors = {r.row_num for r in results if r.status == RowResult.ERROR}
+        assert {8, 9} <= errors  # SBSTRM01 repeated in the third chunk, and its child
+
+        db_session.expire_all()
+        assert Bag.query.filter_by(qr_id='SBSTRM01').one().child_count == 2
+        assert Bag.query.filter_by(qr_id='61005').first() is None
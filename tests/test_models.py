@@ -1,5 +1,5 @@
 import pytest
-from models import User, Bag, Bill, Link, BillBag, UserRole, BagType
+from models import User, Bag, Bill, Link, BillBag, UserRole, BagType, StatisticsCache, StatisticsDelta
 
 pytestmark = pytest.mark.unit  # Mark all tests in this file as unit tests
 
@@ -106,3 +106,603 @@ class TestBillModel:
         # Verify link exists
         link = BillBag.query.filter_by(bill_id=bill.id, bag_id=parent_bag.id).first()
         assert link is not None
+
+class TestStatisticsCounters:
+    def test_exact_counts_add_pending_deltas_to_cache_row(self, db_session):
+        """Test exact counts are the cache row plus unfolded deltas (no trigger needed)"""
+        db_session.query(StatisticsDelta).delete()
+        db_session.query(StatisticsCache).delete()
+        db_session.add(StatisticsCache(id=1, total_bags=10, parent_bags=4, child_bags=6, total_scans=20,
+                                       total_bills=2, total_users=3, total_links=6))
+        # Explicit ids: BIGINT keys are not autoincremented by SQLite
+        db_session.add_all([StatisticsDelta(id=1, counter='total_scans', delta=5),
+                            StatisticsDelta(id=2, counter='total_scans', delta=-2),
+                            StatisticsDelta(id=3, counter='child_bags', delta=1)])
+        db_session.commit()
+        
+        counts = StatisticsCache.get_exact_counts()
+        assert counts['total_scans'] == 23 and counts['child_bags'] == 7
+        assert counts['total_bags'] == 10 and counts['total_links'] == 6
+        
+        db_session.query(StatisticsDelta).delete()
+        db_session.query(StatisticsCache).delete()
+        db_session.commit()
+        assert StatisticsCache.get_exact_counts() is None
+
+@pytest.mark.requires_postgres
+class TestStatisticsCache:
+    def test_refresh_seeds_exact_counts(self, db_session, parent_bag, child_bags):
+        """Test full refresh seeds counters and exact counts match the tables"""
+        StatisticsCache.refresh_cache()
+        
+        counts = StatisticsCache.get_exact_counts()
+        assert counts['parent_bags'] == 1
+        assert counts['child_bags'] == 5
+        assert counts['total_bags'] == 6
+        assert counts['total_links'] == 5
+    
+    def test_fold_applies_pending_deltas(self, db_session, parent_bag):
+        """Test pending deltas count immediately and are folded into the cache row"""
+        StatisticsCache.refresh_cache()
+        db_session.add(StatisticsDelta(counter='total_scans', delta=3))
+        db_session.add(StatisticsDelta(counter='total_scans', delta=-1))
+        db_session.commit()
+        
+        assert StatisticsCache.get_exact_counts()['total_scans'] == 2
+        assert StatisticsCache.fold_deltas() == 2
+        assert StatisticsDelta.query.count() == 0
+        assert StatisticsCache.query.get(1).total_scans == 2
+
+class TestPartitionNames:
+    def test_month_helpers_round_trip_partition_names(self):
+        """Test partition names, their months and month arithmetic agree across year ends"""
+        from datetime import date, datetime
+        from scan_partitions import add_months, month_start, partition_month, partition_name
+        
+        month = month_start(datetime(2025, 12, 31, 23, 59))
+        assert month == date(2025, 12, 1)
+        assert add_months(month, 1) == date(2026, 1, 1)
+        assert add_months(month, -12) == date(2024, 12, 1)
+        assert partition_name(month) == 'scan_y2025m12'
+        assert partition_month(partition_name(month, 'audit_log'), 'audit_log') == month
+        assert partition_month('scan_default') is None
+        assert partition_month('scan_y2025m13') is None
+        assert partition_month('audit_log_y2025m12') is None  # Another table's partition
+
+@pytest.mark.requires_postgres
+class TestScanPartitions:
+    def test_scan_lands_in_month_partition(self, db_session, parent_bag, admin_user):
+        """Test scans are routed to their month's partition, never the default"""
+        from datetime import datetime
+        from models import Scan
+        from sqlalchemy import text
+        from scan_partitions import ensure_scan_partitions, partition_name, month_start
+        
+        conn = db_session.connection()
+        ensure_scan_partitions(conn)
+        db_session.add(Scan(parent_bag_id=parent_bag.id, user_id=admin_user.id, timestamp=datetime.utcnow()))
+        db_session.commit()
+        
+        current = partition_name(month_start(datetime.utcnow()))
+        assert db_session.execute(text(f"SELECT COUNT(*) FROM {current}")).scalar() == 1
+        assert db_session.execute(text("SELECT COUNT(*) FROM scan_default")).scalar() == 0
+
+class TestAuditRetentionPolicy:
+    def test_only_months_wholly_before_cutoff_expire(self, db_session, monkeypatch):
+        """Test a partition expires only once its whole month is older than the cutoff"""
+        from datetime import datetime
+        import audit_retention
+        from audit_retention import AuditRetentionPolicy
+        
+        monkeypatch.setattr(audit_retention, 'is_partitioned', lambda conn, table: True)
+        monkeypatch.setattr(audit_retention, 'list_partitions', lambda conn, table: [
+            {'name': name, 'estimated_rows': 0}
+            for name in ('audit_log_default', 'audit_log_y2026m01', 'audit_log_y2026m02', 'audit_log_y2026m03')
+        ])
+        
+        expired = AuditRetentionPolicy.get_expired_partitions(datetime(2026, 3, 1))
+        assert [p['name'] for p in expired] == ['audit_log_y2026m01', 'audit_log_y2026m02']
+        assert expired[0]['month'] == '2026-01-01'
+    
+    def test_dry_run_counts_unpartitioned_rows(self, db_session):
+        """Test the dry run counts expired rows when audit_log is not partitioned"""
+        from datetime import datetime, timedelta
+        from models import AuditLog
+        from audit_retention import AuditRetentionPolicy
+        
+        db_session.query(AuditLog).delete()
+        db_session.add_all([
+            AuditLog(action='delete_bag', entity_type='bag', timestamp=datetime.utcnow() - timedelta(days=120)),
+            AuditLog(action='create_bag', entity_type='bag', timestamp=datetime.utcnow()),
+        ])
+        db_session.commit()
+        
+        result = AuditRetentionPolicy.cleanup_old_audit_logs(retention_days=90, dry_run=True)
+        assert result['would_delete'] == 1 and result['would_drop_partitions'] == []
+
+@pytest.mark.requires_postgres
+class TestAuditRetention:
+    def test_cleanup_drops_expired_partition_and_keeps_critical(self, db_session):
+        """Test retention drops whole old partitions after archiving critical actions"""
+        from datetime import datetime, timedelta
+        from sqlalchemy import text
+        from models import AuditLog, AuditLogCritical
+        from audit_retention import AuditRetentionPolicy
+        from scan_partitions import create_month_partition, partition_name, month_start
+        
+        old = month_start(datetime.utcnow() - timedelta(days=200))
+        create_month_partition(db_session.connection(), old, 'audit_log')
+        old_time = datetime(old.year, old.month, 15)
+        db_session.add(AuditLog(action='delete_user', entity_type='user', entity_id=7, timestamp=old_time))
+        db_session.add(AuditLog(action='login_success', entity_type='user', timestamp=old_time))
+        # A stray old row in the default partition is deleted row by row
+        db_session.add(AuditLog(action='role_change', entity_type='user', timestamp=datetime(2000, 1, 1)))
+        db_session.add(AuditLog(action='login_success', entity_type='user', timestamp=datetime.utcnow()))
+        db_session.commit()
+        
+        result = AuditRetentionPolicy.cleanup_old_audit_logs(retention_days=90, dry_run=False)
+        
+        assert result['dropped_partitions'] == [partition_name(old, 'audit_log')]
+        assert result['deleted_records'] == 3
+        assert db_session.execute(text("SELECT to_regclass(:name)"), {'name': result['dropped_partitions'][0]}).scalar() is None
+        assert AuditLog.query.count() == 1
+        assert sorted(c.action for c in AuditLogCritical.query.all()) == ['delete_user', 'role_change']
+
+class TestAuditWriter:
+    def test_rows_written_after_commit_and_discarded_on_rollback(self, app, db_session, monkeypatch):
+        """Test buffered audit rows follow the session's commit/rollback and are drained on stop"""
+        import audit_writer
+        from app import db
+        from models import AuditLog
+        from audit_utils import log_audit_with_snapshot
+        
+        writer = audit_writer.AuditLogWriter(app, db)
+        monkeypatch.setattr(audit_writer, 'audit_writer', writer)
+        writer.start()
+        before = AuditLog.query.count()
+        
+        log_audit_with_snapshot('rolled_back', 'bag', 1, details={'n': 1})
+        db.session.rollback()
+        log_audit_with_snapshot('committed', 'bag', 2, after_state={'qr_id': 'SB00001'})
+        assert AuditLog.query.count() == before  # staged, not in the session
+        db.session.commit()
+        writer.stop()
+        
+        rows = AuditLog.query.filter(AuditLog.id > 0).order_by(AuditLog.id.desc()).limit(2).all()
+        assert AuditLog.query.count() == before + 1
+        assert rows[0].action == 'committed'
+        assert rows[0].get_changes() == {'qr_id': (None, 'SB00001')}
+        assert writer.get_stats()['rows_written'] == 1
+
+class TestAuditSnapshots:
+    def test_history_rebuilds_full_states_from_diffs(self, db_session, monkeypatch):
+        """Test snapshots are stored as diffs and full states are rebuilt on read"""
+        import audit_writer
+        from app import db
+        from models import AuditLog
+        from audit_utils import log_audit_with_snapshot, get_entity_history
+        
+        monkeypatch.setattr(audit_writer, 'audit_writer', None)  # write with the session
+        created = {'qr_id': 'SB00042', 'type': 'parent', 'status': 'pending', 'child_count': 0}
+        updated = dict(created, status='completed', child_count=30)
+        log_audit_with_snapshot('create_bag', 'bag', 42, after_state=created)
+        db.session.commit()
+        log_audit_with_snapshot('update_bag', 'bag', 42, before_state=created, after_state=updated)
+        db.session.commit()
+        
+        update_row = AuditLog.query.filter_by(action='update_bag', entity_id=42).one()
+        assert update_row.before_state is None and update_row.after_state is None
+        assert update_row.changed_keys == 'child_count,status'
+        assert 'SB00042' not in (update_row.state_diff or '')
+        
+        history = get_entity_history('bag', 42)
+        assert [entry['action'] for entry in history] == ['create_bag', 'update_bag']
+        assert history[0]['before_state'] is None
+        assert history[1]['before_state'] == created
+        assert history[1]['after_state'] == updated
+        assert history[1]['changes'] == {'status': ('pending', 'completed'), 'child_count': (0, 30)}
+
+
+class TestDashboardCache:
+    def test_shared_backend_round_trips_datetimes(self, tmp_path):
+        """Test values cached in the shared backend come back with their datetimes intact"""
+        from datetime import date, datetime
+        from dashboard_cache import SharedMemoryBackend
+        
+        value = {'last_scan': datetime(2026, 4, 1, 9, 30, 15, 123456), 'day': date(2026, 4, 1),
+                 'recent': [{'timestamp': datetime(2026, 3, 31, 23, 59)}], 'total': 7}
+        backend = SharedMemoryBackend(str(tmp_path))
+        backend.set('stats', value)
+        
+        cached, stored_at = backend.get('stats')
+        assert cached == value
+        assert isinstance(cached['last_scan'], datetime) and isinstance(cached['day'], date)
+        assert stored_at > 0
+
+class TestBillRollupReaders:
+    def test_eod_summary_adds_pending_deltas_to_rollup_rows(self, db_session, admin_user):
+        """Test the EOD summary sums folded rollup rows and still-pending deltas"""
+        from datetime import date
+        from models import DailyBillRollup, DailyBillRollupDelta
+        from bill_rollup import get_eod_summary
+        
+        day = date(2026, 4, 1)
+        db_session.add(DailyBillRollup(day=day, created_by_id=admin_user.id, status='new', bill_count=2,
+                                       parent_bags=1, expected_bags=4, child_bags=10, weight_kg=10.0))
+        db_session.add(DailyBillRollup(day=date(2026, 4, 2), created_by_id=admin_user.id, status='new',
+                                       bill_count=5))
+        # One bill moved new -> completed since the last fold
+        db_session.add(DailyBillRollupDelta(id=1, day=day, created_by_id=admin_user.id, status='new',
+                                            bill_count=-1, parent_bags=-1, expected_bags=-2,
+                                            child_bags=-10, weight_kg=-10.0))
+        db_session.add(DailyBillRollupDelta(id=2, day=day, created_by_id=admin_user.id, status='completed',
+                                            bill_count=1, parent_bags=2, expected_bags=2,
+                                            child_bags=40, weight_kg=40.0))
+        db_session.commit()
+        
+        summary = get_eod_summary(day, include_details=False)
+        assert summary['report_date'] == '01/04/26'
+        assert summary['total_bills'] == 2
+        assert summary['bills_by_status'] == {'new': 1, 'completed': 1}
+        assert summary['bills_by_user'] == {'admin': 2}
+        assert summary['total_parent_bags'] == 2
+        assert summary['total_child_bags'] == 40
+        assert summary['total_weight_kg'] == 40.0
+        assert summary['detailed_bills'] == []
+
+@pytest.mark.requires_postgres
+class TestBillRollup:
+    def test_eod_summary_follows_bill_changes(self, db_session, admin_user):
+        """Test the trigger-maintained rollup tracks inserts, status changes and deletes"""
+        from bill_rollup import get_eod_summary
+        
+        for index, capacity in enumerate([2, 3, 1]):
+            bill = Bill(bill_id=f'EOD00{index}', parent_bag_count=capacity, created_by_id=admin_user.id)
+            db_session.add(bill)
+        db_session.commit()
+        
+        completed = Bill.query.filter_by(bill_id='EOD001').one()
+        completed.status = 'completed'
+        completed.linked_parent_count = 3
+        completed.total_child_bags = 45
+        completed.total_weight_kg = 45.0
+        db_session.delete(Bill.query.filter_by(bill_id='EOD002').one())
+        db_session.commit()
+        
+        summary = get_eod_summary()
+        assert summary['total_bills'] == 2
+        assert summary['bills_by_status'] == {'new': 1, 'completed': 1}
+        assert summary['bills_by_user'] == {'admin': 2}
+        assert summary['total_parent_bags'] == 3
+        assert summary['total_child_bags'] == 45
+        assert summary['total_weight_kg'] == 45.0
+        assert [bill['bill_id'] for bill in summary['detailed_bills']] == ['EOD000', 'EOD001']
+        assert summary['detailed_bills'][1]['expected_bags'] == 3
+        
+        # Triggers only append deltas; folding them leaves the summary unchanged
+        from app import db
+        from models import DailyBillRollupDelta
+        from bill_rollup import fold_bill_rollup_deltas
+        assert DailyBillRollupDelta.query.count() > 0
+        db_session.commit()
+        with db.engine.begin() as conn:
+            assert fold_bill_rollup_deltas(conn) > 0
+        assert DailyBillRollupDelta.query.count() == 0
+        folded = get_eod_summary()
+        assert {k: v for k, v in folded.items() if k != 'generated_at'} == \
+            {k: v for k, v in summary.items() if k != 'generated_at'}
+
+class TestActivityRollupWindows:
+    def test_windows_are_whole_hours_and_groupings_validated(self, app):
+        """Test readers align windows to whole hours and reject unknown groupings"""
+        from datetime import date, datetime
+        from activity_rollup import _window, floor_hour, get_scan_counts, get_audit_counts
+        
+        assert floor_hour(datetime(2026, 4, 1, 9, 59, 59, 999999)) == datetime(2026, 4, 1, 9)
+        assert _window(date(2026, 4, 1), date(2026, 4, 2)) == (datetime(2026, 4, 1), datetime(2026, 4, 2))
+        assert _window(datetime(2026, 4, 1, 9, 30), datetime(2026, 4, 1, 11, 5)) == \
+            (datetime(2026, 4, 1, 9), datetime(2026, 4, 1, 11))
+        
+        with pytest.raises(ValueError, match='dispatch_area'):
+            get_audit_counts(date(2026, 4, 1), date(2026, 4, 2), group_by=('day', 'dispatch_area'))
+        with pytest.raises(ValueError, match='action'):
+            get_scan_counts(date(2026, 4, 1), date(2026, 4, 2), group_by=('action',))
+
+@pytest.mark.requires_postgres
+class TestActivityRollup:
+    def test_rollup_matches_raw_scans_before_and_after_aggregation(self, app, db_session, admin_user, parent_bag, child_bags):
+        """Test readers give the same counts from the raw tail and from the aggregated rollup"""
+        from datetime import datetime, timedelta
+        from sqlalchemy import text
+        from app import db
+        from models import Scan
+        from activity_rollup import ActivityRollupAggregator, get_scan_counts
+        
+        parent_bag.dispatch_area = 'indore'
+        db_session.add(Scan(parent_bag_id=parent_bag.id, user_id=admin_user.id))
+        for bag in child_bags[:3]:
+            db_session.add(Scan(parent_bag_id=parent_bag.id, child_bag_id=bag.id, user_id=admin_user.id))
+        db_session.commit()
+        
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        window = (hour, hour + timedelta(hours=1))
+        expected = [(hour, 'indore', 4, 1, 3)]
+        assert get_scan_counts(*window, group_by=('hour', 'dispatch_area'), user_id=admin_user.id) == expected
+        
+        # First pass records the target id, the next ones consume it once settled
+        aggregator = ActivityRollupAggregator(app, db)
+        max_id = db_session.execute(text("SELECT MAX(id) FROM scan")).scalar()
+        for _ in range(20):
+            result = aggregator.aggregate_once()
+            if result and result['scan']['last_id'] >= max_id:
+                break
+        else:
+            raise AssertionError("scan watermark did not advance")
+        
+        rollup = db_session.execute(text(
+            "SELECT scan_count FROM scan_hourly_rollup WHERE user_id = :user_id"
+        ), {'user_id': admin_user.id}).scalar()
+        assert rollup == 4
+        assert get_scan_counts(*window, group_by=('hour', 'dispatch_area'), user_id=admin_user.id) == expected
+        assert get_scan_counts(*window, user_id=admin_user.id) == [(4, 1, 3)]
+        
+        # Deleting an aggregated scan marks its hour stale: counted raw at once, rebuilt on the next pass
+        db_session.execute(text("DELETE FROM scan WHERE id = :id"), {'id': max_id})
+        db_session.commit()
+        assert get_scan_counts(*window, user_id=admin_user.id) == [(3, 1, 2)]
+        result = aggregator.aggregate_once()
+        assert result['scan']['rebuilt'] == 1 and result['scan']['stale'] == 0
+        rollup = db_session.execute(text(
+            "SELECT scan_count FROM scan_hourly_rollup WHERE user_id = :user_id"
+        ), {'user_id': admin_user.id}).scalar()
+        assert rollup == 3
+        assert get_scan_counts(*window, user_id=admin_user.id) == [(3, 1, 2)]
+
+class TestSearchConditions:
+    def test_conditions_follow_term_length_and_escape_wildcards(self):
+        """Test strategy choice, literal LIKE patterns and prefix ranges built for a term"""
+        from search_utils import choose_strategy, escape_like, prefix_upper_bound, match_condition
+        
+        assert choose_strategy('sr') == 'prefix'
+        assert choose_strategy('srch') == 'trigram'
+        assert escape_like('50%_a\\b') == '50\\%\\_a\\\\b'
+        assert prefix_upper_bound('SR') == 'SS'
+        
+        condition, params = match_condition('bag', 'sr', alias='b.', include_secondary=False)
+        assert condition == 'b.qr_id COLLATE "C" >= :search_bag_lo AND b.qr_id COLLATE "C" < :search_bag_hi'
+        assert params == {'search_bag_lo': 'SR', 'search_bag_hi': 'SS'}
+        
+        condition, params = match_condition('bag', 'r_x', include_secondary=False)
+        assert condition == 'qr_id ILIKE :search_bag_pattern'
+        assert params == {'search_bag_pattern': '%r\\_x%'}
+
+@pytest.mark.requires_postgres
+class TestSearch:
+    def test_strategy_follows_term_and_ranks_exact_first(self, db_session):
+        """Test exact, prefix and substring search with relevance ordering"""
+        from models import Bag
+        from search_utils import search, choose_strategy
+        
+        for qr_id in ['SRCH100', 'XSRCH1', 'SRCH1', 'SR_X', 'SRZ9']:
+            db_session.add(Bag(qr_id=qr_id, type='parent'))
+        db_session.commit()
+        
+        assert choose_strategy('sr') == 'prefix'
+        assert choose_strategy('srch') == 'trigram'
+        
+        found = search('bag', 'srch1', 'id, qr_id')
+        assert found['strategy'] == 'exact'
+        assert [row.qr_id for row in found['rows']] == ['SRCH1', 'SRCH100', 'XSRCH1']
+        
+        found = search('bag', 'sr', 'id, qr_id')
+        assert found['strategy'] == 'prefix'
+        assert [row.qr_id for row in found['rows']] == ['SRCH1', 'SRCH100', 'SRZ9', 'SR_X']
+        
+        # Short terms still match the start of a bag's name
+        db_session.add(Bag(qr_id='NAMED1', type='parent', name='Srinagar dispatch'))
+        db_session.commit()
+        assert 'NAMED1' in [row.qr_id for row in search('bag', 'sr', 'id, qr_id')['rows']]
+        
+        # LIKE wildcards in the term match literally
+        assert [row.qr_id for row in search('bag', 'r_x', 'id, qr_id')['rows']] == ['SR_X']
+        assert search('bag', 'srch', 'id, qr_id', where="type = 'child'")['rows'] == []
+
+class TestIntegrityChecker:
+    @pytest.mark.requires_postgres
+    def test_findings_recorded_and_resolved_incrementally(self, app, db_session, parent_bag, child_bags):
+        """Test violations are found, then resolved by an incremental run once fixed"""
+        import time
+        from app import db
+        from models import Bill, BillBag
+        from integrity_checker import run_integrity_check, get_integrity_report
+        
+        def run(full=False):
+            # The app's background checker may hold the lock for a moment
+            for _ in range(50):
+                with db.engine.begin() as conn:
+                    summary = run_integrity_check(conn, full=full)
+                if summary:
+                    return summary
+                time.sleep(0.1)
+            raise AssertionError("integrity check lock not released")
+        
+        # Bill id reuses a bag QR code and its counters ignore the linked parent
+        bill = Bill(bill_id='child005', parent_bag_count=1, linked_parent_count=0)
+        db_session.add(bill)
+        db_session.commit()
+        db_session.add(BillBag(bill_id=bill.id, bag_id=parent_bag.id))
+        db_session.commit()
+        
+        summary = run(full=True)
+        assert summary['checks']['cross_duplicate']['new'] == 1
+        assert summary['checks']['bill_counters']['new'] == 1
+        
+        report = get_integrity_report()
+        assert report['summary']['open_findings']['cross_duplicate'] == 1
+        assert report['duplicates']['cross_duplicates'][0]['qr_id'] == 'CHILD005'
+        assert report['relationships']['bill_counters'][0]['actual_children'] == 5
+        
+        # Fix both problems - the next incremental run resolves them
+        bill.bill_id = 'INTEG001'
+        bill.linked_parent_count, bill.total_child_bags, bill.total_weight_kg = 1, 5, 5.0
+        db_session.commit()
+        
+        summary = run()
+        assert summary['mode'] == 'incremental'
+        assert summary['resolved_findings'] == 2
+        assert summary['open_findings'] == 0
+        assert get_integrity_report()['summary']['has_issues'] is False
+    
+    def test_check_now_returns_before_the_check_finishes(self, app, monkeypatch):
+        """Test a requested check runs in a background thread instead of the request"""
+        import threading
+        from app import db
+        from integrity_checker import IntegrityChecker
+        
+        checker = IntegrityChecker(app, db, enabled=False)
+        release, finished = threading.Event(), threading.Event()
+        
+        def slow_check(full=False):
+            release.wait(5)
+            finished.set()
+        
+        monkeypatch.setattr(checker, 'check_once', slow_check)
+        assert checker.request_run()
+        assert not finished.is_set()
+        release.set()
+        assert finished.wait(5)
+
+class TestMaintenanceJobQueue:
+    def test_create_job_validates_and_reports_stalled_leases(self, app, db_session):
+        """Test job creation checks the task, its params and duplicates, and status flags expired leases"""
+        import datetime
+        from app import db
+        from maintenance_jobs import DEFAULT_CHUNK_SIZE, create_job, is_stalled, job_status, throttle_delay
+        
+        with pytest.raises(ValueError, match='Unknown'):
+            create_job(db, 'vacuum_everything')
+        with pytest.raises(ValueError, match='user_id'):
+            create_job(db, 'user_data')
+        
+        job = create_job(db, 'bill_weights', chunk_size=0, max_db_share=5)
+        assert (job.chunk_size, job.max_db_share) == (DEFAULT_CHUNK_SIZE, 1.0)
+        with pytest.raises(ValueError, match='already queued'):
+            create_job(db, 'bill_weights')
+        
+        status = job_status(job)
+        assert status['status'] == 'queued' and status['params'] == {} and not status['stalled']
+        
+        # A worker that died leaves its lease behind - a new job may then be queued
+        job.lease_expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db_session.commit()
+        assert is_stalled(job) and job_status(job)['stalled']
+        assert create_job(db, 'bill_weights').id != job.id
+        
+        assert throttle_delay(1.0, 0.25) == 3.0
+        assert throttle_delay(0.0, 0.25) == 0.0
+
+@pytest.mark.requires_postgres
+class TestMaintenanceJobs:
+    def test_bill_counters_job_fixes_drift_in_chunks(self, app, db_session, parent_bag, child_bags):
+        """Test the bill counter job walks bills in chunks and records its cursor and progress"""
+        from app import db
+        from models import Bill, BillBag, MaintenanceJob
+        from maintenance_jobs import create_job, run_maintenance_job
+        
+        bills = [Bill(bill_id=f'MAINT00{n}', parent_bag_count=1, linked_parent_count=0) for n in range(3)]
+        db_session.add_all(bills)
+        db_session.commit()
+        db_session.add(BillBag(bill_id=bills[0].id, bag_id=parent_bag.id))
+        db_session.commit()
+        
+        job = create_job(db, 'bill_counters', chunk_size=2, max_db_share=1.0)
+        assert run_maintenance_job(db, job.id) == 'completed'
+        
+        db_session.expire_all()
+        job = db_session.get(MaintenanceJob, job.id)
+        assert job.cursor == max(bill.id for bill in Bill.query.all())
+        assert job.rows_processed == job.rows_total == Bill.query.count()
+        assert job.chunks_done == (job.rows_total + 1) // 2
+        assert job.progress_pct() == 100.0 and job.eta_seconds() == 0
+        
+        bill = db_session.get(Bill, bills[0].id)
+        assert (bill.linked_parent_count, bill.total_child_bags, bill.status) == (1, 5, 'processing')
+        assert '"drift_fixes": 1' in job.summary
+    
+    def test_user_data_job_deletes_scanned_bags_and_recounts_bills(self, app, db_session, dispatcher_user,
+                                                                    parent_bag, child_bags):
+        """Test the user data job deletes the user's scans and scanned bags and fixes affected bill counters"""
+        from app import db
+        from models import Bag, Bill, BillBag, Link, Scan
+        from maintenance_jobs import create_job, run_maintenance_job
+        
+        bill = Bill(bill_id='DELUSER01', parent_bag_count=1, linked_parent_count=1, total_child_bags=5)
+        db_session.add(bill)
+        db_session.commit()
+        db_session.add(BillBag(bill_id=bill.id, bag_id=parent_bag.id))
+        for bag in child_bags[:2]:
+            db_session.add(Scan(user_id=dispatcher_user.id, parent_bag_id=parent_bag.id, child_bag_id=bag.id))
+        db_session.commit()
+        
+        job = create_job(db, 'user_data', chunk_size=1, max_db_share=1.0,
+                         params={'user_id': dispatcher_user.id, 'username': dispatcher_user.username})
+        assert run_maintenance_job(db, job.id) == 'completed'
+        
+        db_session.expire_all()
+        assert Scan.query.filter_by(user_id=dispatcher_user.id).count() == 0
+        assert Bag.query.filter(Bag.id.in_([parent_bag.id, child_bags[0].id, child_bags[1].id])).count() == 0
+        assert Link.query.filter_by(parent_bag_id=parent_bag.id).count() == 0
+        assert Bag.query.filter_by(qr_id='CHILD003').count() == 1  # Not scanned by the user
+        
+        bill = db_session.get(Bill, bill.id)
+        assert (bill.linked_parent_count, bill.total_child_bags) == (0, 0)
+    
+    def test_paused_job_stops_before_next_chunk(self, app, db_session):
+        """Test a paused job keeps its cursor and throttle delay honours the DB share"""
+        from app import db
+        from models import MaintenanceJob
+        from maintenance_jobs import create_job, get_maintenance_job_runner, run_maintenance_job, throttle_delay
+        
+        job = create_job(db, 'bill_weights')
+        assert get_maintenance_job_runner().pause(job.id)
+        assert run_maintenance_job(db, job.id) == 'paused'
+        
+        db_session.expire_all()
+        job = db_session.get(MaintenanceJob, job.id)
+        assert job.cursor is None and job.chunks_done == 0
+        
+        assert throttle_delay(2.0, 0.5) == 2.0
+        assert throttle_delay(1.0, 0.25) == 3.0
+        assert throttle_delay(1.0, 1.0) == 0.0
+    
+    def test_job_with_expired_lease_is_claimed_and_resumed(self, app, db_session):
+        """Test a live runner claims a dead worker's job and finishes it from its cursor"""
+        import datetime
+        from app import db
+        from models import Bill, MaintenanceJob
+        from maintenance_jobs import MaintenanceJobRunner, create_job, is_stalled
+        
+        bills = [Bill(bill_id=f'LEASE00{n}', parent_bag_count=1) for n in range(3)]
+        db_session.add_all(bills)
+        db_session.commit()
+        
+        # The worker that ran the first chunk died: running, cursor set, lease run out
+        job = create_job(db, 'bill_weights', chunk_size=1, max_db_share=1.0)
+        job.status = 'running'
+        job.cursor = bills[0].id
+        job.rows_processed = 1
+        job.lease_expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db_session.commit()
+        assert is_stalled(job)
+        
+        runner = MaintenanceJobRunner(app, db)
+        assert runner.claim_expired_jobs() == [job.id]
+        assert runner.claim_expired_jobs() == []  # Claimed once
+        for thread in list(runner.threads.values()):
+            thread.join(timeout=10)
+        
+        db_session.expire_all()
+        job = db_session.get(MaintenanceJob, job.id)
+        assert job.status == 'completed'
+        assert job.rows_processed == Bill.query.filter(Bill.id > bills[0].id).count() + 1
+        assert runner.stats['reclaimed'] == 1
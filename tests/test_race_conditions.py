@@ -242,3 +242,39 @@ class TestRaceConditions:
             # All operations should succeed
             successes = [r for r in results if r[0] == 'success']
             assert len(successes) == 3, "All concurrent cache operations should succeed"
+    
+    @pytest.mark.requires_postgres
+    def test_concurrent_child_scans_respect_30_limit(self, app, admin_user, db_session):
+        """Concurrent child scans into one parent never link more than 30 children"""
+        from query_optimizer import QueryOptimizer
+        
+        bag = Bag()
+        bag.qr_id = 'SB77777'
+        bag.type = 'parent'
+        db_session.add(bag)
+        db_session.commit()
+        parent_id = bag.id
+        user_id = admin_user.id
+        
+        results = []
+        
+        def scan_child(index, result_list):
+            """Scan a new child bag into the shared parent"""
+            with app.app_context():
+                result_list.append(QueryOptimizer(db).ultra_fast_child_scan('SB77777', f'RC{index:04d}', user_id))
+                db.session.remove()
+        
+        threads = [threading.Thread(target=scan_child, args=(i, results)) for i in range(35)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        successes = [r for r in results if r['success']]
+        assert len(successes) == 30, "Exactly 30 child scans should succeed"
+        
+        with app.app_context():
+            parent = db.session.get(Bag, parent_id)
+            assert Link.query.filter_by(parent_bag_id=parent_id).count() == 30
+            assert parent.child_count == 30
+            assert parent.status == 'completed'
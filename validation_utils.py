@@ -33,6 +33,24 @@ class InputValidator:
     MAX_OFFSET = 10000
     DEFAULT_PAGE_SIZE = 50
     
+    @staticmethod
+    def normalize_qr(qr_id: Any) -> str:
+        """
+        Canonical form of a QR code as stored in bag.qr_id (trimmed, uppercase)
+        
+        Every write path stores this form, so lookups can compare with plain
+        equality on the unique qr_id index instead of lower()/upper() expressions.
+        
+        Args:
+            qr_id: Raw QR code (scanner input, spreadsheet cell, form field)
+            
+        Returns:
+            Canonical QR code, or '' for empty input
+        """
+        if qr_id is None:
+            return ''
+        return str(qr_id).strip().upper()
+    
     @staticmethod
     def validate_qr_code(qr_id: str, bag_type: Optional[str] = None) -> Tuple[bool, str, str]:
         """
@@ -49,7 +67,7 @@ class InputValidator:
             return False, '', "QR code cannot be empty"
         
         # Trim and normalize
-        qr_id = qr_id.strip().upper()
+        qr_id = InputValidator.normalize_qr(qr_id)
         
         # Length validation
         if len(qr_id) > InputValidator.QR_MAX_LENGTH: